@@ -5,6 +5,7 @@ API密钥池管理 - 负责分配和管理API密钥
 import random
 from typing import List, Optional
 from config import API_KEYS
+from tracing import traced
 
 
 class APIKeyPool:
@@ -15,6 +16,7 @@ class APIKeyPool:
         self.available_keys = API_KEYS.copy()
         self.used_keys = []
         
+    @traced("api_pool.get_keys")
     def get_keys(self, count: int) -> List[str]:
         """
         获取指定数量的API密钥
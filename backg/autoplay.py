@@ -0,0 +1,309 @@
+"""
+自动播放 - 无交互地连续运行纯AI对话，调度与台词生成流水线并行
+
+第N轮台词流式生成到一定字数时，就以包含这段未完成台词的历史快照开始调度第N+1轮，
+台词生成完毕时下一位说话角色通常已经确定，省去每轮串行等待调度的时间；
+完整台词点名的角色与未完成台词不同时丢弃提前调度的结果，按完整台词重新调度。
+台词严格按轮次顺序提交到对话历史；已提交但尚未被消费的台词数量有上限，消费方跟不上时暂停生成。
+
+命令行用法：
+    python autoplay.py "古代武侠世界，三位江湖人士在客栈相遇" --rounds 30
+"""
+
+import argparse
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Optional
+from history import split_speaker
+from tracing import span
+from config import AUTOPLAY_LOOKAHEAD, AUTOPLAY_SPECULATE_CHARS, AUTOPLAY_MAX_ROUNDS, SPEAKER_PLAN_TURNS
+
+
+class AutoPlayEngine:
+    def __init__(self, script_system, rounds: int, lookahead: int = AUTOPLAY_LOOKAHEAD,
+                 speculate_chars: int = AUTOPLAY_SPECULATE_CHARS):
+        """
+        初始化自动播放引擎
+
+        Args:
+            script_system: 已初始化的剧本系统
+            rounds: 对话轮数
+            lookahead: 已提交但尚未被消费的台词最多缓冲条数（0表示不限制）
+            speculate_chars: 台词生成到该字数时开始调度下一轮（0表示台词生成完再调度）
+        """
+        self.script_system = script_system
+        self.rounds = max(0, min(rounds, AUTOPLAY_MAX_ROUNDS))
+        self.lookahead = lookahead
+        self.speculate_chars = speculate_chars
+
+        self.turns: List[Dict[str, Any]] = []  # 按轮次顺序提交的台词
+        self.consumed = 0  # 已被消费的台词数
+        self.state = "pending"  # pending、running、done、cancelled、error
+        self.error: Optional[str] = None
+        self.stats = {
+            "speculative_schedules": 0,
+            "speculation_discards": 0,
+            "schedule_wait_seconds": 0.0,
+            "generation_seconds": 0.0,
+            "backpressure_seconds": 0.0,
+            "elapsed_seconds": 0.0
+        }
+
+        self._start_time: Optional[float] = None
+        self._cancelled = threading.Event()
+        self._condition = threading.Condition()
+        self._thread: Optional[threading.Thread] = None
+        self._schedule_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="autoplay-schedule")
+
+    def start(self) -> "AutoPlayEngine":
+        """
+        在后台线程中开始自动播放（沿用当前上下文的会话归属和trace ID）
+
+        Returns:
+            引擎本身
+        """
+        context = contextvars.copy_context()
+        self.state = "running"
+        self._start_time = time.perf_counter()
+        self._thread = threading.Thread(target=context.run, args=(self._run,), daemon=True,
+                                        name="autoplay")
+        self._thread.start()
+        return self
+
+    def cancel(self) -> None:
+        """
+        取消自动播放：正在生成的台词被丢弃，已提交的台词保留在对话历史中
+        """
+        self._cancelled.set()
+        with self._condition:
+            self._condition.notify_all()
+
+    def join(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待自动播放结束
+
+        Returns:
+            是否已结束
+        """
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.state not in ("pending", "running")
+
+    def _schedule(self, round_num: int, history: List[str], discard_plan: bool = False) -> Future:
+        """
+        在调度线程中决定下一个说话的AI角色（调度线程只有一个，按提交顺序依次调度）
+
+        Args:
+            round_num: 要调度的轮次
+            history: 调度使用的对话历史快照
+            discard_plan: 是否先放弃调度规划（提前调度的结果被丢弃时，其写入的规划同样作废）
+        """
+        scheduler = self.script_system.scheduler
+
+        def decide() -> Optional[str]:
+            if discard_plan:
+                scheduler.invalidate_plan()
+            # 接下来连续多轮都由AI角色说话，一次规划多轮（不超过剩余轮数）
+            plan_turns = min(SPEAKER_PLAN_TURNS, self.rounds - round_num + 1)
+            return scheduler.decide_next_ai_speaker(f"这是第{round_num}轮对话", history, plan_turns)
+
+        return self._schedule_pool.submit(contextvars.copy_context().run, decide)
+
+    def _run(self) -> None:
+        scheduler = self.script_system.scheduler
+        try:
+            with span("autoplay.run", rounds=self.rounds):
+                next_speaker = self._schedule(1, scheduler.conversation_history.tail(10)) if self.rounds else None
+                for round_num in range(1, self.rounds + 1):
+                    if self._cancelled.is_set():
+                        break
+
+                    wait_start = time.perf_counter()
+                    speaker = next_speaker.result()
+                    self.stats["schedule_wait_seconds"] += time.perf_counter() - wait_start
+
+                    character_agent = scheduler.get_character_agent(speaker) if speaker else None
+                    if not character_agent:
+                        print(f"❌ 第{round_num}轮调度失败，跳过")
+                        next_speaker = self._schedule(round_num + 1, scheduler.conversation_history.tail(10))
+                        continue
+
+                    history = scheduler.conversation_history.tail(10)
+                    speculative: List[tuple] = []  # (提前调度所依据的未完成台词, 调度结果)
+                    has_next = round_num < self.rounds
+
+                    def on_delta(text: str) -> bool:
+                        if self._cancelled.is_set():
+                            return False
+                        if (has_next and not speculative and self.speculate_chars
+                                and len(text) >= self.speculate_chars):
+                            # 用未完成的台词提前调度下一轮（带上说话者前缀，调度时据此排除该角色）
+                            line = text if split_speaker(text)[0] == speaker else f"{speaker}：{text}"
+                            speculative.append((line, self._schedule(round_num + 1, history + [line])))
+                        return True
+
+                    generation_start = time.perf_counter()
+                    response = character_agent.generate_response(f"这是第{round_num}轮对话", on_delta)
+                    self.stats["generation_seconds"] += time.perf_counter() - generation_start
+                    if self._cancelled.is_set() or not response:
+                        break
+
+                    if not self._commit(round_num, speaker, response):
+                        break
+                    if has_next:
+                        committed = scheduler.conversation_history.tail(10)
+                        if speculative and self._speculation_holds(speculative[0][0], committed[-1]):
+                            self.stats["speculative_schedules"] += 1
+                            next_speaker = speculative[0][1]
+                        else:
+                            if speculative:
+                                speculative[0][1].cancel()
+                                self.stats["speculation_discards"] += 1
+                            next_speaker = self._schedule(round_num + 1, committed, discard_plan=bool(speculative))
+            self.state = "cancelled" if self._cancelled.is_set() else "done"
+        except Exception as e:
+            self.error = str(e)
+            self.state = "error"
+            print(f"❌ 自动播放失败: {str(e)}")
+        finally:
+            self.stats["elapsed_seconds"] = time.perf_counter() - self._start_time
+            self._schedule_pool.shutdown(wait=False, cancel_futures=True)
+            with self._condition:
+                self._condition.notify_all()
+
+    def _speculation_holds(self, pending_line: str, final_line: str) -> bool:
+        """
+        判断提前调度的依据是否仍然成立：完整台词点名的角色与未完成台词相同
+
+        Args:
+            pending_line: 提前调度时的未完成台词
+            final_line: 写入历史的完整台词
+        """
+        scheduler = self.script_system.scheduler
+        return scheduler.addressed_names(pending_line) == scheduler.addressed_names(final_line)
+
+    def _commit(self, round_num: int, speaker: str, response: str) -> bool:
+        """
+        按轮次顺序提交台词；缓冲的台词达到上限时等待消费
+
+        Returns:
+            是否已提交（等待期间被取消时为False）
+        """
+        with self._condition:
+            if self.lookahead:
+                wait_start = time.perf_counter()
+                while len(self.turns) - self.consumed >= self.lookahead and not self._cancelled.is_set():
+                    self._condition.wait()
+                self.stats["backpressure_seconds"] += time.perf_counter() - wait_start
+            if self._cancelled.is_set():
+                return False
+            self.script_system.scheduler.add_to_history(response, speaker)
+            self.script_system.last_speaker = speaker
+            self.script_system.conversation_count += 1
+            self.turns.append({"round": round_num, "speaker": speaker, "message": response})
+            self._condition.notify_all()
+            return True
+
+    def get_turns(self, since: int = 0) -> List[Dict[str, Any]]:
+        """
+        获取已提交的台词，并把since之前的台词视为已消费（供前端轮询）
+
+        Args:
+            since: 调用方已读取的台词数
+
+        Returns:
+            第since条之后的台词
+        """
+        with self._condition:
+            if since > self.consumed:
+                self.consumed = min(since, len(self.turns))
+                self._condition.notify_all()
+            return self.turns[since:]
+
+    def iter_turns(self) -> Iterator[Dict[str, Any]]:
+        """
+        按顺序逐条消费已提交的台词，直到自动播放结束
+
+        Returns:
+            台词迭代器
+        """
+        index = 0
+        while True:
+            with self._condition:
+                while index >= len(self.turns) and self.state in ("pending", "running"):
+                    self._condition.wait()
+                if index >= len(self.turns):
+                    return
+                turn = self.turns[index]
+                index += 1
+                self.consumed = max(self.consumed, index)
+                self._condition.notify_all()
+            yield turn
+
+    def get_status(self) -> Dict[str, Any]:
+        """
+        获取自动播放状态
+
+        Returns:
+            状态、轮数、已提交台词数和流水线统计
+        """
+        stats = dict(self.stats)
+        if self.state == "running":
+            stats["elapsed_seconds"] = time.perf_counter() - self._start_time
+        for name, value in stats.items():
+            if isinstance(value, float):
+                stats[name] = round(value, 3)
+        return {
+            "state": self.state,
+            "rounds": self.rounds,
+            "committed": len(self.turns),
+            "consumed": self.consumed,
+            "error": self.error,
+            "stats": stats
+        }
+
+
+def main():
+    """命令行入口：创建剧本后无交互地运行纯AI对话"""
+    parser = argparse.ArgumentParser(description="纯AI对话自动播放")
+    parser.add_argument("scene", help="场景描述")
+    parser.add_argument("--rounds", type=int, default=20, help="对话轮数")
+    parser.add_argument("--lookahead", type=int, default=AUTOPLAY_LOOKAHEAD, help="最多缓冲的未消费台词数（0表示不限制）")
+    parser.add_argument("--speculate-chars", type=int, default=AUTOPLAY_SPECULATE_CHARS,
+                        help="台词生成到该字数时开始调度下一轮（0表示生成完再调度）")
+    args = parser.parse_args()
+
+    from script_system import ScriptSystem
+
+    script_system = ScriptSystem()
+    result = script_system.initialize_script(args.scene)
+    if "error" in result:
+        print(f"❌ {result['error']}")
+        return
+
+    print(f"\n🎬 自动播放 {args.rounds} 轮对话...")
+    print("=" * 60)
+    engine = AutoPlayEngine(script_system, args.rounds, args.lookahead, args.speculate_chars).start()
+    try:
+        for turn in engine.iter_turns():
+            print(f"【第 {turn['round']} 轮】💬 {turn['message']}")
+    except KeyboardInterrupt:
+        engine.cancel()
+        engine.join()
+        print("\n⏹️ 自动播放已取消")
+
+    status = engine.get_status()
+    stats = status["stats"]
+    characters = sum(len(turn["message"]) for turn in engine.turns)
+    elapsed = stats["elapsed_seconds"]
+    print("=" * 60)
+    print(f"✅ {status['committed']} 轮台词，耗时 {elapsed:.2f}s，"
+          f"{characters / elapsed if elapsed else 0:.1f} 字/秒")
+    print(f"   调度等待 {stats['schedule_wait_seconds']:.2f}s，提前调度 {stats['speculative_schedules']} 次，"
+          f"台词生成 {stats['generation_seconds']:.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,19 +2,39 @@
 角色智能体 - 每个角色的独立AI智能体
 """
 
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+import contextvars
+import copy
+import time
+from concurrent.futures import Executor, Future
+from typing import Callable, List, Dict, Any, Optional, Union
 from config import (
-    DEEPSEEK_BASE_URL, 
-    DEEPSEEK_MODEL, 
-    MAX_TOKENS, 
-    TEMPERATURE,
-    CHARACTER_SYSTEM_PROMPT_TEMPLATE
+    GENERATION_PROFILES,
+    CHARACTER_STOP_SEQUENCES_ENABLED,
+    MAX_STOP_SEQUENCES,
+    USER_CHARACTER_NAME,
+    CHARACTER_SYSTEM_PROMPT_TEMPLATE,
+    MEMORY_RECALL_ENABLED,
+    MEMORY_RECALL_TOKEN_BUDGET,
+    MEMORY_RECALL_MAX_TURNS,
+    MEMORY_RECALL_MIN_SCORE,
+    MEMORY_QUERY_TURNS,
+    OPENING_LINE_WAIT_SECONDS,
+    TURN_COMMIT_MARGIN,
+    TURN_TIMEOUT_RESPONSE
 )
+from history import ConversationHistory, Turn, TurnStore
+from memory_index import MemoryIndex
+from llm_client import get_client, record_completion
+from model_router import create_completion
+from profiler import phase, record_prompt_size
+from tracing import span
+from turn_deadline import DeadlineExceeded, current_budget, remaining
+from usage_tracker import attribute
 
 
 class CharacterAgent:
-    def __init__(self, character_name: str, character_info: str, api_key: str):
+    def __init__(self, character_name: str, character_info: str, api_key: str,
+                 history_store: Optional[TurnStore] = None):
         """
         初始化角色智能体
         
@@ -22,22 +42,35 @@ class CharacterAgent:
             character_name: 角色名字
             character_info: 角色信息（性格、背景等）
             api_key: 分配给这个角色的API密钥
+            history_store: 台词存储（与调度agent共用，台词只保存一份）
         """
         self.character_name = character_name
         self.character_info = character_info
         self.api_key = api_key
-        self.conversation_history = []
-        
-        # 初始化OpenAI客户端
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=DEEPSEEK_BASE_URL
-        )
+        self.conversation_history = ConversationHistory(history_store)
         
         # 场景和剧情信息（由调度agent设置）
         self.scene_setting = ""
         self.plot_summary = ""
         
+        # 同一剧本中的其他角色（用于生成停止序列）
+        self.other_character_names: List[str] = []
+        
+        # 对话历史的检索索引（由调度agent设置，包含所有台词）和本角色看不到的台词在索引中的编号（召回时跳过）
+        self.memory: Optional[MemoryIndex] = None
+        self.hidden_turns: set = set()
+        
+        # 预先生成的开场台词（由调度agent在剧本创建后启动，第一次被调度时直接使用）和开始生成时的对话历史长度
+        self.opening_line: Optional[Future] = None
+        self._opening_line_turns = 0
+        
+    @property
+    def client(self):
+        """
+        OpenAI客户端（首次调用时创建，同一密钥共享）
+        """
+        return get_client(self.api_key)
+    
     def set_scene_info(self, scene_setting: str, plot_summary: str):
         """
         设置场景和剧情信息
@@ -49,25 +82,189 @@ class CharacterAgent:
         self.scene_setting = scene_setting
         self.plot_summary = plot_summary
         
-    def add_to_history(self, message: str):
+    def set_other_characters(self, character_names: List[str]):
+        """
+        设置同一剧本中的其他角色
+        
+        Args:
+            character_names: 剧本中所有角色的名字（包括用户主角）
+        """
+        self.other_character_names = [name for name in character_names if name != self.character_name]
+    
+    def get_stop_sequences(self) -> Optional[List[str]]:
+        """
+        生成停止序列：模型开始写其他角色的"名字："时停止，只保留自己的一句台词
+        
+        Returns:
+            停止序列列表，未启用时返回None
+        """
+        if not CHARACTER_STOP_SEQUENCES_ENABLED:
+            return None
+        # 用户主角优先，角色过多时按上限截断
+        names = [USER_CHARACTER_NAME] + [name for name in self.other_character_names if name != USER_CHARACTER_NAME]
+        return [f"\n{name}：" for name in names][:MAX_STOP_SEQUENCES]
+    
+    def add_to_history(self, message: Union[str, Turn]):
         """
         添加对话历史
         
         Args:
-            message: 对话内容
+            message: 对话内容，或调度agent已保存在共用存储中的台词记录
         """
         self.conversation_history.append(message)
         
-    def generate_response(self, current_situation: str = "") -> str:
+    def recall(self, current_situation: str = "", recent_count: int = 10) -> List[str]:
+        """
+        召回最近recent_count条之前、与当前情况和最近对话相关的台词
+        
+        Args:
+            current_situation: 当前情况描述
+            recent_count: 提示词中已包含的最近对话条数（不参与召回）
+            
+        Returns:
+            召回的台词（"名字：台词"格式，按时间顺序），总token数不超过预算
+        """
+        if not MEMORY_RECALL_ENABLED or self.memory is None or len(self.conversation_history) <= recent_count:
+            return []
+        
+        with span("character.recall", character=self.character_name):
+            recent = self.conversation_history.tail_turns(recent_count)
+            # 最近的对话已在提示词中，索引中这之后的台词都不参与召回
+            before = self.memory.count_through(recent[0].seq) - 1
+            query = "\n".join([current_situation] + [turn.text for turn in recent[-MEMORY_QUERY_TURNS:]])
+            store = self.conversation_history.store
+            selected = []
+            budget = MEMORY_RECALL_TOKEN_BUDGET
+            hits = self.memory.search(query, MEMORY_RECALL_MAX_TURNS * 2, before, self.hidden_turns)
+            for index, seq, score in hits:
+                if score < MEMORY_RECALL_MIN_SCORE or len(selected) >= MEMORY_RECALL_MAX_TURNS:
+                    break
+                turn = store.turn(seq)
+                if turn.tokens > budget:
+                    continue
+                budget -= turn.tokens
+                selected.append((index, turn.format()))
+        return [line for _, line in sorted(selected)]
+    
+    def generate_response(self, current_situation: str = "",
+                          on_delta: Optional[Callable[[str], Optional[bool]]] = None) -> str:
         """
         生成角色回应
         
         Args:
             current_situation: 当前情况描述
+            on_delta: 流式生成时每收到一段输出的回调，参数为目前已生成的文本，返回False时停止生成
             
         Returns:
-            角色的回应
+            角色的回应（不会写入历史记录）；流式生成被回调中止时返回空字符串
+        """
+        with span("character.generate_response", character=self.character_name), \
+                attribute(character=self.character_name):
+            opening_line = self._take_opening_line()
+            if opening_line is not None:
+                if on_delta is not None:
+                    on_delta(opening_line)
+                return opening_line
+            return self._generate_response(current_situation, on_delta)
+    
+    def prepare_opening_line(self, executor: Executor, situation: str) -> None:
         """
+        在后台生成开场台词（第一次被调度时直接使用，不再调用模型；生成失败时异常保存在Future中）
+        
+        Args:
+            executor: 执行生成的线程池
+            situation: 生成开场台词时的当前情况
+        """
+        def generate() -> str:
+            with span("character.opening_line", character=self.character_name), \
+                    attribute(character=self.character_name):
+                return self._generate_response(situation, raise_errors=True)
+        
+        self._opening_line_turns = len(self.conversation_history)
+        self.opening_line = executor.submit(contextvars.copy_context().run, generate)
+    
+    def _take_opening_line(self) -> Optional[str]:
+        """
+        取出预先生成的开场台词（仍在生成时等待其完成，最多等到单轮截止时间，没有时间预算时最多等OPENING_LINE_WAIT_SECONDS秒）
+        
+        Returns:
+            开场台词；没有开场台词、开始生成后又有新台词（如用户先说了话）或生成失败时返回None
+        """
+        future, self.opening_line = self.opening_line, None
+        if future is None:
+            return None
+        if len(self.conversation_history) != self._opening_line_turns:
+            # 开场台词没有考虑之后的台词，不再使用
+            future.cancel()
+            return None
+        left = remaining()
+        try:
+            return future.result(timeout=OPENING_LINE_WAIT_SECONDS if left is None else max(0.0, left))
+        except Exception:
+            # 生成失败（或等不到生成完成），由调用方重新生成
+            return None
+    
+    def _stream_response(self, messages: List[Dict[str, str]], generation: Dict[str, Any],
+                         on_delta: Callable[[str], Optional[bool]]) -> Optional[str]:
+        """
+        以流式方式生成台词
+        
+        Returns:
+            完整的台词（接近单轮截止时间时为已生成的部分）；被回调中止时返回None
+        """
+        chunks = []
+        usage = None
+        finish_reason = None
+        budget = current_budget()
+        # 有单轮时间预算时，读取超时提前TURN_COMMIT_MARGIN秒触发，留出提交已生成部分的时间
+        extra_args = {"timeout": max(0.1, remaining() - TURN_COMMIT_MARGIN)} if budget is not None else {}
+        start_time = time.perf_counter()
+        with phase("llm.character"), span("http.chat_completion", call_site="character", key=self.api_key[-4:], stream=True):
+            stream = create_completion(
+                "character",
+                self.api_key,
+                messages=messages,
+                temperature=generation["temperature"],
+                max_tokens=generation["max_tokens"],
+                stop=self.get_stop_sequences(),
+                stream=True,
+                stream_options={"include_usage": True},
+                **extra_args
+            )
+            try:
+                for chunk in stream:
+                    if getattr(chunk, "usage", None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    finish_reason = chunk.choices[0].finish_reason or finish_reason
+                    delta = chunk.choices[0].delta.content
+                    if delta:
+                        chunks.append(delta)
+                        if on_delta("".join(chunks)) is False:
+                            if hasattr(stream, "close"):
+                                stream.close()
+                            return None
+                    if budget is not None and finish_reason is None and remaining() < TURN_COMMIT_MARGIN:
+                        # 接近截止时间：停止生成，提交已生成的部分
+                        budget.truncated = True
+                        finish_reason = "deadline"
+                        if hasattr(stream, "close"):
+                            stream.close()
+                        break
+            except Exception:
+                # 读取超时（或连接中断）发生在截止时间附近时提交已生成的部分，否则按生成失败处理
+                if budget is None or remaining() > TURN_COMMIT_MARGIN * 2:
+                    raise
+                budget.truncated = True
+                finish_reason = "deadline"
+        record_completion("character", time.perf_counter() - start_time,
+                          usage.completion_tokens if usage else None, finish_reason)
+        return "".join(chunks)
+    
+    def _generate_response(self, current_situation: str,
+                           on_delta: Optional[Callable[[str], Optional[bool]]] = None,
+                           raise_errors: bool = False) -> str:
         try:
             # 构建系统提示词
             system_prompt = CHARACTER_SYSTEM_PROMPT_TEMPLATE.format(
@@ -78,9 +275,11 @@ class CharacterAgent:
             )
             
             # 构建用户输入
-            conversation_context = "\n".join(self.conversation_history[-10:])  # 最近10条对话
+            conversation_context = "\n".join(self.conversation_history.tail(10))  # 最近10条对话
+            recalled = self.recall(current_situation, 10)
+            recalled_context = "早前的相关对话：\n" + "\n".join(recalled) + "\n\n" if recalled else ""
             user_input = f"""
-当前对话历史：
+{recalled_context}当前对话历史：
 {conversation_context}
 
 当前情况：{current_situation}
@@ -88,28 +287,77 @@ class CharacterAgent:
 请以{self.character_name}的身份回应：
 """
             
-            response = self.client.chat.completions.create(
-                model=DEEPSEEK_MODEL,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_input}
-                ],
-                temperature=TEMPERATURE,
-                max_tokens=MAX_TOKENS,
-                stream=False
-            )
-            
-            character_response = response.choices[0].message.content.strip()
-            
-            # 将回应添加到历史记录
-            self.add_to_history(character_response)
+            record_prompt_size("character", len(system_prompt) + len(user_input))
+            generation = GENERATION_PROFILES["character"]
+            messages = [
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_input}
+            ]
+            budget = current_budget()
+            if on_delta is not None or budget is not None:
+                # 有单轮时间预算时总是流式生成，接近截止时间可以提交已生成的部分
+                streamed = self._stream_response(messages, generation, on_delta or (lambda text: None))
+                if streamed is None:
+                    return ""
+                character_response = streamed.strip()
+                if budget is not None and budget.truncated and \
+                        not character_response.removeprefix(f"{self.character_name}：").strip():
+                    # 截止时还没有生成出台词内容
+                    character_response = f"{self.character_name}：{TURN_TIMEOUT_RESPONSE}"
+            else:
+                start_time = time.perf_counter()
+                with phase("llm.character"), span("http.chat_completion", call_site="character", key=self.api_key[-4:]):
+                    response = create_completion(
+                        "character",
+                        self.api_key,
+                        messages=messages,
+                        temperature=generation["temperature"],
+                        max_tokens=generation["max_tokens"],
+                        stop=self.get_stop_sequences(),
+                        stream=False
+                    )
+                record_completion("character", time.perf_counter() - start_time,
+                                  response.usage.completion_tokens if response.usage else None,
+                                  response.choices[0].finish_reason)
+                
+                character_response = response.choices[0].message.content.strip()
             
+            # 回应由调用方通过调度agent的add_to_history统一写入所有角色（包括自己）的历史记录
             return character_response
             
+        except DeadlineExceeded:
+            # 调度等环节已用完本轮的时间预算，来不及生成台词
+            current_budget().truncated = True
+            return f"{self.character_name}：{TURN_TIMEOUT_RESPONSE}"
         except Exception as e:
-            error_message = f"{self.character_name}：[角色回应生成失败: {str(e)}]"
-            self.add_to_history(error_message)
-            return error_message
+            if raise_errors:
+                raise
+            return f"{self.character_name}：[角色回应生成失败: {str(e)}]"
+    
+    def fork(self, history: ConversationHistory, api_key: Optional[str] = None,
+             memory: Optional[MemoryIndex] = None) -> "CharacterAgent":
+        """
+        为剧情分支创建角色智能体（角色设定等不可变信息与原智能体共享，只替换历史记录）
+        
+        Args:
+            history: 本角色在分支中的对话历史（与原历史共享公共前缀）
+            api_key: 分支使用的API密钥（为None时沿用原密钥）
+            memory: 分支的检索索引（为None时沿用原索引）
+            
+        Returns:
+            分支中的角色智能体
+        """
+        forked = copy.copy(self)
+        forked.conversation_history = history.fork()
+        forked.opening_line = None  # 各分支分别生成台词，不共用开场台词
+        if api_key is not None:
+            forked.api_key = api_key
+        if memory is not None:
+            forked.memory = memory
+        # 分支点之后的编号在分支中对应新的台词
+        forked.hidden_turns = {index for index in self.hidden_turns if index < len(forked.memory)} \
+            if forked.memory is not None else set(self.hidden_turns)
+        return forked
     
     def get_character_info(self) -> Dict[str, str]:
         """
@@ -128,4 +376,5 @@ class CharacterAgent:
         """
         清空对话历史
         """
-        self.conversation_history.clear() 
\ No newline at end of file
+        self.conversation_history.clear()
+        self.hidden_turns = set()
\ No newline at end of file
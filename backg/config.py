@@ -2,6 +2,11 @@
 配置文件 - 管理API密钥池和系统设置
 """
 
+import os
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))  # 数据文件的默认位置与启动时的工作目录无关
+
 # API密钥池
 API_KEYS = [
     "sk-7d309265e6d0461eb4872a947848926e",
@@ -11,18 +16,90 @@ API_KEYS = [
     "sk-1d72f43e0364435382113a410faf53fb",
 ]
 
-# DeepSeek API配置
-DEEPSEEK_BASE_URL = "https://api.deepseek.com"
+# DeepSeek API配置（可通过环境变量指向本地模拟服务，便于压测）
+DEEPSEEK_BASE_URL = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com")
 DEEPSEEK_MODEL = "deepseek-chat"
 
 # 系统配置
 MAX_TOKENS = 2048
 TEMPERATURE = 0.8
 
+# 各调用点的生成参数（剧本设定、角色调度、角色台词）
+GENERATION_PROFILES = {
+    "setting": {"max_tokens": 1536, "temperature": 0.8},
+    "scheduling": {"max_tokens": 4, "temperature": 0.3},  # 只需输出候选角色的编号
+    "character": {"max_tokens": 300, "temperature": 0.9},  # 一次只生成一句台词
+}
+CHARACTER_STOP_SEQUENCES_ENABLED = True  # 角色台词遇到其他角色的"名字："前缀时停止生成
+MAX_STOP_SEQUENCES = 16  # 单次请求的停止序列数量上限（DeepSeek接口限制）
+
+# 模型路由配置：每个调用点按顺序尝试的模型端点，前一个饱和或出错冷却时回退到下一个
+# price_input/price_output为每百万token的价格（元），仅用于成本统计，请按实际价格调整
+API_KEY_POOLS = {
+    "default": API_KEYS,
+}
+MODEL_ENDPOINTS = {
+    "deepseek-chat": {
+        "model": DEEPSEEK_MODEL,
+        "base_url": DEEPSEEK_BASE_URL,
+        "key_pool": "default",
+        "max_concurrency": 16,  # 同时进行的请求数上限，达到上限视为饱和（0表示不限制）
+        "price_input": 2.0,
+        "price_output": 8.0,
+    },
+}
+MODEL_ROUTES = {
+    "setting": ["deepseek-chat"],
+    "scheduling": ["deepseek-chat"],
+    "character": ["deepseek-chat"],
+}
+MODEL_ROUTE_COOLDOWN = 15.0  # 端点返回限流/连接错误后暂停使用的时间（秒）
+MODEL_ROUTE_MAX_RETRIES = 2  # 没有可回退的端点时，限流/连接错误的最大重试次数
+MODEL_ROUTE_QUEUE_TIMEOUT = 10.0  # 候选端点全部饱和时排队等待并发名额的最长时间（秒），超时后超出上限发送
+
+# 可选的快速调度模型（OpenAI兼容接口，如本地部署的小模型），设置后调度优先使用它
+FAST_MODEL_BASE_URL = os.environ.get("ZGCA_FAST_MODEL_BASE_URL")
+if FAST_MODEL_BASE_URL:
+    API_KEY_POOLS["fast"] = [key for key in os.environ.get("ZGCA_FAST_MODEL_API_KEYS", "sk-local").split(",") if key]
+    MODEL_ENDPOINTS["fast"] = {
+        "model": os.environ.get("ZGCA_FAST_MODEL", "deepseek-chat"),
+        "base_url": FAST_MODEL_BASE_URL,
+        "key_pool": "fast",
+        "max_concurrency": 8,
+        "price_input": 0.0,
+        "price_output": 0.0,
+    }
+    MODEL_ROUTES["scheduling"] = ["fast", "deepseek-chat"]
+
+# LLM连接配置
+LLM_CA_BUNDLE = os.environ.get("ZGCA_CA_BUNDLE")  # 自定义CA证书路径（如本地TLS模拟服务），为空时使用系统证书
+LLM_MAX_CONNECTIONS = 20  # 共享连接池的最大连接数
+LLM_KEEPALIVE_EXPIRY = 120.0  # 空闲连接在连接池中保留的时间（秒）
+LLM_PREWARM_ENABLED = True  # 是否在Bridge启动和剧本初始化时预热连接
+LLM_PREWARM_MAX_CONNECTIONS = 5  # 单次预热最多建立的连接数
+LLM_KEEPALIVE_INTERVAL = 30.0  # 连接空闲超过该时间（秒）后发送一次轻量保活请求
+LLM_KEEPALIVE_CONNECTIONS = 2  # 每次保活的连接数
+LLM_KEEPALIVE_MAX_PER_HOUR = 240  # 每小时最多发送的保活请求数
+LLM_KEEPALIVE_IDLE_LIMIT = 600.0  # 连续空闲超过该时间（秒）后停止保活
+
+# 跨进程API配额协调（同一台机器上的多个Bridge/命令行进程通过共享内存文件共用每个密钥的令牌桶和冷却时间）
+QUOTA_ENABLED = os.environ.get("ZGCA_QUOTA", "0") == "1"  # 默认关闭；开启时请把ZGCA_QUOTA_RPM设为服务商给出的实际限额
+QUOTA_SHARED_PATH = os.environ.get("ZGCA_QUOTA_PATH", os.path.join(tempfile.gettempdir(), "zgca_quota.bin"))
+QUOTA_MAX_KEYS = 64  # 共享文件中的密钥槽位数
+QUOTA_REQUESTS_PER_MINUTE = float(os.environ.get("ZGCA_QUOTA_RPM", "120"))  # 每个密钥每分钟允许的请求数（所有进程合计）
+QUOTA_BURST = float(os.environ.get("ZGCA_QUOTA_BURST", "20"))  # 令牌桶容量，允许的瞬时突发请求数
+QUOTA_LEASE_SIZE = 2  # 每次从共享令牌桶预取的令牌数，预取的令牌在本进程内使用，只加进程内锁、不加文件锁
+QUOTA_LEASE_TTL = 1.0  # 预取令牌的有效期（秒），过期未用的令牌作废
+QUOTA_RATE_LIMIT_COOLDOWN = 10.0  # 收到429且未给出Retry-After时，该密钥在所有进程中暂停使用的时间（秒）
+QUOTA_MAX_WAIT = 30.0  # 等待令牌的最长时间（秒），超时后仍然发送请求
+
+# Bridge会话配置
+BRIDGE_MAX_SESSIONS = 64  # 同时保留的会话数量上限（按X-Session-Id区分），超出时淘汰最久未使用的会话
+
 # 用户主角设置
 USER_CHARACTER_NAME = "我"  # 用户在剧本中的角色名
 
-# 调度agent的系统提示词
+# 调度agent的系统提示词（以文本格式生成剧本设定时使用）
 SCHEDULER_SYSTEM_PROMPT = """你现在是一个剧本调度系统。你的任务是：
 
 1. 根据用户输入的场景和限制，创建剧本的基本设定和角色
@@ -47,16 +124,147 @@ SCHEDULER_SYSTEM_PROMPT = """你现在是一个剧本调度系统。你的任务
 下一个说话的角色：[角色名（可以是"我"或其他AI角色名）]
 调度理由：[简要说明为什么选择这个角色]"""
 
-# 角色agent的系统提示词模板
-CHARACTER_SYSTEM_PROMPT_TEMPLATE = """你现在扮演角色：{character_name}
+# 对话调度提示词（每轮调用，只列出编号的候选角色，要求只输出编号）
+SCHEDULING_SYSTEM_PROMPT = """你是剧本的对话调度器，负责决定下一个说话的角色。
+根据场景、最近的对话和当前情况，从候选角色中选出最合适的下一位说话者：
+- 优先选择被提问、被点名或与当前话题最相关的角色
+- 避免同一个角色连续说话；候选中有用户主角"我"时，要让用户有充分的参与机会
+只输出所选角色的编号（一个数字），不要输出其他内容。"""
+SCHEDULING_REASON_ENABLED = os.environ.get("ZGCA_SCHEDULING_REASON", "0") == "1"  # 调试用：要求在编号后附上调度理由并打印
+SCHEDULING_REASON_PROMPT = "\n调试模式：在编号后用一句话说明理由，格式为\"编号|理由\"。"
+SCHEDULING_REASON_MAX_TOKENS = 64  # 附带调度理由时的最大令牌数
 
-角色信息：{character_info}
+# 剧本设定的结构化输出配置
+SCRIPT_SETTING_JSON_MODE = True  # 是否以JSON格式生成剧本设定（失败时回退到文本格式解析）
+SCRIPT_SETTING_REPAIR_MAX_TOKENS = 1024  # 修复单个字段时的最大令牌数
+SCRIPT_SETTING_STREAMING = True  # 是否流式生成剧本设定（主要角色生成完毕即创建角色，不等待剧情大纲）
 
-场景背景：{scene_setting}
+# 剧本设定的JSON输出提示词
+SCRIPT_SETTING_JSON_PROMPT = """你现在是一个剧本调度系统。请根据用户输入的场景和限制，创建剧本的基本设定和角色。
+
+重要：用户将作为主角参与剧本，角色名为"我"。角色列表的第一个必须是"我"。
+
+请只输出一个JSON对象，格式如下：
+{
+  "scene_setting": "描述场景的时间、地点、环境等",
+  "characters": [
+    {"name": "我", "personality": "用户扮演的主角", "background": "根据场景设定主角的背景和特点"},
+    {"name": "其他AI角色名", "personality": "性格特点", "background": "背景"}
+  ],
+  "plot_summary": "简要描述整个剧情的发展脉络，确保用户主角有充分的参与机会"
+}"""
+
+# 修复剧本设定中单个字段的提示词模板
+SCRIPT_SETTING_REPAIR_PROMPT_TEMPLATE = """下面是一个剧本设定JSON，其中字段"{field}"缺失或格式错误（{error}）。
+请只重新生成这个字段，输出JSON对象：{{"{field}": ...}}
+
+字段要求：{requirement}
+
+用户输入的场景和限制：{user_input}
+
+已有设定：
+{context}"""
+
+# 角色agent的系统提示词模板（所有角色相同的场景和剧情放在最前面，不同角色、不同剧情分支的请求共享提示词前缀，便于命中缓存）
+CHARACTER_SYSTEM_PROMPT_TEMPLATE = """场景背景：{scene_setting}
 
 剧情状况：{plot_summary}
 
+你现在扮演角色：{character_name}
+
+角色信息：{character_info}
+
 请根据当前的对话历史和你的角色设定，以第一人称的方式回应。回应要符合角色的性格特点和当前的情境。
 
 输出格式：
-{character_name}：[你的台词和动作描述]""" 
\ No newline at end of file
+{character_name}：[你的台词和动作描述]""" 
+
+# 调试与性能分析配置
+DEBUG_ENDPOINTS_ENABLED = os.environ.get("ZGCA_DEBUG", "0") == "1"  # 是否开放 /api/debug/* 调试端点
+PROFILE_SAMPLE_INTERVAL = 0.005  # 采样分析器的采样间隔（秒）
+PROFILE_MAX_SECONDS = 60  # 单次采样分析的最长时间（秒）
+SLOW_REQUEST_THRESHOLD = float(os.environ.get("ZGCA_SLOW_REQUEST_THRESHOLD", "5.0"))  # 慢请求阈值（秒）
+SLOW_REQUEST_LOG_PATH = os.path.join("logs", "slow_requests.jsonl")  # 慢请求日志文件
+SLOW_REQUEST_MEMORY_SIZE = 100  # 内存中保留的最近慢请求数量
+
+# 调用链追踪配置
+TRACE_ENABLED = os.environ.get("ZGCA_TRACE", "0") == "1"  # 是否记录调用链span（默认关闭）
+TRACE_LOG_PATH = os.path.join("logs", "trace.json")  # Chrome trace-event格式文件，可用chrome://tracing或Perfetto打开
+TRACE_MAX_EVENTS_PER_FILE = 20000  # 单个trace文件的最大事件数，超出后轮转
+TRACE_BACKUP_COUNT = 5  # 保留的历史trace文件数量
+
+# 用量统计配置
+USAGE_LOG_PATH = os.path.join("logs", "usage.json")  # 按会话/角色/调用点/密钥汇总的token用量，定期覆盖写入
+USAGE_FLUSH_INTERVAL = 30.0  # 用量汇总写入磁盘的间隔（秒）
+USAGE_SESSION_TOKEN_QUOTA = int(os.environ.get("ZGCA_SESSION_TOKEN_QUOTA", "0"))  # 每个会话的token配额（0表示不限制）
+USAGE_BACKGROUND_SOFT_RATIO = 0.8  # 会话用量达到配额的该比例后，后台任务（自动对话等）的每次请求先退避
+USAGE_BACKGROUND_DELAY = 1.0  # 后台任务的最长退避时间（秒），从软上限处的0线性增加到配额处的该值
+
+# LLM调用录制/回放配置（用于离线基准测试和回归测试）
+LLM_CASSETTE_MODE = os.environ.get("ZGCA_LLM_CASSETTE_MODE", "off")  # off、record（录制）或replay（回放，不访问网络）
+LLM_CASSETTE_PATH = os.environ.get("ZGCA_LLM_CASSETTE", os.path.join("cassettes", "session.jsonl.gz"))  # cassette文件
+LLM_REPLAY_SPEED = os.environ.get("ZGCA_LLM_REPLAY_SPEED", "fast")  # realtime按录制耗时回放，fast尽快回放
+LLM_REPLAY_ON_MISS = os.environ.get("ZGCA_LLM_REPLAY_ON_MISS", "sequence")  # 提示词哈希不匹配时：sequence按调用点录制顺序回放，error报错
+
+# 自动播放配置（纯AI对话的无交互流水线）
+AUTOPLAY_LOOKAHEAD = 4  # 已提交但尚未被消费（打印、前端拉取）的台词最多缓冲条数，超出后暂停生成
+AUTOPLAY_SPECULATE_CHARS = 16  # 当前台词流式生成到该字数时即开始调度下一轮（0表示等台词生成完再调度）
+AUTOPLAY_MAX_ROUNDS = 500  # 单次自动播放的最大轮数
+
+# 剧情分支配置
+CONTINUATION_MAX_BRANCHES = 8  # 一次并行生成的备选台词（剧情分支）最大数量
+
+# 台词存储配置
+TURN_STORE_SPILL_BYTES = int(os.environ.get("ZGCA_TURN_SPILL_BYTES", str(4 * 1024 * 1024)))  # 内存中台词正文超过该字节数后写入临时文件（0表示不写入）
+TURN_STORE_SPILL_DIR = os.environ.get("ZGCA_TURN_SPILL_DIR") or None  # 临时文件目录（默认使用系统临时目录）
+
+# 会话持久化配置（桥接服务重启后按会话ID恢复剧本和对话历史）
+SESSION_STORE_ENABLED = os.environ.get("ZGCA_SESSION_STORE", "1") == "1"  # 是否把会话写入SQLite
+SESSION_STORE_PATH = os.environ.get("ZGCA_SESSION_DB", os.path.join(BACKEND_DIR, "data", "sessions.db"))  # 数据库文件（WAL模式）
+SESSION_STORE_CHUNK_TURNS = 256  # 散行台词达到两倍该数量时，把最早的一批压缩为一个块
+
+# 检索记忆配置（角色提示词只包含最近10条对话，更早的相关台词按BM25召回）
+MEMORY_RECALL_ENABLED = os.environ.get("ZGCA_MEMORY_RECALL", "1") == "1"  # 是否为角色召回早前的相关台词
+MEMORY_RECALL_TOKEN_BUDGET = 200  # 召回台词的token预算（按估算的token数）
+MEMORY_RECALL_MAX_TURNS = 3  # 最多召回的台词条数
+MEMORY_RECALL_MIN_SCORE = 4.0  # BM25得分低于该值的台词不召回
+MEMORY_QUERY_TURNS = 3  # 以当前情况和最近几条对话作为检索查询
+
+# 角色视角配置（角色只看到在场时发生的、或对其说的台词）
+PERSPECTIVE_FILTER_ENABLED = os.environ.get("ZGCA_PERSPECTIVE_FILTER", "1") == "1"  # 是否按在场情况和私语过滤各角色的对话历史
+PRESENCE_ENTER_TEMPLATE = "（{name}来到了这里）"  # 角色进场时写入对话历史的旁白
+PRESENCE_LEAVE_TEMPLATE = "（{name}离开了）"  # 角色离场时写入对话历史的旁白
+WHISPER_MARKERS = ("悄悄", "低声对", "小声对", "耳语", "私下对")  # 台词开头的动作描述包含这些词并提到角色时，只有说话者和被提到的角色能听到
+
+# 本地调度模型配置（用记录的LLM调度决定训练，置信度足够时不调用LLM）
+SCHEDULER_DECISION_LOG_ENABLED = os.environ.get("ZGCA_LOG_DECISIONS", "0") == "1"  # 是否记录LLM调度决定（收集训练数据时开启）
+SCHEDULER_DECISION_LOG_PATH = os.path.join(BACKEND_DIR, "logs", "scheduler_decisions.jsonl")  # 调度决定日志
+SPEAKER_MODEL_ENABLED = os.environ.get("ZGCA_SPEAKER_MODEL", "1") == "1"  # 有训练好的模型时是否使用
+SPEAKER_MODEL_PATH = os.path.join(BACKEND_DIR, "models", "speaker_model.json")  # train_speaker_model.py输出的模型文件
+SPEAKER_MODEL_CONFIDENCE = float(os.environ.get("ZGCA_SPEAKER_MODEL_CONFIDENCE", "0.85"))  # 本地模型置信度达到该值时直接采用
+
+# 多轮调度规划配置（一次调度规划接下来几轮AI角色的发言顺序）
+SPEAKER_PLAN_TURNS = int(os.environ.get("ZGCA_SPEAKER_PLAN_TURNS", "3"))  # 自动播放时每次规划的轮数（1表示每轮单独调度；交互对话中用户随时可能插话，始终每轮单独调度）
+SCHEDULING_PLAN_PROMPT = "\n请规划接下来{turns}轮依次说话的角色，只输出{turns}个编号，用逗号分隔（如\"2,1,3\"），同一角色不要连续出现，不要输出其他内容。"
+
+# 群戏配置（角色较多时调度提示词只列出部分候选角色）
+SCHEDULING_MAX_CANDIDATES = int(os.environ.get("ZGCA_SCHEDULING_MAX_CANDIDATES", "8"))  # 调度时最多列出的AI角色数（被点名、最近发言的优先，其余按最久没说话补足）
+
+# 跨会话调度合批配置（多个会话几乎同时调度时合并为一次LLM调用）
+SCHEDULING_BATCH_ENABLED = os.environ.get("ZGCA_SCHEDULING_BATCH", "0") == "1"  # 是否合并不同会话的调度请求
+SCHEDULING_BATCH_WINDOW_MS = float(os.environ.get("ZGCA_SCHEDULING_BATCH_WINDOW_MS", "5"))  # 第一个调度请求到达后等待其他请求的时间（毫秒）
+SCHEDULING_BATCH_MAX_SIZE = int(os.environ.get("ZGCA_SCHEDULING_BATCH_MAX_SIZE", "8"))  # 每批最多合并的调度请求数（凑满立即发出）
+SCHEDULING_BATCH_PROMPT = """
+现在有多个互不相关的剧本同时需要调度，每个剧本以"【剧本N】"开头，可能附有该剧本的额外要求。
+为每个剧本分别作答，每个剧本一行，格式为"剧本编号: 回答"（如"1: 2"），回答的格式与只有一个剧本时相同，不要输出其他内容。"""
+
+# 单轮延迟目标配置（/api/send-message的一轮对话在时间预算内完成，调度或生成超时时降级）
+TURN_DEADLINE_SECONDS = float(os.environ.get("ZGCA_TURN_DEADLINE", "0"))  # 每轮的时间预算（秒，0表示不限制；需要延迟目标时设为如12）
+TURN_SCHEDULING_BUDGET = float(os.environ.get("ZGCA_TURN_SCHEDULING_BUDGET", "2"))  # 调度最多占用的时间（秒），超出时在本地选出说话者
+TURN_COMMIT_MARGIN = float(os.environ.get("ZGCA_TURN_COMMIT_MARGIN", "0.5"))  # 距截止时间不足该值时停止生成，提交已生成的部分
+TURN_TIMEOUT_RESPONSE = "（沉默了片刻）"  # 截止前没有生成任何内容时提交的台词
+
+# 开场台词预热配置（剧本创建完成后在后台为AI角色并发生成开场台词，第一轮AI发言直接使用）
+OPENING_LINES_ENABLED = os.environ.get("ZGCA_OPENING_LINES", "0") == "1"  # 是否预先生成开场台词
+OPENING_LINE_SITUATION = "剧情刚刚开始，请说出你的开场白"  # 生成开场台词时的当前情况
+OPENING_LINE_WAIT_SECONDS = float(os.environ.get("ZGCA_OPENING_LINE_WAIT", "15"))  # 没有单轮时间预算时最多等待开场台词生成完成的时间（秒），超时后重新生成
\ No newline at end of file
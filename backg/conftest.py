@@ -0,0 +1,30 @@
+"""
+测试公共配置：把项目根目录加入导入路径，提供指向本地模拟LLM服务的fixture
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import llm_client  # noqa: E402
+import model_router  # noqa: E402
+from fake_llm_server import FakeLLMConfig, start_server  # noqa: E402
+
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    """启动本地模拟LLM服务，测试期间所有LLM客户端都连接到该服务"""
+    config = FakeLLMConfig(latency=0.0)
+    server = start_server(0, config)
+    base_url = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(llm_client, "DEEPSEEK_BASE_URL", base_url)
+    for endpoint in model_router.router.endpoints.values():
+        monkeypatch.setattr(endpoint, "base_url", base_url)
+    llm_client.reset()
+    yield config
+    server.shutdown()
+    server.server_close()
+    llm_client.reset()
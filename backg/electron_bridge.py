@@ -1,14 +1,24 @@
 """
 Electron Bridge - 连接Electron前端与Python后端的API桥梁
+
+启动时先绑定端口并输出就绪信号（BRIDGE_READY），随后再导入Flask、构建剧本系统，
+期间到达的请求会在监听队列中等待，不会被拒绝。
 """
 
 import json
 import logging
-from flask import Flask, request, jsonify
-from flask_cors import CORS
-from script_system import ScriptSystem
+import socket
+from config import DEBUG_ENDPOINTS_ENABLED, BRIDGE_MAX_SESSIONS
+import llm_client
+import profiler
+import tracing
+import usage_tracker
+from turn_deadline import turn_budget
 import threading
 import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future
 
 # 配置日志 - 设置UTF-8编码
 import sys
@@ -29,42 +39,218 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+
+def create_timed_json_provider(app):
+    """创建统计JSON序列化耗时的JSON提供器"""
+    from flask.json.provider import DefaultJSONProvider
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        def response(self, *args, **kwargs):
+            with profiler.phase("json_serialize"):
+                return super().response(*args, **kwargs)
+
+    return TimedJSONProvider(app)
+
+
 class ElectronBridge:
     def __init__(self, port=None):
         # 从环境变量读取端口，如果没有设置则使用默认端口8900
         if port is None:
             port = int(os.environ.get('FLASK_PORT', 8900))
         self.port = port
+        
+        from flask import Flask
+        from flask_cors import CORS
         self.app = Flask(__name__)
+        self.app.json = create_timed_json_provider(self.app)
         CORS(self.app)  # 允许跨域请求
         
-        # 初始化剧本系统
+        # 默认会话的剧本系统在后台线程中初始化，不阻塞服务启动
+        self._script_system = None
+        self._script_system_ready = threading.Event()
+        threading.Thread(target=self._init_script_system, daemon=True).start()
+        
+        # 其他会话的剧本系统（按X-Session-Id区分，默认会话使用self.script_system）
+        self.sessions = OrderedDict()
+        self.sessions_lock = threading.Lock()
+        # 正在创建或从会话存储恢复的会话（会话ID -> 创建结果），同一会话的并发请求等待同一次创建
+        self._pending_sessions = {}
+        
+        self.setup_request_timing()
+        self.setup_routes()
+        if DEBUG_ENDPOINTS_ENABLED:
+            self.setup_debug_routes()
+    
+    def _init_script_system(self):
+        """初始化默认会话的剧本系统，并预先导入openai"""
         try:
-            self.script_system = ScriptSystem()
+            from script_system import ScriptSystem
+            self._script_system = ScriptSystem()
+            if self._script_system.attach_session('default'):
+                logger.info("已从会话存储恢复默认会话")
             logger.info("剧本系统初始化成功")
+            llm_client.preload()
+            self._script_system.prewarm_connections()
         except Exception as e:
             logger.error(f"剧本系统初始化失败: {e}")
-            self.script_system = None
+        finally:
+            self._script_system_ready.set()
+    
+    @property
+    def script_system(self):
+        """默认会话的剧本系统（后台初始化完成前会等待）"""
+        self._script_system_ready.wait()
+        return self._script_system
+    
+    def get_script_system(self):
+        """
+        获取当前请求所属会话的剧本系统
         
-        self.setup_routes()
+        Returns:
+            剧本系统实例，创建失败时返回None
+        """
+        from flask import request
+        from script_system import ScriptSystem
+        
+        session_id = request.headers.get('X-Session-Id', 'default')
+        if session_id == 'default':
+            return self.script_system
+        
+        with self.sessions_lock:
+            script_system = self.sessions.get(session_id)
+            if script_system is not None:
+                self.sessions.move_to_end(session_id)
+                return script_system
+            pending = self._pending_sessions.get(session_id)
+            if pending is not None:
+                creating = False
+            else:
+                creating = True
+                pending = self._pending_sessions[session_id] = Future()
+        
+        if not creating:
+            return pending.result()
+        
+        # 在锁外创建剧本系统和恢复会话，不阻塞其他会话的请求
+        try:
+            script_system = ScriptSystem()
+            # 会话不在内存中（新会话、被淘汰或服务重启）：按需从会话存储恢复
+            if script_system.attach_session(session_id):
+                logger.info(f"已从会话存储恢复会话: {session_id}")
+        except Exception as e:
+            logger.error(f"会话 {session_id} 的剧本系统初始化失败: {e}")
+            script_system = None
+        
+        with self.sessions_lock:
+            if script_system is not None:
+                self._add_session_locked(session_id, script_system)
+            del self._pending_sessions[session_id]
+        pending.set_result(script_system)
+        return script_system
+    
+    def _add_session_locked(self, session_id, script_system):
+        """添加会话（调用方需持有sessions_lock），超出会话上限时淘汰最久未使用的会话"""
+        self.sessions[session_id] = script_system
+        while len(self.sessions) > BRIDGE_MAX_SESSIONS:
+            evicted_id, _ = self.sessions.popitem(last=False)
+            logger.info(f"会话数量超出上限，已移除会话: {evicted_id}")
+    
+    def add_branch_session(self, script_system):
+        """
+        把剧情分支注册为新会话，前端之后用返回的会话ID（X-Session-Id）继续该分支
+        
+        Returns:
+            新会话ID
+        """
+        session_id = f"branch-{uuid.uuid4().hex[:12]}"
+        script_system.attach_session(session_id)
+        with self.sessions_lock:
+            self._add_session_locked(session_id, script_system)
+        return session_id
+    
+    def setup_request_timing(self):
+        """设置请求计时与调用链追踪，超过阈值的请求写入慢请求日志"""
+        from flask import request, g
+        
+        @self.app.before_request
+        def start_timing():
+            session = request.headers.get('X-Session-Id', 'default')
+            profiler.start_request(request.path, session)
+            usage_tracker.set_session(session)
+            # 沿用前端传入的trace ID，没有则新建
+            g.trace_span = tracing.begin_span(
+                f"{request.method} {request.path}",
+                trace_id=request.headers.get('X-Trace-Id') or None,
+                session=session
+            )
+        
+        @self.app.after_request
+        def finish_timing(response):
+            trace_span = g.pop('trace_span', None)
+            if trace_span is not None:
+                trace_span.set('status', response.status_code)
+                response.headers['X-Trace-Id'] = trace_span.trace_id
+                tracing.end_span(trace_span)
+            entry = profiler.finish_request(
+                response.status_code,
+                trace_id=trace_span.trace_id if trace_span is not None else None
+            )
+            if entry:
+                logger.warning(f"慢请求 {entry['route']}: {entry['total']}s {entry['phases']}")
+            return response
+    
+    def setup_debug_routes(self):
+        """设置调试路由（仅在ZGCA_DEBUG=1时启用）"""
+        from flask import request, jsonify, Response
+        
+        @self.app.route('/api/debug/profile', methods=['GET'])
+        def debug_profile():
+            """对当前进程进行采样分析，返回折叠栈格式结果"""
+            try:
+                seconds = float(request.args.get('seconds', 5))
+                collapsed = profiler.profiler.run(seconds)
+                return Response(collapsed, mimetype='text/plain')
+            except RuntimeError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 409
+            except ValueError:
+                return jsonify({
+                    'success': False,
+                    'error': 'seconds参数无效'
+                }), 400
+        
+        @self.app.route('/api/debug/slow-requests', methods=['GET'])
+        def debug_slow_requests():
+            """获取最近的慢请求记录"""
+            recent = profiler.slow_request_log.get_recent()
+            return jsonify({
+                'success': True,
+                'threshold': profiler.slow_request_log.threshold,
+                'requests': recent,
+                'count': len(recent)
+            })
     
     def setup_routes(self):
         """设置API路由"""
+        from flask import request, jsonify
         
         @self.app.route('/api/status', methods=['GET'])
         def get_status():
             """获取系统状态"""
             try:
+                script_system = self.get_script_system()
                 status = {
                     'success': True,
                     'status': 'running',
                     'port': self.port,
-                    'script_system_available': self.script_system is not None,
+                    'script_system_available': script_system is not None,
                     'timestamp': time.time()
                 }
                 
-                if self.script_system:
-                    system_status = self.script_system.get_system_status()
+                if script_system:
+                    system_status = script_system.get_system_status()
                     status.update(system_status)
                 
                 return jsonify(status)
@@ -79,6 +265,7 @@ class ElectronBridge:
         def create_script():
             """创建剧本"""
             try:
+                script_system = self.get_script_system()
                 data = request.get_json()
                 scene_description = data.get('sceneDescription', '').strip()
                 
@@ -88,7 +275,7 @@ class ElectronBridge:
                         'error': '场景描述不能为空'
                     }), 400
                 
-                if not self.script_system:
+                if not script_system:
                     return jsonify({
                         'success': False,
                         'error': '剧本系统未初始化'
@@ -97,7 +284,7 @@ class ElectronBridge:
                 logger.info(f"创建剧本请求: {scene_description}")
                 
                 # 调用剧本系统创建剧本
-                result = self.script_system.initialize_script(scene_description)
+                result = script_system.initialize_script(scene_description)
                 
                 if 'error' in result:
                     return jsonify({
@@ -107,8 +294,8 @@ class ElectronBridge:
                 
                 # 获取角色信息
                 characters_info = []
-                if hasattr(self.script_system.scheduler, 'get_characters_info'):
-                    characters_info = self.script_system.scheduler.get_characters_info()
+                if hasattr(script_system.scheduler, 'get_characters_info'):
+                    characters_info = script_system.scheduler.get_characters_info()
                 
                 response_data = {
                     'success': True,
@@ -117,7 +304,9 @@ class ElectronBridge:
                         'scene': scene_description,
                         'characters': [char['name'] for char in characters_info],
                         'characters_detail': characters_info,
-                        'characters_count': len(characters_info)
+                        'characters_count': len(characters_info),
+                        'plot_pending': result.get('plot_pending', False),
+                        'timings': result.get('timings', {})
                     }
                 }
                 
@@ -131,10 +320,34 @@ class ElectronBridge:
                     'error': f'创建剧本失败: {str(e)}'
                 }), 500
         
+        @self.app.route('/api/script-progress', methods=['GET'])
+        def get_script_progress():
+            """获取剧本创建进度（场景和角色生成后即可获取，无需等待创建完成）"""
+            try:
+                script_system = self.get_script_system()
+                if not script_system:
+                    return jsonify({
+                        'success': False,
+                        'error': '剧本系统未初始化'
+                    }), 500
+                
+                return jsonify({
+                    'success': True,
+                    'data': script_system.get_setup_progress()
+                })
+                
+            except Exception as e:
+                logger.error(f"获取剧本创建进度失败: {e}")
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 500
+        
         @self.app.route('/api/send-message', methods=['POST'])
         def send_message():
             """发送用户消息并获取AI回应"""
             try:
+                script_system = self.get_script_system()
                 data = request.get_json()
                 message = data.get('message', '').strip()
                 round_num = data.get('round', 1)
@@ -145,7 +358,7 @@ class ElectronBridge:
                         'error': '消息内容不能为空'
                     }), 400
                 
-                if not self.script_system or not self.script_system.is_initialized:
+                if not script_system or not script_system.is_initialized:
                     return jsonify({
                         'success': False,
                         'error': '请先创建剧本设定'
@@ -153,41 +366,48 @@ class ElectronBridge:
                 
                 logger.info(f"收到用户消息 (第{round_num}轮): {message}")
                 
-                # 添加用户消息到历史记录
-                user_response = f"我：{message}"
-                self.script_system.scheduler.add_to_history(user_response)
-                
-                # 决定下一个AI角色发言
-                situation = f"用户刚刚说：{message}，这是第{round_num}轮对话"
-                next_speaker = self.script_system.scheduler.decide_next_ai_speaker(situation)
-                
-                if not next_speaker:
-                    return jsonify({
-                        'success': False,
-                        'error': '无法确定下一个发言角色'
-                    }), 500
-                
-                # 获取AI角色回应
-                character_agent = self.script_system.scheduler.get_character_agent(next_speaker)
-                if not character_agent:
-                    return jsonify({
-                        'success': False,
-                        'error': f'找不到角色 {next_speaker} 的智能体'
-                    }), 500
-                
-                # 生成AI回应
-                ai_response = character_agent.generate_response(situation)
-                
-                # 添加AI回应到历史记录
-                self.script_system.scheduler.add_to_history(ai_response)
-                
-                response_data = {
-                    'success': True,
-                    'response': ai_response,
-                    'speaker': next_speaker,
-                    'round': round_num,
-                    'situation': situation
-                }
+                # 一轮对话（调度+生成）在TURN_DEADLINE_SECONDS秒内完成，超时时降级而不是让前端一直等待
+                with turn_budget() as budget:
+                    # 添加用户消息到历史记录
+                    user_response = f"我：{message}"
+                    script_system.scheduler.add_to_history(user_response, "我")
+                    
+                    # 决定下一个AI角色发言
+                    situation = f"用户刚刚说：{message}，这是第{round_num}轮对话"
+                    next_speaker = script_system.scheduler.decide_next_ai_speaker(situation)
+                    
+                    if not next_speaker:
+                        return jsonify({
+                            'success': False,
+                            'error': '无法确定下一个发言角色'
+                        }), 500
+                    
+                    # 获取AI角色回应
+                    character_agent = script_system.scheduler.get_character_agent(next_speaker)
+                    if not character_agent:
+                        return jsonify({
+                            'success': False,
+                            'error': f'找不到角色 {next_speaker} 的智能体'
+                        }), 500
+                    
+                    # 生成AI回应
+                    ai_response = character_agent.generate_response(situation)
+                    
+                    # 添加AI回应到历史记录
+                    script_system.scheduler.add_to_history(ai_response, next_speaker)
+                    
+                    response_data = {
+                        'success': True,
+                        'response': ai_response,
+                        'speaker': next_speaker,
+                        'round': round_num,
+                        'situation': situation
+                    }
+                    if budget is not None:
+                        # 调度超时由本地选出说话者、生成接近截止时间被截断时前端可以提示
+                        response_data['scheduler_fallback'] = budget.scheduler_fallback
+                        response_data['truncated'] = budget.truncated
+                        response_data['elapsed'] = round(time.perf_counter() - budget.started, 3)
                 
                 logger.info(f"AI回应 ({next_speaker}): {ai_response[:100]}...")
                 return jsonify(response_data)
@@ -199,14 +419,34 @@ class ElectronBridge:
                     'error': f'处理消息失败: {str(e)}'
                 }), 500
         
+        @self.app.route('/api/usage', methods=['GET'])
+        def get_usage():
+            """获取token用量统计（?scope=session只返回当前会话）"""
+            try:
+                if request.args.get('scope') == 'session':
+                    data = usage_tracker.usage_tracker.snapshot(usage_tracker.get_session())
+                else:
+                    data = usage_tracker.usage_tracker.snapshot()
+                return jsonify({
+                    'success': True,
+                    'data': data
+                })
+            except Exception as e:
+                logger.error(f"获取用量统计失败: {e}")
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 500
+        
         @self.app.route('/api/start-conversation', methods=['POST'])
         def start_conversation():
             """开始自动对话"""
             try:
+                script_system = self.get_script_system()
                 data = request.get_json()
                 rounds = data.get('rounds', 5)
                 
-                if not self.script_system or not self.script_system.is_initialized:
+                if not script_system or not script_system.is_initialized:
                     return jsonify({
                         'success': False,
                         'error': '请先创建剧本设定'
@@ -214,16 +454,10 @@ class ElectronBridge:
                 
                 logger.info(f"开始自动对话: {rounds} 轮")
                 
-                # 在后台线程中执行对话
-                def run_conversation():
-                    try:
-                        self.script_system.start_conversation(rounds)
-                    except Exception as e:
-                        logger.error(f"自动对话执行失败: {e}")
-                
-                conversation_thread = threading.Thread(target=run_conversation)
-                conversation_thread.daemon = True
-                conversation_thread.start()
+                # 以自动播放任务在后台执行（不等待命令行输入；用量计入当前会话，并作为后台任务在接近配额时优先限流）
+                # 前端不一定轮询台词，不限制缓冲条数
+                with usage_tracker.attribute(background=True):
+                    script_system.start_autoplay(rounds, lookahead=data.get('lookahead', 0))
                 
                 return jsonify({
                     'success': True,
@@ -238,12 +472,159 @@ class ElectronBridge:
                     'error': f'启动对话失败: {str(e)}'
                 }), 500
         
+        @self.app.route('/api/autoplay', methods=['GET'])
+        def get_autoplay():
+            """获取自动播放状态和第since条之后的台词（?since=N，同时表示前端已读取前N条）"""
+            try:
+                script_system = self.get_script_system()
+                engine = script_system.autoplay_engine if script_system else None
+                if engine is None:
+                    return jsonify({
+                        'success': False,
+                        'error': '没有自动播放任务'
+                    }), 404
+                
+                since = request.args.get('since', 0, type=int)
+                return jsonify({
+                    'success': True,
+                    'turns': engine.get_turns(since),
+                    **engine.get_status()
+                })
+                
+            except Exception as e:
+                logger.error(f"获取自动播放状态失败: {e}")
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 500
+        
+        @self.app.route('/api/autoplay/cancel', methods=['POST'])
+        def cancel_autoplay():
+            """取消自动播放"""
+            try:
+                script_system = self.get_script_system()
+                if script_system:
+                    script_system.stop_autoplay()
+                
+                return jsonify({
+                    'success': True,
+                    'message': '自动播放已取消'
+                })
+                
+            except Exception as e:
+                logger.error(f"取消自动播放失败: {e}")
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 500
+        
+        @self.app.route('/api/fork', methods=['POST'])
+        def fork_script():
+            """从第turn_index条对话处分出剧情分支，返回分支的会话ID"""
+            try:
+                script_system = self.get_script_system()
+                if not script_system or not script_system.is_initialized:
+                    return jsonify({
+                        'success': False,
+                        'error': '请先创建剧本设定'
+                    }), 400
+                
+                data = request.get_json() or {}
+                branch = script_system.fork(data.get('turn_index'))
+                
+                return jsonify({
+                    'success': True,
+                    'session_id': self.add_branch_session(branch),
+                    'history': branch.get_conversation_history()
+                })
+                
+            except (ValueError, IndexError) as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            except Exception as e:
+                logger.error(f"创建剧情分支失败: {e}")
+                return jsonify({
+                    'success': False,
+                    'error': f'创建剧情分支失败: {str(e)}'
+                }), 500
+        
+        @self.app.route('/api/continuations', methods=['POST'])
+        def generate_continuations():
+            """从第turn_index条对话处并行生成k句备选台词，每句台词是一个新的剧情分支会话"""
+            try:
+                script_system = self.get_script_system()
+                if not script_system or not script_system.is_initialized:
+                    return jsonify({
+                        'success': False,
+                        'error': '请先创建剧本设定'
+                    }), 400
+                
+                data = request.get_json() or {}
+                branches = script_system.generate_continuations(data.get('k', 3), data.get('turn_index'))
+                
+                return jsonify({
+                    'success': True,
+                    'continuations': [{
+                        'session_id': self.add_branch_session(branch['script_system']),
+                        'speaker': branch['speaker'],
+                        'message': branch['message']
+                    } for branch in branches]
+                })
+                
+            except (ValueError, IndexError) as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            except Exception as e:
+                logger.error(f"生成备选台词失败: {e}")
+                return jsonify({
+                    'success': False,
+                    'error': f'生成备选台词失败: {str(e)}'
+                }), 500
+        
+        @self.app.route('/api/presence', methods=['POST'])
+        def set_presence():
+            """让AI角色进场或离场"""
+            try:
+                script_system = self.get_script_system()
+                if not script_system or not script_system.is_initialized:
+                    return jsonify({
+                        'success': False,
+                        'error': '请先创建剧本设定'
+                    }), 400
+                
+                data = request.get_json() or {}
+                character = data.get('character', '')
+                message = script_system.set_presence(character, bool(data.get('present', True)))
+                
+                return jsonify({
+                    'success': True,
+                    'message': message,
+                    'present': script_system.scheduler.get_present_ai_characters()
+                })
+                
+            except ValueError as e:
+                return jsonify({
+                    'success': False,
+                    'error': str(e)
+                }), 400
+            except Exception as e:
+                logger.error(f"设置角色在场情况失败: {e}")
+                return jsonify({
+                    'success': False,
+                    'error': f'设置角色在场情况失败: {str(e)}'
+                }), 500
+        
         @self.app.route('/api/clear-history', methods=['POST'])
         def clear_history():
             """清空对话历史"""
             try:
-                if self.script_system:
-                    self.script_system.clear_history()
+                script_system = self.get_script_system()
+                if script_system:
+                    script_system.clear_history()
                 
                 logger.info("对话历史已清空")
                 return jsonify({
@@ -262,7 +643,8 @@ class ElectronBridge:
         def get_next_speaker():
             """获取下一个说话的角色"""
             try:
-                if not self.script_system or not self.script_system.is_initialized:
+                script_system = self.get_script_system()
+                if not script_system or not script_system.is_initialized:
                     return jsonify({
                         'success': False,
                         'error': '请先创建剧本设定'
@@ -275,7 +657,7 @@ class ElectronBridge:
                 logger.info(f"获取下一个说话角色 (第{round_num}轮)")
                 
                 # 根据最后一个说话的人决定流程
-                last_speaker = getattr(self.script_system, 'last_speaker', None)
+                last_speaker = getattr(script_system, 'last_speaker', None)
                 
                 if last_speaker != "我":
                     # 上一个不是用户说话（或者是第一轮），应该询问用户
@@ -289,7 +671,7 @@ class ElectronBridge:
                     })
                 else:
                     # 用户刚说完，调度AI角色
-                    next_speaker = self.script_system.scheduler.decide_next_ai_speaker(situation)
+                    next_speaker = script_system.scheduler.decide_next_ai_speaker(situation)
                     
                     if not next_speaker:
                         return jsonify({
@@ -317,7 +699,8 @@ class ElectronBridge:
         def user_speak():
             """用户说话"""
             try:
-                if not self.script_system or not self.script_system.is_initialized:
+                script_system = self.get_script_system()
+                if not script_system or not script_system.is_initialized:
                     return jsonify({
                         'success': False,
                         'error': '请先创建剧本设定'
@@ -348,9 +731,9 @@ class ElectronBridge:
                 
                 # 添加用户消息到历史记录
                 user_response = f"我：{message}"
-                self.script_system.scheduler.add_to_history(user_response)
-                self.script_system.last_speaker = "我"
-                self.script_system.conversation_count += 1
+                script_system.scheduler.add_to_history(user_response, "我")
+                script_system.last_speaker = "我"
+                script_system.conversation_count += 1
                 
                 return jsonify({
                     'success': True,
@@ -371,7 +754,8 @@ class ElectronBridge:
         def ai_speak():
             """AI角色说话"""
             try:
-                if not self.script_system or not self.script_system.is_initialized:
+                script_system = self.get_script_system()
+                if not script_system or not script_system.is_initialized:
                     return jsonify({
                         'success': False,
                         'error': '请先创建剧本设定'
@@ -391,7 +775,7 @@ class ElectronBridge:
                 logger.info(f"AI角色发言 (第{round_num}轮): {speaker}")
                 
                 # 获取AI角色智能体
-                character_agent = self.script_system.scheduler.get_character_agent(speaker)
+                character_agent = script_system.scheduler.get_character_agent(speaker)
                 if not character_agent:
                     return jsonify({
                         'success': False,
@@ -402,9 +786,9 @@ class ElectronBridge:
                 ai_response = character_agent.generate_response(situation)
                 
                 # 添加AI回应到历史记录
-                self.script_system.scheduler.add_to_history(ai_response)
-                self.script_system.last_speaker = speaker
-                self.script_system.conversation_count += 1
+                script_system.scheduler.add_to_history(ai_response, speaker)
+                script_system.last_speaker = speaker
+                script_system.conversation_count += 1
                 
                 return jsonify({
                     'success': True,
@@ -424,13 +808,14 @@ class ElectronBridge:
         def get_history():
             """获取对话历史"""
             try:
-                if not self.script_system:
+                script_system = self.get_script_system()
+                if not script_system:
                     return jsonify({
                         'success': False,
                         'error': '剧本系统未初始化'
                     }), 500
                 
-                history = self.script_system.get_conversation_history()
+                history = script_system.get_conversation_history()
                 
                 return jsonify({
                     'success': True,
@@ -449,20 +834,21 @@ class ElectronBridge:
         def get_system_info():
             """获取系统详细信息"""
             try:
+                script_system = self.get_script_system()
                 info = {
                     'success': True,
                     'bridge_status': 'running',
                     'port': self.port,
-                    'script_system_available': self.script_system is not None
+                    'script_system_available': script_system is not None
                 }
                 
-                if self.script_system:
-                    system_status = self.script_system.get_system_status()
+                if script_system:
+                    system_status = script_system.get_system_status()
                     info.update(system_status)
                     
                     # 获取角色信息
-                    if hasattr(self.script_system.scheduler, 'get_characters_info'):
-                        characters_info = self.script_system.scheduler.get_characters_info()
+                    if hasattr(script_system.scheduler, 'get_characters_info'):
+                        characters_info = script_system.scheduler.get_characters_info()
                         info['characters'] = characters_info
                 
                 return jsonify(info)
@@ -489,6 +875,12 @@ class ElectronBridge:
                     'create_script': '/api/create-script',
                     'send_message': '/api/send-message',
                     'start_conversation': '/api/start-conversation',
+                    'autoplay': '/api/autoplay',
+                    'fork': '/api/fork',
+                    'continuations': '/api/continuations',
+                    'script_progress': '/api/script-progress',
+                    'usage': '/api/usage',
+                    'presence': '/api/presence',
                     'clear_history': '/api/clear-history',
                     'get_history': '/api/get-history'
                 }
@@ -509,31 +901,70 @@ class ElectronBridge:
                 'error': 'Internal server error'
             }), 500
     
-    def run(self, debug=False):
-        """启动Flask服务器"""
+    def run(self, debug=False, listen_socket=None):
+        """
+        启动Flask服务器
+        
+        Args:
+            debug: 是否开启调试模式
+            listen_socket: 已绑定的监听socket，为空时由Flask自行绑定端口
+        """
         try:
             logger.info(f"启动Electron Bridge服务器，端口: {self.port}")
-            self.app.run(
-                host='127.0.0.1',
-                port=self.port,
-                debug=debug,
-                threaded=True,
-                use_reloader=False  # 避免重复启动
-            )
+            if listen_socket is None:
+                self.app.run(
+                    host='127.0.0.1',
+                    port=self.port,
+                    debug=debug,
+                    threaded=True,
+                    use_reloader=False  # 避免重复启动
+                )
+                return
+            
+            from werkzeug.serving import make_server
+            server = make_server('127.0.0.1', self.port, self.app, threaded=True, fd=listen_socket.fileno())
+            server.serve_forever()
         except Exception as e:
             logger.error(f"启动服务器失败: {e}")
             raise
 
+def bind_and_announce(port):
+    """
+    绑定监听端口并立即发出就绪信号
+    
+    Args:
+        port: 端口号（0表示由系统分配）
+        
+    Returns:
+        已开始监听的socket
+    """
+    listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    if not sys.platform.startswith('win'):
+        listen_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listen_socket.bind(('127.0.0.1', port))
+    listen_socket.listen(128)
+    actual_port = listen_socket.getsockname()[1]
+    
+    # 端口文件供不读取stdout的调用方使用
+    ready_file = os.environ.get('BRIDGE_READY_FILE')
+    if ready_file:
+        with open(ready_file, 'w', encoding='utf-8') as f:
+            f.write(str(actual_port))
+    
+    print(f"BRIDGE_READY port={actual_port}", flush=True)
+    return listen_socket
+
 def main():
     """主函数"""
-    bridge = ElectronBridge()  # 使用默认端口配置
+    listen_socket = bind_and_announce(int(os.environ.get('FLASK_PORT', 8900)))
+    bridge = ElectronBridge(port=listen_socket.getsockname()[1])
     
     try:
-        bridge.run(debug=False)
+        bridge.run(debug=False, listen_socket=listen_socket)
     except KeyboardInterrupt:
         logger.info("服务器已停止")
     except Exception as e:
         logger.error(f"服务器运行错误: {e}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
\ No newline at end of file
@@ -0,0 +1,411 @@
+"""
+对话历史 - 紧凑的台词记录，剧情分支共享公共前缀
+
+每个剧本的台词只在TurnStore中保存一份：说话角色（驻留为整数ID）、时间戳、token估算数
+存放在数组中，台词正文以UTF-16编码连续存放（中文每字2字节，没有每条字符串的对象开销）。
+正文缓冲区超过上限后整块写入临时文件，之后通过内存映射读取，超长会话的内存占用有上界。
+
+调度agent和各AI角色的ConversationHistory只保存台词在TurnStore中的序号，
+"名字：台词"格式的字符串在构建提示词时才生成。分支时新历史只引用原历史的前N条，
+原历史之后追加的台词对分支不可见，多个分支共享同一段前缀而不复制。
+"""
+
+import mmap
+import sys
+import tempfile
+import threading
+import time
+from array import array
+from typing import Container, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from config import TURN_STORE_SPILL_BYTES, TURN_STORE_SPILL_DIR
+
+_SEPARATOR = "："
+_MAX_SPEAKER_LENGTH = 20
+_ENCODING = "utf-16-le"
+_RECENT_CACHE_SIZE = 64  # 缓存最近若干条台词的格式化字符串（提示词总是读取最近的台词）
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    估算文本的token数（中文约0.6 token/字，其他字符约0.3 token/字符）
+    """
+    cjk = sum(1 for char in text if "一" <= char <= "鿿")
+    return max(1, round(cjk * 0.6 + (len(text) - cjk) * 0.3)) if text else 0
+
+
+def split_speaker(message: str) -> Tuple[str, str]:
+    """
+    从"名字：台词"格式的字符串中拆出说话角色和台词（没有名字前缀时角色为空字符串）
+    """
+    head, separator, text = message.partition(_SEPARATOR)
+    if separator and head and len(head) <= _MAX_SPEAKER_LENGTH and "\n" not in head:
+        return head, text
+    return "", message
+
+
+class Turn:
+    __slots__ = ("seq", "speaker_id", "speaker", "timestamp", "tokens", "text")
+
+    def __init__(self, seq: int, speaker_id: int, speaker: str, timestamp: float, tokens: int, text: str):
+        self.seq = seq
+        self.speaker_id = speaker_id
+        self.speaker = speaker
+        self.timestamp = timestamp
+        self.tokens = tokens
+        self.text = text
+
+    def format(self) -> str:
+        """
+        格式化为"名字：台词"（没有说话角色时只有台词）
+        """
+        return f"{self.speaker}{_SEPARATOR}{self.text}" if self.speaker else self.text
+
+    def __repr__(self) -> str:
+        return f"Turn({self.seq}, {self.format()!r})"
+
+
+class TurnStore:
+    def __init__(self, spill_bytes: int = TURN_STORE_SPILL_BYTES, spill_dir: Optional[str] = TURN_STORE_SPILL_DIR):
+        """
+        初始化台词存储（同一剧本及其所有分支共用）
+
+        Args:
+            spill_bytes: 内存中台词正文的上限（字节），超出后写入临时文件（0表示不写入文件）
+            spill_dir: 临时文件目录（为None时使用系统临时目录）
+        """
+        self.spill_bytes = spill_bytes
+        self.spill_dir = spill_dir
+        self._speaker_names: List[str] = [""]  # 0号为旁白（没有说话角色）
+        self._speaker_ids = {"": 0}
+        self._speakers = array("H")
+        self._timestamps = array("d")
+        self._tokens = array("I")
+        self._offsets = array("Q")  # 正文在全部正文中的字节偏移
+        self._lengths = array("I")
+        self._buffer = bytearray()  # 尚未写入临时文件的正文
+        self._buffer_start = 0  # 缓冲区第一个字节的偏移
+        self._spill_file = None
+        self._spill_map: Optional[mmap.mmap] = None
+        self._recent: Dict[int, str] = {}
+        self._lock = threading.Lock()
+
+    def speaker_id(self, name: str) -> int:
+        """
+        获取说话角色的整数ID（首次出现时分配）
+        """
+        speaker_id = self._speaker_ids.get(name)
+        if speaker_id is None:
+            with self._lock:
+                speaker_id = self._speaker_ids.get(name)
+                if speaker_id is None:
+                    speaker_id = len(self._speaker_names)
+                    self._speaker_names.append(sys.intern(name))
+                    self._speaker_ids[name] = speaker_id
+        return speaker_id
+
+    def add(self, text: str, speaker: str = "", timestamp: Optional[float] = None) -> Turn:
+        """
+        保存一条台词
+
+        Args:
+            text: 台词（不含名字前缀）
+            speaker: 说话角色
+            timestamp: 时间戳（为None时使用当前时间）
+
+        Returns:
+            台词记录
+        """
+        speaker_id = self.speaker_id(speaker)
+        speaker = self._speaker_names[speaker_id]
+        data = text.encode(_ENCODING)
+        tokens = estimate_tokens(text)
+        if timestamp is None:
+            timestamp = time.time()
+        with self._lock:
+            seq = len(self._speakers)
+            self._speakers.append(speaker_id)
+            self._timestamps.append(timestamp)
+            self._tokens.append(tokens)
+            self._offsets.append(self._buffer_start + len(self._buffer))
+            self._lengths.append(len(data))
+            self._buffer += data
+            if self.spill_bytes and len(self._buffer) >= self.spill_bytes:
+                self._spill()
+            turn = Turn(seq, speaker_id, speaker, timestamp, tokens, text)
+            self._recent[seq] = turn.format()
+            self._recent.pop(seq - _RECENT_CACHE_SIZE, None)
+        return turn
+
+    def _spill(self) -> None:
+        """
+        把内存中的正文整块写入临时文件（调用方需持有锁）
+        """
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(prefix="zgca-turns-", dir=self.spill_dir)
+        self._spill_file.seek(0, 2)
+        self._spill_file.write(self._buffer)
+        self._spill_file.flush()
+        self._buffer_start += len(self._buffer)
+        self._buffer = bytearray()
+
+    def _read(self, offset: int, length: int) -> bytes:
+        """
+        读取正文（调用方需持有锁）
+        """
+        if offset >= self._buffer_start:
+            start = offset - self._buffer_start
+            return bytes(self._buffer[start:start + length])
+        if self._spill_map is None or len(self._spill_map) < offset + length:
+            if self._spill_map is not None:
+                self._spill_map.close()
+            self._spill_map = mmap.mmap(self._spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._spill_map[offset:offset + length]
+
+    def text(self, seq: int) -> str:
+        """
+        获取台词正文
+        """
+        with self._lock:
+            data = self._read(self._offsets[seq], self._lengths[seq])
+        return data.decode(_ENCODING)
+
+    def speaker(self, seq: int) -> str:
+        """
+        获取台词的说话角色
+        """
+        return self._speaker_names[self._speakers[seq]]
+
+    def tokens(self, seq: int) -> int:
+        """
+        获取台词的token估算数
+        """
+        return self._tokens[seq]
+
+    def turn(self, seq: int) -> Turn:
+        """
+        获取完整的台词记录
+        """
+        speaker_id = self._speakers[seq]
+        return Turn(seq, speaker_id, self._speaker_names[speaker_id], self._timestamps[seq],
+                    self._tokens[seq], self.text(seq))
+
+    def format(self, seq: int) -> str:
+        """
+        格式化为"名字：台词"
+        """
+        formatted = self._recent.get(seq)
+        if formatted is not None:
+            return formatted
+        speaker = self.speaker(seq)
+        text = self.text(seq)
+        return f"{speaker}{_SEPARATOR}{text}" if speaker else text
+
+    def __len__(self) -> int:
+        return len(self._speakers)
+
+    def get_stats(self) -> dict:
+        """
+        获取存储统计
+
+        Returns:
+            台词数、说话角色数、内存中的字节数和写入临时文件的字节数
+        """
+        with self._lock:
+            metadata = sum(values.itemsize * len(values) for values in
+                           (self._speakers, self._timestamps, self._tokens, self._offsets, self._lengths))
+            return {
+                "turns": len(self._speakers),
+                "speakers": len(self._speaker_names) - 1,
+                "memory_bytes": metadata + len(self._buffer),
+                "spilled_bytes": self._buffer_start
+            }
+
+
+class _Segment:
+    """
+    历史的一段：前base条台词来自父段，之后的台词序号保存在indices中
+    """
+    __slots__ = ("parent", "base", "indices")
+
+    def __init__(self, parent: Optional["_Segment"], base: int):
+        self.parent = parent
+        self.base = base
+        self.indices = array("I")
+
+
+class ConversationHistory:
+    __slots__ = ("store", "_segment", "_length")
+
+    def __init__(self, store: Optional[TurnStore] = None, messages: Iterable[str] = ()):
+        """
+        初始化对话历史
+
+        Args:
+            store: 台词存储（为None时新建；调度agent和各AI角色共用同一个存储）
+            messages: 初始消息
+        """
+        self.store = store if store is not None else TurnStore()
+        self._segment = _Segment(None, 0)
+        self._length = 0
+        for message in messages:
+            self.append(message)
+
+    def append(self, message: Union[str, Turn], speaker: Optional[str] = None,
+               timestamp: Optional[float] = None) -> Turn:
+        """
+        追加一条台词（不影响从本历史分出的其他分支）
+
+        Args:
+            message: "名字：台词"格式的字符串，或已保存在同一存储中的台词记录
+            speaker: 说话角色（为None时从名字前缀中解析）
+            timestamp: 时间戳（为None时使用当前时间，恢复已保存的会话时沿用原时间）
+
+        Returns:
+            台词记录
+        """
+        if isinstance(message, Turn):
+            turn = message
+        else:
+            if speaker is None:
+                speaker, text = split_speaker(message)
+            else:
+                prefix = f"{speaker}{_SEPARATOR}"
+                text = message[len(prefix):] if message.startswith(prefix) else message
+            turn = self.store.add(text, speaker, timestamp)
+        # 只有本历史会向自己的段追加，分支引用的是追加前的长度，不受影响
+        self._segment.indices.append(turn.seq)
+        self._length += 1
+        return turn
+
+    def extend_from(self, other: "ConversationHistory", start: int, stop: int,
+                    skip: Container[int] = ()) -> None:
+        """
+        追加另一份历史（同一存储）的第start到stop条台词，只复制序号
+
+        Args:
+            other: 来源历史
+            start: 第一条台词在来源历史中的位置
+            stop: 结束位置（不含）
+            skip: 不追加的台词在来源历史中的位置
+        """
+        seqs = other._seqs(start, stop)
+        if skip:
+            seqs = [seq for index, seq in enumerate(seqs, start) if index not in skip]
+        self._segment.indices.extend(seqs)
+        self._length += len(seqs)
+
+    def clear(self) -> None:
+        """
+        清空本历史（其他分支不受影响）
+        """
+        self._segment = _Segment(None, 0)
+        self._length = 0
+
+    def fork(self, length: Optional[int] = None) -> "ConversationHistory":
+        """
+        分出一个新的历史分支，与本历史共享前length条台词
+
+        Args:
+            length: 分支保留的台词条数（为None时保留全部）
+
+        Returns:
+            新的历史分支
+        """
+        if length is None:
+            length = self._length
+        if length < 0 or length > self._length:
+            raise IndexError(f"历史只有 {self._length} 条台词，无法截取前 {length} 条")
+        forked = ConversationHistory(self.store)
+        parent = self._segment
+        while parent.parent is not None and parent.base >= length:
+            parent = parent.parent
+        forked._segment = _Segment(parent if length else None, length)
+        forked._length = length
+        return forked
+
+    def _seqs(self, start: int, stop: int) -> List[int]:
+        """
+        获取第start到stop条台词的序号，只从末尾向前读取到start所在的段为止
+        """
+        parts = []
+        segment, end = self._segment, self._length
+        while segment is not None and end > start:
+            low = max(start, segment.base) - segment.base
+            high = min(stop, end) - segment.base
+            if high > low:
+                parts.append(segment.indices[low:high])
+            end = segment.base
+            segment = segment.parent
+        seqs = []
+        for part in reversed(parts):
+            seqs.extend(part)
+        return seqs
+
+    def tail_turns(self, count: int) -> List[Turn]:
+        """
+        获取最近count条台词记录（按时间顺序）
+        """
+        return [self.store.turn(seq) for seq in self._seqs(max(self._length - count, 0), self._length)]
+
+    def tail(self, count: int) -> List[str]:
+        """
+        获取最近count条台词（"名字：台词"格式，按时间顺序）
+        """
+        return [self.store.format(seq) for seq in self._seqs(max(self._length - count, 0), self._length)]
+
+    def turn(self, index: int) -> Turn:
+        """
+        获取第index条台词记录（支持负数索引）
+        """
+        if index < 0:
+            index += self._length
+        if not 0 <= index < self._length:
+            raise IndexError("对话历史索引超出范围")
+        return self.store.turn(self._seqs(index, index + 1)[0])
+
+    def count_through(self, seq: int) -> int:
+        """
+        统计序号不超过seq的台词条数（同一历史中的台词序号递增，按二分查找）
+        """
+        low, high = 0, self._length
+        while low < high:
+            mid = (low + high) // 2
+            if self._seqs(mid, mid + 1)[0] <= seq:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def copy(self) -> List[str]:
+        """
+        以列表形式返回全部台词
+        """
+        return self.tail(self._length)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.copy())
+
+    def __bool__(self) -> bool:
+        return self._length > 0
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[str, List[str]]:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._length)
+            if stop <= start:
+                return []
+            messages = [self.store.format(seq) for seq in self._seqs(start, stop)]
+            return messages[::step] if step != 1 else messages
+        return self.turn(index).format()
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, ConversationHistory):
+            return self.copy() == other.copy()
+        if isinstance(other, list):
+            return self.copy() == other
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"ConversationHistory({self.copy()!r})"
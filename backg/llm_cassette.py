@@ -0,0 +1,308 @@
+"""
+LLM调用录制/回放 - 把请求与响应录制为压缩的cassette文件，离线时按提示词哈希回放
+
+录制模式下，经过模型路由的每次调用（含流式分块及其时间偏移）追加写入gzip压缩的JSONL文件；
+回放模式下不访问网络，按规范化后的提示词哈希查找录制的响应，可按录制时的耗时实时回放，也可尽快回放。
+提示词有改动导致哈希不匹配时，按调用点的录制顺序回放，便于离线对比提示词和解析逻辑的改动。
+"""
+
+import collections
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+from config import LLM_CASSETTE_MODE, LLM_CASSETTE_PATH, LLM_REPLAY_SPEED, LLM_REPLAY_ON_MISS
+
+_WHITESPACE = re.compile(r"\s+")
+
+# 参与哈希的请求参数（model由路由决定、是否流式不影响内容，都不参与哈希）
+_HASHED_PARAMS = ("max_tokens", "temperature", "stop", "response_format")
+
+
+class CassetteMiss(RuntimeError):
+    """回放时找不到匹配的录制"""
+
+
+def normalize_messages(messages: List[Dict[str, str]]) -> List[List[str]]:
+    """
+    规范化消息列表（合并空白字符），空白差异不影响哈希
+    """
+    return [[message.get("role", ""), _WHITESPACE.sub(" ", message.get("content") or "").strip()]
+            for message in messages]
+
+
+def request_hash(call_site: str, request: Dict[str, Any]) -> str:
+    """
+    计算请求的规范化哈希
+
+    Args:
+        call_site: 调用点名称
+        request: chat.completions.create的参数
+
+    Returns:
+        十六进制哈希
+    """
+    payload = {
+        "call_site": call_site,
+        "messages": normalize_messages(request.get("messages", [])),
+        **{name: request.get(name) for name in _HASHED_PARAMS}
+    }
+    return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode("utf-8")).hexdigest()[:24]
+
+
+def _recordable(request: Dict[str, Any]) -> Dict[str, Any]:
+    # extra_headers中的trace ID每次都不同，timeout取决于本轮剩余的时间预算，都不写入cassette
+    return {name: value for name, value in request.items()
+            if name not in ("extra_headers", "stream_options", "timeout")}
+
+
+class CassetteRecorder:
+    def __init__(self, path: str):
+        """
+        初始化录制器（追加写入，每条记录单独压缩为一个gzip成员，中途退出也不会损坏已有记录）
+
+        Args:
+            path: cassette文件路径
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self.recorded = 0
+
+    def _write(self, entry: Dict[str, Any]) -> None:
+        line = (json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "ab") as f:
+                f.write(gzip.compress(line))
+            self.recorded += 1
+
+    def record(self, call_site: str, request: Dict[str, Any], response, latency: float) -> None:
+        """
+        记录一次非流式调用
+
+        Args:
+            call_site: 调用点名称
+            request: 请求参数
+            response: 响应对象
+            latency: 请求耗时（秒）
+        """
+        self._write({
+            "hash": request_hash(call_site, request),
+            "call_site": call_site,
+            "recorded_at": time.time(),
+            "latency": round(latency, 4),
+            "request": _recordable(request),
+            "response": response.model_dump(mode="json")
+        })
+
+    def wrap_stream(self, call_site: str, request: Dict[str, Any], stream, start_time: float) -> Iterator:
+        """
+        包装流式响应，在透传分块的同时记录每个分块及其相对请求开始的时间偏移
+
+        Args:
+            call_site: 调用点名称
+            request: 请求参数
+            stream: 流式响应
+            start_time: 请求开始时间（perf_counter）
+
+        Returns:
+            逐块产出的迭代器
+        """
+        chunks = []
+        try:
+            for chunk in stream:
+                chunks.append([round(time.perf_counter() - start_time, 4), chunk.model_dump(mode="json")])
+                yield chunk
+        finally:
+            # 调用方提前停止读取时不写入不完整的记录
+            if hasattr(stream, "close"):
+                stream.close()
+        self._write({
+            "hash": request_hash(call_site, request),
+            "call_site": call_site,
+            "recorded_at": time.time(),
+            "latency": round(time.perf_counter() - start_time, 4),
+            "request": _recordable(request),
+            "chunks": chunks
+        })
+
+
+def load_cassette(path: str) -> List[Dict[str, Any]]:
+    """
+    读取cassette中的全部记录（按录制顺序）
+
+    Args:
+        path: cassette文件路径
+
+    Returns:
+        记录列表
+    """
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class CassettePlayer:
+    def __init__(self, path: str, speed: str = LLM_REPLAY_SPEED, on_miss: str = LLM_REPLAY_ON_MISS):
+        """
+        初始化回放器
+
+        Args:
+            path: cassette文件路径
+            speed: realtime按录制耗时回放，fast尽快回放
+            on_miss: 哈希不匹配时的处理方式：sequence按调用点录制顺序回放，error直接报错
+        """
+        self.path = path
+        self.realtime = speed == "realtime"
+        self.on_miss = on_miss
+        self.entries = load_cassette(path)
+        self._by_hash: Dict[str, collections.deque] = collections.defaultdict(collections.deque)
+        self._by_call_site: Dict[str, collections.deque] = collections.defaultdict(collections.deque)
+        for index, entry in enumerate(self.entries):
+            self._by_hash[entry["hash"]].append(index)
+            self._by_call_site[entry["call_site"]].append(index)
+        self._used = set()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "sequence_fallbacks": 0, "misses": 0}
+
+    def _take(self, call_site: str, request: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        取出匹配的记录：优先哈希匹配（同一提示词多次出现时按录制顺序依次使用），否则按调用点顺序
+        """
+        with self._lock:
+            candidates = self._by_hash.get(request_hash(call_site, request))
+            while candidates:
+                index = candidates.popleft()
+                if index not in self._used:
+                    self._used.add(index)
+                    self.stats["hits"] += 1
+                    return self.entries[index]
+
+            if self.on_miss == "sequence":
+                queue = self._by_call_site.get(call_site)
+                while queue:
+                    index = queue.popleft()
+                    if index not in self._used:
+                        self._used.add(index)
+                        self.stats["sequence_fallbacks"] += 1
+                        return self.entries[index]
+
+            self.stats["misses"] += 1
+        raise CassetteMiss(f"cassette中没有调用点 {call_site} 的匹配记录")
+
+    def play(self, call_site: str, request: Dict[str, Any]):
+        """
+        回放一次调用
+
+        Args:
+            call_site: 调用点名称
+            request: 请求参数
+
+        Returns:
+            响应对象；流式请求返回逐块产出的迭代器
+        """
+        from openai.types.chat import ChatCompletion, ChatCompletionChunk
+
+        entry = self._take(call_site, request)
+        if request.get("stream"):
+            if "chunks" not in entry:
+                # 录制时为非流式请求：把完整回复作为单个分块返回
+                return self._as_stream(entry)
+            return self._play_chunks(entry["chunks"], ChatCompletionChunk)
+
+        if "response" not in entry:
+            entry = {"response": self._join_chunks(entry), "latency": entry["latency"]}
+        if self.realtime:
+            time.sleep(entry["latency"])
+        return ChatCompletion.model_validate(entry["response"])
+
+    def _play_chunks(self, chunks: List[list], chunk_type) -> Iterator:
+        start = time.perf_counter()
+        for offset, chunk in chunks:
+            if self.realtime:
+                delay = offset - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            yield chunk_type.model_validate(chunk)
+
+    def _as_stream(self, entry: Dict[str, Any]) -> Iterator:
+        from openai.types.chat import ChatCompletionChunk
+
+        response = entry["response"]
+        choice = response["choices"][0]
+        chunk = {
+            "id": response["id"], "object": "chat.completion.chunk", "created": response["created"],
+            "model": response["model"],
+            "choices": [{"index": 0, "delta": {"role": "assistant", "content": choice["message"]["content"]},
+                         "finish_reason": choice["finish_reason"]}],
+            "usage": response.get("usage")
+        }
+        return self._play_chunks([[entry["latency"], chunk]], ChatCompletionChunk)
+
+    @staticmethod
+    def _join_chunks(entry: Dict[str, Any]) -> Dict[str, Any]:
+        # 录制时为流式请求、回放时为非流式：把分块拼接为完整响应
+        content, finish_reason, usage, first = [], "stop", None, None
+        for _, chunk in entry["chunks"]:
+            first = first or chunk
+            usage = chunk.get("usage") or usage
+            for choice in chunk.get("choices") or []:
+                content.append((choice.get("delta") or {}).get("content") or "")
+                finish_reason = choice.get("finish_reason") or finish_reason
+        return {
+            "id": first["id"] if first else "replay", "object": "chat.completion",
+            "created": first["created"] if first else 0, "model": first["model"] if first else "replay",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(content)},
+                         "finish_reason": finish_reason}],
+            "usage": usage
+        }
+
+
+_recorder: Optional[CassetteRecorder] = None
+_player: Optional[CassettePlayer] = None
+_init_lock = threading.Lock()
+
+
+def configure(mode: str, path: str = LLM_CASSETTE_PATH, speed: str = LLM_REPLAY_SPEED,
+              on_miss: str = LLM_REPLAY_ON_MISS) -> None:
+    """
+    切换录制/回放模式（默认根据配置在首次调用时初始化，离线工具可直接调用本函数）
+
+    Args:
+        mode: off、record或replay
+        path: cassette文件路径
+        speed: 回放速度（realtime或fast）
+        on_miss: 回放时哈希不匹配的处理方式（sequence或error）
+    """
+    global _recorder, _player
+    with _init_lock:
+        _recorder = CassetteRecorder(path) if mode == "record" else None
+        _player = CassettePlayer(path, speed, on_miss) if mode == "replay" else None
+
+
+def get_recorder() -> Optional[CassetteRecorder]:
+    return _recorder
+
+
+def get_player() -> Optional[CassettePlayer]:
+    return _player
+
+
+def get_cassette_stats() -> Dict[str, Any]:
+    """
+    获取录制/回放统计
+    """
+    if _player is not None:
+        return dict(_player.stats, mode="replay", path=_player.path, entries=len(_player.entries))
+    if _recorder is not None:
+        return {"mode": "record", "path": _recorder.path, "recorded": _recorder.recorded}
+    return {"mode": "off"}
+
+
+if LLM_CASSETTE_MODE in ("record", "replay"):
+    configure(LLM_CASSETTE_MODE)
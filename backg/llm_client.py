@@ -0,0 +1,286 @@
+"""
+LLM客户端管理 - 按API密钥缓存OpenAI客户端，所有密钥共享同一个HTTP连接池
+
+openai在首次使用时才导入；连接预热和空闲保活也在这里完成，
+使剧本创建后的第一次调度/台词请求不必再承担DNS、TCP和TLS建连的耗时。
+"""
+
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+from config import (
+    DEEPSEEK_BASE_URL,
+    LLM_CA_BUNDLE,
+    LLM_MAX_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_PREWARM_ENABLED,
+    LLM_PREWARM_MAX_CONNECTIONS,
+    LLM_KEEPALIVE_INTERVAL,
+    LLM_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_MAX_PER_HOUR,
+    LLM_KEEPALIVE_IDLE_LIMIT
+)
+
+_clients: Dict[tuple, object] = {}
+_clients_lock = threading.Lock()
+_http_client = None
+
+# 最近一次真实LLM请求和最近一次保活请求完成的时间，用于判断连接是否空闲
+_last_activity = 0.0
+_last_ping = 0.0
+_ping_local = threading.local()
+_keepalive_thread = None
+_keepalive_stats = {"prewarm_requests": 0, "keepalive_requests": 0, "window_start": 0.0, "window_count": 0}
+_keepalive_lock = threading.Lock()  # 预热线程、保活线程和状态查询会同时访问_keepalive_stats
+
+# 按调用点统计的生成耗时和输出长度
+_generation_stats: Dict[str, Dict[str, float]] = {}
+_generation_lock = threading.Lock()
+
+
+def _on_response(response) -> None:
+    global _last_activity
+    if not getattr(_ping_local, "active", False):
+        _last_activity = time.time()
+
+
+def _get_http_client():
+    """
+    获取共享的httpx客户端（调用方需持有_clients_lock）
+    """
+    global _http_client
+    if _http_client is None:
+        import httpx
+        _http_client = httpx.Client(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+                keepalive_expiry=LLM_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(600.0, connect=10.0),
+            verify=LLM_CA_BUNDLE or True,
+            event_hooks={"response": [_on_response]}
+        )
+    return _http_client
+
+
+def get_client(api_key: str, base_url: Optional[str] = None):
+    """
+    获取指定API密钥对应的OpenAI客户端（同一端点的同一密钥复用同一个客户端）
+
+    Args:
+        api_key: API密钥
+        base_url: 接口地址，默认为DEEPSEEK_BASE_URL
+
+    Returns:
+        OpenAI客户端
+    """
+    cache_key = (base_url or DEEPSEEK_BASE_URL, api_key)
+    client = _clients.get(cache_key)
+    if client is not None:
+        return client
+
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            # openai导入较慢，延迟到第一次真正调用时
+            from openai import OpenAI
+            client = OpenAI(api_key=api_key, base_url=cache_key[0], http_client=_get_http_client())
+            _clients[cache_key] = client
+    return client
+
+
+def preload() -> None:
+    """
+    预先导入openai模块（在后台线程中调用，避免首次请求承担导入耗时）
+    """
+    import openai  # noqa: F401
+
+
+def _ping(api_key: str) -> bool:
+    """
+    发送一次轻量请求（列出模型），用于建立或保持连接
+
+    Args:
+        api_key: 使用的API密钥
+
+    Returns:
+        是否成功
+    """
+    global _last_ping
+    _ping_local.active = True
+    try:
+        get_client(api_key).models.list()
+        return True
+    except Exception as e:
+        print(f"⚠️ 连接预热失败: {str(e)}")
+        return False
+    finally:
+        _ping_local.active = False
+        _last_ping = time.time()
+
+
+def prewarm(api_keys: List[str]) -> int:
+    """
+    并发发送轻量请求，为即将使用的密钥在连接池中建立连接
+
+    Args:
+        api_keys: 即将使用的API密钥（重复的密钥只预热一次）
+
+    Returns:
+        成功预热的连接数
+    """
+    global _last_activity
+    keys = list(dict.fromkeys(api_keys))[:LLM_PREWARM_MAX_CONNECTIONS]
+    if not keys:
+        return 0
+    # 预热视为一次使用，之后的空闲期内由保活线程维持连接
+    _last_activity = max(_last_activity, time.time())
+    # 并发请求才会在连接池中建立多条连接
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        results = list(executor.map(_ping, keys))
+    with _keepalive_lock:
+        _keepalive_stats["prewarm_requests"] += len(keys)
+    return sum(results)
+
+
+def prewarm_async(api_keys: List[str]) -> None:
+    """
+    在后台线程中预热连接，并确保保活线程已启动
+
+    Args:
+        api_keys: 即将使用的API密钥
+    """
+    if not LLM_PREWARM_ENABLED:
+        return
+    threading.Thread(target=prewarm, args=(list(api_keys),), daemon=True).start()
+    start_keepalive(api_keys)
+
+
+def _take_keepalive_budget(count: int) -> int:
+    """
+    从每小时保活预算中申请请求次数
+
+    Args:
+        count: 希望发送的请求数
+
+    Returns:
+        实际允许发送的请求数
+    """
+    now = time.time()
+    with _keepalive_lock:
+        if now - _keepalive_stats["window_start"] >= 3600:
+            _keepalive_stats["window_start"] = now
+            _keepalive_stats["window_count"] = 0
+        allowed = max(0, min(count, LLM_KEEPALIVE_MAX_PER_HOUR - _keepalive_stats["window_count"]))
+        _keepalive_stats["window_count"] += allowed
+    return allowed
+
+
+def _keepalive_loop(api_keys: List[str]) -> None:
+    while True:
+        time.sleep(LLM_KEEPALIVE_INTERVAL / 2)
+        now = time.time()
+        if now - max(_last_activity, _last_ping) < LLM_KEEPALIVE_INTERVAL:
+            continue  # 连接近期有流量，无需保活
+        if now - _last_activity > LLM_KEEPALIVE_IDLE_LIMIT:
+            continue  # 已长时间无人使用，不再保活
+
+        allowed = _take_keepalive_budget(min(LLM_KEEPALIVE_CONNECTIONS, len(api_keys)))
+        if allowed > 0:
+            with ThreadPoolExecutor(max_workers=allowed) as executor:
+                list(executor.map(_ping, api_keys[:allowed]))
+            with _keepalive_lock:
+                _keepalive_stats["keepalive_requests"] += allowed
+
+
+def start_keepalive(api_keys: List[str]) -> None:
+    """
+    启动空闲连接保活线程（重复调用只启动一次）
+
+    Args:
+        api_keys: 保活请求使用的API密钥
+    """
+    global _keepalive_thread
+    keys = list(dict.fromkeys(api_keys))
+    if not LLM_PREWARM_ENABLED or not keys:
+        return
+    with _clients_lock:
+        if _keepalive_thread is None:
+            _keepalive_thread = threading.Thread(target=_keepalive_loop, args=(keys,), daemon=True)
+            _keepalive_thread.start()
+
+
+def get_connection_stats() -> Dict[str, float]:
+    """
+    获取连接预热和保活的统计信息
+
+    Returns:
+        统计信息字典
+    """
+    with _keepalive_lock:
+        prewarm_requests = _keepalive_stats["prewarm_requests"]
+        keepalive_requests = _keepalive_stats["keepalive_requests"]
+    return {
+        "clients": len(_clients),
+        "idle_seconds": round(time.time() - _last_activity, 1) if _last_activity else None,
+        "prewarm_requests": prewarm_requests,
+        "keepalive_requests": keepalive_requests
+    }
+
+
+def record_completion(call_site: str, latency: float, completion_tokens: Optional[int] = None,
+                      finish_reason: Optional[str] = None) -> None:
+    """
+    记录一次LLM生成的耗时和输出长度
+
+    Args:
+        call_site: 调用点名称
+        latency: 请求耗时（秒）
+        completion_tokens: 生成的token数（接口未返回用量时为None）
+        finish_reason: 结束原因（stop、length等）
+    """
+    with _generation_lock:
+        stats = _generation_stats.setdefault(call_site, {
+            "calls": 0, "latency": 0.0, "token_samples": 0, "completion_tokens": 0, "truncated": 0
+        })
+        stats["calls"] += 1
+        stats["latency"] += latency
+        if completion_tokens is not None:
+            stats["token_samples"] += 1
+            stats["completion_tokens"] += completion_tokens
+        if finish_reason == "length":
+            stats["truncated"] += 1
+
+
+def get_generation_stats() -> Dict[str, Dict[str, Any]]:
+    """
+    获取各调用点的生成统计
+
+    Returns:
+        调用点 -> 调用次数、平均耗时、平均生成token数、被max_tokens截断的次数
+    """
+    with _generation_lock:
+        return {
+            call_site: {
+                "calls": stats["calls"],
+                "avg_latency_ms": round(stats["latency"] / stats["calls"] * 1000, 1),
+                "avg_completion_tokens": (round(stats["completion_tokens"] / stats["token_samples"], 1)
+                                          if stats["token_samples"] else None),
+                "truncated": stats["truncated"]
+            }
+            for call_site, stats in _generation_stats.items()
+        }
+
+
+def reset() -> None:
+    """
+    关闭共享连接池并清空客户端缓存（用于基准测试对比冷启动）
+    """
+    global _http_client
+    with _clients_lock:
+        if _http_client is not None:
+            _http_client.close()
+        _http_client = None
+        _clients.clear()
@@ -0,0 +1,228 @@
+"""
+检索记忆 - 对话历史的BM25倒排索引，角色生成台词时召回与当前情况相关的早前台词
+
+台词按中文二元组（连续两个汉字）和英文/数字词切分，每条台词提交时增量写入倒排表。
+角色的提示词只包含最近10条对话，更早的台词按BM25得分召回少量几条，在token预算内附加到提示词中，
+提示词长度基本不随会话变长而增长。
+
+剧情分支与ConversationHistory相同：新索引只引用原索引的前N条台词，分支之后追加的台词写入自己的倒排表。
+从会话存储恢复的台词先记下不切分，第一次检索（或分支、追加新台词）时才写入倒排表，恢复会话时不必重建索引。
+"""
+
+import heapq
+import math
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Container, Dict, Iterable, Iterator, List, Optional, Tuple
+
+_TOKEN = re.compile(r"[一-鿿]+|[A-Za-z0-9]+")
+
+# BM25参数
+_K1 = 1.2
+_B = 0.75
+_MAX_DF_RATIO = 0.1  # 出现在超过该比例台词中的常见词几乎不区分相关性，检索时跳过（遍历其倒排表的开销也最大）
+_MIN_DF_SKIP = 8  # 台词较少时，出现次数不超过该值的词总是参与检索
+
+
+def tokenize(text: str) -> Iterator[str]:
+    """
+    把文本切分为检索词：汉字按二元组（单个汉字保留为一元），英文/数字按词（转为小写）
+    """
+    for run in _TOKEN.findall(text):
+        if "一" <= run[0] <= "鿿":
+            if len(run) == 1:
+                yield run
+            for i in range(len(run) - 1):
+                yield run[i:i + 2]
+        else:
+            yield run.lower()
+
+
+class MemoryIndex:
+    def __init__(self, parent: Optional["MemoryIndex"] = None, base: int = 0):
+        """
+        初始化检索索引（一般直接新建；分支由fork创建）
+
+        Args:
+            parent: 原索引（分支共享其前base条台词）
+            base: 本索引第一条台词的编号
+        """
+        self.parent = parent
+        self.base = base
+        self._postings: Dict[str, Tuple[array, array]] = {}  # 检索词 -> (台词编号, 词频)
+        self._seqs = array("I")  # 台词在TurnStore中的序号
+        self._lengths = array("I")  # 台词的检索词数
+        self._total_lengths = array("Q", [0])  # 检索词数的前缀和
+        self._deferred: List[Tuple[str, int]] = []  # 尚未写入倒排表的(台词正文, 序号)
+        self._deferred_lock = threading.Lock()
+
+    def __len__(self) -> int:
+        self._index_deferred()
+        return self.base + len(self._seqs)
+
+    def add_deferred(self, turns: Iterable[Tuple[str, int]]) -> None:
+        """
+        批量记下台词，推迟到第一次使用索引时再切分写入倒排表（用于恢复会话）
+
+        Args:
+            turns: (台词正文, 台词在TurnStore中的序号)
+        """
+        with self._deferred_lock:
+            self._deferred.extend(turns)
+
+    def _index_deferred(self) -> None:
+        if not self._deferred:
+            return
+        with self._deferred_lock:
+            for text, seq in self._deferred:
+                self._index(text, seq)
+            self._deferred = []
+
+    def add(self, text: str, seq: int) -> int:
+        """
+        写入一条台词
+
+        Args:
+            text: 台词正文（不含名字前缀）
+            seq: 台词在TurnStore中的序号
+
+        Returns:
+            台词在索引中的编号（即在对话历史中的位置）
+        """
+        self._index_deferred()
+        return self._index(text, seq)
+
+    def _index(self, text: str, seq: int) -> int:
+        doc = self.base + len(self._seqs)
+        counts: Dict[str, int] = {}
+        for term in tokenize(text):
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = (array("I"), array("H"))
+            postings[0].append(doc)
+            postings[1].append(min(count, 0xFFFF))
+        length = sum(counts.values())
+        self._seqs.append(seq)
+        self._lengths.append(length)
+        self._total_lengths.append(self._total_lengths[-1] + length)
+        return doc
+
+    def fork(self, length: Optional[int] = None) -> "MemoryIndex":
+        """
+        分出一个新的索引分支，与本索引共享前length条台词
+
+        Args:
+            length: 分支保留的台词条数（为None时保留全部）
+
+        Returns:
+            新的索引分支
+        """
+        self._index_deferred()
+        if length is None:
+            length = len(self)
+        if length < 0 or length > len(self):
+            raise IndexError(f"索引只有 {len(self)} 条台词，无法截取前 {length} 条")
+        parent = self
+        while parent.parent is not None and parent.base >= length:
+            parent = parent.parent
+        return MemoryIndex(parent if length else None, length)
+
+    def _chain(self) -> Iterator[Tuple["MemoryIndex", int]]:
+        """
+        从本索引向上遍历，产出(索引, 该索引在本分支中可见的台词编号上限)
+        """
+        node, limit = self, len(self)
+        while node is not None and limit > 0:
+            yield node, limit
+            limit = node.base
+            node = node.parent
+
+    def _locate(self, doc: int) -> Tuple["MemoryIndex", int]:
+        node = self
+        while doc < node.base:
+            node = node.parent
+        return node, doc - node.base
+
+    def count_through(self, seq: int) -> int:
+        """
+        统计TurnStore序号不超过seq的台词条数（同一分支中的序号递增）
+        """
+        self._index_deferred()
+        for node, node_limit in self._chain():
+            end = node_limit - node.base
+            if end and node._seqs[0] <= seq:
+                return node.base + bisect_right(node._seqs, seq, 0, end)
+        return 0
+
+    def search(self, query: str, limit: int, before: Optional[int] = None,
+               exclude: Optional[Container[int]] = None) -> List[Tuple[int, int, float]]:
+        """
+        按BM25得分检索台词
+
+        Args:
+            query: 查询文本
+            limit: 最多返回条数
+            before: 只检索编号小于该值的台词（用于排除已在提示词中的最近台词，为None时检索全部）
+            exclude: 不参与检索的台词编号（如角色看不到的台词）
+
+        Returns:
+            (台词编号, TurnStore序号, 得分)列表，按得分从高到低
+        """
+        self._index_deferred()
+        total = len(self)
+        before = total if before is None else min(before, total)
+        if before <= 0 or limit <= 0:
+            return []
+        total_length = sum(node._total_lengths[node_limit - node.base] for node, node_limit in self._chain())
+        average_length = total_length / total or 1.0
+
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            parts = []
+            frequency = 0
+            for node, node_limit in self._chain():
+                postings = node._postings.get(term)
+                if postings is None:
+                    continue
+                end = bisect_left(postings[0], node_limit)
+                frequency += end
+                stop = min(end, bisect_left(postings[0], before))
+                if stop:
+                    parts.append((node, postings, stop))
+            if not parts or frequency > max(_MIN_DF_SKIP, total * _MAX_DF_RATIO):
+                continue
+            idf = math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+            for node, (docs, tfs), stop in parts:
+                lengths = node._lengths
+                for i in range(stop):
+                    doc = docs[i]
+                    if exclude and doc in exclude:
+                        continue
+                    tf = tfs[i]
+                    norm = _K1 * (1 - _B + _B * lengths[doc - node.base] / average_length)
+                    scores[doc] = scores.get(doc, 0.0) + idf * tf * (_K1 + 1) / (tf + norm)
+
+        results = []
+        for doc, score in heapq.nlargest(limit, scores.items(), key=lambda item: item[1]):
+            node, offset = self._locate(doc)
+            results.append((doc, node._seqs[offset], score))
+        return results
+
+    def get_stats(self) -> Dict[str, int]:
+        """
+        获取索引统计（不触发推迟的索引写入）
+        """
+        terms = 0
+        depth = 0
+        node = self
+        while node is not None:
+            terms += len(node._postings)
+            depth += 1
+            node = node.parent
+        deferred = len(self._deferred)
+        return {"turns": self.base + len(self._seqs) + deferred, "terms": terms, "branch_depth": depth,
+                "deferred": deferred}
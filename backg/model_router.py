@@ -0,0 +1,384 @@
+"""
+模型路由 - 按调用点选择模型端点，端点饱和或出错时回退（全部饱和时排队），并统计各端点的延迟和成本
+"""
+
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from llm_client import get_client
+from quota_coordinator import acquire as quota_acquire, cooldown_remaining, report_rate_limited
+from usage_tracker import usage_tracker
+from llm_cassette import get_player, get_recorder
+from turn_deadline import DeadlineExceeded, check_deadline, remaining
+from tracing import trace_headers
+from config import (
+    API_KEY_POOLS,
+    MODEL_ENDPOINTS,
+    MODEL_ROUTES,
+    MODEL_ROUTE_COOLDOWN,
+    MODEL_ROUTE_MAX_RETRIES,
+    MODEL_ROUTE_QUEUE_TIMEOUT,
+    QUOTA_MAX_WAIT
+)
+
+
+def _retry_after(error) -> Optional[float]:
+    # 429响应中的Retry-After（秒）
+    try:
+        return float(error.response.headers.get("retry-after"))
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+class ModelEndpoint:
+    def __init__(self, name: str, model: str, base_url: str, key_pool: str,
+                 max_concurrency: int = 0, price_input: float = 0.0, price_output: float = 0.0):
+        """
+        初始化模型端点
+
+        Args:
+            name: 端点名称
+            model: 模型名
+            base_url: 接口地址
+            key_pool: 使用的API密钥池名称
+            max_concurrency: 同时进行的请求数上限（0表示不限制）
+            price_input: 每百万输入token的价格
+            price_output: 每百万输出token的价格
+        """
+        self.name = name
+        self.model = model
+        self.base_url = base_url
+        self.keys = list(API_KEY_POOLS.get(key_pool, []))
+        self.max_concurrency = max_concurrency
+        self.price_input = price_input
+        self.price_output = price_output
+
+        self.in_flight = 0
+        self.cooldown_until = 0.0
+        self._key_cycle = itertools.cycle(self.keys) if self.keys else None
+        self.stats = {"calls": 0, "errors": 0, "fallbacks": 0, "queued": 0, "latency": 0.0,
+                      "prompt_tokens": 0, "completion_tokens": 0}
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.cooldown_until
+
+    def is_saturated(self) -> bool:
+        return bool(self.max_concurrency) and self.in_flight >= self.max_concurrency
+
+    def pick_key(self, api_key: Optional[str]) -> str:
+        """
+        选择请求使用的密钥：调用方分配的密钥属于本端点时直接使用，否则在密钥池中轮换
+        """
+        if api_key and (api_key in self.keys or self._key_cycle is None):
+            return api_key
+        return next(self._key_cycle)
+
+    def cost(self, prompt_tokens: int, completion_tokens: int) -> float:
+        return (prompt_tokens * self.price_input + completion_tokens * self.price_output) / 1_000_000
+
+
+class _RoutedStream:
+    """
+    路由返回的流式响应：读完、出错、调用方调用close()或对象被回收时释放端点的并发名额（只释放一次），
+    调用方提前停止读取甚至从未开始读取时也不会一直占用名额
+    """
+
+    def __init__(self, router: "ModelRouter", endpoint: ModelEndpoint, start_time: float, stream,
+                 call_site: str, key: str):
+        self._router = router
+        self._endpoint = endpoint
+        self._start_time = start_time
+        self._stream = stream
+        self._iterator = iter(stream)
+        self._call_site = call_site
+        self._key = key
+        self._usage = None
+        self._closed = False
+        self._close_lock = threading.Lock()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        try:
+            chunk = next(self._iterator)
+        except StopIteration:
+            self.close()
+            raise
+        except Exception:
+            self._release(error=True)
+            raise
+        if getattr(chunk, "usage", None):
+            self._usage = chunk.usage
+        return chunk
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self.close()
+
+    def close(self) -> None:
+        self._release(error=False)
+
+    def _release(self, error: bool) -> None:
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            # 关闭底层响应，释放连接
+            if hasattr(self._stream, "close"):
+                self._stream.close()
+        finally:
+            self._router._finish(self._endpoint, self._start_time, self._usage, error, self._call_site, self._key)
+
+
+class ModelRouter:
+    def __init__(self, endpoints: Dict[str, Dict[str, Any]] = MODEL_ENDPOINTS,
+                 routes: Dict[str, List[str]] = MODEL_ROUTES):
+        """
+        初始化模型路由
+
+        Args:
+            endpoints: 端点名称 -> 端点配置
+            routes: 调用点（生成参数配置名）-> 按优先级排列的端点名称
+        """
+        self.endpoints = {name: ModelEndpoint(name, **options) for name, options in endpoints.items()}
+        self.routes = {call_site: [self.endpoints[name] for name in names] for call_site, names in routes.items()}
+        self._lock = threading.Lock()
+        self._slot_freed = threading.Condition(self._lock)  # 有请求结束、释放并发名额时通知排队的请求
+
+    def _acquire(self, call_site: str, excluded: List[ModelEndpoint]) -> Optional[ModelEndpoint]:
+        """
+        选择端点并占用一个并发名额：优先第一个未饱和且未冷却的端点；候选端点全部饱和时排队等待名额释放，
+        最多等待MODEL_ROUTE_QUEUE_TIMEOUT秒（有单轮时间预算时不超过剩余时间），仍未等到名额时
+        超出上限使用第一个候选端点
+
+        Returns:
+            占用了名额的端点；没有候选端点时为None
+        """
+        queue_deadline = time.time() + MODEL_ROUTE_QUEUE_TIMEOUT
+        queued = False
+        with self._slot_freed:
+            while True:
+                candidates = [endpoint for endpoint in self.routes[call_site] if endpoint not in excluded]
+                if not candidates:
+                    return None
+                now = time.time()
+                available = [endpoint for endpoint in candidates if endpoint.is_available(now)] or candidates
+                endpoint = next((endpoint for endpoint in available if not endpoint.is_saturated()), None)
+                if endpoint is None:
+                    left = remaining()
+                    wait = queue_deadline - now if left is None else min(queue_deadline - now, left)
+                    if wait > 0:
+                        queued = True
+                        self._slot_freed.wait(wait)
+                        continue
+                    if left is not None and left <= 0:
+                        raise DeadlineExceeded(f"调用点 {call_site} 排队等待模型端点时用完了本轮的时间预算")
+                    endpoint = available[0]
+                if queued:
+                    endpoint.stats["queued"] += 1
+                endpoint.in_flight += 1
+                return endpoint
+
+    def _release(self, endpoint: ModelEndpoint) -> None:
+        # 请求没有发出时归还并发名额（不计入调用统计）
+        with self._lock:
+            endpoint.in_flight -= 1
+            self._slot_freed.notify_all()
+
+    def create_completion(self, call_site: str, api_key: Optional[str] = None, **kwargs):
+        """
+        通过路由发送Chat Completions请求，失败时依次回退到下一个端点
+
+        Args:
+            call_site: 调用点（MODEL_ROUTES中的键）
+            api_key: 调用方分配的API密钥（端点使用其他密钥池时忽略）
+            **kwargs: 传给chat.completions.create的参数（model由路由决定）
+
+        Returns:
+            响应对象；stream=True时返回逐块产出的迭代器
+        """
+        from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+        retryable = (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
+        # 会话超出token配额时直接拒绝，后台任务接近配额时先延迟
+        usage_tracker.check_quota()
+
+        player = get_player()
+        if player is not None:
+            return self._replay(player, call_site, kwargs)
+
+        # 单轮时间预算：每次尝试的超时不超过剩余时间，预算用完后不再重试
+        check_deadline()
+        caller_timeout = kwargs.get("timeout")
+        # 调用方传入的请求头与trace请求头合并（不能同时作为两个extra_headers参数传入）
+        caller_headers = kwargs.pop("extra_headers", None) or {}
+        tried = []
+        last_error = None
+        final_attempts = 0
+        fell_back = False
+        while True:
+            endpoint = self._acquire(call_site, tried)
+            if endpoint is None:
+                raise last_error or RuntimeError(f"调用点 {call_site} 没有可用的模型端点")
+            if not fell_back and endpoint is not self.routes[call_site][0]:
+                # 首选端点饱和、冷却或出错时由本端点承接（每个请求只计一次，之后的重试不再重复计数）
+                fell_back = True
+                with self._lock:
+                    endpoint.stats["fallbacks"] += 1
+
+            is_last = len(tried) + 1 >= len(self.routes[call_site])
+            try:
+                key = self._pick_key(endpoint, api_key)
+                # 跨进程令牌桶：多个进程共用同一密钥时在这里排队，而不是一起触发429；
+                # 有单轮时间预算时最多等到截止时间，到期仍没有令牌则不再发送请求
+                left = remaining()
+                if left is None:
+                    quota_acquire(key)
+                elif left > 0:
+                    quota_acquire(key, min(QUOTA_MAX_WAIT, left))
+                    left = remaining()
+                if left is not None:
+                    if left <= 0:
+                        raise DeadlineExceeded(f"调用点 {call_site} 等待配额时用完了本轮的时间预算")
+                    kwargs["timeout"] = left if caller_timeout is None else min(caller_timeout, left)
+            except BaseException:
+                self._release(endpoint)
+                raise
+            start_time = time.perf_counter()
+            try:
+                # 重试由路由统一处理（回退端点或等待共享配额），不使用openai客户端自带的重试
+                client = get_client(key, endpoint.base_url).with_options(max_retries=0)
+                response = client.chat.completions.create(
+                    model=endpoint.model, **kwargs,
+                    extra_headers={**caller_headers, **trace_headers(endpoint.base_url)})
+            except retryable as e:
+                self._finish(endpoint, start_time, None, error=True)
+                last_error = e
+                if isinstance(e, RateLimitError):
+                    report_rate_limited(key, _retry_after(e))
+                left = remaining()
+                if left is not None and left <= 0.05:
+                    raise DeadlineExceeded(f"调用点 {call_site} 在本轮的时间预算内没有得到响应") from e
+                if is_last:
+                    # 没有可回退的端点：限流时等待共享配额后重试，连接错误短暂退避后重试
+                    final_attempts += 1
+                    if final_attempts > MODEL_ROUTE_MAX_RETRIES:
+                        raise
+                    if not isinstance(e, RateLimitError):
+                        backoff = 0.5 * 2 ** (final_attempts - 1)
+                        time.sleep(backoff if left is None else min(backoff, left))
+                    continue
+                # 还有可回退的端点：暂停使用该端点，回退到下一个
+                tried.append(endpoint)
+                endpoint.cooldown_until = time.time() + MODEL_ROUTE_COOLDOWN
+                print(f"⚠️ 模型端点 {endpoint.name} 暂不可用（{type(e).__name__}），尝试回退")
+                continue
+            except Exception:
+                self._finish(endpoint, start_time, None, error=True)
+                raise
+
+            recorder = get_recorder()
+            if kwargs.get("stream"):
+                if recorder is not None:
+                    response = recorder.wrap_stream(call_site, kwargs, response, start_time)
+                return _RoutedStream(self, endpoint, start_time, response, call_site, key)
+            if recorder is not None:
+                recorder.record(call_site, kwargs, response, time.perf_counter() - start_time)
+            self._finish(endpoint, start_time, response.usage, call_site=call_site, key=key)
+            return response
+
+    def _replay(self, player, call_site: str, request: Dict[str, Any]):
+        """
+        从cassette回放响应（不访问网络），用量按该调用点首选端点的价格计入统计
+        """
+        endpoint = self.routes[call_site][0]
+        response = player.play(call_site, request)
+        if not request.get("stream"):
+            if response.usage is not None:
+                usage_tracker.record(call_site, "replay", response.usage,
+                                     endpoint.cost(response.usage.prompt_tokens, response.usage.completion_tokens))
+            return response
+
+        def stream():
+            usage = None
+            for chunk in response:
+                usage = chunk.usage or usage
+                yield chunk
+            if usage is not None:
+                usage_tracker.record(call_site, "replay", usage,
+                                     endpoint.cost(usage.prompt_tokens, usage.completion_tokens))
+        return stream()
+
+    @staticmethod
+    def _pick_key(endpoint: ModelEndpoint, api_key: Optional[str]) -> str:
+        """
+        选择密钥；密钥正在冷却（任一进程收到429）时换用端点密钥池中未冷却的密钥
+        """
+        key = endpoint.pick_key(api_key)
+        if cooldown_remaining(key) > 0:
+            for alternative in endpoint.keys:
+                if cooldown_remaining(alternative) == 0:
+                    return alternative
+        return key
+
+    def _finish(self, endpoint: ModelEndpoint, start_time: float, usage, error: bool = False,
+                call_site: Optional[str] = None, key: Optional[str] = None) -> None:
+        with self._lock:
+            endpoint.in_flight -= 1
+            self._slot_freed.notify_all()
+            stats = endpoint.stats
+            stats["calls"] += 1
+            stats["latency"] += time.perf_counter() - start_time
+            if error:
+                stats["errors"] += 1
+            if usage is not None:
+                stats["prompt_tokens"] += usage.prompt_tokens or 0
+                stats["completion_tokens"] += usage.completion_tokens or 0
+        if usage is not None and call_site is not None:
+            usage_tracker.record(call_site, key, usage,
+                                 endpoint.cost(usage.prompt_tokens or 0, usage.completion_tokens or 0))
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """
+        获取各端点的调用统计
+
+        Returns:
+            endpoints（端点名称 -> 调用次数、错误数、回退次数、排队次数、平均延迟、token用量和成本）和routes（调用点 -> 端点顺序）
+        """
+        with self._lock:
+            endpoints = {}
+            for name, endpoint in self.endpoints.items():
+                stats = endpoint.stats
+                endpoints[name] = {
+                    "model": endpoint.model,
+                    "calls": stats["calls"],
+                    "errors": stats["errors"],
+                    "fallbacks": stats["fallbacks"],
+                    "queued": stats["queued"],
+                    "in_flight": endpoint.in_flight,
+                    "cooling_down": not endpoint.is_available(time.time()),
+                    "avg_latency_ms": round(stats["latency"] / stats["calls"] * 1000, 1) if stats["calls"] else None,
+                    "prompt_tokens": stats["prompt_tokens"],
+                    "completion_tokens": stats["completion_tokens"],
+                    "cost": round(endpoint.cost(stats["prompt_tokens"], stats["completion_tokens"]), 6)
+                }
+            routes = {call_site: [endpoint.name for endpoint in route] for call_site, route in self.routes.items()}
+            return {"endpoints": endpoints, "routes": routes}
+
+
+router = ModelRouter()
+
+
+def create_completion(call_site: str, api_key: Optional[str] = None, **kwargs):
+    """
+    通过全局路由发送Chat Completions请求（参数见ModelRouter.create_completion）
+    """
+    return router.create_completion(call_site, api_key, **kwargs)
@@ -0,0 +1,249 @@
+"""
+性能分析工具 - 采样分析器与慢请求记录
+"""
+
+import collections
+import contextvars
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+from config import (
+    PROFILE_SAMPLE_INTERVAL,
+    PROFILE_MAX_SECONDS,
+    SLOW_REQUEST_THRESHOLD,
+    SLOW_REQUEST_LOG_PATH,
+    SLOW_REQUEST_MEMORY_SIZE
+)
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL):
+        """
+        初始化采样分析器
+
+        Args:
+            interval: 采样间隔（秒）
+        """
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def run(self, seconds: float) -> str:
+        """
+        在当前进程上运行采样分析
+
+        Args:
+            seconds: 采样时长（秒）
+
+        Returns:
+            折叠栈格式（collapsed stacks）的采样结果，可直接用于生成火焰图
+        """
+        if not self._lock.acquire(blocking=False):
+            raise RuntimeError("已有采样分析正在运行")
+
+        try:
+            seconds = max(0.1, min(float(seconds), PROFILE_MAX_SECONDS))
+            counts: Dict[str, int] = collections.Counter()
+            own_ident = threading.get_ident()
+            thread_names = {}
+            deadline = time.perf_counter() + seconds
+
+            while time.perf_counter() < deadline:
+                # 线程名只在有新线程出现时刷新
+                frames = sys._current_frames()
+                if any(ident not in thread_names for ident in frames):
+                    thread_names = {t.ident: t.name for t in threading.enumerate()}
+
+                for ident, frame in frames.items():
+                    if ident == own_ident:
+                        continue  # 跳过采样线程自身
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(thread_names.get(ident, str(ident)))
+                    counts[";".join(reversed(stack))] += 1
+
+                time.sleep(self.interval)
+
+            return "\n".join(f"{stack} {count}" for stack, count in counts.most_common())
+        finally:
+            self._lock.release()
+
+
+class RequestTimer:
+    def __init__(self, route: str, session: str):
+        """
+        初始化单次请求的计时器
+
+        Args:
+            route: 请求路由
+            session: 会话标识
+        """
+        self.route = route
+        self.session = session
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.phases: Dict[str, float] = collections.defaultdict(float)
+        self.prompt_sizes: Dict[str, int] = collections.defaultdict(int)
+
+    def to_dict(self, total: float, status: int) -> Dict[str, Any]:
+        """
+        导出请求计时信息
+
+        Args:
+            total: 请求总耗时（秒）
+            status: HTTP状态码
+
+        Returns:
+            计时信息字典
+        """
+        phases = {name: round(seconds, 4) for name, seconds in self.phases.items()}
+        # 未被任何阶段覆盖的时间归入Flask及其他开销
+        phases["other"] = round(max(0.0, total - sum(self.phases.values())), 4)
+        return {
+            "timestamp": self.started_at,
+            "route": self.route,
+            "session": self.session,
+            "status": status,
+            "total": round(total, 4),
+            "phases": phases,
+            "prompt_sizes": dict(self.prompt_sizes)
+        }
+
+
+class SlowRequestLog:
+    def __init__(self, threshold: float = SLOW_REQUEST_THRESHOLD, log_path: str = SLOW_REQUEST_LOG_PATH):
+        """
+        初始化慢请求日志
+
+        Args:
+            threshold: 慢请求阈值（秒）
+            log_path: 日志文件路径
+        """
+        self.threshold = threshold
+        self.log_path = log_path
+        self.recent = collections.deque(maxlen=SLOW_REQUEST_MEMORY_SIZE)
+        self._lock = threading.Lock()
+
+    def record(self, entry: Dict[str, Any]) -> None:
+        """
+        记录一条慢请求
+
+        Args:
+            entry: 请求计时信息
+        """
+        with self._lock:
+            self.recent.append(entry)
+            try:
+                directory = os.path.dirname(self.log_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"❌ 慢请求日志写入失败: {str(e)}")
+
+    def get_recent(self) -> List[Dict[str, Any]]:
+        """
+        获取最近的慢请求记录
+
+        Returns:
+            慢请求记录列表
+        """
+        with self._lock:
+            return list(self.recent)
+
+
+_current_timer: contextvars.ContextVar = contextvars.ContextVar("request_timer", default=None)
+
+profiler = SamplingProfiler()
+slow_request_log = SlowRequestLog()
+
+
+def start_request(route: str, session: str) -> RequestTimer:
+    """
+    开始记录当前请求的耗时
+
+    Args:
+        route: 请求路由
+        session: 会话标识
+
+    Returns:
+        请求计时器
+    """
+    timer = RequestTimer(route, session)
+    _current_timer.set(timer)
+    return timer
+
+
+def finish_request(status: int, trace_id: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    结束当前请求的计时，超过阈值时写入慢请求日志
+
+    Args:
+        status: HTTP状态码
+        trace_id: 请求对应的trace ID，用于在trace文件中定位慢请求
+
+    Returns:
+        慢请求记录，未超过阈值时返回None
+    """
+    timer = _current_timer.get()
+    if timer is None:
+        return None
+    _current_timer.set(None)
+
+    total = time.perf_counter() - timer.start
+    if total < slow_request_log.threshold:
+        return None
+
+    entry = timer.to_dict(total, status)
+    if trace_id:
+        entry["trace_id"] = trace_id
+    slow_request_log.record(entry)
+    return entry
+
+
+def record_phase(name: str, seconds: float) -> None:
+    """
+    累加当前请求某个阶段的耗时
+
+    Args:
+        name: 阶段名称
+        seconds: 耗时（秒）
+    """
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.phases[name] += seconds
+
+
+def record_prompt_size(name: str, size: int) -> None:
+    """
+    累加当前请求的提示词长度
+
+    Args:
+        name: 调用点名称
+        size: 提示词字符数
+    """
+    timer = _current_timer.get()
+    if timer is not None:
+        timer.prompt_sizes[name] += size
+
+
+@contextmanager
+def phase(name: str):
+    """
+    统计代码块耗时并计入当前请求的某个阶段
+
+    Args:
+        name: 阶段名称
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - start)
@@ -0,0 +1,312 @@
+"""
+跨进程API配额协调 - 同一台机器上的多个进程通过共享内存文件共用每个密钥的令牌桶和冷却时间
+
+共享文件中每个密钥占一个固定槽位（令牌数、更新时间、冷却截止时间），修改时加文件锁。
+每次从共享令牌桶预取少量令牌在本进程内使用，大部分请求只走进程内的快速路径（只加进程内锁，不加跨进程文件锁）。
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional, Tuple
+from profiler import record_phase
+from config import (
+    QUOTA_ENABLED,
+    QUOTA_SHARED_PATH,
+    QUOTA_MAX_KEYS,
+    QUOTA_REQUESTS_PER_MINUTE,
+    QUOTA_BURST,
+    QUOTA_LEASE_SIZE,
+    QUOTA_LEASE_TTL,
+    QUOTA_RATE_LIMIT_COOLDOWN,
+    QUOTA_MAX_WAIT
+)
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+_MAGIC = b"ZGCAQTA1"
+_HEADER = struct.Struct("<8sI4x")
+_SLOT = struct.Struct("<Qddd")  # 密钥标识、令牌数、令牌更新时间、冷却截止时间
+
+
+def _key_id(api_key: str) -> int:
+    # 共享文件中不保存密钥原文，只保存哈希（0保留给空槽位）
+    return int.from_bytes(hashlib.sha1(api_key.encode("utf-8")).digest()[:8], "little") | 1
+
+
+class SharedQuota:
+    def __init__(self, path: str = QUOTA_SHARED_PATH, max_keys: int = QUOTA_MAX_KEYS,
+                 requests_per_minute: float = QUOTA_REQUESTS_PER_MINUTE, burst: float = QUOTA_BURST):
+        """
+        打开（必要时创建）共享配额文件
+
+        Args:
+            path: 共享文件路径
+            max_keys: 密钥槽位数
+            requests_per_minute: 每个密钥每分钟允许的请求数
+            burst: 令牌桶容量
+        """
+        self.path = path
+        self.max_keys = max_keys
+        self.rate = requests_per_minute / 60.0
+        self.burst = burst
+        self.size = _HEADER.size + _SLOT.size * max_keys
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o600), "r+b")
+        self._thread_lock = threading.Lock()
+        with self._locked():
+            if os.path.getsize(path) < self.size:
+                self._file.truncate(self.size)
+            self._mmap = mmap.mmap(self._file.fileno(), self.size)
+            magic, _ = _HEADER.unpack_from(self._mmap, 0)
+            if magic != _MAGIC:
+                self._mmap[:self.size] = bytes(self.size)
+                _HEADER.pack_into(self._mmap, 0, _MAGIC, max_keys)
+
+        self._slots: Dict[str, int] = {}
+        self._leases: Dict[str, list] = {}  # 密钥 -> [剩余预取令牌数, 过期时间]
+        self.stats = {"fast_path": 0, "shared_path": 0, "waits": 0, "wait_seconds": 0.0, "rate_limited": 0}
+
+    @contextmanager
+    def _locked(self):
+        """
+        加进程内锁和跨进程文件锁
+        """
+        with self._thread_lock:
+            fd = self._file.fileno()
+            if os.name == "nt":
+                os.lseek(fd, 0, os.SEEK_SET)
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+            else:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if os.name == "nt":
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+                else:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _slot_offset(self, api_key: str) -> int:
+        """
+        查找或分配密钥的槽位（调用方需持有锁），返回槽位在文件中的偏移
+        """
+        offset = self._slots.get(api_key)
+        if offset is not None:
+            return offset
+
+        key_id = _key_id(api_key)
+        start = key_id % self.max_keys
+        for probe in range(self.max_keys):
+            offset = _HEADER.size + _SLOT.size * ((start + probe) % self.max_keys)
+            slot_id, _, _, _ = _SLOT.unpack_from(self._mmap, offset)
+            if slot_id == key_id:
+                break
+            if slot_id == 0:
+                _SLOT.pack_into(self._mmap, offset, key_id, float(self.burst), time.time(), 0.0)
+                break
+        else:
+            raise RuntimeError("共享配额文件的密钥槽位已满，请增大QUOTA_MAX_KEYS")
+
+        self._slots[api_key] = offset
+        return offset
+
+    def _take(self, api_key: str, count: int) -> Tuple[int, float]:
+        """
+        从共享令牌桶中取出令牌
+
+        Args:
+            api_key: API密钥
+            count: 希望取出的令牌数
+
+        Returns:
+            (实际取出的令牌数, 取不到时建议的重试时间点)
+        """
+        with self._locked():
+            offset = self._slot_offset(api_key)
+            key_id, tokens, updated, cooldown_until = _SLOT.unpack_from(self._mmap, offset)
+            now = time.time()
+            if cooldown_until > now:
+                return 0, cooldown_until
+
+            tokens = min(self.burst, tokens + max(0.0, now - updated) * self.rate)
+            granted = min(count, int(tokens))
+            tokens -= granted
+            _SLOT.pack_into(self._mmap, offset, key_id, tokens, now, cooldown_until)
+            self.stats["shared_path"] += 1
+
+        if granted:
+            return granted, now
+        return 0, now + (1.0 - tokens) / self.rate
+
+    def cooldown_remaining(self, api_key: str) -> float:
+        """
+        获取密钥剩余的冷却时间（无锁读取）
+
+        Args:
+            api_key: API密钥
+
+        Returns:
+            剩余冷却秒数，未冷却时为0
+        """
+        offset = self._slots.get(api_key)
+        if offset is None:
+            return 0.0
+        _, _, _, cooldown_until = _SLOT.unpack_from(self._mmap, offset)
+        return max(0.0, cooldown_until - time.time())
+
+    def acquire(self, api_key: str, timeout: float = QUOTA_MAX_WAIT) -> float:
+        """
+        获取一个请求令牌，令牌不足或密钥冷却时等待
+
+        Args:
+            api_key: API密钥
+            timeout: 最长等待时间（秒），超时后直接放行
+
+        Returns:
+            等待的秒数
+        """
+        now = time.time()
+        with self._thread_lock:
+            lease = self._leases.get(api_key)
+            if lease and lease[0] > 0 and now < lease[1] and self.cooldown_remaining(api_key) == 0:
+                lease[0] -= 1
+                self.stats["fast_path"] += 1
+                return 0.0
+
+        start = time.perf_counter()
+        deadline = start + timeout
+        while True:
+            granted, retry_at = self._take(api_key, QUOTA_LEASE_SIZE)
+            if granted:
+                with self._thread_lock:
+                    self._leases[api_key] = [granted - 1, time.time() + QUOTA_LEASE_TTL]
+                break
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            time.sleep(min(max(retry_at - time.time(), 0.01), remaining, 0.5))
+
+        waited = time.perf_counter() - start
+        if waited >= 0.01:
+            with self._thread_lock:
+                self.stats["waits"] += 1
+                self.stats["wait_seconds"] += waited
+            record_phase("quota.wait", waited)
+        return waited
+
+    def report_rate_limited(self, api_key: str, retry_after: Optional[float] = None) -> None:
+        """
+        报告密钥被限流：在所有进程中暂停使用该密钥，并清空令牌
+
+        Args:
+            api_key: API密钥
+            retry_after: 服务端建议的重试间隔（秒）
+        """
+        cooldown = retry_after if retry_after and retry_after > 0 else QUOTA_RATE_LIMIT_COOLDOWN
+        with self._locked():
+            offset = self._slot_offset(api_key)
+            key_id, _, _, cooldown_until = _SLOT.unpack_from(self._mmap, offset)
+            now = time.time()
+            _SLOT.pack_into(self._mmap, offset, key_id, 0.0, now, max(cooldown_until, now + cooldown))
+            self._leases.pop(api_key, None)
+            self.stats["rate_limited"] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取配额统计
+
+        Returns:
+            快速路径/共享路径次数、等待次数和时长、限流次数，以及每个密钥的剩余令牌和冷却时间
+        """
+        keys = {}
+        with self._thread_lock:
+            for api_key, offset in self._slots.items():
+                _, tokens, updated, cooldown_until = _SLOT.unpack_from(self._mmap, offset)
+                now = time.time()
+                keys[f"...{api_key[-4:]}"] = {
+                    "tokens": round(min(self.burst, tokens + max(0.0, now - updated) * self.rate), 2),
+                    "cooldown_seconds": round(max(0.0, cooldown_until - now), 2)
+                }
+            stats = dict(self.stats)
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        stats["keys"] = keys
+        return stats
+
+
+_quota: Optional[SharedQuota] = None
+_quota_lock = threading.Lock()
+_quota_disabled = not QUOTA_ENABLED
+
+
+def get_quota() -> Optional[SharedQuota]:
+    """
+    获取全局共享配额（首次调用时打开共享文件，未启用或无法打开时返回None）
+    """
+    global _quota, _quota_disabled
+    if _quota is None and not _quota_disabled:
+        with _quota_lock:
+            if _quota is None and not _quota_disabled:
+                try:
+                    _quota = SharedQuota()
+                except (OSError, ValueError) as e:
+                    print(f"⚠️ 共享配额文件不可用，不再进行跨进程限流: {str(e)}")
+                    _quota_disabled = True
+    return _quota
+
+
+def acquire(api_key: str, timeout: float = QUOTA_MAX_WAIT) -> float:
+    """
+    获取一个请求令牌（未启用配额协调时直接返回）
+
+    Args:
+        api_key: API密钥
+        timeout: 最长等待时间（秒），超时后直接放行
+
+    Returns:
+        等待的秒数
+    """
+    quota = get_quota()
+    return quota.acquire(api_key, timeout) if quota else 0.0
+
+
+def report_rate_limited(api_key: str, retry_after: Optional[float] = None) -> None:
+    """
+    报告密钥被限流（未启用配额协调时忽略）
+
+    Args:
+        api_key: API密钥
+        retry_after: 服务端建议的重试间隔（秒）
+    """
+    quota = get_quota()
+    if quota:
+        quota.report_rate_limited(api_key, retry_after)
+
+
+def cooldown_remaining(api_key: str) -> float:
+    """
+    获取密钥剩余的冷却时间（未启用配额协调时为0）
+    """
+    quota = get_quota()
+    return quota.cooldown_remaining(api_key) if quota else 0.0
+
+
+def get_quota_stats() -> Dict[str, Any]:
+    """
+    获取配额统计（未启用时只返回enabled=False）
+    """
+    quota = get_quota()
+    if not quota:
+        return {"enabled": False}
+    return dict(quota.get_stats(), enabled=True, path=quota.path)
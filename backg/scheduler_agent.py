@@ -2,21 +2,75 @@
 调度智能体 - 负责剧本创建、角色管理和对话调度
 """
 
+import copy
 import re
-from typing import List, Dict, Any, Optional
-from openai import OpenAI
+import threading
+import time
+from bisect import bisect_left
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, List, Dict, Any, Optional, Tuple
 from character_agent import CharacterAgent
+from history import ConversationHistory, Turn, split_speaker
+from memory_index import MemoryIndex
+from speaker_model import FEATURE_NAMES, decision_log, extract_features, get_speaker_model
+from scheduling_batcher import get_scheduling_batcher
+from turn_deadline import DeadlineExceeded, current_budget, stage
 from api_pool import APIKeyPool
+from llm_client import get_client, record_completion
+from model_router import create_completion
+from profiler import phase, record_prompt_size
+from tracing import span, traced
+from script_schema import (
+    FIELD_REQUIREMENTS,
+    SettingStreamParser,
+    build_repair_context,
+    loads_setting,
+    parse_character_lines,
+    parse_setting_json,
+    to_parsed_setting,
+    validate_field
+)
 from config import (
-    DEEPSEEK_BASE_URL, 
-    DEEPSEEK_MODEL, 
-    MAX_TOKENS, 
-    TEMPERATURE,
+    API_KEYS,
+    GENERATION_PROFILES,
     SCHEDULER_SYSTEM_PROMPT,
-    USER_CHARACTER_NAME
+    SCHEDULING_SYSTEM_PROMPT,
+    SCHEDULING_REASON_ENABLED,
+    SCHEDULING_REASON_PROMPT,
+    SCHEDULING_REASON_MAX_TOKENS,
+    SCRIPT_SETTING_JSON_MODE,
+    SCRIPT_SETTING_JSON_PROMPT,
+    SCRIPT_SETTING_REPAIR_PROMPT_TEMPLATE,
+    SCRIPT_SETTING_REPAIR_MAX_TOKENS,
+    SCRIPT_SETTING_STREAMING,
+    USER_CHARACTER_NAME,
+    PERSPECTIVE_FILTER_ENABLED,
+    PRESENCE_ENTER_TEMPLATE,
+    PRESENCE_LEAVE_TEMPLATE,
+    WHISPER_MARKERS,
+    SPEAKER_MODEL_CONFIDENCE,
+    SCHEDULING_PLAN_PROMPT,
+    SCHEDULING_MAX_CANDIDATES,
+    TURN_SCHEDULING_BUDGET,
+    OPENING_LINE_SITUATION
 )
 
 
+# 开场台词在所有会话共用的线程池中生成（线程按需创建）
+_opening_executor = ThreadPoolExecutor(max_workers=SCHEDULING_MAX_CANDIDATES, thread_name_prefix="opening")
+
+
+def _presence_pattern(template: str) -> "re.Pattern":
+    before, _, after = template.partition("{name}")
+    return re.compile(f"^{re.escape(before)}(.+?){re.escape(after)}$")
+
+
+_ENTER_PATTERN = _presence_pattern(PRESENCE_ENTER_TEMPLATE)
+_LEAVE_PATTERN = _presence_pattern(PRESENCE_LEAVE_TEMPLATE)
+_STAGE_DIRECTION = re.compile(r"^\s*[（(]([^）)]*)[）)]")
+
+
 class SchedulerAgent:
     def __init__(self, api_key: str):
         """
@@ -26,43 +80,109 @@ class SchedulerAgent:
             api_key: 调度agent的API密钥
         """
         self.api_key = api_key
-        self.client = OpenAI(
-            api_key=self.api_key,
-            base_url=DEEPSEEK_BASE_URL
-        )
         
         self.api_pool = APIKeyPool()
+        
+        # 角色名册：所有AI角色的设定和分配的密钥（按创建顺序）；characters中只有用户主角和已创建的AI角色智能体，
+        # AI角色第一次被调度或查询时才创建智能体，群戏中从未说话的角色不占用每轮的开销
+        self.character_infos: Dict[str, str] = {}
+        self.character_keys: Dict[str, str] = {}
         self.characters: Dict[str, CharacterAgent] = {}
+        self._synced: Dict[str, int] = {}  # AI角色的历史已补到调度agent历史的第几条
+        self._roster_lock = threading.RLock()
+        self._name_pattern: Optional["re.Pattern"] = None
+        self._characters_info: Optional[List[Dict[str, Any]]] = None
+        
+        # AI角色按最近一次发言排序（最久没说话的在前），候选角色较多时用于补足调度候选
+        self._speak_order: "OrderedDict[str, None]" = OrderedDict()
         self.scene_setting = ""
         self.plot_summary = ""
-        self.conversation_history = []
+        self.conversation_history = ConversationHistory()
+        
+        # 对话历史的检索索引（所有AI角色共用，用于召回早前的相关台词）
+        self.memory = MemoryIndex()
+        
+        # 不在场的AI角色，以及进场/离场记录（对话历史中的位置, 角色, 是否在场），分支时据此恢复在场情况
+        self.absent: set = set()
+        self.presence_events: List[tuple] = []
+        
+        # 私语的听众（对话历史中的位置 -> 能听到的AI角色），补上AI角色的历史时据此过滤
+        self.audiences: Dict[int, frozenset] = {}
+        
+        # 台词提交到对话历史后的回调（参数为台词记录及其在历史中的位置，用于会话持久化）
+        self.turn_listeners: List[Callable[[Turn, int], None]] = []
+        
+        # 剧本设定解析统计（JSON直接通过、单字段修复、回退文本解析、最终解析失败）
+        self.parse_stats = {
+            "settings": 0,
+            "json_ok": 0,
+            "repairs": 0,
+            "repair_failures": 0,
+            "regex_fallbacks": 0,
+            "parse_failures": 0
+        }
+        
+        # 调度统计（总次数、只有一个候选、按编号解析、按名字匹配、默认第一个候选，
+        # 本地模型直接决定、本地模型置信度不足时与LLM决定一致的次数/比较次数，多轮规划，候选角色过多时预筛选的次数，
+        # 调度超出单轮时间预算、在本地选出说话者的次数，预先生成的开场台词数）
+        self.scheduling_stats = {
+            "decisions": 0,
+            "single_candidate": 0,
+            "index_ok": 0,
+            "name_fallbacks": 0,
+            "default_fallbacks": 0,
+            "local_decisions": 0,
+            "model_agreements": 0,
+            "model_comparisons": 0,
+            "plan_calls": 0,
+            "planned_decisions": 0,
+            "plan_invalidations": 0,
+            "prefiltered": 0,
+            "deadline_fallbacks": 0,
+            "opening_lines": 0
+        }
+        
+        # 是否有尚未作废的开场台词（第一句AI台词写入历史后，其余角色的开场台词作废）
+        self._opening_pending = False
+        
+        # 多轮调度规划：接下来依次说话的AI角色（台词写入历史时才从规划中移除，调度时只读取）
+        self.speaker_plan: deque = deque()
+        self._plan_lock = threading.Lock()
         
-    def create_script_setting(self, user_input: str) -> Dict[str, Any]:
+    @property
+    def client(self):
+        """
+        OpenAI客户端（首次调用时创建，同一密钥共享）
+        """
+        return get_client(self.api_key)
+    
+    @traced("scheduler.create_script_setting")
+    def create_script_setting(self, user_input: str,
+                              on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
         """
         根据用户输入创建剧本设定
         
         Args:
             user_input: 用户输入的场景和限制
+            on_field: 流式生成时，每个字段（scene_setting、characters、plot_summary）生成完毕后的回调
             
         Returns:
             剧本设定信息
         """
         try:
-            response = self.client.chat.completions.create(
-                model=DEEPSEEK_MODEL,
-                messages=[
-                    {"role": "system", "content": SCHEDULER_SYSTEM_PROMPT},
-                    {"role": "user", "content": user_input}
-                ],
-                temperature=TEMPERATURE,
-                max_tokens=MAX_TOKENS,
-                stream=False
-            )
+            self.parse_stats["settings"] += 1
             
-            script_setting = response.choices[0].message.content.strip()
+            if SCRIPT_SETTING_JSON_MODE:
+                parsed_setting = self._create_script_setting_json(user_input, on_field)
+            else:
+                script_setting = self._generate_setting_text(SCHEDULER_SYSTEM_PROMPT, user_input, False, on_field)
+                
+                # 解析剧本设定
+                with phase("parse.script_setting"):
+                    parsed_setting = self._parse_script_setting(script_setting)
             
-            # 解析剧本设定
-            parsed_setting = self._parse_script_setting(script_setting)
+            if not parsed_setting["characters"]:
+                self.parse_stats["parse_failures"] += 1
             
             # 保存场景和剧情信息
             self.scene_setting = parsed_setting.get("scene_setting", "")
@@ -73,6 +193,207 @@ class SchedulerAgent:
         except Exception as e:
             return {"error": f"剧本设定创建失败: {str(e)}"}
     
+    def _create_script_setting_json(self, user_input: str,
+                                    on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """
+        以JSON格式生成剧本设定，只对校验失败的字段单独重新生成
+        
+        Args:
+            user_input: 用户输入的场景和限制
+            on_field: 字段生成完毕后的回调
+            
+        Returns:
+            解析后的设定信息
+        """
+        script_setting = self._generate_setting_text(SCRIPT_SETTING_JSON_PROMPT, user_input, True, on_field)
+        
+        with phase("parse.script_setting"):
+            data, errors = parse_setting_json(script_setting)
+        
+        if data is None:
+            # 输出不是合法JSON（如被截断或模型忽略了格式），按文本格式解析
+            self.parse_stats["regex_fallbacks"] += 1
+            with phase("parse.script_setting"):
+                return self._parse_script_setting(script_setting)
+        
+        if not errors:
+            self.parse_stats["json_ok"] += 1
+        
+        for field, error in errors.items():
+            repaired = self._repair_setting_field(user_input, data, field, error)
+            if repaired is None:
+                self.parse_stats["repair_failures"] += 1
+            else:
+                self.parse_stats["repairs"] += 1
+                data[field] = repaired
+        
+        return to_parsed_setting(data)
+    
+    def _repair_setting_field(self, user_input: str, data: Dict[str, Any], field: str, error: str) -> Any:
+        """
+        重新生成剧本设定中的单个字段
+        
+        Args:
+            user_input: 用户输入的场景和限制
+            data: 已解析的剧本设定JSON对象
+            field: 需要修复的字段
+            error: 字段的校验错误
+            
+        Returns:
+            修复后的字段值，修复失败时返回None
+        """
+        print(f"🔧 剧本设定字段 {field} 无效（{error}），正在单独重新生成...")
+        repair_prompt = SCRIPT_SETTING_REPAIR_PROMPT_TEMPLATE.format(
+            field=field,
+            error=error,
+            requirement=FIELD_REQUIREMENTS[field],
+            user_input=user_input,
+            context=build_repair_context(data, field)
+        )
+        try:
+            repaired_text = self._request_completion(
+                "setting_repair", SCRIPT_SETTING_JSON_PROMPT, repair_prompt, "setting",
+                json_mode=True, max_tokens=SCRIPT_SETTING_REPAIR_MAX_TOKENS
+            )
+        except Exception as e:
+            print(f"❌ 字段 {field} 修复失败: {str(e)}")
+            return None
+        
+        repaired = loads_setting(repaired_text)
+        if repaired is None or validate_field(field, repaired.get(field)) is not None:
+            return None
+        return repaired[field]
+    
+    def _generate_setting_text(self, system_prompt: str, user_input: str, json_mode: bool,
+                               on_field: Optional[Callable[[str, Any], None]]) -> str:
+        """
+        生成剧本设定文本；开启流式生成时边生成边解析，字段完整后立即回调
+        
+        Args:
+            system_prompt: 系统提示词
+            user_input: 用户输入的场景和限制
+            json_mode: 是否要求输出JSON对象
+            on_field: 字段生成完毕后的回调
+            
+        Returns:
+            完整的模型输出文本
+        """
+        if not SCRIPT_SETTING_STREAMING or on_field is None:
+            return self._request_completion("setting", system_prompt, user_input, "setting", json_mode=json_mode)
+        
+        parser = SettingStreamParser(json_mode)
+        
+        def on_delta(delta: str):
+            for field, value in parser.feed(delta):
+                on_field(field, value)
+        
+        script_setting = self._stream_completion("setting", system_prompt, user_input, "setting", on_delta, json_mode)
+        for field, value in parser.finish():
+            on_field(field, value)
+        return script_setting
+    
+    def _stream_completion(self, call_site: str, system_prompt: str, user_input: str, profile: str,
+                           on_delta: Callable[[str], None], json_mode: bool = False) -> str:
+        """
+        以流式方式调用LLM生成文本
+        
+        Args:
+            call_site: 调用点名称（用于计时和追踪）
+            system_prompt: 系统提示词
+            user_input: 用户输入
+            profile: 生成参数配置名（GENERATION_PROFILES中的键）
+            on_delta: 每收到一段输出时的回调
+            json_mode: 是否要求输出JSON对象
+            
+        Returns:
+            完整的模型输出文本
+        """
+        record_prompt_size(call_site, len(system_prompt) + len(user_input))
+        extra_args = {"response_format": {"type": "json_object"}} if json_mode else {}
+        generation = GENERATION_PROFILES[profile]
+        chunks = []
+        usage = None
+        finish_reason = None
+        start_time = time.perf_counter()
+        with phase(f"llm.{call_site}"), span("http.chat_completion", call_site=call_site, key=self.api_key[-4:], stream=True):
+            stream = create_completion(
+                profile,
+                self.api_key,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_input}
+                ],
+                temperature=generation["temperature"],
+                max_tokens=generation["max_tokens"],
+                stream=True,
+                stream_options={"include_usage": True},
+                **extra_args
+            )
+            for chunk in stream:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if not chunk.choices:
+                    continue
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    chunks.append(delta)
+                    on_delta(delta)
+        record_completion(call_site, time.perf_counter() - start_time,
+                          usage.completion_tokens if usage else None, finish_reason)
+        return "".join(chunks).strip()
+    
+    def _request_completion(self, call_site: str, system_prompt: str, user_input: str, profile: str,
+                            json_mode: bool = False, max_tokens: Optional[int] = None) -> str:
+        """
+        调用LLM生成文本
+        
+        Args:
+            call_site: 调用点名称（用于计时和追踪）
+            system_prompt: 系统提示词
+            user_input: 用户输入
+            profile: 生成参数配置名（GENERATION_PROFILES中的键）
+            json_mode: 是否要求输出JSON对象
+            max_tokens: 覆盖配置中的最大令牌数
+            
+        Returns:
+            模型输出文本
+        """
+        record_prompt_size(call_site, len(system_prompt) + len(user_input))
+        extra_args = {"response_format": {"type": "json_object"}} if json_mode else {}
+        generation = GENERATION_PROFILES[profile]
+        start_time = time.perf_counter()
+        with phase(f"llm.{call_site}"), span("http.chat_completion", call_site=call_site, key=self.api_key[-4:]):
+            response = create_completion(
+                profile,
+                self.api_key,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_input}
+                ],
+                temperature=generation["temperature"],
+                max_tokens=max_tokens or generation["max_tokens"],
+                stream=False,
+                **extra_args
+            )
+        record_completion(call_site, time.perf_counter() - start_time,
+                          response.usage.completion_tokens if response.usage else None,
+                          response.choices[0].finish_reason)
+        return response.choices[0].message.content.strip()
+    
+    def get_parse_stats(self) -> Dict[str, Any]:
+        """
+        获取剧本设定解析统计
+        
+        Returns:
+            解析统计信息（含修复率和解析失败率）
+        """
+        stats = dict(self.parse_stats)
+        settings = stats["settings"]
+        stats["repair_rate"] = round(stats["repairs"] / settings, 4) if settings else 0.0
+        stats["parse_failure_rate"] = round(stats["parse_failures"] / settings, 4) if settings else 0.0
+        return stats
+    
     def _parse_script_setting(self, script_setting: str) -> Dict[str, Any]:
         """
         解析剧本设定文本
@@ -98,19 +419,8 @@ class SchedulerAgent:
         # 提取主要角色
         characters_match = re.search(r'【主要角色】\s*\n(.*?)(?=【|$)', script_setting, re.DOTALL)
         if characters_match:
-            characters_text = characters_match.group(1).strip()
             # 解析角色信息（格式：角色名|性格特点|背景）
-            character_lines = [line.strip() for line in characters_text.split('\n') if line.strip()]
-            for line in character_lines:
-                if '|' in line:
-                    parts = line.split('|')
-                    if len(parts) >= 2:
-                        character_name = parts[0].strip()
-                        character_info = '|'.join(parts[1:]).strip()
-                        result["characters"].append({
-                            "name": character_name,
-                            "info": character_info
-                        })
+            result["characters"] = parse_character_lines(characters_match.group(1).strip())
         
         # 提取剧情大纲
         plot_match = re.search(r'【剧情大纲】\s*\n(.*?)(?=【|$)', script_setting, re.DOTALL)
@@ -119,9 +429,10 @@ class SchedulerAgent:
         
         return result
     
+    @traced("scheduler.create_characters")
     def create_characters(self, characters_info: List[Dict[str, str]]) -> bool:
         """
-        创建角色智能体
+        创建角色（登记角色名册并分配API密钥，AI角色的智能体在第一次被调度或查询时创建）
         
         Args:
             characters_info: 角色信息列表
@@ -149,23 +460,27 @@ class SchedulerAgent:
                 return False
             
             # 记录用户主角信息（不需要创建AI智能体）
-            self.characters[USER_CHARACTER_NAME] = "user_character"
+            characters = {USER_CHARACTER_NAME: "user_character"}
             
-            # 只为AI角色分配API密钥
+            # 只为AI角色分配API密钥，智能体在角色第一次被调度或查询时创建
             ai_character_count = len(ai_characters)
-            if ai_character_count > 0:
-                api_keys = self.api_pool.get_keys(ai_character_count)
-                
-                # 创建AI角色智能体
-                for i, character_info in enumerate(ai_characters):
-                    character_name = character_info["name"]
-                    character_detail = character_info["info"]
-                    api_key = api_keys[i]
-                    
-                    character_agent = CharacterAgent(character_name, character_detail, api_key)
-                    character_agent.set_scene_info(self.scene_setting, self.plot_summary)
-                    
-                    self.characters[character_name] = character_agent
+            api_keys = self.api_pool.get_keys(ai_character_count) if ai_character_count > 0 else []
+            character_infos = {}
+            character_keys = {}
+            for i, character_info in enumerate(ai_characters):
+                character_infos[character_info["name"]] = character_info["info"]
+                character_keys[character_info["name"]] = api_keys[i]
+            
+            with self._roster_lock:
+                self.characters = characters
+                self.character_infos = character_infos
+                self.character_keys = character_keys
+                self._speak_order = OrderedDict.fromkeys(character_infos)
+                self._synced = {}
+                self._characters_info = None
+                # 名字较长的优先匹配，避免"小明"被"明"之类的短名字抢先匹配
+                names = sorted(character_infos, key=len, reverse=True)
+                self._name_pattern = re.compile("|".join(map(re.escape, names))) if names else None
             
             print(f"✅ 创建完成：用户主角 + {ai_character_count} 个AI角色")
             return True
@@ -174,6 +489,7 @@ class SchedulerAgent:
             print(f"❌ 角色创建失败: {str(e)}")
             return False
     
+    @traced("scheduler.decide_next_speaker")
     def decide_next_speaker(self, current_situation: str = "") -> Optional[str]:
         """
         决定下一个说话的角色（包括用户主角）
@@ -185,157 +501,545 @@ class SchedulerAgent:
             下一个说话的角色名字
         """
         try:
-            # 构建对话历史
-            conversation_context = "\n".join(self.conversation_history[-10:])  # 最近10条对话
-            
-            # 构建可选角色列表
-            character_list = ", ".join(self.characters.keys())
-            
-            user_input = f"""
-当前场景：{self.scene_setting}
-
-可选角色：{character_list}
-
-最近对话历史：
-{conversation_context}
-
-当前情况：{current_situation}
-
-请决定下一个应该说话的角色。
-"""
-            
-            response = self.client.chat.completions.create(
-                model=DEEPSEEK_MODEL,
-                messages=[
-                    {"role": "system", "content": SCHEDULER_SYSTEM_PROMPT},
-                    {"role": "user", "content": user_input}
-                ],
-                temperature=TEMPERATURE,
-                max_tokens=512,
-                stream=False
-            )
-            
-            decision_text = response.choices[0].message.content.strip()
-            
-            # 从回应中提取角色名
-            next_speaker = self._extract_character_name(decision_text)
-            
-            return next_speaker
+            # 候选角色：用户主角和在场的AI角色（不在场的AI角色不参与调度）
+            history = self.conversation_history.tail(10)
+            candidates = [USER_CHARACTER_NAME] + self._scheduling_candidates(history)
+            return self._decide_speaker(candidates, history, current_situation)
             
         except Exception as e:
             print(f"❌ 角色调度失败: {str(e)}")
             return None
     
-    def decide_next_ai_speaker(self, current_situation: str = "") -> Optional[str]:
+    @traced("scheduler.decide_next_ai_speaker")
+    def decide_next_ai_speaker(self, current_situation: str = "",
+                               recent_history: Optional[List[str]] = None,
+                               plan_turns: int = 1) -> Optional[str]:
         """
         决定下一个说话的AI角色（不包括用户主角）
         
         Args:
             current_situation: 当前情况描述
+            recent_history: 用于调度的对话历史快照（自动播放时可包含尚未生成完的台词），默认使用当前历史
+            plan_turns: 需要调用模型时一次规划的轮数（只有接下来连续多轮都由AI角色说话时，如自动播放，才大于1）
             
         Returns:
             下一个说话的AI角色名字
         """
         try:
-            # 构建对话历史
-            conversation_context = "\n".join(self.conversation_history[-10:])  # 最近10条对话
+            # 候选角色：在场的AI角色（排除用户主角）
+            history = self.conversation_history.tail(10) if recent_history is None else recent_history[-10:]
+            pending = self._pending_speaker(history) if recent_history is not None else None
+            planned = self._take_planned_speaker(history, pending)
+            if planned is not None:
+                return planned
             
-            # 构建AI角色列表（排除用户主角）
-            ai_characters = [name for name in self.characters.keys() if name != USER_CHARACTER_NAME]
-            if not ai_characters:
+            candidates = self._scheduling_candidates(history)
+            if pending is not None:
+                # 未完成台词的说话者刚说完，不再调度为下一位（只剩其一人在场时除外）
+                candidates = [name for name in candidates if name != pending] or candidates
+            if not candidates:
                 print("❌ 没有可用的AI角色")
                 return None
+            return self._decide_speaker(candidates, history, current_situation, plan_turns, pending)
             
-            character_list = ", ".join(ai_characters)
+        except Exception as e:
+            print(f"❌ AI角色调度失败: {str(e)}")
+            return None
+    
+    def _pending_speaker(self, history: List[str]) -> Optional[str]:
+        """
+        调度使用的历史快照中最后一句尚未写入对话历史时（自动播放用未完成的台词提前调度），返回其说话角色
+        """
+        if not history:
+            return None
+        committed = self.conversation_history.tail(1)
+        if committed and committed[-1] == history[-1]:
+            return None
+        return split_speaker(history[-1])[0]
+    
+    def _take_planned_speaker(self, history: List[str], pending: Optional[str] = None) -> Optional[str]:
+        """
+        按规划读取下一位说话的AI角色（不从规划中移除，台词写入历史时才移除，调用方放弃这次调度结果时规划不受影响）；
+        规划的角色已不在场，或上一句台词点名了规划之外的其他AI角色时放弃规划
+        
+        Args:
+            history: 最近的对话历史
+            pending: 历史快照中尚未写入的最后一句台词的角色（是规划中的下一位时跳过该角色）
             
-            user_input = f"""
-当前场景：{self.scene_setting}
+        Returns:
+            规划的角色；没有可用的规划时返回None
+        """
+        with self._plan_lock:
+            offset = 1 if pending is not None and self.speaker_plan and self.speaker_plan[0] == pending else 0
+            if len(self.speaker_plan) <= offset:
+                return None
+            speaker = self.speaker_plan[offset]
+            addressed = self.addressed_names(history[-1]) if history else []
+            if not self._is_present(speaker) or (addressed and speaker not in addressed):
+                self._invalidate_plan_locked()
+                return None
+            self.scheduling_stats["decisions"] += 1
+            self.scheduling_stats["planned_decisions"] += 1
+            return speaker
+    
+    def invalidate_plan(self) -> None:
+        """
+        放弃调度规划（自动播放丢弃提前调度的结果时调用）
+        """
+        with self._plan_lock:
+            self._invalidate_plan_locked()
+    
+    def _invalidate_plan_locked(self) -> None:
+        # 调用方需持有_plan_lock
+        if self.speaker_plan:
+            self.scheduling_stats["plan_invalidations"] += 1
+        self.speaker_plan.clear()
+    
+    def _check_plan(self, speaker: str) -> None:
+        """
+        台词写入历史时推进规划：规划中的下一位角色说话时将其从规划中移除，用户发言、旁白或其他角色插话时放弃规划
+        """
+        with self._plan_lock:
+            if self.speaker_plan and self.speaker_plan[0] == speaker:
+                self.speaker_plan.popleft()
+                return
+            self._invalidate_plan_locked()
+    
+    def get_speaker_plan(self) -> List[str]:
+        """
+        获取调度规划
+        
+        Returns:
+            接下来依次说话的AI角色（已调度、台词尚未写入历史的角色仍在其中）
+        """
+        with self._plan_lock:
+            return list(self.speaker_plan)
+    
+    def _decide_speaker(self, candidates: List[str], history: List[str], current_situation: str,
+                        plan_turns: int = 1, pending: Optional[str] = None) -> Optional[str]:
+        """
+        以编号列出候选角色，请模型只输出编号
+        
+        Args:
+            candidates: 候选角色
+            history: 最近的对话历史
+            current_situation: 当前情况描述
+            plan_turns: 规划的轮数（大于1时请模型依次输出多个编号，写入调度规划）
+            pending: 历史快照中尚未写入的最后一句台词的角色（规划排在其后，该台词写入历史时不会放弃规划）
+            
+        Returns:
+            选中的角色名字
+        """
+        self.scheduling_stats["decisions"] += 1
+        if len(candidates) == 1:
+            # 只有一个候选角色时无需调用模型
+            self.scheduling_stats["single_candidate"] += 1
+            return candidates[0]
+        
+        model = get_speaker_model()
+        features = extract_features(candidates, history) if model is not None or decision_log is not None else None
+        predicted = None
+        if model is not None:
+            predicted, confidence = model.predict(features)
+            if confidence >= SPEAKER_MODEL_CONFIDENCE:
+                self.scheduling_stats["local_decisions"] += 1
+                return candidates[predicted]
+        
+        user_input = self._scheduling_prompt(candidates, history, current_situation)
+        system_prompt = SCHEDULING_SYSTEM_PROMPT
+        max_tokens = None
+        if plan_turns > 1:
+            system_prompt += SCHEDULING_PLAN_PROMPT.format(turns=plan_turns)
+            max_tokens = plan_turns * 3 + 1  # 每个编号和逗号各约1个token
+            self.scheduling_stats["plan_calls"] += 1
+        if SCHEDULING_REASON_ENABLED:
+            system_prompt += SCHEDULING_REASON_PROMPT
+            max_tokens = SCHEDULING_REASON_MAX_TOKENS
+        try:
+            # 调度最多占用单轮时间预算中的TURN_SCHEDULING_BUDGET秒，其余留给角色生成台词
+            with stage(TURN_SCHEDULING_BUDGET):
+                decision_text = self._request_scheduling(system_prompt, user_input, max_tokens)
+        except DeadlineExceeded:
+            return self._fallback_speaker(candidates, history, predicted)
+        
+        match = re.match(r"\s*(\d+)", decision_text)
+        if match and 1 <= int(match.group(1)) <= len(candidates):
+            self.scheduling_stats["index_ok"] += 1
+            speaker = candidates[int(match.group(1)) - 1]
+            # 只记录按编号明确回答的决定，作为本地模型的训练数据
+            if decision_log is not None:
+                decision_log.record(candidates, features, speaker)
+            if plan_turns > 1:
+                plan = [candidates[int(index) - 1] for index in re.findall(r"\d+", decision_text.partition("|")[0])
+                        if 1 <= int(index) <= len(candidates)]
+                with self._plan_lock:
+                    self.speaker_plan = deque(([pending] if pending else []) + plan[:plan_turns])
+        else:
+            # 模型没有按编号回答时，退回到按角色名匹配
+            speaker = self._extract_character_name(decision_text, candidates)
+        
+        if predicted is not None:
+            self.scheduling_stats["model_comparisons"] += 1
+            self.scheduling_stats["model_agreements"] += candidates[predicted] == speaker
+        
+        if SCHEDULING_REASON_ENABLED:
+            reason = decision_text.partition("|")[2].strip()
+            print(f"🧭 调度：{speaker}（{reason or decision_text}）")
+        return speaker
+    
+    def _fallback_speaker(self, candidates: List[str], history: List[str], predicted: Optional[int]) -> str:
+        """
+        调度超出时间预算时在本地选出说话者：有本地模型时采用其预测，否则优先上一句点名的角色，其次最久没说话的角色
+        
+        Args:
+            candidates: 候选角色
+            history: 最近的对话历史
+            predicted: 本地模型预测的候选编号（没有本地模型时为None）
+            
+        Returns:
+            选中的角色名字
+        """
+        self.scheduling_stats["deadline_fallbacks"] += 1
+        budget = current_budget()
+        if budget is not None:
+            budget.scheduler_fallback = True
+        if predicted is not None:
+            return candidates[predicted]
+        rows = extract_features(candidates, history)
+        mentioned = FEATURE_NAMES.index("mentioned_last")
+        gap = FEATURE_NAMES.index("turn_gap")
+        best = max(range(len(candidates)), key=lambda i: rows[i][mentioned] * 10 + rows[i][gap])
+        return candidates[best]
+    
+    def _request_scheduling(self, system_prompt: str, user_input: str, max_tokens: Optional[int]) -> str:
+        """
+        发出调度请求（启用跨会话合批时与其他会话同时到达的调度请求合并为一次调用）
+        """
+        def single_call() -> str:
+            return self._request_completion("scheduler", system_prompt, user_input, "scheduling",
+                                            max_tokens=max_tokens)
+        
+        batcher = get_scheduling_batcher()
+        if batcher is None:
+            return single_call()
+        return batcher.request(system_prompt, user_input,
+                               max_tokens or GENERATION_PROFILES["scheduling"]["max_tokens"],
+                               self.api_key, single_call).strip()
+    
+    def _scheduling_prompt(self, candidates: List[str], history: List[str], current_situation: str) -> str:
+        """
+        构建调度提示词（以编号列出候选角色）
+        """
+        candidate_list = "\n".join(f"{i}. {name}" for i, name in enumerate(candidates, 1))
+        conversation_context = "\n".join(history)
+        return f"""场景：{self.scene_setting}
 
-可选AI角色：{character_list}
+候选角色：
+{candidate_list}
 
-最近对话历史：
+最近对话：
 {conversation_context}
 
-当前情况：{current_situation}
-
-请从AI角色中决定下一个应该说话的角色。注意：不要选择用户主角"{USER_CHARACTER_NAME}"。
-"""
-            
-            response = self.client.chat.completions.create(
-                model=DEEPSEEK_MODEL,
-                messages=[
-                    {"role": "system", "content": SCHEDULER_SYSTEM_PROMPT},
-                    {"role": "user", "content": user_input}
-                ],
-                temperature=TEMPERATURE,
-                max_tokens=512,
-                stream=False
-            )
-            
-            decision_text = response.choices[0].message.content.strip()
-            
-            # 从回应中提取角色名
-            next_speaker = self._extract_character_name(decision_text, ai_only=True)
-            
-            return next_speaker
-            
-        except Exception as e:
-            print(f"❌ AI角色调度失败: {str(e)}")
-            return None
+当前情况：{current_situation}"""
     
-    def _extract_character_name(self, decision_text: str, ai_only: bool = False) -> Optional[str]:
+    def _extract_character_name(self, decision_text: str, candidates: List[str]) -> Optional[str]:
         """
-        从调度决定中提取角色名
+        从调度决定中按角色名匹配（模型没有输出有效编号时使用）
         
         Args:
             decision_text: 调度决定文本
-            ai_only: 是否只从AI角色中选择
+            candidates: 候选角色
             
         Returns:
-            角色名字
+            角色名字（文本中没有候选角色名时返回第一个候选角色）
         """
-        # 获取候选角色列表
-        if ai_only:
-            candidate_characters = [name for name in self.characters.keys() if name != USER_CHARACTER_NAME]
-        else:
-            candidate_characters = list(self.characters.keys())
-        
-        if not candidate_characters:
+        if not candidates:
             return None
         
-        # 尝试匹配 "下一个说话的角色：角色名" 格式
-        match = re.search(r'下一个说话的角色：(.+)', decision_text)
-        if match:
-            character_name = match.group(1).strip()
-            # 检查是否是有效的角色名
-            for name in candidate_characters:
-                if name in character_name:
-                    return name
-        
-        # 如果没有匹配到格式，尝试直接在文本中查找角色名
-        for character_name in candidate_characters:
+        # 名字较长的优先匹配，避免"小明"被"明"之类的短名字抢先匹配
+        for character_name in sorted(candidates, key=len, reverse=True):
             if character_name in decision_text:
+                self.scheduling_stats["name_fallbacks"] += 1
                 return character_name
         
-        # 如果都没找到，返回第一个候选角色
-        if candidate_characters:
-            return candidate_characters[0]
+        self.scheduling_stats["default_fallbacks"] += 1
+        return candidates[0]
+    
+    def _scheduling_candidates(self, history: List[str]) -> List[str]:
+        """
+        选出参与调度的在场AI角色：角色不多时为全部在场角色；超过SCHEDULING_MAX_CANDIDATES个时，
+        依次取最近3句台词点名的角色、最近发言的角色，再按最久没说话补足，调度提示词的长度不随角色数增长
+        
+        Args:
+            history: 最近的对话历史
+            
+        Returns:
+            候选AI角色
+        """
+        if len(self.character_infos) - len(self.absent) <= SCHEDULING_MAX_CANDIDATES:
+            return self.get_present_ai_characters()
         
-        return None
+        self.scheduling_stats["prefiltered"] += 1
+        selected: Dict[str, None] = {}
+        for line in reversed(history[-3:]):
+            for name in self._mentioned_names(split_speaker(line)[1]):
+                if name not in self.absent:
+                    selected[name] = None
+        for line in reversed(history):
+            speaker = split_speaker(line)[0]
+            if speaker in self.character_infos and speaker not in self.absent:
+                selected[speaker] = None
+        with self._roster_lock:
+            for name in self._speak_order:
+                if len(selected) >= SCHEDULING_MAX_CANDIDATES:
+                    break
+                if name not in self.absent:
+                    selected[name] = None
+        return list(selected)[:SCHEDULING_MAX_CANDIDATES]
+    
+    def _mentioned_names(self, text: str) -> List[str]:
+        """
+        找出文本中提到的AI角色（按名册一次扫描，不随角色数逐个匹配）
+        """
+        if self._name_pattern is None:
+            return []
+        return list(dict.fromkeys(self._name_pattern.findall(text)))
     
-    def add_to_history(self, message: str):
+    def addressed_names(self, line: str) -> List[str]:
         """
-        添加到对话历史
+        找出一句台词点名的在场AI角色（不含说话者本人）
         
         Args:
-            message: 对话内容
+            line: 带说话者前缀的台词
+            
+        Returns:
+            被点名的AI角色
         """
-        self.conversation_history.append(message)
+        speaker, text = split_speaker(line)
+        return [name for name in self._mentioned_names(text) if name != speaker and name not in self.absent]
+    
+    def _is_present(self, name: str) -> bool:
+        return name in self.character_infos and name not in self.absent
+    
+    def has_character(self, name: str) -> bool:
+        """
+        判断剧本中是否有该角色（包括用户主角和尚未创建智能体的AI角色）
+        """
+        return name in self.character_infos or (name == USER_CHARACTER_NAME and name in self.characters)
+    
+    @property
+    def character_names(self) -> List[str]:
+        """
+        剧本中所有角色的名字（用户主角在前）
+        """
+        if USER_CHARACTER_NAME not in self.characters:
+            return []
+        return [USER_CHARACTER_NAME] + list(self.character_infos)
+    
+    def get_present_ai_characters(self) -> List[str]:
+        """
+        获取在场的AI角色
         
-        # 同时添加到所有AI角色的历史记录
-        for name, character in self.characters.items():
-            if name != USER_CHARACTER_NAME:  # 跳过用户主角
-                character.add_to_history(message)
+        Returns:
+            在场的AI角色名字列表
+        """
+        return [name for name in self.character_infos if name not in self.absent]
+    
+    def set_presence(self, character_name: str, present: bool) -> Optional[Turn]:
+        """
+        让AI角色进场或离场（写入一条旁白，在场的角色都能看到；离场后的台词该角色看不到，也不会被调度）
+        
+        Args:
+            character_name: AI角色名字
+            present: True为进场，False为离场
+            
+        Returns:
+            写入的旁白；在场情况没有变化时返回None
+        """
+        if character_name not in self.character_infos:
+            raise ValueError(f"没有名为 {character_name} 的AI角色")
+        if (character_name not in self.absent) == present:
+            return None
+        template = PRESENCE_ENTER_TEMPLATE if present else PRESENCE_LEAVE_TEMPLATE
+        return self.add_to_history(template.format(name=character_name), "")
+    
+    def _record_visibility(self, turn: Turn, index: int) -> None:
+        """
+        记录台词的可见范围：进场/离场旁白更新在场情况，私语记录听众
+        
+        Args:
+            turn: 台词记录
+            index: 台词在对话历史中的位置
+        """
+        if not turn.speaker:
+            for pattern, present in ((_ENTER_PATTERN, True), (_LEAVE_PATTERN, False)):
+                match = pattern.match(turn.text)
+                if match and match.group(1) in self.character_infos:
+                    name = match.group(1)
+                    if present:
+                        self.absent.discard(name)
+                    else:
+                        self.absent.add(name)
+                    self.presence_events.append((index, name, present))
+                    self._characters_info = None
+                    return
+        if not PERSPECTIVE_FILTER_ENABLED:
+            return
+        
+        direction = _STAGE_DIRECTION.match(turn.text)
+        if direction and any(marker in direction.group(1) for marker in WHISPER_MARKERS):
+            targets = self._mentioned_names(direction.group(1))
+            if targets or USER_CHARACTER_NAME in direction.group(1):
+                # 私语：只有说话者和被提到的角色能听到
+                self.audiences[index] = frozenset(targets) | {turn.speaker}
+    
+    def _hidden_between(self, name: str, start: int, stop: int) -> set:
+        """
+        计算第start到stop条台词中AI角色看不到的部分：不在场时的台词（离场的角色能看到自己离场，
+        进场的角色能看到自己进场）和没有对其说的私语；角色自己说的台词和对其说的私语总能看到
+        """
+        hidden = set()
+        for index in reversed(self.audiences):
+            if index < start:
+                break
+            if index < stop and name not in self.audiences[index]:
+                hidden.add(index)
+        
+        events = [(index, present) for index, event_name, present
+                  in self.presence_events[bisect_left(self.presence_events, (start,)):]
+                  if event_name == name and index < stop]
+        absent = events[0][1] if events else name in self.absent  # 第一次进场之前不在场，第一次离场之前在场
+        cursor = start
+        for index, present in events:
+            if absent:
+                hidden.update(range(cursor, index))
+            absent = not present
+            cursor = index + 1
+        if absent:
+            hidden.update(range(cursor, stop))
+        return {index for index in hidden if name not in self.audiences.get(index, ())
+                and self.conversation_history.turn(index).speaker != name}
+    
+    def _sync_character(self, name: str, character: CharacterAgent) -> None:
+        """
+        把AI角色的历史补到与调度agent一致（调用方需持有_roster_lock）：
+        台词写入历史时不逐个通知角色，角色被调度或查询时才补上其间能看到的台词；
+        从未有过看不到的台词的角色直接共享调度agent的历史
+        """
+        start, stop = self._synced.get(name, 0), len(self.conversation_history)
+        if start >= stop:
+            return
+        hidden = self._hidden_between(name, start, stop) if PERSPECTIVE_FILTER_ENABLED else set()
+        if not hidden and not character.hidden_turns:
+            character.conversation_history = self.conversation_history.fork(stop)
+        else:
+            character.conversation_history.extend_from(self.conversation_history, start, stop, hidden)
+            character.hidden_turns.update(hidden)
+        self._synced[name] = stop
+    
+    def add_to_history(self, message: str, speaker: Optional[str] = None,
+                       timestamp: Optional[float] = None) -> Turn:
+        """
+        添加到对话历史（AI角色的历史在其被调度或查询时再补上，写入的开销与角色数无关）
+        
+        Args:
+            message: 对话内容（"名字：台词"格式）
+            speaker: 说话角色（为None时从名字前缀中解析）
+            timestamp: 时间戳（为None时使用当前时间）
+            
+        Returns:
+            保存的台词记录
+        """
+        with self._roster_lock:
+            turn = self.conversation_history.append(message, speaker, timestamp)
+            self.memory.add(turn.text, turn.seq)
+            self._check_plan(turn.speaker)
+            if turn.speaker in self._speak_order:
+                self._speak_order.move_to_end(turn.speaker)
+            index = len(self.conversation_history) - 1
+            self._record_visibility(turn, index)
+            if self._opening_pending and turn.speaker in self.character_infos:
+                self._opening_pending = False
+                for character in self.characters.values():
+                    if character != "user_character":
+                        character.opening_line = None
+        
+        for listener in self.turn_listeners:
+            listener(turn, index)
+        return turn
+    
+    def restore_history(self, turns: Iterable[Tuple[str, str, float]]) -> int:
+        """
+        批量写入从会话存储恢复的台词：不通知监听者、不推进调度规划，检索索引推迟到第一次召回时再建立
+        
+        Args:
+            turns: (说话角色, 台词, 时间戳)
+            
+        Returns:
+            写入的台词条数
+        """
+        deferred = []
+        with self._roster_lock:
+            for speaker, text, timestamp in turns:
+                turn = self.conversation_history.append(text, speaker, timestamp)
+                deferred.append((turn.text, turn.seq))
+                if turn.speaker in self._speak_order:
+                    self._speak_order.move_to_end(turn.speaker)
+                self._record_visibility(turn, len(self.conversation_history) - 1)
+            self.memory.add_deferred(deferred)
+        return len(deferred)
+    
+    def fork(self, turn_index: int, key_offset: int = 0) -> "SchedulerAgent":
+        """
+        从第turn_index条对话处分出剧情分支：场景、角色设定等与原调度agent共享，
+        对话历史与原历史共享前turn_index条（AI角色的历史截取到第turn_index条对话之前能看到的部分）
+        
+        Args:
+            turn_index: 分支保留的对话条数
+            key_offset: 分支中AI角色的密钥在API_KEYS中的轮换偏移（并行生成多个分支时分散到不同密钥）
+            
+        Returns:
+            分支中的调度智能体
+        """
+        forked = copy.copy(self)
+        forked.conversation_history = self.conversation_history.fork(turn_index)
+        forked.parse_stats = dict(self.parse_stats)
+        forked.scheduling_stats = dict(self.scheduling_stats)
+        forked.speaker_plan = deque()
+        forked._plan_lock = threading.Lock()
+        forked.turn_listeners = []
+        forked.memory = self.memory.fork(turn_index)
+        forked.presence_events = [event for event in self.presence_events if event[0] < turn_index]
+        forked.audiences = {index: audience for index, audience in self.audiences.items() if index < turn_index}
+        forked.absent = set()
+        for _, name, present in forked.presence_events:
+            if present:
+                forked.absent.discard(name)
+            else:
+                forked.absent.add(name)
+        forked._roster_lock = threading.RLock()
+        forked._characters_info = None
+        # 发言顺序沿用原调度agent当前的顺序（分支点之后的发言会有偏差，只影响候选角色过多时的补足顺序）
+        forked._speak_order = OrderedDict(self._speak_order)
+        forked.character_keys = {}
+        for name, api_key in self.character_keys.items():
+            if key_offset and api_key in API_KEYS:
+                api_key = API_KEYS[(API_KEYS.index(api_key) + key_offset) % len(API_KEYS)]
+            forked.character_keys[name] = api_key
+        # 只分支已创建的角色智能体，其余角色在分支中第一次被调度时再创建
+        forked.characters = {}
+        last_seq = self.conversation_history.turn(turn_index - 1).seq if turn_index else None
+        with self._roster_lock:
+            forked._synced = {name: min(synced, turn_index) for name, synced in self._synced.items()}
+            for name, character in self.characters.items():
+                if name == USER_CHARACTER_NAME:
+                    forked.characters[name] = character
+                    continue
+                history = character.conversation_history
+                length = history.count_through(last_seq) if last_seq is not None else 0
+                forked.characters[name] = character.fork(history.fork(length), forked.character_keys[name],
+                                                         forked.memory)
+        return forked
     
     def get_character_agent(self, character_name: str) -> Optional[CharacterAgent]:
         """
@@ -347,38 +1051,84 @@ class SchedulerAgent:
         Returns:
             角色智能体，如果是用户主角则返回None
         """
-        if character_name == USER_CHARACTER_NAME:
+        if character_name == USER_CHARACTER_NAME or character_name not in self.character_infos:
             return None  # 用户主角不是AI智能体
-        return self.characters.get(character_name)
+        with self._roster_lock:
+            character = self.characters.get(character_name)
+            if character is None:
+                character = CharacterAgent(character_name, self.character_infos[character_name],
+                                           self.character_keys[character_name], self.conversation_history.store)
+                character.set_scene_info(self.scene_setting, self.plot_summary)
+                character.set_other_characters(self.character_names)
+                character.memory = self.memory
+                self.characters[character_name] = character
+            self._sync_character(character_name, character)
+        return character
+    
+    def prepare_opening_lines(self, situation: str = OPENING_LINE_SITUATION) -> List[str]:
+        """
+        在后台为最先可能被调度的在场AI角色（最多SCHEDULING_MAX_CANDIDATES个）并发生成开场台词，
+        各角色使用各自分配的密钥；角色第一次被调度时直接使用，第一句AI台词写入历史后其余角色的开场台词作废
+        
+        Args:
+            situation: 生成开场台词时的当前情况
+            
+        Returns:
+            开始生成开场台词的角色
+        """
+        with self._roster_lock:
+            names = [name for name in self._speak_order if name not in self.absent][:SCHEDULING_MAX_CANDIDATES]
+        if not names:
+            return []
+        for name in names:
+            self.get_character_agent(name).prepare_opening_line(_opening_executor, situation)
+        self._opening_pending = True
+        self.scheduling_stats["opening_lines"] += len(names)
+        return names
     
     def get_characters_info(self) -> List[Dict[str, str]]:
         """
-        获取所有角色信息
+        获取所有角色信息（结果会缓存到角色或在场情况变化为止，返回的字典请勿修改）
         
         Returns:
             角色信息列表
         """
-        characters_info = []
-        for name, character in self.characters.items():
-            if name == USER_CHARACTER_NAME:
+        characters_info = self._characters_info
+        if characters_info is None:
+            characters_info = []
+            if USER_CHARACTER_NAME in self.characters:
                 # 用户主角的信息
                 characters_info.append({
                     "name": USER_CHARACTER_NAME,
                     "info": "用户扮演的主角",
                     "type": "user"
                 })
-            else:
-                # AI角色的信息
-                character_info = character.get_character_info()
-                character_info["type"] = "ai"
-                characters_info.append(character_info)
-        return characters_info
+            for name, info in self.character_infos.items():
+                # AI角色的信息（不需要创建智能体）
+                characters_info.append({
+                    "name": name,
+                    "info": info,
+                    "api_key": self.character_keys[name][:20] + "...",  # 只显示前20个字符
+                    "type": "ai",
+                    "present": name not in self.absent
+                })
+            self._characters_info = characters_info
+        return list(characters_info)
     
     def clear_all_history(self):
         """
         清空所有历史记录
         """
         self.conversation_history.clear()
-        for name, character in self.characters.items():
+        self.memory = MemoryIndex()
+        self.absent = set()
+        self.presence_events = []
+        self.audiences = {}
+        self._characters_info = None
+        with self._plan_lock:
+            self._invalidate_plan_locked()
+        self._synced = dict.fromkeys(self._synced, 0)
+        for name, character in list(self.characters.items()):
             if name != USER_CHARACTER_NAME:  # 跳过用户主角
-                character.clear_history() 
\ No newline at end of file
+                character.clear_history()
+                character.memory = self.memory 
\ No newline at end of file
@@ -0,0 +1,223 @@
+"""
+跨会话调度合批 - 多个会话几乎同时调度时，把各自的调度请求合并为一次LLM调用
+
+调度请求的提示词很短、输出只有几个token，并发会话较多时每次请求的固定开销（往返延迟、按请求计的限流）
+占了大部分耗时。第一个到达的请求成为这一批的发起者，等待一个很短的时间窗口（或凑满一批）后，
+把这一批的提示词按"【剧本N】"分段合并为一次请求，按"剧本编号: 回答"逐行拆分结果分发给各会话。
+某个会话没有得到可解析的回答（或合并请求失败）时，由该会话自己单独调度一次。
+合并请求使用发起者的密钥发出，用量按各会话分段的长度分摊到各会话；各会话的token配额在提交时分别检查。
+"""
+
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+from llm_client import record_completion
+from model_router import create_completion
+from profiler import phase, record_prompt_size
+from tracing import span
+from usage_tracker import attribute, get_session, usage_tracker
+from turn_deadline import DeadlineExceeded, remaining
+from config import (
+    GENERATION_PROFILES,
+    SCHEDULING_SYSTEM_PROMPT,
+    SCHEDULING_BATCH_ENABLED,
+    SCHEDULING_BATCH_WINDOW_MS,
+    SCHEDULING_BATCH_MAX_SIZE,
+    SCHEDULING_BATCH_PROMPT
+)
+
+_ANSWER = re.compile(r"^\s*(?:剧本)?(\d+)\s*[:：]\s*(.+?)\s*$", re.MULTILINE)
+
+
+class _Request:
+    __slots__ = ("system_prompt", "user_input", "max_tokens", "session", "submitted", "done", "merged", "answer")
+
+    def __init__(self, system_prompt: str, user_input: str, max_tokens: int):
+        self.system_prompt = system_prompt
+        self.user_input = user_input
+        self.max_tokens = max_tokens
+        self.session = get_session()  # 提交请求的会话（合并请求的用量按会话分摊）
+        self.submitted = time.perf_counter()
+        self.done = threading.Event()
+        self.merged = False  # 是否与其他请求合并发出
+        self.answer: Optional[str] = None
+
+
+class SchedulingBatcher:
+    def __init__(self, window_ms: float = SCHEDULING_BATCH_WINDOW_MS, max_size: int = SCHEDULING_BATCH_MAX_SIZE):
+        """
+        初始化调度合批
+
+        Args:
+            window_ms: 第一个请求到达后等待其他请求的时间（毫秒）
+            max_size: 每批最多合并的请求数（凑满立即发出）
+        """
+        self.window = max(0.0, window_ms) / 1000
+        self.max_size = max(1, max_size)
+        self._lock = threading.Lock()
+        self._pending: List[_Request] = []
+        self._full = threading.Event()
+        self.stats = {
+            "requests": 0,
+            "batches": 0,
+            "merged_calls": 0,
+            "merged_requests": 0,
+            "fallbacks": 0,
+            "wait_seconds": 0.0,
+            "batch_sizes": {}
+        }
+
+    def request(self, system_prompt: str, user_input: str, max_tokens: int, api_key: str,
+                single_call: Callable[[], str]) -> str:
+        """
+        提交一个调度请求，等待这一批的结果
+
+        Args:
+            system_prompt: 该会话的调度系统提示词
+            user_input: 该会话的调度输入（场景、候选角色、最近对话等）
+            max_tokens: 该会话的回答最多需要的令牌数
+            api_key: 该会话的API密钥（本请求发起一批时用于合并请求）
+            single_call: 单独调度的函数（只有一个请求或没有得到回答时调用）
+
+        Returns:
+            模型对该会话的回答
+
+        Raises:
+            UsageQuotaExceeded: 该会话的token用量已超出配额（不加入合批）
+        """
+        usage_tracker.check_quota()
+        request = _Request(system_prompt, user_input, max_tokens)
+        with self._lock:
+            if not self._pending:
+                self._full = threading.Event()
+            full = self._full
+            self._pending.append(request)
+            leader = len(self._pending) == 1
+            if len(self._pending) >= self.max_size:
+                full.set()
+
+        if leader:
+            # 发起者等待窗口结束或凑满一批，在自己的线程（和上下文）中发出合并请求
+            full.wait(self.window)
+            with self._lock:
+                batch = self._pending
+                self._pending = []
+            self._dispatch(batch, api_key)
+        elif not request.done.wait(remaining()):
+            # 这一批的合并请求没有在本会话的时间预算内返回
+            raise DeadlineExceeded("等待合并调度请求时用完了本轮的时间预算")
+
+        if request.answer is None:
+            if request.merged:
+                with self._lock:
+                    self.stats["fallbacks"] += 1
+            request.answer = single_call()
+        return request.answer
+
+    def _dispatch(self, batch: List[_Request], api_key: str) -> None:
+        """
+        发出一批请求并把回答分发给各请求（只有一个请求时由其单独调度）
+        """
+        now = time.perf_counter()
+        with self._lock:
+            self.stats["requests"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["wait_seconds"] += sum(now - request.submitted for request in batch)
+            self.stats["batch_sizes"][len(batch)] = self.stats["batch_sizes"].get(len(batch), 0) + 1
+        try:
+            if len(batch) > 1:
+                for request in batch:
+                    request.merged = True
+                answers = self._merged_call(batch, api_key)
+                for index, request in enumerate(batch, 1):
+                    request.answer = answers.get(index)
+        except Exception as e:
+            print(f"⚠️ 合并调度请求失败，各会话单独调度: {str(e)}")
+        finally:
+            for request in batch:
+                request.done.set()
+
+    def _merged_call(self, batch: List[_Request], api_key: str) -> Dict[int, str]:
+        """
+        把一批调度请求合并为一次LLM调用
+
+        Returns:
+            剧本编号 -> 回答
+        """
+        sections = []
+        shares: Dict[str, float] = {}
+        for index, request in enumerate(batch, 1):
+            # 各会话共同的调度说明只在系统提示词中出现一次，分段中只保留各自的额外要求
+            extra = request.system_prompt
+            if extra.startswith(SCHEDULING_SYSTEM_PROMPT):
+                extra = extra[len(SCHEDULING_SYSTEM_PROMPT):]
+            extra = extra.strip()
+            sections.append(f"【剧本{index}】\n" + (f"要求：{extra}\n" if extra else "") + request.user_input)
+            shares[request.session] = shares.get(request.session, 0.0) + len(sections[-1])
+        system_prompt = SCHEDULING_SYSTEM_PROMPT + SCHEDULING_BATCH_PROMPT
+        user_input = "\n\n".join(sections)
+        max_tokens = sum(request.max_tokens + 4 for request in batch)  # 每行的剧本编号和分隔符约3~4个token
+
+        record_prompt_size("scheduler_batch", len(system_prompt) + len(user_input))
+        start_time = time.perf_counter()
+        with phase("llm.scheduler_batch"), attribute(shares=shares), \
+                span("http.chat_completion", call_site="scheduler_batch", key=api_key[-4:], batch=len(batch)):
+            response = create_completion(
+                "scheduling",
+                api_key,
+                messages=[
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_input}
+                ],
+                temperature=GENERATION_PROFILES["scheduling"]["temperature"],
+                max_tokens=max_tokens,
+                stream=False
+            )
+        record_completion("scheduler_batch", time.perf_counter() - start_time,
+                          response.usage.completion_tokens if response.usage else None,
+                          response.choices[0].finish_reason)
+        with self._lock:
+            self.stats["merged_calls"] += 1
+            self.stats["merged_requests"] += len(batch)
+        answers: Dict[int, str] = {}
+        for match in _ANSWER.finditer(response.choices[0].message.content or ""):
+            answers.setdefault(int(match.group(1)), match.group(2))
+        return answers
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取合批统计
+
+        Returns:
+            请求数、批数、合并调用数、单独调度的回退次数、平均批大小、平均等待时间（毫秒）、
+            节省的LLM调用数和批大小分布
+        """
+        with self._lock:
+            stats = dict(self.stats, batch_sizes=dict(self.stats["batch_sizes"]))
+        requests = stats["requests"]
+        stats["window_ms"] = self.window * 1000
+        stats["max_size"] = self.max_size
+        stats["wait_seconds"] = round(stats["wait_seconds"], 4)
+        stats["average_batch_size"] = round(requests / stats["batches"], 3) if stats["batches"] else 0.0
+        stats["average_wait_ms"] = round(stats["wait_seconds"] / requests * 1000, 3) if requests else 0.0
+        stats["saved_calls"] = stats["merged_requests"] - stats["merged_calls"] - stats["fallbacks"]
+        return stats
+
+
+_batcher: Optional[SchedulingBatcher] = SchedulingBatcher() if SCHEDULING_BATCH_ENABLED else None
+
+
+def get_scheduling_batcher() -> Optional[SchedulingBatcher]:
+    """
+    获取全局调度合批（未启用时返回None）
+    """
+    return _batcher
+
+
+def set_scheduling_batcher(batcher: Optional[SchedulingBatcher]) -> None:
+    """
+    替换全局调度合批（用于基准测试对比不同的窗口和批大小，None表示停用）
+    """
+    global _batcher
+    _batcher = batcher
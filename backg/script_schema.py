@@ -0,0 +1,360 @@
+"""
+剧本设定结构 - JSON格式剧本设定的校验、转换和字段修复提示
+"""
+
+import json
+import re
+from typing import Dict, Any, List, Optional, Tuple
+from config import USER_CHARACTER_NAME
+
+# 每个字段的要求说明，用于字段修复提示词
+FIELD_REQUIREMENTS = {
+    "scene_setting": "非空字符串，描述场景的时间、地点、环境等",
+    "characters": (
+        f'数组，每个元素为{{"name": 角色名, "personality": 性格特点, "background": 背景}}，'
+        f'第一个角色必须是"{USER_CHARACTER_NAME}"（用户扮演的主角），至少再包含一个AI角色，角色名不能重复'
+    ),
+    "plot_summary": "非空字符串，简要描述整个剧情的发展脉络",
+}
+
+# 文本格式中各段落标题对应的字段
+SECTION_FIELDS = {
+    "场景设定": "scene_setting",
+    "主要角色": "characters",
+    "剧情大纲": "plot_summary",
+}
+
+_CODE_FENCE = re.compile(r'^```(?:json)?\s*|\s*```$')
+_SECTION_HEADER = re.compile(r'【(' + '|'.join(SECTION_FIELDS) + r')】')
+
+
+def loads_setting(text: str) -> Optional[Dict[str, Any]]:
+    """
+    把模型输出解析为JSON对象（容忍```json代码块包裹）
+
+    Args:
+        text: 模型输出文本
+
+    Returns:
+        JSON对象，无法解析时返回None
+    """
+    try:
+        data = json.loads(_CODE_FENCE.sub("", text.strip()))
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def validate_field(field: str, value: Any) -> Optional[str]:
+    """
+    校验剧本设定中的单个字段
+
+    Args:
+        field: 字段名
+        value: 字段值
+
+    Returns:
+        错误描述，校验通过时返回None
+    """
+    if field in ("scene_setting", "plot_summary"):
+        if not isinstance(value, str) or not value.strip():
+            return "应为非空字符串"
+        return None
+
+    if not isinstance(value, list) or not value:
+        return "应为非空数组"
+    names = set()
+    for index, character in enumerate(value):
+        if not isinstance(character, dict):
+            return f"第{index + 1}个角色不是对象"
+        name = character.get("name")
+        if not isinstance(name, str) or not name.strip():
+            return f"第{index + 1}个角色缺少name"
+        if not isinstance(character.get("personality", ""), str) or not isinstance(character.get("background", ""), str):
+            return f"角色{name}的personality/background应为字符串"
+        if name.strip() in names:
+            return f"角色名{name}重复"
+        names.add(name.strip())
+    if not any(USER_CHARACTER_NAME in name for name in names):
+        return f'缺少用户主角"{USER_CHARACTER_NAME}"'
+    if len(names) < 2:
+        return "至少需要一个AI角色"
+    return None
+
+
+def validate_setting(data: Dict[str, Any]) -> Dict[str, str]:
+    """
+    校验剧本设定的所有字段
+
+    Args:
+        data: 剧本设定JSON对象
+
+    Returns:
+        字段名 -> 错误描述，全部通过时为空字典
+    """
+    errors = {}
+    for field in FIELD_REQUIREMENTS:
+        error = validate_field(field, data.get(field))
+        if error:
+            errors[field] = error
+    return errors
+
+
+def build_repair_context(data: Dict[str, Any], field: str) -> str:
+    """
+    构建字段修复时提供给模型的上下文（只包含其他有效字段）
+
+    Args:
+        data: 剧本设定JSON对象
+        field: 需要修复的字段
+
+    Returns:
+        JSON格式的上下文
+    """
+    context = {key: value for key, value in data.items()
+               if key in FIELD_REQUIREMENTS and key != field and validate_field(key, value) is None}
+    return json.dumps(context, ensure_ascii=False, indent=2)
+
+
+def to_parsed_setting(data: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    把JSON剧本设定转换为与文本解析一致的结构（无效字段置空）
+
+    Args:
+        data: 剧本设定JSON对象
+
+    Returns:
+        解析后的设定信息（full_setting、scene_setting、characters、plot_summary）
+    """
+    characters = []
+    if validate_field("characters", data.get("characters")) is None:
+        characters = to_character_infos(data["characters"])
+
+    # 修复失败的文本字段以空字符串处理，不影响角色创建
+    scene_setting = data["scene_setting"].strip() if validate_field("scene_setting", data.get("scene_setting")) is None else ""
+    plot_summary = data["plot_summary"].strip() if validate_field("plot_summary", data.get("plot_summary")) is None else ""
+
+    return {
+        "full_setting": render_setting_text(scene_setting, characters, plot_summary),
+        "scene_setting": scene_setting,
+        "characters": characters,
+        "plot_summary": plot_summary
+    }
+
+
+def to_character_infos(characters: List[Dict[str, str]]) -> List[Dict[str, str]]:
+    """
+    把JSON角色列表转换为角色信息列表
+
+    Args:
+        characters: JSON角色列表（name、personality、background）
+
+    Returns:
+        角色信息列表（name、info）
+    """
+    result = []
+    for character in characters:
+        info = "|".join(part.strip() for part in (character.get("personality", ""), character.get("background", ""))
+                        if part and part.strip())
+        result.append({"name": character["name"].strip(), "info": info})
+    return result
+
+
+def parse_character_lines(characters_text: str) -> List[Dict[str, str]]:
+    """
+    解析文本格式的角色列表（每行：角色名|性格特点|背景）
+
+    Args:
+        characters_text: 【主要角色】段落内容
+
+    Returns:
+        角色信息列表（name、info）
+    """
+    characters = []
+    for line in characters_text.split('\n'):
+        parts = line.strip().split('|')
+        if len(parts) >= 2:
+            characters.append({"name": parts[0].strip(), "info": '|'.join(parts[1:]).strip()})
+    return characters
+
+
+def render_setting_text(scene_setting: str, characters: list, plot_summary: str) -> str:
+    """
+    按文本格式渲染剧本设定（用于展示）
+
+    Args:
+        scene_setting: 场景设定
+        characters: 角色列表（name、info）
+        plot_summary: 剧情大纲
+
+    Returns:
+        【场景设定】【主要角色】【剧情大纲】格式的文本
+    """
+    character_lines = "\n".join(f"{c['name']}|{c['info']}" for c in characters)
+    return f"【场景设定】\n{scene_setting.strip()}\n\n【主要角色】\n{character_lines}\n\n【剧情大纲】\n{plot_summary.strip()}"
+
+
+def parse_setting_json(text: str) -> Tuple[Optional[Dict[str, Any]], Dict[str, str]]:
+    """
+    解析并校验模型输出的JSON剧本设定
+
+    Args:
+        text: 模型输出文本
+
+    Returns:
+        (JSON对象, 字段错误)，无法解析为JSON时返回(None, {})
+    """
+    data = loads_setting(text)
+    if data is None:
+        return None, {}
+    return data, validate_setting(data)
+
+
+class SettingStreamParser:
+    """
+    流式剧本设定的增量解析器
+
+    每收到一段输出就调用feed()，某个字段（场景设定、主要角色、剧情大纲）完整生成后立即返回，
+    不必等待整个剧本设定生成完毕。JSON格式在顶层字段的值结束时返回，文本格式在下一个段落标题出现时返回。
+    返回的值与to_parsed_setting()中的结构一致：场景和剧情为字符串，角色为角色信息列表。
+    """
+
+    def __init__(self, json_mode: bool):
+        """
+        初始化解析器
+
+        Args:
+            json_mode: 输出是否为JSON格式
+        """
+        self.json_mode = json_mode
+        self.text = ""
+        self.emitted = set()
+
+        # JSON扫描状态（只跟踪顶层对象的键值边界）
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._expect = "key"
+        self._key_start = None
+        self._key = None
+        self._value_start = None
+
+    def feed(self, delta: str) -> List[Tuple[str, Any]]:
+        """
+        追加一段输出
+
+        Args:
+            delta: 新生成的文本
+
+        Returns:
+            本次新完成的字段列表[(字段名, 值)]
+        """
+        self.text += delta
+        if self.json_mode:
+            return self._scan_json()
+        return self._scan_sections(final=False)
+
+    def finish(self) -> List[Tuple[str, Any]]:
+        """
+        输出结束，返回尚未返回的最后一个字段
+
+        Returns:
+            新完成的字段列表[(字段名, 值)]
+        """
+        if self.json_mode:
+            return []  # 顶层对象的最后一个字段在右花括号处已经返回
+        return self._scan_sections(final=True)
+
+    def _emit(self, field: str, value: Any) -> List[Tuple[str, Any]]:
+        if field in self.emitted:
+            return []
+        if field == "characters":
+            if self.json_mode:
+                if validate_field(field, value) is not None:
+                    return []  # 无效的角色列表留给完整解析后的字段修复处理
+                value = to_character_infos(value)
+            elif not value:
+                return []
+        elif not isinstance(value, str) or not value.strip():
+            return []
+        else:
+            value = value.strip()
+        self.emitted.add(field)
+        return [(field, value)]
+
+    def _scan_sections(self, final: bool) -> List[Tuple[str, Any]]:
+        headers = list(_SECTION_HEADER.finditer(self.text))
+        completed = []
+        for index, header in enumerate(headers):
+            if index + 1 < len(headers):
+                content = self.text[header.end():headers[index + 1].start()]
+            elif final:
+                content = self.text[header.end():]
+            else:
+                break  # 最后一个段落可能还在生成
+            field = SECTION_FIELDS[header.group(1)]
+            value = parse_character_lines(content) if field == "characters" else content
+            completed.extend(self._emit(field, value))
+        return completed
+
+    def _scan_json(self) -> List[Tuple[str, Any]]:
+        completed = []
+        text = self.text
+        while self._pos < len(text):
+            i = self._pos
+            char = text[i]
+            self._pos += 1
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key_end":
+                        try:
+                            self._key = json.loads(text[self._key_start:i + 1])
+                        except ValueError:
+                            self._key = None
+                        self._expect = "colon"
+                continue
+
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    self._expect = "key"
+                continue  # 忽略对象之前的```json等内容
+
+            if self._depth == 1:
+                if self._expect == "key" and char == '"':
+                    self._in_string = True
+                    self._key_start = i
+                    self._expect = "key_end"
+                    continue
+                if self._expect == "colon" and char == ":":
+                    self._expect = "value"
+                    self._value_start = None
+                    continue
+                if self._expect == "value" and char in ",}":
+                    if self._value_start is not None and self._key in FIELD_REQUIREMENTS:
+                        try:
+                            value = json.loads(text[self._value_start:i])
+                        except ValueError:
+                            value = None
+                        completed.extend(self._emit(self._key, value))
+                    self._expect = "key"
+                    if char == "}":
+                        self._depth = 0
+                    continue
+                if self._expect == "value" and self._value_start is None and not char.isspace():
+                    self._value_start = i
+
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                self._depth += 1
+            elif char in "}]":
+                self._depth -= 1
+        return completed
@@ -2,10 +2,30 @@
 剧本系统核心逻辑 - 整合调度agent和角色agents的交互流程
 """
 
-from typing import Optional, Dict, Any
+import contextvars
+import copy
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Dict, Any, List
 from scheduler_agent import SchedulerAgent
 from api_pool import APIKeyPool
-from config import API_KEYS, USER_CHARACTER_NAME
+from llm_client import prewarm_async, get_connection_stats, get_generation_stats
+from model_router import router
+from quota_coordinator import get_quota_stats
+from usage_tracker import usage_tracker, get_session
+from llm_cassette import get_cassette_stats, get_player
+from autoplay import AutoPlayEngine
+from session_store import SessionStore, get_session_store
+from scheduling_batcher import get_scheduling_batcher
+from turn_deadline import turn_slo
+from config import (
+    API_KEYS,
+    USER_CHARACTER_NAME,
+    CONTINUATION_MAX_BRANCHES,
+    OPENING_LINES_ENABLED,
+    SCRIPT_SETTING_STREAMING,
+)
 
 
 class ScriptSystem:
@@ -25,22 +45,105 @@ class ScriptSystem:
         self.conversation_count = 0
         self.last_speaker = None  # 记录上一个说话的角色
         
+        # 剧本创建进度（流式生成时场景和角色会先于完整设定返回，供界面轮询展示）
+        self.setup_progress: Dict[str, Any] = {"stage": "idle"}
+        self._progress_lock = threading.Lock()
+        
+        # 当前的自动播放任务（纯AI对话，无交互）
+        self.autoplay_engine: Optional[AutoPlayEngine] = None
+        
+        # 持久化的会话（绑定后每条台词增量写入会话存储）
+        self.session_id: Optional[str] = None
+        self.session_store: Optional[SessionStore] = None
+        
     def initialize_script(self, user_input: str) -> Dict[str, Any]:
         """
-        初始化剧本设定和角色
+        初始化剧本设定和角色；流式生成时主要角色一创建完毕就返回（此时已可开始对话），
+        剧情大纲在后台继续生成，完成后补充到各角色
         
         Args:
             user_input: 用户输入的场景和限制
             
         Returns:
-            初始化结果
+            初始化结果（剧情大纲仍在生成时plot_pending为True）
         """
         print("🎭 正在创建剧本设定...")
+        start_time = time.perf_counter()
+        self._update_progress(stage="setting", scene_setting="", characters=[], plot_summary="",
+                              first_playable_seconds=None)
+        
+        # 剧本设定生成期间在后台为角色即将使用的密钥建立连接
+        self.prewarm_connections()
+        
+        early_characters = []
+        playable = threading.Event()
+        outcome: Dict[str, Any] = {}
+        
+        def on_field(field: str, value: Any):
+            # 流式生成时逐字段回调：主要角色一生成完毕就创建角色并标记剧本可玩，剧情大纲继续在后台生成
+            if field == "scene_setting":
+                self.scheduler.scene_setting = value
+                self._update_progress(scene_setting=value)
+                print(f"🏞️ 场景设定已生成：{value}")
+            elif field == "characters":
+                if self.scheduler.create_characters(value):
+                    early_characters.extend(value)
+                    first_playable = self._mark_playable(start_time)
+                    self._update_progress(
+                        stage="characters_ready",
+                        characters=[c["name"] for c in value],
+                        first_playable_seconds=first_playable
+                    )
+                    print(f"🤖 已提前创建 {len(self.scheduler.character_infos)} 个AI角色，剧情大纲仍在生成...")
+                    playable.set()
+            elif field == "plot_summary":
+                self._update_progress(plot_summary=value)
+        
+        def finish():
+            try:
+                outcome.update(self._finish_script_setting(user_input, on_field, start_time, early_characters))
+            finally:
+                playable.set()
+        
+        if not SCRIPT_SETTING_STREAMING:
+            finish()
+            return outcome
+        
+        threading.Thread(target=contextvars.copy_context().run, args=(finish,), daemon=True).start()
+        playable.wait()
+        if outcome:
+            return outcome
+        with self._progress_lock:
+            first_playable = self.setup_progress["first_playable_seconds"]
+        return {
+            "success": True,
+            "characters_count": len(early_characters),
+            "characters": list(early_characters),
+            "plot_pending": True,
+            "timings": {
+                "first_playable_seconds": first_playable,
+                "total_seconds": None
+            }
+        }
+    
+    def _finish_script_setting(self, user_input: str, on_field, start_time: float,
+                               early_characters: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """
+        生成完整的剧本设定；角色已提前创建时只补充场景和剧情大纲，否则在此创建角色
         
-        # 创建剧本设定
-        script_setting = self.scheduler.create_script_setting(user_input)
+        Returns:
+            初始化结果
+        """
+        script_setting = self.scheduler.create_script_setting(user_input, on_field)
         
         if "error" in script_setting:
+            if early_characters:
+                # 角色已可对话，剧情大纲生成失败时沿用已创建的角色
+                print(f"⚠️ 剧情大纲生成失败，沿用已创建的角色: {script_setting['error']}")
+                self._update_progress(stage="done", error=script_setting["error"],
+                                      total_seconds=round(time.perf_counter() - start_time, 3))
+            else:
+                self._update_progress(stage="error", error=script_setting["error"])
             return script_setting
         
         print("📝 剧本设定创建完成！")
@@ -50,18 +153,41 @@ class ScriptSystem:
         
         # 创建角色智能体
         characters_info = script_setting.get("characters", [])
-        if not characters_info:
-            return {"error": "未能从剧本设定中提取到角色信息"}
+        if early_characters:
+            if [c["name"] for c in early_characters] != [c["name"] for c in characters_info]:
+                # 对话可能已经开始，不再重建角色
+                print("⚠️ 完整设定中的角色与提前创建的角色不一致，沿用提前创建的角色")
+            characters_info = early_characters
+            # 角色已在流式生成时创建，只需补上完整的场景和剧情大纲（尚未创建的角色创建时直接读取）
+            for character in list(self.scheduler.characters.values()):
+                if character != "user_character":
+                    character.set_scene_info(self.scheduler.scene_setting, self.scheduler.plot_summary)
+            self._save_setting()
+        else:
+            if not characters_info:
+                self._update_progress(stage="error", error="未能从剧本设定中提取到角色信息")
+                return {"error": "未能从剧本设定中提取到角色信息"}
+            print(f"🤖 正在创建 {len(characters_info)} 个角色智能体...")
+            self.scheduler.characters = {}
+            success = self.scheduler.create_characters(characters_info)
+            if not success:
+                self._update_progress(stage="error", error="角色智能体创建失败")
+                return {"error": "角色智能体创建失败"}
+            self._mark_playable(start_time)
         
-        print(f"🤖 正在创建 {len(characters_info)} 个角色智能体...")
+        total_seconds = round(time.perf_counter() - start_time, 3)
+        with self._progress_lock:
+            first_playable = self.setup_progress.get("first_playable_seconds") or total_seconds
+        self._update_progress(
+            stage="done",
+            scene_setting=self.scheduler.scene_setting,
+            characters=[c["name"] for c in characters_info],
+            plot_summary=self.scheduler.plot_summary,
+            first_playable_seconds=first_playable,
+            total_seconds=total_seconds
+        )
         
-        success = self.scheduler.create_characters(characters_info)
-        if not success:
-            return {"error": "角色智能体创建失败"}
-        
-        self.is_initialized = True
-        
-        print("✅ 角色智能体创建完成！")
+        print(f"✅ 角色智能体创建完成！（可开始对话 {first_playable:.2f}s，设定完成 {total_seconds:.2f}s）")
         print("\n🎯 创建的角色：")
         for character_info in self.scheduler.get_characters_info():
             print(f"  - {character_info['name']}: {character_info['info']}")
@@ -69,9 +195,136 @@ class ScriptSystem:
         return {
             "success": True,
             "characters_count": len(characters_info),
-            "characters": characters_info
+            "characters": characters_info,
+            "timings": {
+                "first_playable_seconds": first_playable,
+                "total_seconds": total_seconds
+            }
         }
     
+    def _mark_playable(self, start_time: float) -> float:
+        """
+        角色创建完毕后标记剧本可开始对话：预热角色连接、保存设定并按配置生成开场台词
+        
+        Returns:
+            从开始创建到可开始对话的耗时（秒）
+        """
+        self._warm_character_clients()
+        self.is_initialized = True
+        self._save_setting()
+        if OPENING_LINES_ENABLED:
+            # 在后台并发生成开场台词，第一轮AI发言不再等待生成
+            opening = self.scheduler.prepare_opening_lines()
+            print(f"🎬 正在为 {len(opening)} 个角色预先生成开场台词...")
+        return round(time.perf_counter() - start_time, 3)
+    
+    def attach_session(self, session_id: str, store: Optional[SessionStore] = None) -> bool:
+        """
+        绑定持久化会话：存储中已有该会话时直接恢复剧本和对话历史（不调用LLM），
+        否则保存当前剧本（如已初始化）；之后每条台词提交时增量写入
+        
+        Args:
+            session_id: 会话ID
+            store: 会话存储（为None时使用全局存储，未启用持久化时不绑定）
+            
+        Returns:
+            是否从存储中恢复了会话
+        """
+        store = store if store is not None else get_session_store()
+        if store is None:
+            return False
+        self.session_id = session_id
+        self.session_store = store
+        
+        restored = False
+        saved = None if self.is_initialized else store.load(session_id)
+        if saved is not None:
+            restored = self._restore(saved)
+        elif self.is_initialized:
+            # 剧情分支等已有对话历史的剧本：整体写入
+            history = self.scheduler.conversation_history
+            self._save_setting()
+            store.clear_turns(session_id)
+            store.append_turns(session_id, ((turn.speaker, turn.text, turn.timestamp)
+                                            for turn in history.tail_turns(len(history))))
+        self.scheduler.turn_listeners.append(self._persist_turn)
+        return restored
+    
+    def _restore(self, saved: Dict[str, Any]) -> bool:
+        """
+        从会话存储读取的数据恢复剧本（角色重新分配密钥，不调用LLM）
+        """
+        start_time = time.perf_counter()
+        self.scheduler.scene_setting = saved["scene_setting"]
+        self.scheduler.plot_summary = saved["plot_summary"]
+        self.scheduler.characters = {}
+        if not saved["characters"] or not self.scheduler.create_characters(saved["characters"]):
+            return False
+        # 批量写入对话历史，检索索引在第一次召回时才建立
+        self.scheduler.restore_history(saved["turns"])
+        self.last_speaker = next((speaker for speaker, _, _ in reversed(saved["turns"])
+                                  if self.scheduler.has_character(speaker)), self.last_speaker)
+        self.conversation_count = len(saved["turns"])
+        self.is_initialized = True
+        self._update_progress(
+            stage="done",
+            scene_setting=self.scheduler.scene_setting,
+            characters=self.scheduler.character_names,
+            plot_summary=self.scheduler.plot_summary
+        )
+        print(f"♻️ 会话 {self.session_id} 已恢复：{len(saved['turns'])} 条对话，"
+              f"耗时 {(time.perf_counter() - start_time) * 1000:.1f}ms")
+        return True
+    
+    def _save_setting(self) -> None:
+        if self.session_store is None:
+            return
+        characters = [{"name": c["name"], "info": c["info"]} for c in self.scheduler.get_characters_info()]
+        try:
+            self.session_store.save_setting(self.session_id, self.scheduler.scene_setting,
+                                            self.scheduler.plot_summary, characters)
+        except Exception as e:
+            print(f"⚠️ 会话 {self.session_id} 的剧本设定保存失败: {str(e)}")
+    
+    def _persist_turn(self, turn, index: int) -> None:
+        # 持久化失败不影响对话本身
+        try:
+            self.session_store.append_turn(self.session_id, index, turn.speaker, turn.text, turn.timestamp)
+        except Exception as e:
+            print(f"⚠️ 会话 {self.session_id} 的对话保存失败: {str(e)}")
+    
+    def _update_progress(self, **updates) -> None:
+        """
+        更新剧本创建进度
+        """
+        with self._progress_lock:
+            self.setup_progress.update(updates)
+    
+    def get_setup_progress(self) -> Dict[str, Any]:
+        """
+        获取剧本创建进度
+        
+        Returns:
+            进度信息（stage、scene_setting、characters、plot_summary及耗时）
+        """
+        with self._progress_lock:
+            return dict(self.setup_progress)
+    
+    def _warm_character_clients(self) -> None:
+        """
+        为AI角色分配的密钥在后台建立真实连接，首次台词请求直接复用预热好的连接（回放录制时不访问网络）
+        """
+        if get_player() is None:
+            prewarm_async(list(self.scheduler.character_keys.values()))
+    
+    def prewarm_connections(self) -> None:
+        """
+        在后台为调度agent和AI角色的密钥预热LLM连接并启动空闲保活（回放录制时不访问网络，无需预热）；
+        只预热即将并发使用的密钥，不为密钥池中的所有密钥建立连接
+        """
+        if get_player() is None:
+            prewarm_async([self.scheduler.api_key] + list(self.scheduler.character_keys.values()))
+    
     def start_conversation(self, rounds: int = 10) -> None:
         """
         开始多轮对话
@@ -109,7 +362,7 @@ class ScriptSystem:
                     
                     # 添加到历史记录
                     formatted_response = f"{USER_CHARACTER_NAME}：{user_speech}"
-                    self.scheduler.add_to_history(formatted_response)
+                    self.scheduler.add_to_history(formatted_response, USER_CHARACTER_NAME)
                     self.last_speaker = USER_CHARACTER_NAME
                     
                     self.conversation_count += 1
@@ -139,7 +392,7 @@ class ScriptSystem:
             print(f"💬 {character_response}")
             
             # 添加到历史记录
-            self.scheduler.add_to_history(character_response)
+            self.scheduler.add_to_history(character_response, next_speaker)
             self.last_speaker = next_speaker
             
             self.conversation_count += 1
@@ -148,6 +401,124 @@ class ScriptSystem:
             if round_num < rounds:
                 print()
     
+    def start_autoplay(self, rounds: int, lookahead: Optional[int] = None) -> AutoPlayEngine:
+        """
+        在后台开始纯AI对话的自动播放（调度与台词生成流水线并行，不等待用户输入）
+        
+        Args:
+            rounds: 对话轮数
+            lookahead: 最多缓冲的未消费台词数（为None时使用配置，0表示不限制）
+            
+        Returns:
+            自动播放引擎
+        """
+        self.stop_autoplay()
+        if lookahead is None:
+            engine = AutoPlayEngine(self, rounds)
+        else:
+            engine = AutoPlayEngine(self, rounds, lookahead)
+        self.autoplay_engine = engine.start()
+        return engine
+    
+    def stop_autoplay(self) -> None:
+        """
+        取消正在进行的自动播放
+        """
+        engine = self.autoplay_engine
+        if engine is not None and engine.state == "running":
+            engine.cancel()
+            engine.join()
+    
+    def fork(self, turn_index: Optional[int] = None, key_offset: int = 0) -> "ScriptSystem":
+        """
+        从第turn_index条对话处分出剧情分支，分支与原剧本共享角色设定和对话历史的公共前缀
+        
+        Args:
+            turn_index: 分支保留的对话条数（为None时保留全部）
+            key_offset: 分支中AI角色的密钥轮换偏移
+            
+        Returns:
+            分支的剧本系统（之后的对话与原剧本互不影响）
+        """
+        if not self.is_initialized:
+            raise ValueError("请先初始化剧本设定")
+        history = self.scheduler.conversation_history
+        if turn_index is None:
+            turn_index = len(history)
+        
+        forked = copy.copy(self)
+        forked.scheduler = self.scheduler.fork(turn_index, key_offset)
+        forked.conversation_count = turn_index
+        forked.last_speaker = None
+        if turn_index:
+            speaker = history.turn(turn_index - 1).speaker
+            if forked.scheduler.has_character(speaker):
+                forked.last_speaker = speaker
+        forked.setup_progress = dict(self.setup_progress)
+        forked._progress_lock = threading.Lock()
+        forked.autoplay_engine = None
+        forked.session_id = None
+        forked.session_store = None
+        return forked
+    
+    def generate_continuations(self, count: int, turn_index: Optional[int] = None) -> List[Dict[str, Any]]:
+        """
+        从第turn_index条对话处并行生成多个不同的下一句台词，每个结果都是一个独立的剧情分支
+        
+        只调度一次：第一个分支使用调度结果，其余分支依次换成其他AI角色，保证各分支互不相同。
+        各分支的提示词前缀（场景、剧情和对话历史）完全相同，分支分散到不同的API密钥上并发请求。
+        
+        Args:
+            count: 分支数量
+            turn_index: 分支保留的对话条数（为None时从当前对话末尾继续）
+            
+        Returns:
+            分支列表（branch、speaker、message和分支的剧本系统script_system）
+        """
+        count = max(1, min(count, CONTINUATION_MAX_BRANCHES))
+        base = self.fork(turn_index)
+        situation = f"这是第{len(base.scheduler.conversation_history) + 1}轮对话"
+        
+        ai_names = base.scheduler.get_present_ai_characters()
+        if not ai_names:
+            raise ValueError("没有在场的AI角色")
+        decided = base.scheduler.decide_next_ai_speaker(situation)
+        order = ([decided] if decided in ai_names else []) + [name for name in ai_names if name != decided]
+        speakers = [order[i % len(order)] for i in range(count)]
+        
+        def continue_branch(index: int) -> Dict[str, Any]:
+            branch = base.fork(key_offset=index)
+            speaker = speakers[index]
+            response = branch.scheduler.get_character_agent(speaker).generate_response(situation)
+            branch.scheduler.add_to_history(response, speaker)
+            branch.last_speaker = speaker
+            branch.conversation_count += 1
+            return {"branch": index, "speaker": speaker, "message": response, "script_system": branch}
+        
+        with ThreadPoolExecutor(max_workers=count, thread_name_prefix="continuation") as executor:
+            futures = [executor.submit(contextvars.copy_context().run, continue_branch, index)
+                       for index in range(count)]
+            return [future.result() for future in futures]
+    
+    def set_presence(self, character_name: str, present: bool) -> Optional[str]:
+        """
+        让AI角色进场或离场（之后该角色只能看到自己在场时的台词，离场期间不会被调度）
+        
+        Args:
+            character_name: AI角色名字
+            present: True为进场，False为离场
+            
+        Returns:
+            写入对话历史的旁白；在场情况没有变化时返回None
+        """
+        if not self.is_initialized:
+            raise ValueError("请先初始化剧本设定")
+        turn = self.scheduler.set_presence(character_name, present)
+        if turn is None:
+            return None
+        self.conversation_count += 1
+        return turn.format()
+    
     def _get_user_speech_or_skip(self) -> Optional[str]:
         """
         获取用户台词或跳过
@@ -231,7 +602,7 @@ class ScriptSystem:
                         
                         # 添加到历史记录
                         formatted_response = f"{USER_CHARACTER_NAME}：{user_speech}"
-                        self.scheduler.add_to_history(formatted_response)
+                        self.scheduler.add_to_history(formatted_response, USER_CHARACTER_NAME)
                         self.last_speaker = USER_CHARACTER_NAME
                         
                         self.conversation_count += 1
@@ -260,7 +631,7 @@ class ScriptSystem:
                 print(f"💬 {character_response}")
                 
                 # 添加到历史记录
-                self.scheduler.add_to_history(character_response)
+                self.scheduler.add_to_history(character_response, next_speaker)
                 self.last_speaker = next_speaker
                 
                 self.conversation_count += 1
@@ -284,7 +655,10 @@ class ScriptSystem:
         """
         清空对话历史
         """
+        self.stop_autoplay()
         self.scheduler.clear_all_history()
+        if self.session_store is not None:
+            self.session_store.clear_turns(self.session_id)
         self.conversation_count = 0
         self.last_speaker = None
         print("✅ 对话历史已清空")
@@ -299,11 +673,34 @@ class ScriptSystem:
         status = {
             "initialized": self.is_initialized,
             "conversation_count": self.conversation_count,
-            "characters_count": len(self.scheduler.characters),
+            "characters_count": len(self.scheduler.character_names),
+            "materialized_characters": max(len(self.scheduler.characters) - 1, 0),
             "api_pool_available": self.scheduler.api_pool.get_available_count(),
-            "api_pool_total": self.scheduler.api_pool.get_total_count()
+            "api_pool_total": self.scheduler.api_pool.get_total_count(),
+            "llm_connections": get_connection_stats(),
+            "generation_stats": get_generation_stats(),
+            "model_routes": router.get_stats(),
+            "api_quota": get_quota_stats(),
+            "usage": usage_tracker.snapshot(get_session()),
+            "llm_cassette": get_cassette_stats(),
+            "script_parse_stats": self.scheduler.get_parse_stats(),
+            "scheduling_stats": dict(self.scheduler.scheduling_stats),
+            "speaker_plan": self.scheduler.get_speaker_plan(),
+            "history_store": self.scheduler.conversation_history.store.get_stats(),
+            "memory_index": self.scheduler.memory.get_stats(),
+            "turn_slo": turn_slo.get_stats()
         }
         
+        batcher = get_scheduling_batcher()
+        if batcher is not None:
+            status["scheduling_batch"] = batcher.get_stats()
+        
+        if self.session_store is not None:
+            status["session_store"] = dict(self.session_store.get_stats(), session_id=self.session_id)
+        
+        if self.autoplay_engine is not None:
+            status["autoplay"] = self.autoplay_engine.get_status()
+        
         if self.is_initialized:
             status["characters"] = self.scheduler.get_characters_info()
         
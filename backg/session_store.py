@@ -0,0 +1,275 @@
+"""
+会话持久化 - 把剧本设定和对话历史增量写入SQLite（WAL模式），桥接服务重启后无需调用LLM即可恢复会话
+
+每条台词提交时追加一行；单个会话的散行达到一定数量后，把最早的一批台词压缩为一个块（快照），
+恢复时读取压缩块和剩余的散行，按会话首次被访问时才加载（不在启动时加载全部会话）。
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from config import SESSION_STORE_ENABLED, SESSION_STORE_PATH, SESSION_STORE_CHUNK_TURNS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    session_id TEXT PRIMARY KEY,
+    scene_setting TEXT NOT NULL,
+    plot_summary TEXT NOT NULL,
+    characters TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS turns (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    speaker TEXT NOT NULL,
+    text TEXT NOT NULL,
+    timestamp REAL NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS turn_chunks (
+    session_id TEXT NOT NULL,
+    first_seq INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    data BLOB NOT NULL,
+    PRIMARY KEY (session_id, first_seq)
+) WITHOUT ROWID;
+"""
+
+# 一条台词：(说话角色, 台词, 时间戳)
+TurnRow = Tuple[str, str, float]
+
+
+class SessionStore:
+    def __init__(self, path: str = SESSION_STORE_PATH, chunk_turns: int = SESSION_STORE_CHUNK_TURNS):
+        """
+        初始化会话存储
+
+        Args:
+            path: SQLite数据库文件路径
+            chunk_turns: 每个压缩块的台词条数（散行达到两倍时压缩最早的一批）
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.chunk_turns = max(1, chunk_turns)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")  # WAL模式下只在检查点时fsync，断电最多丢失最近的提交
+        self._conn.executescript(_SCHEMA)
+        self._folded: Dict[str, int] = {}  # 会话ID -> 已压缩的台词条数
+        self.stats = {"appends": 0, "compactions": 0, "loads": 0, "load_seconds": 0.0}
+
+    def _folded_count(self, session_id: str) -> int:
+        # 调用方需持有_lock
+        if session_id not in self._folded:
+            row = self._conn.execute("SELECT COALESCE(SUM(count), 0) FROM turn_chunks WHERE session_id = ?",
+                                     (session_id,)).fetchone()
+            self._folded[session_id] = row[0]
+        return self._folded[session_id]
+
+    def save_setting(self, session_id: str, scene_setting: str, plot_summary: str,
+                     characters: List[Dict[str, str]]) -> None:
+        """
+        保存（或更新）会话的剧本设定
+
+        Args:
+            session_id: 会话ID
+            scene_setting: 场景设定
+            plot_summary: 剧情大纲
+            characters: 角色信息列表（name、info）
+        """
+        now = time.time()
+        characters_json = json.dumps([{"name": c["name"], "info": c["info"]} for c in characters],
+                                     ensure_ascii=False)
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO sessions VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(session_id) DO UPDATE SET "
+                "scene_setting = excluded.scene_setting, plot_summary = excluded.plot_summary, "
+                "characters = excluded.characters, updated_at = excluded.updated_at",
+                (session_id, scene_setting, plot_summary, characters_json, now, now)
+            )
+
+    def append_turn(self, session_id: str, seq: int, speaker: str, text: str, timestamp: float) -> None:
+        """
+        追加一条台词（seq为台词在会话对话历史中的位置）
+
+        Args:
+            session_id: 会话ID
+            seq: 台词序号（从0开始）
+            speaker: 说话角色
+            text: 台词（不含名字前缀）
+            timestamp: 时间戳
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute("INSERT OR REPLACE INTO turns VALUES (?, ?, ?, ?, ?)",
+                                   (session_id, seq, speaker, text, timestamp))
+                self._touch_locked(session_id)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self.stats["appends"] += 1
+            if seq + 1 - self._folded_count(session_id) >= 2 * self.chunk_turns:
+                self._compact_locked(session_id)
+
+    def append_turns(self, session_id: str, rows: Iterable[TurnRow], start: int = 0) -> None:
+        """
+        批量追加台词（在一个事务中写入，用于保存剧情分支等已有的对话历史）
+
+        Args:
+            session_id: 会话ID
+            rows: 台词列表
+            start: 第一条台词的序号
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR REPLACE INTO turns VALUES (?, ?, ?, ?, ?)",
+                                       ((session_id, start + i, speaker, text, timestamp)
+                                        for i, (speaker, text, timestamp) in enumerate(rows)))
+                self._touch_locked(session_id)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            while self._conn.execute("SELECT COUNT(*) FROM turns WHERE session_id = ?",
+                                     (session_id,)).fetchone()[0] >= 2 * self.chunk_turns:
+                self._compact_locked(session_id)
+
+    def _touch_locked(self, session_id: str) -> None:
+        # 台词写入时更新会话的updated_at（调用方需持有_lock），list_sessions据此按最近活跃排序
+        self._conn.execute("UPDATE sessions SET updated_at = ? WHERE session_id = ?", (time.time(), session_id))
+
+    def _compact_locked(self, session_id: str) -> None:
+        """
+        把最早的chunk_turns条散行压缩为一个块（调用方需持有_lock）
+        """
+        first_seq = self._folded_count(session_id)
+        rows = self._conn.execute(
+            "SELECT seq, speaker, text, timestamp FROM turns WHERE session_id = ? AND seq >= ? AND seq < ? "
+            "ORDER BY seq", (session_id, first_seq, first_seq + self.chunk_turns)
+        ).fetchall()
+        if len(rows) < self.chunk_turns or rows[-1][0] != first_seq + len(rows) - 1:
+            return  # 序号不连续（不应出现），保留散行
+        data = zlib.compress(json.dumps([row[1:] for row in rows], ensure_ascii=False).encode("utf-8"))
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.execute("INSERT OR REPLACE INTO turn_chunks VALUES (?, ?, ?, ?)",
+                               (session_id, first_seq, len(rows), data))
+            self._conn.execute("DELETE FROM turns WHERE session_id = ? AND seq < ?",
+                               (session_id, first_seq + len(rows)))
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._folded[session_id] = first_seq + len(rows)
+        self.stats["compactions"] += 1
+
+    def clear_turns(self, session_id: str) -> None:
+        """
+        删除会话的全部台词（保留剧本设定）
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._conn.execute("DELETE FROM turns WHERE session_id = ?", (session_id,))
+            self._conn.execute("DELETE FROM turn_chunks WHERE session_id = ?", (session_id,))
+            self._conn.execute("COMMIT")
+            self._folded[session_id] = 0
+
+    def delete(self, session_id: str) -> None:
+        """
+        删除会话
+        """
+        self.clear_turns(session_id)
+        with self._lock:
+            self._conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            self._folded.pop(session_id, None)
+
+    def load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取会话
+
+        Args:
+            session_id: 会话ID
+
+        Returns:
+            scene_setting、plot_summary、characters和turns（按顺序的(说话角色, 台词, 时间戳)列表），
+            会话不存在时返回None
+        """
+        start = time.perf_counter()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT scene_setting, plot_summary, characters FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            turns: List[TurnRow] = []
+            for (data,) in self._conn.execute(
+                    "SELECT data FROM turn_chunks WHERE session_id = ? ORDER BY first_seq", (session_id,)):
+                turns.extend(tuple(turn) for turn in json.loads(zlib.decompress(data)))
+            self._folded[session_id] = len(turns)
+            turns.extend(self._conn.execute(
+                "SELECT speaker, text, timestamp FROM turns WHERE session_id = ? ORDER BY seq", (session_id,)
+            ))
+            self.stats["loads"] += 1
+            self.stats["load_seconds"] += time.perf_counter() - start
+        return {
+            "scene_setting": row[0],
+            "plot_summary": row[1],
+            "characters": json.loads(row[2]),
+            "turns": turns
+        }
+
+    def list_sessions(self) -> List[Dict[str, Any]]:
+        """
+        列出已保存的会话
+
+        Returns:
+            会话ID、创建时间和更新时间（按更新时间从新到旧）
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT session_id, created_at, updated_at FROM sessions ORDER BY updated_at DESC"
+            ).fetchall()
+        return [{"session_id": r[0], "created_at": r[1], "updated_at": r[2]} for r in rows]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取存储统计
+        """
+        with self._lock:
+            stats = dict(self.stats)
+        stats["load_seconds"] = round(stats["load_seconds"], 4)
+        stats["path"] = self.path
+        return stats
+
+
+_store: Optional[SessionStore] = None
+_store_failed = False
+_store_lock = threading.Lock()
+
+
+def get_session_store() -> Optional[SessionStore]:
+    """
+    获取全局会话存储（未启用持久化或数据库无法打开时返回None）
+    """
+    global _store, _store_failed
+    if not SESSION_STORE_ENABLED or _store_failed:
+        return None
+    with _store_lock:
+        if _store is None and not _store_failed:
+            try:
+                _store = SessionStore()
+            except (sqlite3.Error, OSError) as e:
+                print(f"⚠️ 会话存储无法打开，已停用持久化: {e}")
+                _store_failed = True
+        return _store
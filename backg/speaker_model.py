@@ -0,0 +1,214 @@
+"""
+本地调度模型 - 用记录下来的LLM调度决定训练的下一位说话者分类器（NumPy，CPU运行）
+
+每次LLM调度都记录候选角色的特征（是否被点名、距上次发言的轮数等）和LLM选中的角色，
+离线用train_speaker_model.py训练一个条件logit模型：每个候选角色的得分为特征与权重的内积，
+在候选角色间做softmax。调度时先用本地模型预测，置信度达到阈值时直接采用，否则仍调用LLM。
+"""
+
+import json
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from history import split_speaker
+from config import (
+    USER_CHARACTER_NAME,
+    SPEAKER_MODEL_ENABLED,
+    SPEAKER_MODEL_PATH,
+    SPEAKER_MODEL_CONFIDENCE,
+    SCHEDULER_DECISION_LOG_ENABLED,
+    SCHEDULER_DECISION_LOG_PATH
+)
+
+try:
+    import numpy as np
+except ImportError:  # 没有安装numpy时只记录调度决定，不使用本地模型
+    np = None
+
+# 特征集版本：特征有改动时递增，训练时只使用同一版本的记录
+FEATURE_SET = 1
+FEATURE_NAMES = [
+    "mentioned_last",  # 上一句台词提到了该角色
+    "mentioned_recent",  # 最近3句其他角色的台词提到了该角色
+    "asked_last",  # 上一句是问句且提到了该角色
+    "question_open",  # 上一句是问句且不是该角色说的
+    "is_last_speaker",  # 该角色刚说完
+    "is_second_last_speaker",  # 该角色说了倒数第二句（一问一答的对话节奏）
+    "turn_gap",  # 距该角色上次发言的台词条数/10（最近10条中没有发言为1）
+    "recent_share",  # 该角色在最近10条中的发言比例
+    "is_user",  # 用户主角
+]
+
+
+def extract_features(candidates: Sequence[str], history: Sequence[str]) -> List[List[float]]:
+    """
+    提取每个候选角色的特征
+
+    Args:
+        candidates: 候选角色
+        history: 最近的对话历史（"名字：台词"格式，按时间顺序）
+
+    Returns:
+        每个候选角色一行特征（顺序与FEATURE_NAMES一致）
+    """
+    turns = [split_speaker(line) for line in history[-10:]]
+    last_speaker, last_text = turns[-1] if turns else ("", "")
+    second_last_speaker = turns[-2][0] if len(turns) > 1 else ""
+    last_is_question = "？" in last_text or "?" in last_text
+    window = len(turns) or 1
+
+    rows = []
+    for name in candidates:
+        gap = 10
+        spoken = 0
+        for distance, (speaker, _) in enumerate(reversed(turns)):
+            if speaker == name:
+                spoken += 1
+                gap = min(gap, distance)
+        mentioned_last = last_speaker != name and name in last_text
+        mentioned_recent = any(name in text for speaker, text in turns[-3:] if speaker != name)
+        rows.append([
+            float(mentioned_last),
+            float(mentioned_recent),
+            float(mentioned_last and last_is_question),
+            float(last_is_question and last_speaker != name),
+            float(last_speaker == name),
+            float(second_last_speaker == name and last_speaker != name),
+            gap / 10,
+            spoken / window,
+            float(name == USER_CHARACTER_NAME),
+        ])
+    return rows
+
+
+class SpeakerModel:
+    def __init__(self, weights: Sequence[float]):
+        """
+        初始化本地调度模型
+
+        Args:
+            weights: 与FEATURE_NAMES一一对应的权重
+        """
+        self.weights = np.asarray(weights, dtype=np.float64)
+
+    def predict(self, features: List[List[float]]) -> Tuple[int, float]:
+        """
+        预测下一位说话者
+
+        Args:
+            features: 每个候选角色的特征
+
+        Returns:
+            (候选角色下标, 置信度)
+        """
+        scores = np.asarray(features, dtype=np.float64) @ self.weights
+        scores -= scores.max()
+        probabilities = np.exp(scores)
+        probabilities /= probabilities.sum()
+        index = int(probabilities.argmax())
+        return index, float(probabilities[index])
+
+    def save(self, path: str, metadata: Optional[Dict[str, Any]] = None) -> None:
+        """
+        保存模型（JSON格式，便于查看各特征的权重）
+
+        Args:
+            path: 模型文件路径
+            metadata: 附带保存的训练信息
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({
+                "feature_set": FEATURE_SET,
+                "features": FEATURE_NAMES,
+                "weights": [round(float(w), 6) for w in self.weights],
+                **(metadata or {})
+            }, f, ensure_ascii=False, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["SpeakerModel"]:
+        """
+        读取模型（文件不存在、特征集版本不一致或没有安装numpy时返回None）
+
+        Args:
+            path: 模型文件路径
+
+        Returns:
+            本地调度模型
+        """
+        if np is None or not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 本地调度模型读取失败: {str(e)}")
+            return None
+        if data.get("feature_set") != FEATURE_SET or data.get("features") != FEATURE_NAMES:
+            print("⚠️ 本地调度模型的特征与当前代码不一致，请重新训练")
+            return None
+        return cls(data["weights"])
+
+
+class DecisionLog:
+    def __init__(self, log_path: str = SCHEDULER_DECISION_LOG_PATH):
+        """
+        初始化调度决定日志（JSONL，每行一次LLM调度）
+
+        Args:
+            log_path: 日志文件路径
+        """
+        self.log_path = log_path
+        self._lock = threading.Lock()
+
+    def record(self, candidates: Sequence[str], features: List[List[float]], chosen: str) -> None:
+        """
+        记录一次LLM调度决定
+
+        Args:
+            candidates: 候选角色
+            features: 每个候选角色的特征
+            chosen: LLM选中的角色
+        """
+        entry = {
+            "time": round(time.time(), 3),
+            "feature_set": FEATURE_SET,
+            "candidates": list(candidates),
+            "features": features,
+            "chosen": candidates.index(chosen)
+        }
+        with self._lock:
+            try:
+                directory = os.path.dirname(self.log_path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.log_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            except OSError as e:
+                print(f"❌ 调度决定日志写入失败: {str(e)}")
+
+
+_model: Optional[SpeakerModel] = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+decision_log = DecisionLog() if SCHEDULER_DECISION_LOG_ENABLED else None
+
+
+def get_speaker_model() -> Optional[SpeakerModel]:
+    """
+    获取本地调度模型（首次调用时读取，未启用或没有训练好的模型时返回None）
+    """
+    global _model, _model_loaded
+    if not SPEAKER_MODEL_ENABLED:
+        return None
+    with _model_lock:
+        if not _model_loaded:
+            _model = SpeakerModel.load(SPEAKER_MODEL_PATH)
+            _model_loaded = True
+            if _model is not None:
+                print(f"🧠 已加载本地调度模型（置信度阈值 {SPEAKER_MODEL_CONFIDENCE}）")
+        return _model
@@ -0,0 +1,102 @@
+"""
+autoplay.py的单元测试：按轮次顺序提交、用带说话者前缀的未完成台词提前调度、依据改变时丢弃、取消
+"""
+
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from autoplay import AutoPlayEngine
+from scheduler_agent import SchedulerAgent
+
+CHARACTERS = [
+    {"name": "我", "info": "用户扮演的主角"},
+    {"name": "小明", "info": "开朗健谈"},
+    {"name": "小红", "info": "沉默寡言"},
+    {"name": "老王", "info": "管家"}
+]
+
+
+@pytest.fixture
+def system(monkeypatch):
+    scheduler = SchedulerAgent("sk-test")
+    assert scheduler.create_characters(CHARACTERS)
+    decisions = []
+
+    def decide(candidates, history, current_situation, plan_turns=1, pending=None):
+        # 优先选上一句点名的角色，否则选第一个候选角色
+        decisions.append({"candidates": candidates, "last_line": history[-1] if history else "", "pending": pending})
+        addressed = [name for name in scheduler.addressed_names(history[-1]) if name in candidates] if history else []
+        return (addressed or candidates)[0]
+
+    monkeypatch.setattr(scheduler, "_decide_speaker", decide)
+    return SimpleNamespace(scheduler=scheduler, last_speaker=None, conversation_count=0, decisions=decisions)
+
+
+def script_lines(monkeypatch, system, lines):
+    """让每个角色按顺序说出lines中的台词（不带说话者前缀，逐字流式输出）"""
+    remaining = list(lines)
+
+    for name in ("小明", "小红", "老王"):
+        def generate_response(current_situation="", on_delta=None):
+            text = remaining.pop(0)
+            for end in range(1, len(text) + 1):
+                if on_delta(text[:end]) is False:
+                    return ""
+            return text
+        monkeypatch.setattr(system.scheduler.get_character_agent(name), "generate_response", generate_response)
+
+
+def test_turns_commit_in_order_and_speculation_excludes_pending_speaker(system, monkeypatch):
+    script_lines(monkeypatch, system, ["今天天气真不错，我们出去走走吧"] * 3)
+    engine = AutoPlayEngine(system, rounds=3, lookahead=0, speculate_chars=4).start()
+    assert engine.join(5)
+
+    assert engine.state == "done"
+    assert [(turn["round"], turn["speaker"]) for turn in engine.turns] == [(1, "小明"), (2, "小红"), (3, "小明")]
+    assert system.scheduler.conversation_history.copy()[0] == "小明：今天天气真不错，我们出去走走吧"
+    speculative = [decision for decision in system.decisions if decision["pending"]]
+    assert [decision["last_line"] for decision in speculative] == ["小明：今天天气", "小红：今天天气"]
+    assert all(decision["pending"] not in decision["candidates"] for decision in speculative)
+    assert engine.get_status()["stats"]["speculative_schedules"] == 2
+
+
+def test_speculation_is_discarded_when_final_line_addresses_someone_else(system, monkeypatch):
+    script_lines(monkeypatch, system, ["我觉得这件事情应该好好商量一下，老王你怎么看", "交给我吧"])
+    engine = AutoPlayEngine(system, rounds=2, lookahead=0, speculate_chars=4).start()
+    assert engine.join(5)
+
+    # 提前调度时台词还没有点名（猜的是小红，可能来不及执行就被取消）；完整台词点名了老王，按完整台词重新调度
+    assert all(decision["last_line"] == "小明：我觉得这件" for decision in system.decisions if decision["pending"])
+    assert [turn["speaker"] for turn in engine.turns] == ["小明", "老王"]
+    stats = engine.get_status()["stats"]
+    assert (stats["speculative_schedules"], stats["speculation_discards"]) == (0, 1)
+
+
+def test_cancel_discards_the_line_being_generated(system, monkeypatch):
+    generating = threading.Event()
+    resume = threading.Event()
+    rounds = []
+
+    def generate_response(current_situation="", on_delta=None):
+        rounds.append(current_situation)
+        if len(rounds) == 1:
+            return "大家好"
+        on_delta("正在说")
+        generating.set()
+        resume.wait(5)
+        return "" if on_delta("正在说的话") is False else "正在说的话"
+
+    for name in ("小明", "小红", "老王"):
+        monkeypatch.setattr(system.scheduler.get_character_agent(name), "generate_response", generate_response)
+
+    engine = AutoPlayEngine(system, rounds=5, lookahead=0, speculate_chars=0).start()
+    assert generating.wait(5)
+    engine.cancel()
+    resume.set()
+    assert engine.join(5)
+
+    assert engine.state == "cancelled"
+    assert [turn["message"] for turn in engine.turns] == ["大家好"]
+    assert len(system.scheduler.conversation_history) == 1
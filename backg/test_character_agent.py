@@ -0,0 +1,100 @@
+"""
+character_agent.py的单元测试：停止序列、按调用点的生成参数和预先生成的开场台词
+"""
+
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import character_agent
+import llm_client
+from character_agent import CharacterAgent
+from config import GENERATION_PROFILES
+
+
+def make_agent(name="小明"):
+    agent = CharacterAgent(name, "开朗健谈", "sk-test")
+    agent.set_scene_info("深夜的侦探事务所", "一桩失窃案")
+    return agent
+
+
+def test_stop_sequences_put_the_user_first_and_skip_self():
+    agent = make_agent()
+    agent.set_other_characters(["小红", "小明", "我", "老王"])
+    assert agent.get_stop_sequences() == ["\n我：", "\n小红：", "\n老王："]
+
+
+def test_stop_sequences_are_capped(monkeypatch):
+    monkeypatch.setattr(character_agent, "MAX_STOP_SEQUENCES", 2)
+    agent = make_agent()
+    agent.set_other_characters(["小红", "老王", "我"])
+    assert agent.get_stop_sequences() == ["\n我：", "\n小红："]
+
+    monkeypatch.setattr(character_agent, "CHARACTER_STOP_SEQUENCES_ENABLED", False)
+    assert agent.get_stop_sequences() is None
+
+
+def test_reply_stops_before_other_characters(fake_llm):
+    agent = make_agent()
+    agent.set_other_characters(["我", "小明", "小红"])
+    before = llm_client.get_generation_stats().get("character", {}).get("calls", 0)
+    reply = agent.generate_response("大家刚刚到齐")
+    # 模拟服务会接着替"我"继续写，停止序列只保留小明自己的一句
+    assert reply.startswith("小明：") and "\n" not in reply
+    assert llm_client.get_generation_stats()["character"]["calls"] == before + 1
+
+
+def test_character_replies_are_capped_by_the_profile(fake_llm, monkeypatch):
+    monkeypatch.setitem(GENERATION_PROFILES, "character", dict(GENERATION_PROFILES["character"], max_tokens=5))
+    monkeypatch.setattr(character_agent, "CHARACTER_STOP_SEQUENCES_ENABLED", False)
+    before = llm_client.get_generation_stats().get("character", {}).get("truncated", 0)
+    assert make_agent().generate_response() == "小明：（看"
+    assert llm_client.get_generation_stats()["character"]["truncated"] == before + 1
+
+
+def test_generation_stats_average_per_call_site():
+    llm_client.record_completion("test_site", 0.1, 10, "stop")
+    llm_client.record_completion("test_site", 0.3, None, "length")
+    stats = llm_client.get_generation_stats()["test_site"]
+    assert stats == {"calls": 2, "avg_latency_ms": 200.0, "avg_completion_tokens": 10.0, "truncated": 1}
+
+
+def character_calls():
+    return llm_client.get_generation_stats().get("character", {}).get("calls", 0)
+
+
+def test_opening_line_is_used_once(fake_llm):
+    agent = make_agent()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        agent.prepare_opening_line(executor, "剧情刚刚开始")
+        opening = agent.opening_line.result(5)
+    before = character_calls()
+    assert agent.generate_response() == opening
+    assert character_calls() == before
+    agent.generate_response()
+    assert character_calls() == before + 1
+
+
+def test_opening_line_is_dropped_after_a_new_line(fake_llm):
+    agent = make_agent()
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        agent.prepare_opening_line(executor, "剧情刚刚开始")
+        agent.opening_line.result(5)
+    # 用户在开场台词生成后先说了话，开场台词没有考虑这句话
+    agent.conversation_history.append("我：有人在吗？", "我")
+    before = character_calls()
+    assert agent.generate_response("用户刚刚说：有人在吗？").startswith("小明：")
+    assert character_calls() == before + 1
+    assert agent.opening_line is None
+
+
+def test_waiting_for_the_opening_line_is_bounded_without_a_budget(fake_llm, monkeypatch):
+    class StalledExecutor:
+        def submit(self, fn, *args):
+            return Future()
+
+    monkeypatch.setattr(character_agent, "OPENING_LINE_WAIT_SECONDS", 0.2)
+    agent = make_agent()
+    agent.prepare_opening_line(StalledExecutor(), "剧情刚刚开始")
+    start = time.perf_counter()
+    assert agent.generate_response().startswith("小明：")
+    assert 0.2 <= time.perf_counter() - start < 5
@@ -0,0 +1,152 @@
+"""
+electron_bridge.py的单元测试：启动就绪信号、Bridge进程的握手、按需创建会话和单轮时间预算的降级
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+import requests
+
+import llm_client
+import scheduler_agent
+import script_system
+import session_store
+import turn_deadline
+from config import TURN_TIMEOUT_RESPONSE
+from electron_bridge import bind_and_announce
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def test_bind_and_announce_listens_before_serving(monkeypatch, tmp_path, capsys):
+    ready_file = tmp_path / "ready.txt"
+    monkeypatch.setenv("BRIDGE_READY_FILE", str(ready_file))
+    listen_socket = bind_and_announce(0)
+    try:
+        port = listen_socket.getsockname()[1]
+        assert capsys.readouterr().out == f"BRIDGE_READY port={port}\n"
+        assert ready_file.read_text(encoding="utf-8") == str(port)
+        # 还没有开始处理请求，但连接已经可以进入监听队列
+        socket.create_connection(("127.0.0.1", port), timeout=1).close()
+    finally:
+        listen_socket.close()
+
+
+def test_bridge_process_handshake(tmp_path):
+    env = dict(os.environ, FLASK_PORT="0", PYTHONIOENCODING="utf-8", PYTHONUNBUFFERED="1")
+    process = subprocess.Popen([sys.executable, os.path.join(BACKEND_DIR, "electron_bridge.py")], cwd=str(tmp_path),
+                               env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+    try:
+        for line in process.stdout:
+            if line.startswith("BRIDGE_READY"):
+                port = int(line.strip().split("port=")[1])
+                break
+        else:
+            raise AssertionError("Bridge没有输出就绪信号")
+        response = requests.get(f"http://127.0.0.1:{port}/api/status", timeout=30)
+        assert response.status_code == 200
+        assert response.json()["port"] == port
+    finally:
+        process.kill()
+        process.wait()
+
+
+def test_clients_are_cached_per_key():
+    client = llm_client.get_client("sk-test-a")
+    assert llm_client.get_client("sk-test-a") is client
+    assert llm_client.get_client("sk-test-b") is not client
+
+
+def test_session_is_created_once_outside_the_sessions_lock(monkeypatch):
+    from electron_bridge import ElectronBridge
+
+    release = threading.Event()
+    attached = []
+
+    class SlowScriptSystem:
+        def attach_session(self, session_id, store=None):
+            attached.append(session_id)
+            if session_id == "slow":
+                release.wait(5)
+            return False
+
+        def prewarm_connections(self):
+            pass
+
+    monkeypatch.setattr(script_system, "ScriptSystem", SlowScriptSystem)
+    bridge = ElectronBridge(port=0)
+
+    def get(session_id):
+        with bridge.app.test_request_context(headers={"X-Session-Id": session_id}):
+            return bridge.get_script_system()
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(get("slow"))) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    time.sleep(0.1)
+    # 慢会话创建期间，其他会话的请求不被阻塞
+    start = time.perf_counter()
+    assert get("fast") is not None
+    assert time.perf_counter() - start < 1
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert len(results) == 2 and results[0] is results[1]
+    assert bridge.sessions["slow"] is results[0]
+    assert attached.count("slow") == 1
+
+
+@pytest.fixture
+def send_message(fake_llm, monkeypatch):
+    """创建好剧本的会话，返回向其发送一条消息的函数"""
+    from electron_bridge import ElectronBridge
+
+    monkeypatch.setattr(session_store, "SESSION_STORE_ENABLED", False)
+    monkeypatch.setattr(script_system, "SCRIPT_SETTING_STREAMING", False)
+    monkeypatch.setattr(scheduler_agent, "SCRIPT_SETTING_STREAMING", False)
+    monkeypatch.setattr(script_system, "OPENING_LINES_ENABLED", False)
+    bridge = ElectronBridge(port=0)
+    client = bridge.app.test_client()
+    headers = {"X-Session-Id": "turn-deadline"}
+    with bridge.app.test_request_context(headers=headers):
+        bridge.get_script_system().initialize_script("深夜的图书馆")
+
+    def send(message):
+        response = client.post("/api/send-message", json={"message": message}, headers=headers)
+        assert response.status_code == 200, response.get_json()
+        return response.get_json()
+
+    return send
+
+
+def test_turns_are_unbounded_by_default(send_message, fake_llm):
+    assert turn_deadline.TURN_DEADLINE_SECONDS == 0
+    data = send_message("大家好")
+    assert data["success"] and "truncated" not in data
+
+
+def test_generation_is_truncated_near_the_deadline(send_message, fake_llm, monkeypatch):
+    monkeypatch.setattr(turn_deadline, "TURN_DEADLINE_SECONDS", 1.0)
+    fake_llm.per_token_latency = 0.05
+    data = send_message("大家好")
+    assert (data["truncated"], data["scheduler_fallback"]) == (True, False)
+    # 提交已生成的部分，而不是等到完整台词生成完毕
+    assert data["response"].startswith(f"{data['speaker']}：") and len(data["response"]) < 40
+    assert data["elapsed"] < 1.0
+
+
+def test_slow_scheduling_falls_back_and_empty_generation_times_out(send_message, fake_llm, monkeypatch):
+    monkeypatch.setattr(turn_deadline, "TURN_DEADLINE_SECONDS", 1.0)
+    monkeypatch.setattr(scheduler_agent, "TURN_SCHEDULING_BUDGET", 0.2)
+    fake_llm.latency = 1.5
+    data = send_message("大家好")
+    assert (data["scheduler_fallback"], data["truncated"]) == (True, True)
+    assert data["speaker"] != "我"
+    assert data["response"] == f"{data['speaker']}：{TURN_TIMEOUT_RESPONSE}"
+    assert data["elapsed"] < 1.5
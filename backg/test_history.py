@@ -0,0 +1,101 @@
+"""
+history.py的单元测试：台词存储、历史分支和按序号追加
+"""
+
+import pytest
+
+from history import ConversationHistory, TurnStore, estimate_tokens, split_speaker
+
+
+def test_split_speaker():
+    assert split_speaker("小明：你好：再见") == ("小明", "你好：再见")
+    assert split_speaker("没有名字前缀") == ("", "没有名字前缀")
+    assert split_speaker("：以冒号开头") == ("", "：以冒号开头")
+    assert split_speaker("很长" * 11 + "：台词") == ("", "很长" * 11 + "：台词")
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens("a") == 1
+    assert estimate_tokens("你好你好你") == 3
+
+
+def test_store_round_trip_and_speaker_interning():
+    store = TurnStore(spill_bytes=0)
+    first = store.add("你好", "小明", timestamp=1.0)
+    second = store.add("旁白的描述")
+    third = store.add("再见", "小明")
+    assert (first.seq, second.seq, third.seq) == (0, 1, 2)
+    assert store.format(0) == "小明：你好"
+    assert store.format(1) == "旁白的描述"
+    assert store.speaker(2) == "小明"
+    assert first.speaker_id == third.speaker_id
+    assert store.turn(0).timestamp == 1.0
+    assert store.get_stats()["speakers"] == 1
+
+
+def test_store_spills_to_file_and_reads_back():
+    store = TurnStore(spill_bytes=64)
+    texts = [f"第{i}句台词，内容稍微长一点" for i in range(50)]
+    for text in texts:
+        store.add(text, "小红")
+    assert store.get_stats()["spilled_bytes"] > 0
+    # 较早的台词不在最近台词的缓存中，需要从临时文件读取
+    assert [store.text(seq) for seq in range(len(texts))] == texts
+    assert store.format(0) == "小红：" + texts[0]
+
+
+def test_append_parses_or_uses_given_speaker():
+    history = ConversationHistory(TurnStore(spill_bytes=0))
+    assert history.append("小明：你好").speaker == "小明"
+    assert history.append("小红：早上好", "小红").text == "早上好"
+    assert history.append("没有前缀的台词", "老王").text == "没有前缀的台词"
+    assert history.copy() == ["小明：你好", "小红：早上好", "老王：没有前缀的台词"]
+    assert history[-1] == "老王：没有前缀的台词"
+    assert history[0:2] == ["小明：你好", "小红：早上好"]
+    assert history.tail(2) == ["小红：早上好", "老王：没有前缀的台词"]
+
+
+def test_fork_shares_prefix_and_branches_are_isolated():
+    history = ConversationHistory(TurnStore(spill_bytes=0), [f"小明：第{i}句" for i in range(5)])
+    branch = history.fork(3)
+    history.append("小明：主线")
+    branch.append("小红：分支")
+    assert len(history.store) == 7
+    assert history.copy()[-2:] == ["小明：第4句", "小明：主线"]
+    assert branch.copy() == ["小明：第0句", "小明：第1句", "小明：第2句", "小红：分支"]
+
+    nested = branch.fork()
+    nested.append("老王：嵌套分支")
+    assert branch.tail(1) == ["小红：分支"]
+    assert nested.tail(2) == ["小红：分支", "老王：嵌套分支"]
+    assert history.fork(0).copy() == []
+
+
+def test_fork_rejects_out_of_range_length():
+    history = ConversationHistory(TurnStore(spill_bytes=0), ["小明：你好"])
+    for length in (-1, 2):
+        with pytest.raises(IndexError):
+            history.fork(length)
+
+
+
+def test_count_through():
+    store = TurnStore(spill_bytes=0)
+    history = ConversationHistory(store)
+    other = ConversationHistory(store)
+    for i in range(4):
+        history.append(f"小明：第{i}句")
+        other.append(f"小红：第{i}句")
+    # history中的台词序号为0、2、4、6
+    assert history.count_through(-1) == 0
+    assert history.count_through(3) == 2
+    assert history.count_through(6) == 4
+
+
+def test_extend_from_copies_sequence_numbers_with_skip():
+    source = ConversationHistory(TurnStore(spill_bytes=0), [f"小明：第{i}句" for i in range(6)])
+    target = ConversationHistory(source.store)
+    target.extend_from(source, 1, 5, skip={2, 4})
+    assert target.copy() == ["小明：第1句", "小明：第3句"]
+    assert len(source.store) == 6  # 只复制序号，不重复保存台词
@@ -0,0 +1,75 @@
+"""
+llm_cassette.py的单元测试：提示词哈希、经过模型路由的录制与回放、哈希不匹配时的回放策略
+"""
+
+import pytest
+
+import llm_cassette
+from llm_cassette import CassetteMiss, CassettePlayer, load_cassette, request_hash
+from model_router import create_completion
+
+MESSAGES = [{"role": "system", "content": "你现在扮演角色：小明"}, {"role": "user", "content": "继续"}]
+
+
+@pytest.fixture
+def cassette(tmp_path):
+    yield str(tmp_path / "cassettes" / "session.jsonl.gz")
+    llm_cassette.configure("off")
+
+
+def record_session(path):
+    llm_cassette.configure("record", path)
+    reply = create_completion("character", messages=MESSAGES, max_tokens=50).choices[0].message.content
+    stream = create_completion("setting", messages=[{"role": "user", "content": "创建剧本"}], max_tokens=50,
+                               stream=True, stream_options={"include_usage": True})
+    streamed = "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices)
+    return reply, streamed
+
+
+def test_request_hash_ignores_whitespace_and_model():
+    request = {"messages": MESSAGES, "max_tokens": 50, "model": "a"}
+    spaced = [{"role": "system", "content": "你现在扮演角色：小明\n\n"}, {"role": "user", "content": " 继续"}]
+    assert request_hash("character", request) == request_hash("character", {"messages": spaced, "max_tokens": 50})
+    assert request_hash("character", request) != request_hash("setting", request)
+    assert request_hash("character", request) != request_hash("character", dict(request, max_tokens=60))
+
+
+def test_record_then_replay_without_network(fake_llm, cassette):
+    reply, streamed = record_session(cassette)
+    entries = load_cassette(cassette)
+    assert [entry["call_site"] for entry in entries] == ["character", "setting"]
+    assert "extra_headers" not in entries[0]["request"] and entries[1]["chunks"]
+
+    llm_cassette.configure("replay", cassette)
+    fake_llm.error_rate = 1.0  # 回放时访问网络会收到429
+    requests_before = fake_llm.total_requests
+    assert create_completion("character", messages=MESSAGES, max_tokens=50).choices[0].message.content == reply
+    stream = create_completion("setting", messages=[{"role": "user", "content": "创建剧本"}], max_tokens=50,
+                               stream=True, stream_options={"include_usage": True})
+    assert "".join(chunk.choices[0].delta.content or "" for chunk in stream if chunk.choices) == streamed
+    assert fake_llm.total_requests == requests_before
+    assert llm_cassette.get_cassette_stats()["hits"] == 2
+
+
+def test_replay_converts_between_stream_and_non_stream(fake_llm, cassette):
+    reply, streamed = record_session(cassette)
+    player = CassettePlayer(cassette, speed="fast")
+    stream = player.play("character", {"messages": MESSAGES, "max_tokens": 50, "stream": True})
+    assert "".join(chunk.choices[0].delta.content for chunk in stream) == reply
+    joined = player.play("setting", {"messages": [{"role": "user", "content": "创建剧本"}], "max_tokens": 50})
+    assert joined.choices[0].message.content == streamed
+
+
+def test_changed_prompt_falls_back_to_call_site_order(fake_llm, cassette):
+    reply, _ = record_session(cassette)
+    changed = {"messages": [{"role": "user", "content": "改过的提示词"}], "max_tokens": 50}
+
+    player = CassettePlayer(cassette, speed="fast", on_miss="sequence")
+    assert player.play("character", changed).choices[0].message.content == reply
+    assert player.stats == {"hits": 0, "sequence_fallbacks": 1, "misses": 0}
+    # 每条记录只回放一次
+    with pytest.raises(CassetteMiss):
+        player.play("character", changed)
+
+    with pytest.raises(CassetteMiss):
+        CassettePlayer(cassette, speed="fast", on_miss="error").play("character", changed)
@@ -0,0 +1,84 @@
+"""
+memory_index.py的单元测试：切词、BM25检索和索引分支
+"""
+
+import pytest
+
+from memory_index import MemoryIndex, tokenize
+
+
+def build(texts):
+    index = MemoryIndex()
+    for seq, text in enumerate(texts):
+        index.add(text, seq)
+    return index
+
+
+def test_tokenize_bigrams_and_words():
+    assert list(tokenize("失窃案")) == ["失窃", "窃案"]
+    assert list(tokenize("我")) == ["我"]
+    assert list(tokenize("Room 302号")) == ["room", "302", "号"]
+
+
+def test_search_ranks_matching_turns_first():
+    index = build(["今天的天气很好", "保险箱里的项链不见了", "我们去吃晚饭吧", "项链是昨晚被偷的"])
+    results = index.search("项链被偷", 2)
+    assert [doc for doc, _, _ in results] == [3, 1]
+    assert results[0][2] > results[1][2] > 0
+
+
+def test_search_respects_before_exclude_and_limit():
+    index = build(["项链不见了", "项链在哪里", "找到项链了"])
+    assert {doc for doc, _, _ in index.search("项链", 5, before=2)} == {0, 1}
+    assert {doc for doc, _, _ in index.search("项链", 5, exclude={1})} == {0, 2}
+    assert len(index.search("项链", 1)) == 1
+    assert index.search("项链", 0) == []
+    assert index.search("完全无关", 5) == []
+
+
+def test_search_returns_store_sequence_numbers():
+    index = MemoryIndex()
+    index.add("无关的台词", 10)
+    index.add("保险箱被打开了", 42)
+    assert [(doc, seq) for doc, seq, _ in index.search("保险箱", 5)] == [(1, 42)]
+
+
+def test_fork_shares_prefix_and_branches_are_isolated():
+    index = build(["项链不见了", "大家冷静", "我看到有人进了书房"])
+    branch = index.fork(2)
+    index.add("书房的窗户开着", 3)
+    branch.add("书房里有脚印", 4)
+    assert len(index) == 4 and len(branch) == 3
+    assert {seq for _, seq, _ in index.search("书房", 5)} == {2, 3}
+    assert {seq for _, seq, _ in branch.search("书房", 5)} == {4}
+    assert {seq for _, seq, _ in branch.search("项链", 5)} == {0}
+    assert branch.get_stats()["branch_depth"] == 2
+
+
+def test_fork_rejects_out_of_range_length():
+    index = build(["项链不见了"])
+    with pytest.raises(IndexError):
+        index.fork(2)
+
+
+def test_count_through():
+    index = MemoryIndex()
+    for seq in (0, 3, 5, 9):
+        index.add("台词", seq)
+    branch = index.fork(3)
+    branch.add("台词", 12)
+    assert index.count_through(4) == 2
+    assert index.count_through(9) == 4
+    assert branch.count_through(9) == 3
+    assert branch.count_through(12) == 4
+    assert MemoryIndex().count_through(5) == 0
+
+
+def test_deferred_turns_are_indexed_on_first_use():
+    texts = ["今天的天气很好", "保险箱里的项链不见了", "我们去吃晚饭吧", "项链是昨晚被偷的"]
+    index = MemoryIndex()
+    index.add_deferred((text, seq) for seq, text in enumerate(texts))
+    assert index.get_stats() == {"turns": 4, "terms": 0, "branch_depth": 1, "deferred": 4}
+    assert index.search("项链被偷", 2) == build(texts).search("项链被偷", 2)
+    assert index.get_stats()["deferred"] == 0
+    assert index.add("项链找到了", 4) == 4
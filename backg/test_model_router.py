@@ -0,0 +1,93 @@
+"""
+model_router.py的单元测试：流式响应释放并发名额、端点饱和时排队、回退次数统计
+"""
+
+import gc
+import socket
+import threading
+import time
+
+import pytest
+
+import model_router
+from model_router import ModelRouter
+
+MESSAGES = [{"role": "system", "content": "你现在扮演角色：小明"}, {"role": "user", "content": "继续"}]
+
+
+def make_router(*base_urls, max_concurrency=0):
+    endpoints = {f"e{i}": {"model": "deepseek-chat", "base_url": base_url, "key_pool": "default",
+                           "max_concurrency": max_concurrency} for i, base_url in enumerate(base_urls)}
+    return ModelRouter(endpoints, {"character": list(endpoints)})
+
+
+def closed_port_url():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def open_stream(router):
+    return router.create_completion("character", messages=MESSAGES, max_tokens=50, stream=True)
+
+
+def test_stream_releases_slot_when_closed_or_abandoned(fake_llm):
+    router = make_router(model_router.router.endpoints["deepseek-chat"].base_url)
+    endpoint = router.endpoints["e0"]
+
+    stream = open_stream(router)
+    next(stream)
+    assert endpoint.in_flight == 1
+    stream.close()
+    stream.close()
+    assert (endpoint.in_flight, endpoint.stats["calls"]) == (0, 1)
+
+    # 从未开始读取的流被回收时也要释放名额
+    stream = open_stream(router)
+    assert endpoint.in_flight == 1
+    del stream
+    gc.collect()
+    assert endpoint.in_flight == 0
+
+    assert "".join(chunk.choices[0].delta.content or "" for chunk in open_stream(router) if chunk.choices)
+    assert (endpoint.in_flight, endpoint.stats["calls"]) == (0, 3)
+
+
+def test_saturated_endpoint_queues_until_slot_is_freed(fake_llm):
+    router = make_router(model_router.router.endpoints["deepseek-chat"].base_url, max_concurrency=1)
+    endpoint = router.endpoints["e0"]
+    first = open_stream(router)
+    replies = []
+    waiter = threading.Thread(target=lambda: replies.append(
+        router.create_completion("character", messages=MESSAGES, max_tokens=50)))
+    waiter.start()
+    time.sleep(0.3)
+    assert replies == [] and endpoint.in_flight == 1
+
+    first.close()
+    waiter.join(5)
+    assert len(replies) == 1
+    assert (endpoint.in_flight, endpoint.stats["queued"]) == (0, 1)
+
+
+def test_queue_wait_is_bounded(fake_llm, monkeypatch):
+    monkeypatch.setattr(model_router, "MODEL_ROUTE_QUEUE_TIMEOUT", 0.2)
+    router = make_router(model_router.router.endpoints["deepseek-chat"].base_url, max_concurrency=1)
+    first = open_stream(router)
+    start = time.perf_counter()
+    router.create_completion("character", messages=MESSAGES, max_tokens=50)
+    assert 0.15 < time.perf_counter() - start < 2
+    first.close()
+    assert router.endpoints["e0"].in_flight == 0
+
+
+def test_fallback_is_counted_once_per_request(monkeypatch):
+    monkeypatch.setattr(model_router, "MODEL_ROUTE_MAX_RETRIES", 1)
+    router = make_router(closed_port_url(), closed_port_url())
+    with pytest.raises(Exception):
+        router.create_completion("character", messages=MESSAGES, max_tokens=50)
+    first, second = router.endpoints["e0"], router.endpoints["e1"]
+    # 第二个端点重试了一次，但只承接了一次回退
+    assert (first.stats["calls"], second.stats["calls"]) == (1, 2)
+    assert (first.stats["fallbacks"], second.stats["fallbacks"]) == (0, 1)
+    assert first.in_flight == second.in_flight == 0
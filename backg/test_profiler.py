@@ -0,0 +1,73 @@
+"""
+profiler.py的单元测试：采样分析器、请求阶段计时和慢请求日志
+"""
+
+import json
+import threading
+import time
+
+import pytest
+
+import profiler
+from profiler import SamplingProfiler, SlowRequestLog, finish_request, phase, record_prompt_size, start_request
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_sampling_profiler_collapses_stacks():
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="busy-worker")
+    worker.start()
+    try:
+        result = SamplingProfiler(interval=0.005).run(0.2)
+    finally:
+        stop.set()
+        worker.join()
+    lines = [line for line in result.splitlines() if line.startswith("busy-worker;")]
+    assert lines and all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+    assert any("busy_loop (test_profiler.py:" in line for line in lines)
+
+
+def test_sampling_profiler_rejects_concurrent_runs():
+    sampler = SamplingProfiler(interval=0.01)
+    worker = threading.Thread(target=sampler.run, args=(0.3,))
+    worker.start()
+    time.sleep(0.05)
+    try:
+        with pytest.raises(RuntimeError):
+            sampler.run(0.1)
+    finally:
+        worker.join()
+
+
+def test_phases_and_prompt_sizes_accumulate_per_request(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler, "slow_request_log", SlowRequestLog(0.0, str(tmp_path / "logs" / "slow.jsonl")))
+    start_request("/api/send-message", "s1")
+    with phase("llm.character"):
+        time.sleep(0.01)
+    with phase("llm.character"):
+        pass
+    record_prompt_size("character", 100)
+    record_prompt_size("character", 20)
+    entry = finish_request(200)
+
+    assert (entry["route"], entry["session"], entry["status"]) == ("/api/send-message", "s1", 200)
+    assert entry["phases"]["llm.character"] >= 0.01
+    assert entry["phases"]["other"] >= 0
+    assert entry["prompt_sizes"] == {"character": 120}
+    with open(tmp_path / "logs" / "slow.jsonl", encoding="utf-8") as f:
+        assert [json.loads(line)["route"] for line in f] == ["/api/send-message"]
+    assert profiler.slow_request_log.get_recent() == [entry]
+    # 请求结束后计时器已清除，不再计入
+    assert finish_request(200) is None
+
+
+def test_fast_requests_are_not_logged(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiler, "slow_request_log", SlowRequestLog(60.0, str(tmp_path / "slow.jsonl")))
+    start_request("/api/status", "s1")
+    assert finish_request(200) is None
+    assert profiler.slow_request_log.get_recent() == []
+    assert not (tmp_path / "slow.jsonl").exists()
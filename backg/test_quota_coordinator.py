@@ -0,0 +1,93 @@
+"""
+quota_coordinator.py的单元测试：共享令牌桶、预取令牌、跨进程冷却和槽位分配
+"""
+
+import multiprocessing
+import time
+
+import pytest
+
+import quota_coordinator
+from quota_coordinator import SharedQuota
+
+
+def drain_in_other_process(path, api_key, count):
+    quota = SharedQuota(path, max_keys=8, requests_per_minute=6, burst=4)
+    for _ in range(count):
+        quota.acquire(api_key, timeout=0)
+
+
+def test_burst_then_fast_path_then_wait(tmp_path):
+    quota = SharedQuota(str(tmp_path / "quota.bin"), max_keys=8, requests_per_minute=600, burst=2)
+    assert quota.acquire("sk-a") < 0.01  # 从共享令牌桶预取2个令牌
+    assert quota.acquire("sk-a") == 0.0  # 使用本进程预取的令牌
+    assert (quota.stats["shared_path"], quota.stats["fast_path"]) == (1, 1)
+
+    # 令牌桶已空，按每秒10个的速率等待补充
+    waited = quota.acquire("sk-a", timeout=5)
+    assert 0.05 < waited < 1
+    assert quota.stats["waits"] == 1
+
+
+def test_wait_is_bounded_by_timeout(tmp_path):
+    quota = SharedQuota(str(tmp_path / "quota.bin"), max_keys=8, requests_per_minute=6, burst=1)
+    quota.acquire("sk-a")
+    start = time.perf_counter()
+    waited = quota.acquire("sk-a", timeout=0.2)
+    assert 0.15 < waited < 0.5
+    assert time.perf_counter() - start < 0.5
+
+
+def test_tokens_are_shared_across_processes(tmp_path):
+    path = str(tmp_path / "quota.bin")
+    process = multiprocessing.get_context("spawn").Process(target=drain_in_other_process, args=(path, "sk-a", 4))
+    process.start()
+    process.join(30)
+    assert process.exitcode == 0
+
+    # 另一个进程用掉了全部4个令牌（每次预取2个），本进程取不到令牌，只能等待
+    quota = SharedQuota(path, max_keys=8, requests_per_minute=6, burst=4)
+    assert quota.acquire("sk-a", timeout=0.1) >= 0.1
+    assert quota.acquire("sk-b", timeout=0.1) < 0.01
+
+
+def test_rate_limit_cooldown_reaches_other_instances(tmp_path):
+    path = str(tmp_path / "quota.bin")
+    first = SharedQuota(path, max_keys=8, requests_per_minute=600, burst=10)
+    second = SharedQuota(path, max_keys=8, requests_per_minute=600, burst=10)
+    second.acquire("sk-a")
+    assert second.cooldown_remaining("sk-a") == 0.0
+
+    first.report_rate_limited("sk-a", retry_after=5)
+    assert 4 < second.cooldown_remaining("sk-a") <= 5
+    # 冷却期间预取的令牌也不能使用
+    assert second.acquire("sk-a", timeout=0.1) >= 0.1
+    assert second.get_stats()["keys"]["...sk-a"]["cooldown_seconds"] > 4
+
+
+def test_slots_store_key_hashes_and_fill_up(tmp_path):
+    path = tmp_path / "quota.bin"
+    quota = SharedQuota(str(path), max_keys=2, requests_per_minute=600, burst=10)
+    quota.acquire("sk-secret-1")
+    quota.acquire("sk-secret-2")
+    assert b"sk-secret" not in path.read_bytes()
+    with pytest.raises(RuntimeError):
+        quota.acquire("sk-secret-3")
+
+
+def test_reopen_keeps_state_and_resets_foreign_files(tmp_path):
+    path = tmp_path / "quota.bin"
+    SharedQuota(str(path), max_keys=8, requests_per_minute=6, burst=2).acquire("sk-a")
+    assert SharedQuota(str(path), max_keys=8, requests_per_minute=6, burst=2).acquire("sk-a", timeout=0.1) >= 0.1
+
+    path.write_bytes(b"not a quota file")
+    assert SharedQuota(str(path), max_keys=8, requests_per_minute=6, burst=2).acquire("sk-a", timeout=0.1) < 0.01
+
+
+def test_module_functions_are_no_ops_when_disabled(monkeypatch):
+    monkeypatch.setattr(quota_coordinator, "_quota", None)
+    monkeypatch.setattr(quota_coordinator, "_quota_disabled", True)
+    assert quota_coordinator.acquire("sk-a") == 0.0
+    assert quota_coordinator.cooldown_remaining("sk-a") == 0.0
+    quota_coordinator.report_rate_limited("sk-a", 5)
+    assert quota_coordinator.get_quota_stats() == {"enabled": False}
@@ -0,0 +1,176 @@
+"""
+scheduler_agent.py的单元测试：按在场情况和私语过滤各角色的对话历史、以编号列出候选角色的调度
+"""
+
+import pytest
+
+import scheduler_agent
+from scheduler_agent import SchedulerAgent
+
+CHARACTERS = [
+    {"name": "我", "info": "用户扮演的主角"},
+    {"name": "小明", "info": "开朗健谈"},
+    {"name": "小红", "info": "沉默寡言"},
+    {"name": "老王", "info": "管家"}
+]
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = SchedulerAgent("sk-test")
+    assert scheduler.create_characters(CHARACTERS)
+    return scheduler
+
+
+def seen_by(scheduler, name):
+    return scheduler.get_character_agent(name).conversation_history.copy()
+
+
+def test_whisper_reaches_only_speaker_and_named_characters(scheduler):
+    scheduler.add_to_history("我：大家好", "我")
+    scheduler.add_to_history("小明：（悄悄对小红说）别告诉别人", "小明")
+    assert seen_by(scheduler, "小明") == ["我：大家好", "小明：（悄悄对小红说）别告诉别人"]
+    assert seen_by(scheduler, "小红") == ["我：大家好", "小明：（悄悄对小红说）别告诉别人"]
+    assert seen_by(scheduler, "老王") == ["我：大家好"]
+    assert scheduler.get_character_agent("老王").hidden_turns == {1}
+
+
+def test_absent_characters_miss_lines_and_are_not_scheduled(scheduler):
+    scheduler.set_presence("老王", False)
+    assert scheduler.set_presence("老王", False) is None
+    scheduler.add_to_history("小明：老王走了", "小明")
+    assert scheduler.get_present_ai_characters() == ["小明", "小红"]
+    assert seen_by(scheduler, "老王") == ["（老王离开了）"]
+
+    scheduler.set_presence("老王", True)
+    assert seen_by(scheduler, "老王") == ["（老王离开了）", "（老王来到了这里）"]
+    assert {info["name"]: info.get("present") for info in scheduler.get_characters_info()}["老王"] is True
+    with pytest.raises(ValueError):
+        scheduler.set_presence("我", False)
+
+
+def test_fork_restores_presence_and_character_histories(scheduler):
+    scheduler.add_to_history("我：大家好", "我")
+    scheduler.set_presence("小红", False)
+    scheduler.add_to_history("小明：小红出去了", "小明")
+    scheduler.set_presence("小红", True)
+
+    forked = scheduler.fork(3)
+    assert forked.absent == {"小红"}
+    assert seen_by(forked, "小红") == ["我：大家好", "（小红离开了）"]
+    assert seen_by(forked, "小明") == ["我：大家好", "（小红离开了）", "小明：小红出去了"]
+    assert forked.get_character_agent("小红").hidden_turns == {2}
+    assert scheduler.absent == set()
+
+
+def test_scheduling_returns_a_present_candidate_by_index(fake_llm, scheduler):
+    scheduler.set_presence("老王", False)
+    for _ in range(5):
+        assert scheduler.decide_next_ai_speaker("继续") in ("小明", "小红")
+    assert scheduler.decide_next_speaker("继续") in ("我", "小明", "小红")
+    assert scheduler.scheduling_stats["decisions"] == 6
+
+
+def test_single_candidate_skips_the_model(fake_llm, scheduler):
+    scheduler.set_presence("小红", False)
+    scheduler.set_presence("老王", False)
+    assert scheduler.decide_next_ai_speaker("继续") == "小明"
+    assert fake_llm.total_requests == 0
+    assert scheduler.scheduling_stats["single_candidate"] == 1
+
+
+def test_name_fallback_prefers_longer_names(scheduler):
+    assert scheduler._extract_character_name("应该让小明明说话", ["明", "小明明"]) == "小明明"
+    assert scheduler._extract_character_name("无法判断", ["小红", "老王"]) == "小红"
+    assert (scheduler.scheduling_stats["name_fallbacks"], scheduler.scheduling_stats["default_fallbacks"]) == (1, 1)
+
+
+def test_reason_mode_still_parses_the_index(fake_llm, scheduler, monkeypatch, capsys):
+    monkeypatch.setattr(scheduler_agent, "SCHEDULING_REASON_ENABLED", True)
+    assert scheduler.decide_next_ai_speaker("继续") in ("小明", "小红", "老王")
+    assert "推动剧情发展" in capsys.readouterr().out
+
+
+def test_character_agents_are_created_on_first_use(scheduler):
+    scheduler.add_to_history("我：大家好", "我")
+    assert [info["name"] for info in scheduler.get_characters_info()] == ["我", "小明", "小红", "老王"]
+    assert list(scheduler.characters) == ["我"]
+
+    agent = scheduler.get_character_agent("小明")
+    assert agent is scheduler.get_character_agent("小明")
+    assert agent.conversation_history.copy() == ["我：大家好"]
+    assert agent.other_character_names and "小明" not in agent.other_character_names
+    assert list(scheduler.characters) == ["我", "小明"]
+    # 之后的台词在下次获取时补上
+    scheduler.add_to_history("小红：你好", "小红")
+    assert scheduler.get_character_agent("小明").conversation_history.tail(1) == ["小红：你好"]
+
+
+def test_large_casts_prefilter_scheduling_candidates():
+    scheduler = SchedulerAgent("sk-test")
+    names = [f"角色{chr(ord('A') + i)}" for i in range(12)]
+    assert scheduler.create_characters([CHARACTERS[0]] + [{"name": name, "info": "路人"} for name in names])
+    scheduler.add_to_history("角色A：大家好", "角色A")
+    scheduler.add_to_history("角色B：角色K你怎么看？", "角色B")
+
+    candidates = scheduler._scheduling_candidates(scheduler.conversation_history.tail(10))
+    assert len(candidates) == scheduler_agent.SCHEDULING_MAX_CANDIDATES
+    # 先取被点名的角色和最近发言的角色，再按最久没说话补足
+    assert candidates[:3] == ["角色K", "角色B", "角色A"]
+    assert candidates[3:] == names[2:7]
+    assert scheduler.scheduling_stats["prefiltered"] == 1
+
+
+@pytest.fixture
+def scripted_scheduling(scheduler, monkeypatch):
+    """调度请求固定回答"1,2,3"，记录每次请求的系统提示词"""
+    prompts = []
+
+    def request_scheduling(system_prompt, user_input, max_tokens):
+        prompts.append(system_prompt)
+        return "1,2,3"
+
+    monkeypatch.setattr(scheduler_agent, "get_speaker_model", lambda: None)
+    monkeypatch.setattr(scheduler, "_request_scheduling", request_scheduling)
+    return prompts
+
+
+def test_plan_is_requested_only_for_back_to_back_ai_turns(scheduler, scripted_scheduling):
+    assert scheduler.decide_next_ai_speaker("继续") == "小明"
+    assert "接下来" not in scripted_scheduling[0] and scheduler.get_speaker_plan() == []
+
+    assert scheduler.decide_next_ai_speaker("继续", plan_turns=3) == "小明"
+    assert "接下来3轮" in scripted_scheduling[1]
+    assert scheduler.get_speaker_plan() == ["小明", "小红", "老王"]
+
+
+def test_plan_is_consumed_as_planned_speakers_talk(scheduler, scripted_scheduling):
+    assert scheduler.decide_next_ai_speaker("继续", plan_turns=3) == "小明"
+    scheduler.add_to_history("小明：大家好", "小明")
+    assert scheduler.get_speaker_plan() == ["小红", "老王"]
+
+    assert scheduler.decide_next_ai_speaker("继续", plan_turns=3) == "小红"
+    # 调度时只读取规划，台词写入历史时才移除
+    assert scheduler.decide_next_ai_speaker("继续", plan_turns=3) == "小红"
+    scheduler.add_to_history("小红：你好", "小红")
+    assert scheduler.get_speaker_plan() == ["老王"]
+    assert len(scripted_scheduling) == 1
+    assert scheduler.scheduling_stats["planned_decisions"] == 2
+
+
+def test_plan_is_invalidated_by_interruptions_and_addressed_names(scheduler, scripted_scheduling):
+    scheduler.decide_next_ai_speaker("继续", plan_turns=3)
+    scheduler.add_to_history("我：等一下", "我")
+    assert scheduler.get_speaker_plan() == []
+
+    scheduler.decide_next_ai_speaker("继续", plan_turns=3)
+    scheduler.add_to_history("小红：我先说两句", "小红")
+    assert scheduler.get_speaker_plan() == []
+
+    # 上一句点名了规划之外的角色：放弃规划，重新请求调度
+    scheduler.decide_next_ai_speaker("继续", plan_turns=3)
+    scheduler.add_to_history("小明：老王，你怎么看？", "小明")
+    assert scheduler.get_speaker_plan() == ["小红", "老王"]
+    scheduler.decide_next_ai_speaker("继续", plan_turns=3)
+    assert len(scripted_scheduling) == 4
+    assert scheduler.scheduling_stats["plan_invalidations"] == 3
@@ -0,0 +1,71 @@
+"""
+scheduling_batcher.py的单元测试：合并回答的解析、按会话分发和回退，以及合并调用的用量分摊
+"""
+
+import threading
+
+from scheduling_batcher import _ANSWER, SchedulingBatcher
+from usage_tracker import _split_entry
+
+
+def parse(content):
+    answers = {}
+    for match in _ANSWER.finditer(content):
+        answers.setdefault(int(match.group(1)), match.group(2))
+    return answers
+
+
+def test_answer_parsing():
+    content = "剧本1: 小明\n  2：小红 \n\n说明文字\n剧本3 : 老王\n1: 重复的编号"
+    assert parse(content) == {1: "小明", 2: "小红", 3: "老王"}
+    assert parse("小明") == {}
+    assert parse("剧本2：") == {}
+
+
+def run_batch(batcher, count, answers):
+    calls = []
+    batcher._merged_call = lambda batch, api_key: (calls.append(len(batch)), answers)[1]
+    results = [None] * count
+
+    def submit(index):
+        results[index] = batcher.request("系统提示词", f"输入{index}", 4, "sk-test",
+                                         lambda: f"单独{index}")
+
+    threads = [threading.Thread(target=submit, args=(index,)) for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, calls
+
+
+def test_full_batch_is_merged_and_missing_answers_fall_back():
+    batcher = SchedulingBatcher(window_ms=5000, max_size=3)
+    results, calls = run_batch(batcher, 3, {1: "小明", 2: "小红", 3: "老王"})
+    assert calls == [3]
+    assert sorted(results) == ["小明", "小红", "老王"]
+
+    results, calls = run_batch(batcher, 3, {2: "小红"})
+    assert calls == [3]
+    assert sorted(results)[-1] == "小红"
+    assert sum(result.startswith("单独") for result in results) == 2
+    stats = batcher.get_stats()
+    assert (stats["requests"], stats["fallbacks"], stats["batch_sizes"]) == (6, 2, {3: 2})
+
+
+def test_single_request_is_scheduled_alone():
+    batcher = SchedulingBatcher(window_ms=0, max_size=4)
+    results, calls = run_batch(batcher, 1, {1: "不会用到"})
+    assert (results, calls) == (["单独0"], [])
+
+
+def test_split_entry_keeps_totals():
+    parts = _split_entry({"calls": 1, "prompt_tokens": 10, "completion_tokens": 3, "cost": 0.3},
+                         {"a": 1.0, "b": 1.0, "c": 1.0})
+    assert all(part["calls"] == 1 for part in parts.values())
+    assert sum(part["prompt_tokens"] for part in parts.values()) == 10
+    assert sum(part["completion_tokens"] for part in parts.values()) == 3
+    assert abs(sum(part["cost"] for part in parts.values()) - 0.3) < 1e-9
+
+    weighted = _split_entry({"calls": 1, "prompt_tokens": 100}, {"a": 3.0, "b": 1.0})
+    assert (weighted["a"]["prompt_tokens"], weighted["b"]["prompt_tokens"]) == (75, 25)
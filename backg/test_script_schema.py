@@ -0,0 +1,109 @@
+"""
+script_schema.py的单元测试：JSON剧本设定的解析、校验、转换和流式增量解析
+"""
+
+import json
+
+from script_schema import (
+    SettingStreamParser,
+    build_repair_context,
+    loads_setting,
+    parse_character_lines,
+    parse_setting_json,
+    to_parsed_setting,
+    validate_field,
+    validate_setting
+)
+
+SETTING = {
+    "scene_setting": "深夜的侦探事务所",
+    "characters": [
+        {"name": "我", "personality": "冷静", "background": "新来的助手"},
+        {"name": "小明", "personality": "开朗健谈", "background": "事务所的老侦探"}
+    ],
+    "plot_summary": "一桩失窃案牵出旧事"
+}
+
+
+def feed_all(parser, text, size):
+    completed = []
+    for start in range(0, len(text), size):
+        completed.extend(parser.feed(text[start:start + size]))
+    return completed + parser.finish()
+
+
+def test_loads_setting_accepts_code_fence():
+    text = json.dumps(SETTING, ensure_ascii=False)
+    assert loads_setting(text) == SETTING
+    assert loads_setting("```json\n" + text + "\n```") == SETTING
+    assert loads_setting("不是JSON") is None
+    assert loads_setting("[1, 2]") is None
+
+
+def test_validate_field():
+    assert validate_field("scene_setting", "  ") == "应为非空字符串"
+    assert validate_field("plot_summary", 1) == "应为非空字符串"
+    assert validate_field("characters", SETTING["characters"]) is None
+    assert validate_field("characters", []) == "应为非空数组"
+    assert validate_field("characters", ["我"]) == "第1个角色不是对象"
+    assert validate_field("characters", [{"name": "我"}, {"name": " "}]) == "第2个角色缺少name"
+    assert validate_field("characters", [{"name": "我"}, {"name": "我"}]) == "角色名我重复"
+    assert validate_field("characters", [{"name": "小明"}, {"name": "小红"}]) == '缺少用户主角"我"'
+    assert validate_field("characters", [{"name": "我"}]) == "至少需要一个AI角色"
+
+
+def test_parse_setting_json_reports_field_errors():
+    data, errors = parse_setting_json(json.dumps(dict(SETTING, plot_summary=""), ensure_ascii=False))
+    assert data["scene_setting"] == SETTING["scene_setting"]
+    assert errors == {"plot_summary": "应为非空字符串"}
+    assert validate_setting(SETTING) == {}
+    assert parse_setting_json("模型没有按格式输出") == (None, {})
+
+
+def test_repair_context_excludes_target_and_invalid_fields():
+    data = dict(SETTING, characters=[])
+    context = json.loads(build_repair_context(data, "plot_summary"))
+    assert context == {"scene_setting": SETTING["scene_setting"]}
+
+
+def test_to_parsed_setting_blanks_invalid_fields():
+    parsed = to_parsed_setting(SETTING)
+    assert parsed["characters"] == [{"name": "我", "info": "冷静|新来的助手"}, {"name": "小明", "info": "开朗健谈|事务所的老侦探"}]
+    assert parsed["full_setting"].startswith("【场景设定】\n深夜的侦探事务所")
+
+    broken = to_parsed_setting(dict(SETTING, scene_setting=None, characters="小明"))
+    assert (broken["scene_setting"], broken["characters"]) == ("", [])
+    assert broken["plot_summary"] == SETTING["plot_summary"]
+
+
+def test_parse_character_lines():
+    text = "\n我|冷静|新来的助手\n没有分隔符的行\n小明|开朗健谈\n"
+    assert parse_character_lines(text) == [{"name": "我", "info": "冷静|新来的助手"}, {"name": "小明", "info": "开朗健谈"}]
+
+
+def test_stream_parser_json_emits_fields_as_they_complete():
+    text = "```json\n" + json.dumps(SETTING, ensure_ascii=False, indent=2) + "\n```"
+    parser = SettingStreamParser(json_mode=True)
+    completed = feed_all(parser, text, 7)
+    assert [field for field, _ in completed] == ["scene_setting", "characters", "plot_summary"]
+    assert dict(completed) == {key: value for key, value in to_parsed_setting(SETTING).items() if key != "full_setting"}
+
+
+def test_stream_parser_json_handles_escapes_and_skips_invalid_characters():
+    text = json.dumps({"scene_setting": '雨夜，门上写着"请勿打扰"}', "characters": [{"name": "小明"}],
+                       "plot_summary": "大纲"}, ensure_ascii=False)
+    completed = feed_all(SettingStreamParser(json_mode=True), text, 3)
+    # 缺少用户主角的角色列表不返回，留给完整解析后的字段修复
+    assert completed == [("scene_setting", '雨夜，门上写着"请勿打扰"}'), ("plot_summary", "大纲")]
+
+
+def test_stream_parser_text_emits_last_section_on_finish():
+    text = "【场景设定】\n深夜的侦探事务所\n\n【主要角色】\n我|冷静\n小明|开朗健谈\n\n【剧情大纲】\n一桩失窃案"
+    parser = SettingStreamParser(json_mode=False)
+    completed = []
+    for start in range(0, len(text), 5):
+        completed.extend(parser.feed(text[start:start + 5]))
+    assert [field for field, _ in completed] == ["scene_setting", "characters"]
+    assert completed[1][1] == [{"name": "我", "info": "冷静"}, {"name": "小明", "info": "开朗健谈"}]
+    assert parser.finish() == [("plot_summary", "一桩失窃案")]
+    assert parser.finish() == []
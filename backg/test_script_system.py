@@ -0,0 +1,82 @@
+"""
+script_system.py的单元测试：主要角色生成完毕即可开始对话，剧情大纲在后台补充；从会话存储恢复
+"""
+
+import threading
+import time
+
+import scheduler_agent
+import script_system
+from script_system import ScriptSystem
+from session_store import SessionStore
+
+CHARACTERS = [{"name": "我", "info": "用户扮演的主角"}, {"name": "小明", "info": "开朗健谈"},
+              {"name": "小红", "info": "沉默寡言"}]
+
+
+def wait_for_stage(system, stage, timeout=10):
+    deadline = time.time() + timeout
+    while system.get_setup_progress()["stage"] != stage:
+        assert time.time() < deadline, system.get_setup_progress()
+        time.sleep(0.01)
+
+
+def test_turn_runs_before_plot_summary_arrives(fake_llm, monkeypatch):
+    monkeypatch.setattr(script_system, "SCRIPT_SETTING_STREAMING", True)
+    system = ScriptSystem()
+    release = threading.Event()
+    create_script_setting = system.scheduler.create_script_setting
+
+    def stalled_after_characters(user_input, on_field):
+        # 主要角色回调之后卡住剧本设定的生成，模拟剧情大纲迟迟未到
+        def forward(field, value):
+            on_field(field, value)
+            if field == "characters":
+                release.wait(10)
+        return create_script_setting(user_input, forward)
+
+    monkeypatch.setattr(system.scheduler, "create_script_setting", stalled_after_characters)
+    try:
+        result = system.initialize_script("深夜的图书馆")
+        assert result["plot_pending"] is True
+        assert result["timings"]["first_playable_seconds"] is not None
+        assert system.is_initialized and system.scheduler.plot_summary == ""
+        assert system.get_setup_progress()["stage"] == "characters_ready"
+
+        speaker = system.scheduler.decide_next_ai_speaker()
+        reply = system.scheduler.get_character_agent(speaker).generate_response()
+        assert reply
+        system.scheduler.add_to_history(reply, speaker)
+    finally:
+        release.set()
+
+    wait_for_stage(system, "done")
+    assert system.scheduler.plot_summary
+    assert system.scheduler.get_character_agent(speaker).plot_summary == system.scheduler.plot_summary
+    assert len(system.scheduler.conversation_history) == 1
+
+
+def test_non_streaming_returns_complete_setting(fake_llm, monkeypatch):
+    monkeypatch.setattr(script_system, "SCRIPT_SETTING_STREAMING", False)
+    monkeypatch.setattr(scheduler_agent, "SCRIPT_SETTING_STREAMING", False)
+    system = ScriptSystem()
+    result = system.initialize_script("深夜的图书馆")
+    assert "plot_pending" not in result
+    assert system.scheduler.plot_summary
+    assert result["timings"]["first_playable_seconds"] == result["timings"]["total_seconds"]
+    assert system.get_setup_progress()["stage"] == "done"
+
+
+def test_restore_defers_memory_index(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    store.save_setting("s1", "深夜的图书馆", "一本书失踪了", CHARACTERS)
+    store.append_turns("s1", [("我", "有人看到那本书吗", 1.0), ("小明", "小红昨天借走了", 2.0)])
+
+    system = ScriptSystem()
+    assert system.attach_session("s1", store)
+    assert system.is_initialized and system.last_speaker == "小明"
+    assert system.scheduler.conversation_history.copy() == ["我：有人看到那本书吗", "小明：小红昨天借走了"]
+    assert system.scheduler.memory.get_stats()["deferred"] == 2
+    # 恢复的台词不会再次写入存储，之后的台词照常追加
+    system.scheduler.add_to_history("小红：我已经还回去了", "小红")
+    assert [turn[1] for turn in store.load("s1")["turns"]] == ["有人看到那本书吗", "小红昨天借走了", "我已经还回去了"]
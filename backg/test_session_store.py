@@ -0,0 +1,90 @@
+"""
+session_store.py的单元测试：剧本设定、增量写入台词、压缩块和恢复
+"""
+
+import os
+
+from session_store import SessionStore
+
+CHARACTERS = [{"name": "我", "info": "用户扮演的主角"}, {"name": "小明", "info": "开朗健谈"}]
+
+
+def rows(count, start=0):
+    return [("小明" if i % 2 else "我", f"第{i}句", 1000.0 + i) for i in range(start, start + count)]
+
+
+def test_missing_session_loads_as_none(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    assert store.load("missing") is None
+
+
+def test_setting_and_turns_round_trip(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"), chunk_turns=4)
+    store.save_setting("s1", "深夜的侦探事务所", "一桩失窃案", CHARACTERS)
+    for seq, (speaker, text, timestamp) in enumerate(rows(3)):
+        store.append_turn("s1", seq, speaker, text, timestamp)
+    saved = store.load("s1")
+    assert saved["scene_setting"] == "深夜的侦探事务所"
+    assert saved["plot_summary"] == "一桩失窃案"
+    assert saved["characters"] == CHARACTERS
+    assert saved["turns"] == rows(3)
+
+
+def test_compaction_keeps_order_and_survives_reopen(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    store = SessionStore(path, chunk_turns=4)
+    store.save_setting("s1", "场景", "大纲", CHARACTERS)
+    for seq, (speaker, text, timestamp) in enumerate(rows(19)):
+        store.append_turn("s1", seq, speaker, text, timestamp)
+    assert store.get_stats()["compactions"] >= 3
+    assert store.load("s1")["turns"] == rows(19)
+
+    # 重新打开数据库后继续追加（已压缩的条数从数据库中读取）
+    reopened = SessionStore(path, chunk_turns=4)
+    for seq, (speaker, text, timestamp) in enumerate(rows(5, 19), 19):
+        reopened.append_turn("s1", seq, speaker, text, timestamp)
+    assert reopened.load("s1")["turns"] == rows(24)
+
+
+def test_append_turns_in_bulk_and_clear(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"), chunk_turns=4)
+    store.save_setting("s1", "场景", "大纲", CHARACTERS)
+    store.append_turns("s1", rows(10))
+    assert store.load("s1")["turns"] == rows(10)
+
+    store.clear_turns("s1")
+    assert store.load("s1")["turns"] == []
+    store.append_turn("s1", 0, "我", "重新开始", 1.0)
+    assert store.load("s1")["turns"] == [("我", "重新开始", 1.0)]
+
+
+def test_sessions_are_isolated_and_deletable(tmp_path):
+    store = SessionStore(str(tmp_path / "data" / "sessions.db"))
+    assert os.path.isdir(tmp_path / "data")
+    store.save_setting("a", "场景A", "大纲A", CHARACTERS)
+    store.save_setting("b", "场景B", "大纲B", CHARACTERS)
+    store.append_turn("a", 0, "我", "只在A中", 1.0)
+    assert store.load("b")["turns"] == []
+    assert {session["session_id"] for session in store.list_sessions()} == {"a", "b"}
+
+    store.delete("a")
+    assert store.load("a") is None
+    assert [session["session_id"] for session in store.list_sessions()] == ["b"]
+
+
+def test_save_setting_updates_existing_session(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    store.save_setting("s1", "旧场景", "旧大纲", CHARACTERS)
+    store.save_setting("s1", "新场景", "新大纲", CHARACTERS[:1])
+    saved = store.load("s1")
+    assert (saved["scene_setting"], saved["plot_summary"], saved["characters"]) == ("新场景", "新大纲", CHARACTERS[:1])
+
+
+def test_appending_turns_updates_session_activity(tmp_path):
+    store = SessionStore(str(tmp_path / "sessions.db"))
+    store.save_setting("a", "场景A", "大纲A", CHARACTERS)
+    store.save_setting("b", "场景B", "大纲B", CHARACTERS)
+    store.append_turn("a", 0, "我", "A又有了新台词", 1.0)
+    assert [session["session_id"] for session in store.list_sessions()] == ["a", "b"]
+    store.append_turns("b", rows(2))
+    assert [session["session_id"] for session in store.list_sessions()] == ["b", "a"]
@@ -0,0 +1,59 @@
+"""
+speaker_model.py的单元测试：候选角色特征、调度决定日志和本地模型的训练/保存/预测
+"""
+
+import pytest
+
+from speaker_model import FEATURE_NAMES, DecisionLog, SpeakerModel, extract_features
+
+np = pytest.importorskip("numpy")
+
+HISTORY = ["我：大家好", "小明：小红，你昨晚去哪了？"]
+
+
+def feature(row, name):
+    return row[FEATURE_NAMES.index(name)]
+
+
+def test_extract_features():
+    xiaoming, xiaohong, laowang, user = extract_features(["小明", "小红", "老王", "我"], HISTORY)
+    assert len(xiaoming) == len(FEATURE_NAMES)
+    assert feature(xiaohong, "mentioned_last") == feature(xiaohong, "asked_last") == 1.0
+    assert feature(xiaoming, "mentioned_last") == 0.0 and feature(xiaoming, "is_last_speaker") == 1.0
+    assert feature(xiaoming, "question_open") == 0.0 and feature(laowang, "question_open") == 1.0
+    assert feature(user, "is_second_last_speaker") == 1.0 and feature(user, "is_user") == 1.0
+    assert (feature(xiaoming, "turn_gap"), feature(user, "turn_gap"), feature(laowang, "turn_gap")) == (0.0, 0.1, 1.0)
+    assert (feature(xiaoming, "recent_share"), feature(laowang, "recent_share")) == (0.5, 0.0)
+    assert extract_features(["小明"], []) == [[0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 1.0, 0.0, 0.0]]
+
+
+def test_train_save_load_predict_round_trip(tmp_path):
+    import train_speaker_model
+
+    # 记录的LLM决定总是选上一句被点名的角色
+    log = DecisionLog(str(tmp_path / "logs" / "decisions.jsonl"))
+    candidates = ["小明", "小红", "老王"]
+    for i in range(30):
+        speaker, addressed = candidates[i % 3], candidates[(i + 1) % 3]
+        history = [f"{candidates[(i + 2) % 3]}：嗯", f"{speaker}：{addressed}，你觉得呢？"]
+        log.record(candidates, extract_features(candidates, history), addressed)
+
+    entries = train_speaker_model.load_decisions(log.log_path)
+    assert len(entries) == 30
+    arrays = train_speaker_model.to_arrays(entries)
+    weights = train_speaker_model.train(*arrays, epochs=300, learning_rate=0.5, l2=1e-3)
+    assert train_speaker_model.evaluate(weights, *arrays)["agreement"] == 1.0
+
+    path = str(tmp_path / "models" / "speaker_model.json")
+    SpeakerModel(weights).save(path, {"trained_on": len(entries)})
+    model = SpeakerModel.load(path)
+    assert np.allclose(model.weights, weights, atol=1e-5)
+    index, confidence = model.predict(extract_features(candidates, ["小明：嗯", "小红：老王，你说呢？"]))
+    assert candidates[index] == "老王" and 0.5 < confidence <= 1.0
+
+
+def test_load_rejects_missing_or_mismatched_model(tmp_path):
+    path = tmp_path / "speaker_model.json"
+    assert SpeakerModel.load(str(path)) is None
+    path.write_text('{"feature_set": 0, "features": [], "weights": []}', encoding="utf-8")
+    assert SpeakerModel.load(str(path)) is None
@@ -0,0 +1,89 @@
+"""
+tracing.py的单元测试：嵌套span、trace ID传递、请求头过滤和trace文件轮转
+"""
+
+import json
+
+import pytest
+
+import tracing
+from tracing import TraceExporter, begin_span, end_span, span, trace_headers, traced
+
+
+def read_events(path):
+    # trace文件是省略结尾"]"的JSON数组
+    with open(path, encoding="utf-8") as f:
+        return json.loads(f.read().rstrip().rstrip(",") + "]")
+
+
+@pytest.fixture
+def exporter(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing, "TRACE_ENABLED", True)
+    exporter = TraceExporter(str(tmp_path / "logs" / "trace.json"), max_events=1000, backup_count=2)
+    monkeypatch.setattr(tracing, "exporter", exporter)
+    return exporter
+
+
+def test_nested_spans_share_trace_and_link_parents(exporter):
+    @traced("inner")
+    def inner():
+        return "done"
+
+    with span("root", route="/api/test") as root:
+        with span("child"):
+            assert inner() == "done"
+    events = {event["name"]: event for event in read_events(exporter.log_path)}
+
+    assert set(events) == {"root", "child", "inner"}
+    assert {event["args"]["trace_id"] for event in events.values()} == {root.trace_id}
+    assert "parent_id" not in events["root"]["args"]
+    assert events["child"]["args"]["parent_id"] == events["root"]["args"]["span_id"]
+    assert events["inner"]["args"]["parent_id"] == events["child"]["args"]["span_id"]
+    assert events["root"]["args"]["route"] == "/api/test"
+    assert all(event["ph"] == "X" and event["dur"] >= 0 for event in events.values())
+
+
+def test_span_records_errors(exporter):
+    with pytest.raises(ValueError):
+        with span("failing"):
+            raise ValueError("出错了")
+    assert read_events(exporter.log_path)[0]["args"]["error"] == "出错了"
+
+
+def test_trace_headers_only_for_local_services(exporter):
+    assert trace_headers("http://127.0.0.1:8001") == {}
+    root = begin_span("root", trace_id="abc123")
+    try:
+        assert trace_headers("http://127.0.0.1:8001/v1") == {"X-Trace-Id": "abc123"}
+        assert trace_headers("http://localhost:8001") == {"X-Trace-Id": "abc123"}
+        assert trace_headers("https://api.deepseek.com") == {}
+    finally:
+        end_span(root)
+    assert trace_headers("http://127.0.0.1:8001") == {}
+
+
+def test_disabled_tracing_records_nothing(monkeypatch, tmp_path):
+    monkeypatch.setattr(tracing, "TRACE_ENABLED", False)
+    monkeypatch.setattr(tracing, "exporter", TraceExporter(str(tmp_path / "trace.json")))
+    with span("root") as current:
+        assert current is None
+        assert trace_headers("http://127.0.0.1:8001") == {}
+    assert not (tmp_path / "trace.json").exists()
+
+
+def test_exporter_rotates_files(tmp_path):
+    exporter = TraceExporter(str(tmp_path / "trace.json"), max_events=2, backup_count=2)
+    for index in range(7):
+        exporter.add({"name": f"event{index}"}, flush=True)
+    assert [event["name"] for event in read_events(tmp_path / "trace.json")] == ["event6"]
+    assert [event["name"] for event in read_events(tmp_path / "trace.1.json")] == ["event4", "event5"]
+    assert [event["name"] for event in read_events(tmp_path / "trace.2.json")] == ["event2", "event3"]
+    assert not (tmp_path / "trace.3.json").exists()
+
+
+def test_exporter_buffers_until_flush(tmp_path):
+    exporter = TraceExporter(str(tmp_path / "trace.json"))
+    exporter.add({"name": "child"})
+    assert not (tmp_path / "trace.json").exists()
+    exporter.flush()
+    assert [event["name"] for event in read_events(tmp_path / "trace.json")] == ["child"]
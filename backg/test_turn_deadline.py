@@ -0,0 +1,74 @@
+"""
+turn_deadline.py的单元测试：单轮时间预算、环节限制和延迟目标统计
+"""
+
+import time
+
+import pytest
+
+from turn_deadline import (
+    DeadlineExceeded,
+    TurnBudget,
+    TurnSLO,
+    check_deadline,
+    current_budget,
+    remaining,
+    stage,
+    turn_budget
+)
+
+
+def test_no_budget_means_no_limit():
+    assert current_budget() is None
+    assert remaining() is None
+    check_deadline()
+    with stage(0):
+        assert remaining() is None
+    with turn_budget(0) as budget:
+        assert budget is None
+        assert remaining() is None
+
+
+def test_turn_budget_sets_and_resets_context():
+    with turn_budget(5) as budget:
+        assert current_budget() is budget
+        assert 4.5 < remaining() <= 5
+        check_deadline()
+    assert current_budget() is None
+
+
+def test_expired_budget_raises():
+    with turn_budget(0.01):
+        time.sleep(0.02)
+        assert remaining() <= 0
+        with pytest.raises(DeadlineExceeded):
+            check_deadline()
+
+
+def test_stage_takes_the_earlier_deadline():
+    with turn_budget(5):
+        with stage(0.5):
+            assert remaining() <= 0.5
+            with stage(0):
+                with pytest.raises(DeadlineExceeded):
+                    check_deadline()
+            assert 0 < remaining() <= 0.5
+        with stage(10):
+            assert remaining() <= 5
+        assert remaining() > 4
+
+
+def test_slo_stats():
+    slo = TurnSLO(window=3)
+    assert slo.get_stats()["attainment"] is None
+    assert slo.get_stats()["p50"] is None
+    for elapsed in (0.5, 1.0, 1.5, 3.0):
+        budget = TurnBudget(2)
+        budget.truncated = elapsed > 2
+        budget.scheduler_fallback = elapsed == 1.5
+        slo.record(budget, elapsed)
+    stats = slo.get_stats()
+    assert (stats["turns"], stats["met"], stats["truncated"], stats["scheduler_fallbacks"]) == (4, 3, 1, 1)
+    assert stats["attainment"] == 0.75
+    # 百分位数只统计最近window轮
+    assert (stats["p50"], stats["p99"]) == (1.5, 3.0)
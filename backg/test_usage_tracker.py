@@ -0,0 +1,57 @@
+"""
+usage_tracker.py的单元测试：会话配额检查和后台任务的退避
+"""
+
+import pytest
+
+import usage_tracker
+from turn_deadline import turn_budget
+from usage_tracker import UsageQuotaExceeded, UsageTracker, attribute
+
+
+class Usage:
+    def __init__(self, prompt_tokens, completion_tokens=0):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+@pytest.fixture
+def tracker(monkeypatch, tmp_path):
+    monkeypatch.setattr(usage_tracker, "USAGE_SESSION_TOKEN_QUOTA", 1000)
+    monkeypatch.setattr(usage_tracker, "USAGE_BACKGROUND_SOFT_RATIO", 0.8)
+    monkeypatch.setattr(usage_tracker, "USAGE_BACKGROUND_DELAY", 0.2)
+    return UsageTracker(str(tmp_path / "usage.json"), flush_interval=3600)
+
+
+def use(tracker, tokens):
+    with attribute(session="s1"):
+        tracker.record("character", "sk-test", Usage(tokens))
+
+
+def test_foreground_requests_never_back_off(tracker):
+    use(tracker, 950)
+    with attribute(session="s1"):
+        assert tracker.check_quota() == 0.0
+
+
+def test_background_back_off_grows_towards_the_quota(tracker):
+    with attribute(session="s1", background=True):
+        use(tracker, 700)
+        assert tracker.check_quota() == 0.0
+        use(tracker, 150)
+        assert tracker.check_quota() == pytest.approx(0.05)
+        use(tracker, 100)
+        assert tracker.check_quota() == pytest.approx(0.15)
+        # 有单轮时间预算时退避不超过剩余时间
+        with turn_budget(0.05):
+            assert tracker.check_quota() <= 0.05
+        use(tracker, 50)
+        with pytest.raises(UsageQuotaExceeded):
+            tracker.check_quota()
+
+
+def test_no_quota_means_no_check(tracker, monkeypatch):
+    monkeypatch.setattr(usage_tracker, "USAGE_SESSION_TOKEN_QUOTA", 0)
+    use(tracker, 10 ** 9)
+    with attribute(session="s1", background=True):
+        assert tracker.check_quota() == 0.0
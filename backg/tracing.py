@@ -0,0 +1,265 @@
+"""
+调用链追踪 - 轻量级嵌套span记录，导出为Chrome trace-event格式
+"""
+
+import atexit
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Any, List, Optional
+from urllib.parse import urlparse
+from config import (
+    TRACE_ENABLED,
+    TRACE_LOG_PATH,
+    TRACE_MAX_EVENTS_PER_FILE,
+    TRACE_BACKUP_COUNT
+)
+
+
+class Span:
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], args: Dict[str, Any]):
+        """
+        初始化span
+
+        Args:
+            name: span名称
+            trace_id: 所属trace的ID
+            parent_id: 父span的ID
+            args: 附加属性
+        """
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.args = args
+        self.start = time.perf_counter()
+        self.tid = threading.get_ident()
+        self._token = None
+
+    def set(self, key: str, value: Any) -> None:
+        """
+        设置span的附加属性
+
+        Args:
+            key: 属性名
+            value: 属性值
+        """
+        self.args[key] = value
+
+    def to_event(self, end: float) -> Dict[str, Any]:
+        """
+        转换为Chrome trace的完整事件（ph=X）
+
+        Args:
+            end: 结束时间（perf_counter）
+
+        Returns:
+            trace事件字典
+        """
+        args = dict(self.args)
+        args["trace_id"] = self.trace_id
+        args["span_id"] = self.span_id
+        if self.parent_id:
+            args["parent_id"] = self.parent_id
+        return {
+            "name": self.name,
+            "ph": "X",
+            "ts": int((self.start - _EPOCH_OFFSET) * 1_000_000),
+            "dur": int((end - self.start) * 1_000_000),
+            "pid": os.getpid(),
+            "tid": self.tid,
+            "args": args
+        }
+
+
+class TraceExporter:
+    def __init__(self, log_path: str = TRACE_LOG_PATH,
+                 max_events: int = TRACE_MAX_EVENTS_PER_FILE,
+                 backup_count: int = TRACE_BACKUP_COUNT):
+        """
+        初始化trace文件导出器
+
+        Args:
+            log_path: trace文件路径
+            max_events: 单个文件最多记录的事件数，超出后轮转
+            backup_count: 保留的历史文件数量
+        """
+        self.log_path = log_path
+        self.max_events = max_events
+        self.backup_count = backup_count
+        self.buffer: List[Dict[str, Any]] = []
+        self.events_in_file = 0
+        self._lock = threading.Lock()
+
+    def add(self, event: Dict[str, Any], flush: bool = False) -> None:
+        """
+        添加事件，根span结束时写入文件
+
+        Args:
+            event: trace事件
+            flush: 是否立即写入文件
+        """
+        with self._lock:
+            self.buffer.append(event)
+            if flush or len(self.buffer) >= 100:
+                self._flush_locked()
+
+    def flush(self) -> None:
+        """
+        将缓冲区中的事件写入文件
+        """
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        if not self.buffer:
+            return
+        try:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            if self.events_in_file == 0 or self.events_in_file >= self.max_events:
+                self._rotate()
+            # JSON数组格式允许省略结尾的"]"，因此可以直接追加写入
+            with open(self.log_path, "a", encoding="utf-8") as f:
+                for event in self.buffer:
+                    f.write(json.dumps(event, ensure_ascii=False) + ",\n")
+            self.events_in_file += len(self.buffer)
+        except OSError as e:
+            print(f"❌ trace写入失败: {str(e)}")
+        self.buffer.clear()
+
+    def _rotate(self) -> None:
+        if os.path.exists(self.log_path):
+            root, ext = os.path.splitext(self.log_path)
+            for i in range(self.backup_count - 1, 0, -1):
+                source = f"{root}.{i}{ext}"
+                if os.path.exists(source):
+                    os.replace(source, f"{root}.{i + 1}{ext}")
+            if self.backup_count > 0:
+                os.replace(self.log_path, f"{root}.1{ext}")
+            else:
+                os.remove(self.log_path)
+        with open(self.log_path, "w", encoding="utf-8") as f:
+            f.write("[\n")
+        self.events_in_file = 0
+
+
+_EPOCH_OFFSET = time.perf_counter() - time.time()  # 把perf_counter换算成墙钟时间
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+_current_trace_id: contextvars.ContextVar = contextvars.ContextVar("trace_id", default=None)
+
+_LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+exporter = TraceExporter()
+atexit.register(exporter.flush)
+
+
+def new_trace_id() -> str:
+    """
+    生成新的trace ID
+
+    Returns:
+        32位十六进制trace ID
+    """
+    return uuid.uuid4().hex
+
+
+def begin_span(name: str, trace_id: Optional[str] = None, **args) -> Optional[Span]:
+    """
+    开始一个span并设为当前span（用于无法使用with语句的场景，如请求钩子）
+
+    Args:
+        name: span名称
+        trace_id: 指定trace ID，为空时沿用当前trace或新建
+        **args: 附加属性
+
+    Returns:
+        span对象，追踪关闭时返回None
+    """
+    if not TRACE_ENABLED:
+        return None
+    parent = _current_span.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else (_current_trace_id.get() or new_trace_id())
+    new_span = Span(name, trace_id, parent.span_id if parent else None, args)
+    new_span._token = (_current_span.set(new_span), _current_trace_id.set(trace_id))
+    return new_span
+
+
+def end_span(span: Optional[Span]) -> None:
+    """
+    结束span并恢复父span
+
+    Args:
+        span: begin_span返回的span对象
+    """
+    if span is None:
+        return
+    event = span.to_event(time.perf_counter())
+    span_token, trace_token = span._token
+    try:
+        _current_span.reset(span_token)
+        _current_trace_id.reset(trace_token)
+    except ValueError:
+        # 在其他上下文中结束span时无法还原，直接清空
+        _current_span.set(None)
+        _current_trace_id.set(None)
+    exporter.add(event, flush=span.parent_id is None)
+
+
+@contextmanager
+def span(name: str, **args):
+    """
+    记录代码块的嵌套span
+
+    Args:
+        name: span名称
+        **args: 附加属性
+    """
+    current = begin_span(name, **args)
+    try:
+        yield current
+    except Exception as e:
+        if current is not None:
+            current.set("error", str(e))
+        raise
+    finally:
+        end_span(current)
+
+
+def traced(name: str):
+    """
+    装饰器：把整个函数调用记录为一个span
+
+    Args:
+        name: span名称
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_headers(base_url: str) -> Dict[str, str]:
+    """
+    生成向下游HTTP请求传递trace ID的请求头（只发给本机的服务，如模拟LLM服务，不把内部trace ID发给第三方接口）
+
+    Args:
+        base_url: 下游服务的地址
+
+    Returns:
+        请求头字典，不在trace中或下游不是本机服务时为空
+    """
+    trace_id = _current_trace_id.get()
+    if not trace_id or urlparse(base_url).hostname not in _LOCAL_HOSTS:
+        return {}
+    return {"X-Trace-Id": trace_id}
@@ -0,0 +1,150 @@
+"""
+单轮时间预算 - 一轮对话（调度+生成）的截止时间通过contextvars传递，各环节据此降级
+
+Bridge处理一轮对话时设置截止时间；调度最多占用其中一部分，超出时在本地选出说话者；
+模型路由按剩余时间设置请求超时、不再重试；流式生成接近截止时间时停止，提交已生成的部分并标记为截断。
+每轮的耗时和是否在预算内完成汇总为延迟目标（SLO）达成情况。
+"""
+
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+from config import TURN_DEADLINE_SECONDS
+
+
+class DeadlineExceeded(TimeoutError):
+    """本轮（或当前环节）的时间预算已用完"""
+
+
+class TurnBudget:
+    __slots__ = ("seconds", "started", "deadline", "scheduler_fallback", "truncated")
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.started = time.perf_counter()
+        self.deadline = self.started + seconds
+        self.scheduler_fallback = False  # 调度超时，由本地选出说话者
+        self.truncated = False  # 生成接近截止时间被截断
+
+
+_budget: contextvars.ContextVar = contextvars.ContextVar("turn_budget", default=None)
+_stage_deadline: contextvars.ContextVar = contextvars.ContextVar("turn_stage_deadline", default=None)
+
+
+def current_budget() -> Optional[TurnBudget]:
+    """
+    获取当前上下文中的单轮时间预算（没有设置时返回None）
+    """
+    return _budget.get()
+
+
+def remaining() -> Optional[float]:
+    """
+    获取距截止时间（当前环节有更早的截止时间时取较早者）的剩余秒数，没有时间预算时返回None
+    """
+    budget = _budget.get()
+    if budget is None:
+        return None
+    deadline = budget.deadline
+    stage_deadline = _stage_deadline.get()
+    if stage_deadline is not None:
+        deadline = min(deadline, stage_deadline)
+    return deadline - time.perf_counter()
+
+
+def check_deadline() -> None:
+    """
+    时间预算已用完时抛出DeadlineExceeded
+    """
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded("本轮的时间预算已用完")
+
+
+@contextmanager
+def stage(seconds: float) -> Iterator[None]:
+    """
+    在代码块内把当前环节限制在seconds秒以内（没有单轮时间预算时不限制）
+    """
+    if _budget.get() is None:
+        yield
+        return
+    token = _stage_deadline.set(time.perf_counter() + seconds)
+    try:
+        yield
+    finally:
+        _stage_deadline.reset(token)
+
+
+class TurnSLO:
+    def __init__(self, window: int = 1000):
+        """
+        初始化延迟目标统计
+
+        Args:
+            window: 计算百分位数的最近轮数
+        """
+        self.window = window
+        self._lock = threading.Lock()
+        self._latencies: List[float] = []
+        self.stats = {"turns": 0, "met": 0, "scheduler_fallbacks": 0, "truncated": 0}
+
+    def record(self, budget: TurnBudget, elapsed: float) -> None:
+        """
+        记录一轮对话的耗时
+        """
+        with self._lock:
+            self.stats["turns"] += 1
+            self.stats["met"] += elapsed <= budget.seconds
+            self.stats["scheduler_fallbacks"] += budget.scheduler_fallback
+            self.stats["truncated"] += budget.truncated
+            self._latencies.append(elapsed)
+            if len(self._latencies) > self.window:
+                del self._latencies[:len(self._latencies) - self.window]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        获取延迟目标统计
+
+        Returns:
+            轮数、预算内完成的比例、调度降级和生成截断次数、最近各轮耗时的p50/p95/p99（秒）
+        """
+        with self._lock:
+            stats: Dict[str, Any] = dict(self.stats)
+            ordered = sorted(self._latencies)
+        stats["deadline_seconds"] = TURN_DEADLINE_SECONDS
+        stats["attainment"] = round(stats["met"] / stats["turns"], 4) if stats["turns"] else None
+        for name, p in (("p50", 50), ("p95", 95), ("p99", 99)):
+            stats[name] = round(ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))], 3) \
+                if ordered else None
+        return stats
+
+
+turn_slo = TurnSLO()
+
+
+@contextmanager
+def turn_budget(seconds: Optional[float] = None) -> Iterator[Optional[TurnBudget]]:
+    """
+    在代码块内设置单轮时间预算，结束时计入延迟目标统计
+
+    Args:
+        seconds: 时间预算（秒，不大于0时不限制），默认使用TURN_DEADLINE_SECONDS
+
+    Yields:
+        单轮时间预算（不限制时为None），调用方可从中读取是否降级、是否截断
+    """
+    if seconds is None:
+        seconds = TURN_DEADLINE_SECONDS
+    if seconds <= 0:
+        yield None
+        return
+    budget = TurnBudget(seconds)
+    token = _budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _budget.reset(token)
+        turn_slo.record(budget, time.perf_counter() - budget.started)
@@ -0,0 +1,272 @@
+"""
+用量统计 - 按会话、角色、调用点和API密钥汇总token用量与成本，定期写入磁盘
+
+会话、角色和是否为后台任务通过contextvars传递，LLM调用处不需要逐层传参。
+合并了多个会话请求的调用（跨会话调度合批）按各会话的提示词占比分摊用量。
+设置了会话token配额时，接近配额先让后台任务（自动对话等）退避，超出配额后拒绝所有请求。
+"""
+
+import atexit
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Optional
+from config import (
+    USAGE_LOG_PATH,
+    USAGE_FLUSH_INTERVAL,
+    USAGE_SESSION_TOKEN_QUOTA,
+    USAGE_BACKGROUND_SOFT_RATIO,
+    USAGE_BACKGROUND_DELAY
+)
+from turn_deadline import remaining
+
+_session: contextvars.ContextVar = contextvars.ContextVar("usage_session", default="default")
+_character: contextvars.ContextVar = contextvars.ContextVar("usage_character", default=None)
+_background: contextvars.ContextVar = contextvars.ContextVar("usage_background", default=False)
+_shares: contextvars.ContextVar = contextvars.ContextVar("usage_shares", default=None)
+
+
+class UsageQuotaExceeded(RuntimeError):
+    """会话的token用量超出配额"""
+
+
+def _cached_tokens(usage) -> int:
+    # DeepSeek返回prompt_cache_hit_tokens，OpenAI兼容接口返回prompt_tokens_details.cached_tokens
+    cached = getattr(usage, "prompt_cache_hit_tokens", None)
+    if cached is None:
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = getattr(details, "cached_tokens", None) if details else None
+    return cached or 0
+
+
+def _split_entry(entry: Dict[str, float], shares: Dict[str, float]) -> Dict[str, Dict[str, float]]:
+    """
+    按权重把一次调用的用量分摊到多个会话（每个会话各计一次调用，token按最大余数法取整，合计不变）
+    """
+    total_weight = sum(shares.values()) or 1.0
+    parts = {session: {"calls": 1} for session in shares}
+    for name, value in entry.items():
+        if name == "calls":
+            continue
+        exact = {session: value * weight / total_weight for session, weight in shares.items()}
+        if name == "cost":
+            for session, amount in exact.items():
+                parts[session][name] = amount
+            continue
+        floors = {session: int(amount) for session, amount in exact.items()}
+        leftover = int(value) - sum(floors.values())
+        for session in sorted(exact, key=lambda s: exact[s] - floors[s], reverse=True)[:leftover]:
+            floors[session] += 1
+        for session, amount in floors.items():
+            parts[session][name] = amount
+    return parts
+
+
+class UsageTracker:
+    DIMENSIONS = ("sessions", "characters", "call_sites", "keys")
+
+    def __init__(self, log_path: str = USAGE_LOG_PATH, flush_interval: float = USAGE_FLUSH_INTERVAL):
+        """
+        初始化用量统计
+
+        Args:
+            log_path: 汇总数据写入的文件
+            flush_interval: 写入磁盘的间隔（秒）
+        """
+        self.log_path = log_path
+        self.flush_interval = flush_interval
+        self.totals = self._empty()
+        self.aggregates: Dict[str, Dict[str, Dict[str, float]]] = {dimension: {} for dimension in self.DIMENSIONS}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._flush_thread = None
+
+    @staticmethod
+    def _empty() -> Dict[str, float]:
+        return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "cost": 0.0}
+
+    @staticmethod
+    def _rounded(bucket: Dict[str, float]) -> Dict[str, float]:
+        return dict(bucket, cost=round(bucket["cost"], 6))
+
+    def record(self, call_site: str, api_key: str, usage, cost: float = 0.0) -> None:
+        """
+        记录一次LLM调用的用量（会话和角色取自当前上下文）
+
+        Args:
+            call_site: 调用点名称
+            api_key: 使用的API密钥
+            usage: 接口返回的用量对象
+            cost: 本次调用的成本
+        """
+        entry = {
+            "calls": 1,
+            "prompt_tokens": usage.prompt_tokens or 0,
+            "completion_tokens": usage.completion_tokens or 0,
+            "cached_tokens": _cached_tokens(usage),
+            "cost": cost
+        }
+        session = _session.get()
+        character = _character.get()
+        shares = _shares.get()
+        keys = {
+            "sessions": session if not shares else None,
+            "characters": f"{session}/{character}" if character and not shares else None,  # 不同会话可能有同名角色
+            "call_sites": call_site,
+            "keys": f"...{api_key[-4:]}"
+        }
+        with self._lock:
+            for name, value in entry.items():
+                self.totals[name] += value
+            for dimension, key in keys.items():
+                if key is None:
+                    continue
+                bucket = self.aggregates[dimension].setdefault(key, self._empty())
+                for name, value in entry.items():
+                    bucket[name] += value
+            if shares:
+                for share_session, part in _split_entry(entry, shares).items():
+                    bucket = self.aggregates["sessions"].setdefault(share_session, self._empty())
+                    for name, value in part.items():
+                        bucket[name] += value
+            self._dirty = True
+        self._ensure_flush_thread()
+
+    def session_tokens(self, session: str) -> int:
+        """
+        获取会话已使用的token总数
+        """
+        with self._lock:
+            bucket = self.aggregates["sessions"].get(session)
+            return int(bucket["prompt_tokens"] + bucket["completion_tokens"]) if bucket else 0
+
+    def check_quota(self) -> float:
+        """
+        在发送请求前检查当前会话的配额：后台任务超过软上限后按接近配额的程度退避，超出配额时拒绝
+
+        Returns:
+            本次退避的时间（秒），从软上限处的0线性增加到配额处的USAGE_BACKGROUND_DELAY，且不超过本轮剩余时间
+
+        Raises:
+            UsageQuotaExceeded: 会话用量已超出配额
+        """
+        if not USAGE_SESSION_TOKEN_QUOTA:
+            return 0.0
+        session = _session.get()
+        used = self.session_tokens(session)
+        if used >= USAGE_SESSION_TOKEN_QUOTA:
+            raise UsageQuotaExceeded(f"会话 {session} 的token用量已达到配额 {USAGE_SESSION_TOKEN_QUOTA}")
+        soft_limit = USAGE_SESSION_TOKEN_QUOTA * USAGE_BACKGROUND_SOFT_RATIO
+        if not _background.get() or used < soft_limit:
+            return 0.0
+        # 后台任务先让路，把剩余配额留给用户直接触发的请求
+        delay = USAGE_BACKGROUND_DELAY * (used - soft_limit) / max(1.0, USAGE_SESSION_TOKEN_QUOTA - soft_limit)
+        left = remaining()
+        if left is not None:
+            delay = min(delay, max(0.0, left))
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def snapshot(self, session: Optional[str] = None) -> Dict[str, Any]:
+        """
+        获取用量汇总
+
+        Args:
+            session: 只返回指定会话的用量（为None时返回全部维度）
+
+        Returns:
+            用量汇总
+        """
+        with self._lock:
+            if session is not None:
+                bucket = self._rounded(self.aggregates["sessions"].get(session, self._empty()))
+                result = {"session": session, "usage": bucket}
+                if USAGE_SESSION_TOKEN_QUOTA:
+                    result["quota"] = USAGE_SESSION_TOKEN_QUOTA
+                return result
+            return {
+                "updated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                "totals": self._rounded(self.totals),
+                **{dimension: {key: self._rounded(bucket) for key, bucket in buckets.items()}
+                   for dimension, buckets in self.aggregates.items()}
+            }
+
+    def flush(self) -> None:
+        """
+        把用量汇总写入磁盘（先写临时文件再替换，避免写入中途被读取）
+        """
+        with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+        data = self.snapshot()
+        try:
+            directory = os.path.dirname(self.log_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.log_path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(temp_path, self.log_path)
+        except OSError as e:
+            print(f"⚠️ 用量统计写入失败: {str(e)}")
+
+    def _ensure_flush_thread(self) -> None:
+        if self._flush_thread is None:
+            with self._lock:
+                if self._flush_thread is None:
+                    self._flush_thread = threading.Thread(target=self._flush_loop, daemon=True)
+                    self._flush_thread.start()
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+
+usage_tracker = UsageTracker()
+atexit.register(usage_tracker.flush)
+
+
+@contextmanager
+def attribute(session: Optional[str] = None, character: Optional[str] = None, background: Optional[bool] = None,
+              shares: Optional[Dict[str, float]] = None):
+    """
+    在代码块内把LLM用量归属到指定的会话/角色
+
+    Args:
+        session: 会话标识
+        character: 角色名
+        background: 是否为后台任务
+        shares: 会话 -> 权重（一次调用合并了多个会话的请求时，用量按权重分摊到这些会话）
+    """
+    tokens = []
+    for var, value in ((_session, session), (_character, character), (_background, background), (_shares, shares)):
+        if value is not None:
+            tokens.append((var, var.set(value)))
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def set_session(session: str) -> None:
+    """
+    设置当前上下文所属的会话（Bridge在每个请求开始时调用）
+
+    Args:
+        session: 会话标识
+    """
+    _session.set(session)
+
+
+def get_session() -> str:
+    """
+    获取当前上下文所属的会话
+    """
+    return _session.get()
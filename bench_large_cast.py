@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+群戏基准测试 - 测量角色数增长时每轮调度和写入历史的本地开销（不调用LLM）
+
+模拟一个群戏会话：每轮选出调度候选角色并构建调度提示词，从候选中随机选一位说话（偶尔点名其他角色、
+偶尔有角色进场/离场），创建（或取出）该角色的智能体，把台词写入历史，并查询一次角色信息。
+对每个角色数报告：每轮耗时、调度提示词长度、候选角色数和已创建的角色智能体数。
+加上 --no-prefilter 可对比不预筛选候选角色时的结果。
+
+用法：
+    python bench_large_cast.py --casts 10,30,100 --turns 2000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backg"))
+
+PHRASES = ["（看了看周围）", "我觉得我们应该先把情况弄清楚，", "再决定下一步怎么做。", "你说得对，",
+           "可是时间已经不多了。", "（压低声音）这件事没那么简单。", "先去问问其他人吧。", "我有一个想法，"]
+
+
+def run(cast: int, turns: int) -> dict:
+    from config import API_KEYS, USER_CHARACTER_NAME
+    from scheduler_agent import SchedulerAgent
+
+    rng = random.Random(cast)
+    names = [f"群众{i}" for i in range(cast)]
+    scheduler = SchedulerAgent(API_KEYS[0])
+    scheduler.scene_setting = "夜晚的集市，人声鼎沸"
+    scheduler.create_characters([{"name": USER_CHARACTER_NAME, "info": "用户扮演的主角"}] +
+                                [{"name": name, "info": f"集市上的{name}"} for name in names])
+
+    timings = {"schedule": 0.0, "agent": 0.0, "history": 0.0, "info": 0.0}
+    prompt_chars = 0
+    candidate_count = 0
+    for _ in range(turns):
+        start = time.perf_counter()
+        history = scheduler.conversation_history.tail(10)
+        candidates = scheduler._scheduling_candidates(history)
+        prompt = scheduler._scheduling_prompt(candidates, history, "")
+        timings["schedule"] += time.perf_counter() - start
+        prompt_chars += len(prompt)
+        candidate_count += len(candidates)
+
+        speaker = rng.choice(candidates)
+        start = time.perf_counter()
+        scheduler.get_character_agent(speaker)
+        timings["agent"] += time.perf_counter() - start
+
+        text = "".join(rng.choice(PHRASES) for _ in range(rng.randint(2, 4)))
+        if rng.random() < 0.3:
+            text = f"{rng.choice(names)}，{text}"
+        start = time.perf_counter()
+        scheduler.add_to_history(f"{speaker}：{text}", speaker)
+        if rng.random() < 0.02:
+            name = rng.choice(names)
+            scheduler.set_presence(name, name in scheduler.absent)
+        timings["history"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        scheduler.get_characters_info()
+        timings["info"] += time.perf_counter() - start
+
+    return {
+        "per_turn_us": {key: value / turns * 1e6 for key, value in timings.items()},
+        "prompt_chars": prompt_chars / turns,
+        "candidates": candidate_count / turns,
+        "materialized": len(scheduler.characters) - 1
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="群戏基准测试")
+    parser.add_argument("--casts", default="10,30,100", help="AI角色数（逗号分隔）")
+    parser.add_argument("--turns", type=int, default=2000, help="每个角色数模拟的轮数")
+    parser.add_argument("--no-prefilter", action="store_true", help="不预筛选调度候选角色（列出全部在场角色）")
+    args = parser.parse_args()
+
+    if args.no_prefilter:
+        os.environ["ZGCA_SCHEDULING_MAX_CANDIDATES"] = str(10 ** 6)
+    os.environ.setdefault("ZGCA_LOG_DECISIONS", "0")
+
+    print(f"🎭 群戏基准：每个角色数模拟 {args.turns} 轮（{'不预筛选' if args.no_prefilter else '预筛选'}候选角色）")
+    print(f"   {'角色数':<6} {'调度µs':>8} {'取智能体µs':>10} {'写历史µs':>8} {'角色信息µs':>10} "
+          f"{'提示词字数':>10} {'候选数':>6} {'已创建智能体':>12}")
+    for cast in (int(value) for value in args.casts.split(",")):
+        result = run(cast, args.turns)
+        per_turn = result["per_turn_us"]
+        print(f"   {cast:<9} {per_turn['schedule']:>8.1f} {per_turn['agent']:>13.1f} {per_turn['history']:>11.1f} "
+              f"{per_turn['info']:>13.1f} {result['prompt_chars']:>14.0f} {result['candidates']:>9.1f} "
+              f"{result['materialized']:>17}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+对话历史内存基准测试 - 对比字符串列表与紧凑台词存储的内存占用和读取耗时
+
+模拟一个长会话：调度agent和每个AI角色各保存一份历史，每轮追加一条台词并读取最近10条构建提示词。
+对比三种存储方式：
+    列表：每份历史是一个"名字：台词"字符串列表（原来的实现）
+    紧凑存储：台词只保存一份（数组+UTF-16正文），各历史只保存序号
+    紧凑存储+临时文件：正文超过上限后写入临时文件，通过内存映射读取
+
+用法：
+    python bench_memory.py --turns 200000 --characters 4
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backg"))
+
+from history import ConversationHistory, TurnStore  # noqa: E402
+
+PHRASES = ["（看了看周围）", "我觉得我们应该先把情况弄清楚，", "再决定下一步怎么做。", "你说得对，",
+           "可是时间已经不多了。", "（压低声音）这件事没那么简单。", "先去问问其他人吧。", "我有一个想法，"]
+
+
+def make_lines(count: int, speakers: list) -> list:
+    """
+    生成模拟台词（每条约40~80字）
+    """
+    rng = random.Random(0)
+    return [(speaker, "".join(rng.choice(PHRASES) for _ in range(rng.randint(3, 6))))
+            for speaker in (rng.choice(speakers) for _ in range(count))]
+
+
+def run_lists(lines: list, characters: list) -> tuple:
+    scheduler_history = []
+    character_histories = {name: [] for name in characters}
+    read_seconds = 0.0
+    for speaker, text in lines:
+        line = f"{speaker}：{text}"  # 与模型返回的台词一样，每条都是新字符串
+        start = time.perf_counter()
+        "\n".join(character_histories.get(speaker, scheduler_history)[-10:])
+        read_seconds += time.perf_counter() - start
+        scheduler_history.append(line)
+        for history in character_histories.values():
+            history.append(line)
+    return read_seconds, (scheduler_history, character_histories)
+
+
+def run_store(lines: list, characters: list, spill_bytes: int) -> tuple:
+    store = TurnStore(spill_bytes=spill_bytes)
+    scheduler_history = ConversationHistory(store)
+    character_histories = {name: ConversationHistory(store) for name in characters}
+    read_seconds = 0.0
+    for speaker, text in lines:
+        line = f"{speaker}：{text}"
+        start = time.perf_counter()
+        "\n".join(character_histories.get(speaker, scheduler_history).tail(10))
+        read_seconds += time.perf_counter() - start
+        turn = scheduler_history.append(line, speaker)
+        for history in character_histories.values():
+            history.append(turn)
+    return read_seconds, (scheduler_history, character_histories)
+
+
+def measure(label: str, target, *args):
+    # 计时和内存统计分开运行（tracemalloc会显著拖慢内存分配）
+    start = time.perf_counter()
+    read_seconds, histories = target(*args)
+    elapsed = time.perf_counter() - start
+    del histories
+    tracemalloc.start()
+    _, histories = target(*args)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    turns = len(args[0])
+    print(f"   {label:<14} 内存 {current / 1024 / 1024:>8.2f} MB  峰值 {peak / 1024 / 1024:>8.2f} MB  "
+          f"每条 {current / turns:>6.1f} B  总耗时 {elapsed:>6.2f}s  读取最近10条 {read_seconds / turns * 1e6:>6.2f}µs/次")
+    return histories
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="对话历史内存基准测试")
+    parser.add_argument("--turns", type=int, default=200000, help="台词条数")
+    parser.add_argument("--characters", type=int, default=4, help="AI角色数")
+    parser.add_argument("--spill-mb", type=float, default=1.0, help="紧凑存储+临时文件时内存中正文的上限（MB）")
+    args = parser.parse_args()
+
+    characters = [f"角色{i}" for i in range(args.characters)]
+    lines = make_lines(args.turns, characters + ["我"])
+    print(f"🧠 {args.turns} 条台词，{args.characters} 个AI角色（每个角色和调度agent各一份历史）")
+    measure("列表", run_lists, lines, characters)
+    measure("紧凑存储", run_store, lines, characters, 0)
+    scheduler_history, _ = measure("紧凑存储+临时文件", run_store, lines, characters, int(args.spill_mb * 1024 * 1024))
+    print(f"   临时文件：{scheduler_history.store.get_stats()['spilled_bytes'] / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
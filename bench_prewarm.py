@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+连接预热基准测试 - 对比冷连接、预热后和稳态下的首次请求延迟
+
+在本地启动HTTPS模拟LLM服务（自签名证书，可设置每条新连接的建连延迟），
+分别测量：不预热时的首次请求、预热后的首次请求、以及连接复用的稳态请求。
+
+用法：
+    python bench_prewarm.py --connect-delay 0.15 --runs 5
+"""
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fake_llm_server import FakeLLMConfig, start_server
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backg")
+
+
+def create_self_signed_cert(directory: str) -> tuple:
+    """
+    使用openssl生成localhost自签名证书
+
+    Args:
+        directory: 证书输出目录
+
+    Returns:
+        (证书文件, 私钥文件)
+    """
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    subprocess.run([
+        "openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+        "-keyout", keyfile, "-out", certfile, "-subj", "/CN=127.0.0.1",
+        "-addext", "subjectAltName=IP:127.0.0.1"
+    ], check=True, capture_output=True)
+    return certfile, keyfile
+
+
+def timed_completion(llm_client, api_key: str) -> float:
+    """
+    发送一次台词请求并返回耗时（秒）
+    """
+    start = time.perf_counter()
+    llm_client.get_client(api_key).chat.completions.create(
+        model="deepseek-chat",
+        messages=[{"role": "system", "content": "你现在扮演角色：小明"}, {"role": "user", "content": "你好"}],
+        max_tokens=64
+    )
+    return time.perf_counter() - start
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="连接预热基准测试")
+    parser.add_argument("--port", type=int, default=8960, help="HTTPS模拟服务端口")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟生成延迟（秒）")
+    parser.add_argument("--connect-delay", type=float, default=0.15, help="每条新连接的建连延迟（秒）")
+    parser.add_argument("--runs", type=int, default=5, help="重复次数")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = create_self_signed_cert(directory)
+        config = FakeLLMConfig(latency=args.latency, connect_delay=args.connect_delay)
+        start_server(args.port, config, certfile, keyfile)
+
+        # 必须在导入backg模块之前设置，config.py在导入时读取环境变量
+        os.environ["DEEPSEEK_BASE_URL"] = f"https://127.0.0.1:{args.port}"
+        os.environ["ZGCA_CA_BUNDLE"] = certfile
+        os.environ["ZGCA_TRACE"] = "0"
+        sys.path.insert(0, BACKEND_DIR)
+        import llm_client
+
+        api_key = "sk-bench"
+        cold, warm, steady = [], [], []
+        for _ in range(args.runs):
+            llm_client.reset()
+            cold.append(timed_completion(llm_client, api_key))
+            steady.extend(timed_completion(llm_client, api_key) for _ in range(3))
+
+            llm_client.reset()
+            llm_client.prewarm([api_key])
+            warm.append(timed_completion(llm_client, api_key))
+
+        print(f"🔒 HTTPS模拟服务 建连延迟 {args.connect_delay * 1000:.0f} ms  生成延迟 {args.latency * 1000:.0f} ms")
+        for label, values in [("冷连接首次请求", cold), ("预热后首次请求", warm), ("稳态请求", steady)]:
+            values_ms = [v * 1000 for v in values]
+            print(f"   {label:<10} 中位数 {statistics.median(values_ms):>7.1f} ms  最大 {max(values_ms):>7.1f} ms")
+        print(f"   模拟服务共建立 {config.total_connections} 条连接")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨进程配额协调基准测试 - 多个进程共用同一个API密钥时的吞吐量和429次数
+
+在本地启动按密钥限流的模拟LLM服务，分别在关闭和开启共享配额时启动多个工作进程
+并发请求，对比成功吞吐量（与服务端限额相比）和服务端返回的429次数。
+
+用法：
+    python bench_quota.py --processes 4 --threads 4 --rps 10 --duration 10
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from fake_llm_server import FakeLLMConfig, start_server
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backg")
+API_KEY = "sk-bench-quota"
+
+
+def run_worker(threads: int, duration: float):
+    """
+    工作进程：多个线程通过模型路由持续发送台词请求，结束后输出JSON结果
+    """
+    sys.path.insert(0, BACKEND_DIR)
+    from model_router import create_completion
+
+    results = {"ok": 0, "failed": 0}
+    lock = threading.Lock()
+    deadline = time.time() + duration
+
+    def loop():
+        while time.time() < deadline:
+            try:
+                create_completion("character", API_KEY, max_tokens=16,
+                                  messages=[{"role": "system", "content": "你现在扮演角色：小明"},
+                                            {"role": "user", "content": "你好"}])
+                outcome = "ok"
+            except Exception:
+                outcome = "failed"
+            with lock:
+                results[outcome] += 1
+
+    workers = [threading.Thread(target=loop) for _ in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    print(json.dumps(results))
+
+
+def run_stage(args, quota_enabled: bool, port: int) -> dict:
+    """
+    启动一组工作进程并统计结果
+
+    Args:
+        args: 命令行参数
+        quota_enabled: 是否开启跨进程配额协调
+        port: 模拟服务端口
+
+    Returns:
+        成功数、失败数、429次数和成功吞吐量
+    """
+    config = FakeLLMConfig(latency=args.latency, rate_limit_rps=args.rps, rate_limit_burst=args.burst)
+    server = start_server(port, config)
+    with tempfile.TemporaryDirectory() as directory:
+        env = dict(os.environ,
+                   DEEPSEEK_BASE_URL=f"http://127.0.0.1:{port}",
+                   ZGCA_TRACE="0",
+                   ZGCA_QUOTA="1" if quota_enabled else "0",
+                   ZGCA_QUOTA_PATH=os.path.join(directory, "quota.bin"),
+                   ZGCA_QUOTA_RPM=str(args.rps * 60),
+                   ZGCA_QUOTA_BURST=str(args.burst),
+                   PYTHONIOENCODING="utf-8")
+        command = [sys.executable, os.path.abspath(__file__), "--worker",
+                   "--threads", str(args.threads), "--duration", str(args.duration)]
+        start = time.perf_counter()
+        processes = [subprocess.Popen(command, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                      text=True, encoding="utf-8") for _ in range(args.processes)]
+        totals = {"ok": 0, "failed": 0}
+        for process in processes:
+            output, _ = process.communicate()
+            lines = output.strip().splitlines()
+            result = json.loads(lines[-1]) if lines else {"ok": 0, "failed": 0}
+            totals["ok"] += result["ok"]
+            totals["failed"] += result["failed"]
+        elapsed = time.perf_counter() - start
+    server.shutdown()
+    server.server_close()
+
+    totals["rate_limited"] = config.total_rate_limited
+    totals["throughput"] = totals["ok"] / elapsed
+    return totals
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="跨进程配额协调基准测试")
+    parser.add_argument("--processes", type=int, default=4, help="工作进程数")
+    parser.add_argument("--threads", type=int, default=4, help="每个进程的并发线程数")
+    parser.add_argument("--rps", type=float, default=10.0, help="模拟服务对单个密钥的限额（每秒请求数）")
+    parser.add_argument("--burst", type=float, default=5.0, help="模拟服务对单个密钥允许的突发请求数")
+    parser.add_argument("--latency", type=float, default=0.05, help="模拟生成延迟（秒）")
+    parser.add_argument("--duration", type=float, default=10.0, help="每组测试时长（秒）")
+    parser.add_argument("--port", type=int, default=8962, help="模拟服务端口")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args.threads, args.duration)
+        return
+
+    print(f"🔑 单个密钥，服务端限额 {args.rps:.1f} 请求/秒（突发 {args.burst:.0f}），"
+          f"{args.processes} 个进程 × {args.threads} 个线程，每组 {args.duration:.0f} 秒")
+    for label, quota_enabled, port in [("进程内各自限流", False, args.port), ("共享配额协调", True, args.port + 1)]:
+        result = run_stage(args, quota_enabled, port)
+        print(f"   {label:<8} 成功 {result['ok']:>5}  失败 {result['failed']:>4}  "
+              f"429 {result['rate_limited']:>6}  成功吞吐 {result['throughput']:>6.2f} 请求/秒")
+
+
+if __name__ == "__main__":
+    main()
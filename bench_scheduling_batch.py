@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+跨会话调度合批基准测试 - 对比不同合批窗口下并发会话的调度延迟、吞吐量和LLM调用次数
+
+在本地启动模拟LLM服务（可按密钥限流、限制并发数），多个会话各自在线程中连续调度
+（每次调度前写入一条台词，多轮规划关闭，每次调度都需要调用模型），
+依次以不合批和各个合批窗口运行，输出每次调度的p50/p95/p99延迟、吞吐量、实际LLM请求数、429次数和平均批大小。
+
+用法：
+    python bench_scheduling_batch.py --sessions 16 --decisions 20 --windows 0,2,5,10 --rps 5
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+from fake_llm_server import FakeLLMConfig, start_server
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backg"))
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))]
+
+
+def run(sessions: int, decisions: int, window_ms: float, max_size: int, llm_config: FakeLLMConfig) -> dict:
+    from config import API_KEYS, USER_CHARACTER_NAME
+    from scheduler_agent import SchedulerAgent
+    from scheduling_batcher import SchedulingBatcher, set_scheduling_batcher
+
+    batcher = SchedulingBatcher(window_ms, max_size) if window_ms > 0 else None
+    set_scheduling_batcher(batcher)
+    schedulers = []
+    for i in range(sessions):
+        scheduler = SchedulerAgent(API_KEYS[i % len(API_KEYS)])
+        scheduler.scene_setting = "深夜的侦探事务所"
+        scheduler.create_characters([{"name": USER_CHARACTER_NAME, "info": "用户扮演的主角"},
+                                     {"name": "小明", "info": "开朗健谈"},
+                                     {"name": "小红", "info": "冷静理性"},
+                                     {"name": "老王", "info": "沉稳寡言"}])
+        schedulers.append(scheduler)
+
+    latencies = []
+    lock = threading.Lock()
+
+    def loop(scheduler):
+        for round_num in range(1, decisions + 1):
+            scheduler.add_to_history(f"{USER_CHARACTER_NAME}：这是第{round_num}句，大家怎么看？")
+            start = time.perf_counter()
+            scheduler.decide_next_ai_speaker(f"这是第{round_num}轮对话")
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    requests_before = llm_config.total_requests
+    limited_before = llm_config.total_rate_limited
+    start = time.perf_counter()
+    threads = [threading.Thread(target=loop, args=(scheduler,)) for scheduler in schedulers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    batch_stats = batcher.get_stats() if batcher is not None else {}
+    return {
+        "elapsed": elapsed,
+        "throughput": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "llm_requests": llm_config.total_requests - requests_before,
+        "rate_limited": llm_config.total_rate_limited - limited_before,
+        "average_batch_size": batch_stats.get("average_batch_size", 1.0),
+        "fallbacks": batch_stats.get("fallbacks", 0)
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="跨会话调度合批基准测试")
+    parser.add_argument("--sessions", type=int, default=16, help="并发会话数")
+    parser.add_argument("--decisions", type=int, default=20, help="每个会话的调度次数")
+    parser.add_argument("--windows", default="0,2,5,10", help="合批窗口（毫秒，逗号分隔，0表示不合批）")
+    parser.add_argument("--max-size", type=int, default=8, help="每批最多合并的调度请求数")
+    parser.add_argument("--llm-port", type=int, default=8960, help="模拟LLM服务端口")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="模拟LLM每次请求的固定延迟（秒）")
+    parser.add_argument("--per-token-latency", type=float, default=0.002, help="模拟LLM每个生成token的延迟（秒）")
+    parser.add_argument("--rps", type=float, default=0.0, help="模拟LLM每个密钥每秒允许的请求数（0为不限）")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="模拟LLM最大并发数（0为不限）")
+    args = parser.parse_args()
+
+    os.environ["DEEPSEEK_BASE_URL"] = f"http://127.0.0.1:{args.llm_port}"
+    os.environ["ZGCA_SPEAKER_MODEL"] = "0"
+    os.environ.setdefault("ZGCA_LOG_DECISIONS", "0")
+    os.environ.setdefault("ZGCA_TRACE", "0")
+    os.environ.setdefault("ZGCA_SESSION_STORE", "0")
+    llm_config = FakeLLMConfig(args.llm_latency, args.per_token_latency, max_concurrency=args.max_concurrency,
+                               rate_limit_rps=args.rps, rate_limit_burst=max(1.0, args.rps))
+    start_server(args.llm_port, llm_config)
+
+    print(f"🧭 调度合批基准：{args.sessions} 个会话各调度 {args.decisions} 次，每批最多 {args.max_size} 个请求")
+    print(f"   {'窗口ms':>6} {'吞吐量/s':>9} {'p50':>7} {'p95':>7} {'p99':>7} {'LLM请求':>8} {'429':>5} "
+          f"{'平均批大小':>9} {'回退':>5}")
+    for window in (float(value) for value in args.windows.split(",")):
+        result = run(args.sessions, args.decisions, window, args.max_size, llm_config)
+        print(f"   {window:>8.1f} {result['throughput']:>11.1f} {result['p50']:>7.3f} {result['p95']:>7.3f} "
+              f"{result['p99']:>7.3f} {result['llm_requests']:>10} {result['rate_limited']:>5} "
+              f"{result['average_batch_size']:>13.2f} {result['fallbacks']:>6}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bridge冷启动基准测试 - 统计导入耗时、就绪信号耗时和首个请求耗时
+
+用法：
+    python bench_startup.py --runs 5
+    python bench_startup.py --importtime   # 额外输出导入耗时最高的模块
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backg")
+
+
+def measure_once(port: int) -> dict:
+    """
+    启动一次Bridge并测量各阶段耗时
+
+    Args:
+        port: Bridge端口
+
+    Returns:
+        各阶段耗时（秒）
+    """
+    env = dict(os.environ, FLASK_PORT=str(port), PYTHONIOENCODING="utf-8", ZGCA_TRACE="0")
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "electron_bridge.py"], cwd=BACKEND_DIR, env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, encoding="utf-8")
+    try:
+        ready = None
+        for line in process.stdout:
+            if "BRIDGE_READY" in line:
+                ready = time.perf_counter() - start
+                break
+        if ready is None:
+            raise RuntimeError("Bridge未输出就绪信号")
+
+        # 首个请求会在监听队列中等待Flask和剧本系统初始化完成
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/status", timeout=30) as response:
+            json.loads(response.read())
+        first_response = time.perf_counter() - start
+        return {"ready": ready, "first_response": first_response}
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def print_import_times(top: int):
+    """
+    输出导入Bridge及openai时耗时最高的模块
+
+    Args:
+        top: 输出的模块数量
+    """
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import electron_bridge, flask, flask_cors, openai"],
+        cwd=BACKEND_DIR, capture_output=True, text=True, encoding="utf-8"
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line.split(":", 1)[1].split("|")
+        rows.append((int(cumulative_us), name))
+    rows.sort(reverse=True)
+    print(f"\n📦 累计导入耗时最高的 {top} 个模块:")
+    for cumulative_us, name in rows[:top]:
+        print(f"   {cumulative_us / 1000:>8.1f} ms  {name.strip()}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="Bridge冷启动基准测试")
+    parser.add_argument("--runs", type=int, default=5, help="重复次数")
+    parser.add_argument("--port", type=int, default=8902, help="Bridge端口")
+    parser.add_argument("--importtime", action="store_true", help="输出导入耗时最高的模块")
+    parser.add_argument("--top", type=int, default=15, help="--importtime输出的模块数量")
+    args = parser.parse_args()
+
+    results = [measure_once(args.port) for _ in range(args.runs)]
+    for key, label in [("ready", "就绪信号"), ("first_response", "首个请求完成")]:
+        values = [r[key] * 1000 for r in results]
+        print(f"⏱️ {label}: 中位数 {statistics.median(values):.1f} ms  "
+              f"最小 {min(values):.1f} ms  最大 {max(values):.1f} ms")
+
+    if args.importtime:
+        print_import_times(args.top)
+
+
+if __name__ == "__main__":
+    main()
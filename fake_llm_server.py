@@ -0,0 +1,382 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟LLM服务 - 兼容OpenAI Chat Completions接口，用于压测和离线调试
+
+用法：
+    python fake_llm_server.py --port 8950 --latency 0.3
+    然后以 DEEPSEEK_BASE_URL=http://127.0.0.1:8950 启动 electron_bridge.py
+"""
+
+import argparse
+import json
+import random
+import re
+import ssl
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SCRIPT_SETTING_TEMPLATE = """【场景设定】
+{scene}
+
+【主要角色】
+我|用户扮演的主角|普通人，好奇心强
+小明|开朗健谈|主角的老朋友，做事冲动
+小红|冷静理性|主角的同事，擅长分析
+老王|沉稳寡言|经验丰富的前辈
+
+【剧情大纲】
+众人围绕当前场景展开讨论，逐渐发现隐藏的问题，主角需要做出选择。"""
+
+
+class FakeLLMConfig:
+    def __init__(self, latency: float = 0.2, per_token_latency: float = 0.0,
+                 error_rate: float = 0.0, max_concurrency: int = 0, connect_delay: float = 0.0,
+                 rate_limit_rps: float = 0.0, rate_limit_burst: float = 1.0):
+        """
+        初始化模拟服务配置
+
+        Args:
+            latency: 每次请求的固定延迟（秒）
+            per_token_latency: 每个生成token的额外延迟（秒）
+            error_rate: 随机返回429错误的概率
+            max_concurrency: 最大并发请求数，超出时返回429（0表示不限制）
+            connect_delay: 每条新连接的额外建连延迟（秒），模拟DNS+TCP+TLS的往返耗时
+            rate_limit_rps: 每个API密钥每秒允许的请求数，超出时返回429（0表示不限制）
+            rate_limit_burst: 每个API密钥允许的瞬时突发请求数
+        """
+        self.latency = latency
+        self.per_token_latency = per_token_latency
+        self.error_rate = error_rate
+        self.max_concurrency = max_concurrency
+        self.connect_delay = connect_delay
+        self.rate_limit_rps = rate_limit_rps
+        self.rate_limit_burst = rate_limit_burst
+        self.key_buckets = {}  # API密钥 -> [令牌数, 更新时间]
+        self.total_rate_limited = 0
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_connections = 0
+        self.lock = threading.Lock()
+
+    def take_key_token(self, api_key: str) -> float:
+        """
+        按密钥的令牌桶限流（调用方需持有lock）
+
+        Returns:
+            0表示放行，否则为建议的重试间隔（秒）
+        """
+        if not self.rate_limit_rps:
+            return 0.0
+        now = time.time()
+        tokens, updated = self.key_buckets.get(api_key, (self.rate_limit_burst, now))
+        tokens = min(self.rate_limit_burst, tokens + (now - updated) * self.rate_limit_rps)
+        if tokens < 1:
+            self.key_buckets[api_key] = (tokens, now)
+            return (1 - tokens) / self.rate_limit_rps
+        self.key_buckets[api_key] = (tokens - 1, now)
+        return 0.0
+
+
+SCRIPT_SETTING_JSON = {
+    "characters": [
+        {"name": "我", "personality": "用户扮演的主角", "background": "普通人，好奇心强"},
+        {"name": "小明", "personality": "开朗健谈", "background": "主角的老朋友，做事冲动"},
+        {"name": "小红", "personality": "冷静理性", "background": "主角的同事，擅长分析"},
+        {"name": "老王", "personality": "沉稳寡言", "background": "经验丰富的前辈"}
+    ],
+    "plot_summary": "众人围绕当前场景展开讨论，逐渐发现隐藏的问题，主角需要做出选择。"
+}
+
+
+def build_reply(messages: list, json_mode: bool = False) -> str:
+    """
+    根据提示词构造模拟回复
+
+    Args:
+        messages: 请求中的消息列表
+        json_mode: 请求是否要求输出JSON对象
+
+    Returns:
+        模拟的回复文本
+    """
+    system_prompt = messages[0]["content"] if messages else ""
+    user_input = messages[-1]["content"] if messages else ""
+
+    # 合并的调度请求：按"【剧本N】"分段，每段单独作答，逐行输出"剧本编号: 回答"
+    sections = re.split(r'^【剧本(\d+)】\n', user_input, flags=re.MULTILINE)
+    if len(sections) > 1:
+        answers = []
+        for index, section in zip(sections[1::2], sections[2::2]):
+            requirement = re.match(r'要求：(.*)\n', section)
+            answers.append(f"{index}: " + build_reply([
+                {"role": "system", "content": requirement.group(1) if requirement else ""},
+                {"role": "user", "content": section}
+            ]))
+        return "\n".join(answers)
+
+    # 调度请求：从编号列出的候选角色中随机选择一个（尽量不选用户主角）
+    candidates = re.findall(r'^(\d+)\. (.+)$', user_input.split("最近对话：")[0], re.MULTILINE)
+    if candidates:
+        choices = [index for index, name in candidates if name != "我"] or [index for index, _ in candidates]
+        plan_match = re.search(r'接下来(\d+)轮', system_prompt)
+        choice = ",".join(random.choice(choices) for _ in range(int(plan_match.group(1)) if plan_match else 1))
+        return f"{choice}|推动剧情发展" if "调试模式" in system_prompt else choice
+
+    # 角色台词请求
+    name_match = re.search(r'你现在扮演角色：(.+)', system_prompt)
+    if name_match:
+        name = name_match.group(1).strip()
+        # 与真实模型一样，不设置停止序列时会接着替其他角色继续写
+        return (f"{name}：（看了看周围）我觉得我们应该先把情况弄清楚，再决定下一步怎么做。"
+                f"\n我：（点点头）好，那我们先从哪里开始？"
+                f"\n{name}：先去问问其他人吧。")
+
+    # 剧本设定请求
+    scene = user_input.strip()[:200] or "现代都市"
+    if json_mode:
+        return json.dumps({"scene_setting": scene, **SCRIPT_SETTING_JSON}, ensure_ascii=False)
+    return SCRIPT_SETTING_TEMPLATE.format(scene=scene)
+
+
+def apply_limits(reply: str, stop, max_tokens) -> tuple:
+    """
+    按停止序列和max_tokens截断回复（每个字符按一个token计）
+
+    Args:
+        reply: 完整回复
+        stop: 停止序列（字符串或列表）
+        max_tokens: 最大生成token数
+
+    Returns:
+        (截断后的回复, 结束原因)
+    """
+    if isinstance(stop, str):
+        stop = [stop]
+    for sequence in stop or []:
+        index = reply.find(sequence)
+        if index != -1:
+            reply = reply[:index]
+    if max_tokens and len(reply) > max_tokens:
+        return reply[:max_tokens], "length"
+    return reply, "stop"
+
+
+def make_handler(config: FakeLLMConfig):
+    """
+    创建绑定了配置的请求处理类
+
+    Args:
+        config: 模拟服务配置
+
+    Returns:
+        请求处理类
+    """
+
+    class FakeLLMHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass  # 压测时不打印访问日志
+
+        def setup(self):
+            # 每条连接只调用一次，用于模拟建连耗时
+            with config.lock:
+                config.total_connections += 1
+            if config.connect_delay > 0:
+                time.sleep(config.connect_delay)
+            if isinstance(self.request, ssl.SSLSocket):
+                self.request.do_handshake()
+            super().setup()
+
+        def _send_json(self, status: int, payload: dict, headers: dict = None):
+            body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _send_stream(self, reply: str, model: str, finish_reason: str, usage: dict = None, chunk_size: int = 4):
+            # 以SSE格式逐段返回，首段前等待固定延迟，之后按每token延迟陆续输出
+            completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            time.sleep(config.latency)
+            pieces = [reply[i:i + chunk_size] for i in range(0, len(reply), chunk_size)]
+            for index, piece in enumerate(pieces + [None]):
+                if piece is not None and config.per_token_latency:
+                    time.sleep(len(piece) * config.per_token_latency)
+                payload = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{
+                        "index": 0,
+                        "delta": {"role": "assistant", "content": piece} if piece is not None else {},
+                        "finish_reason": None if piece is not None else finish_reason
+                    }]
+                }
+                self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n")
+            if usage:
+                # stream_options.include_usage：最后单独发送一个只含用量的分块
+                payload = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                           "model": model, "choices": [], "usage": usage}
+                self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n")
+            self._write_chunk("data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def _write_chunk(self, text: str):
+            data = text.encode("utf-8")
+            self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+            self.wfile.flush()
+
+        def do_GET(self):
+            if self.path.rstrip("/").endswith("/models"):
+                self._send_json(200, {"object": "list", "data": [{"id": "deepseek-chat", "object": "model"}]})
+            else:
+                self._send_json(404, {"error": {"message": "not found"}})
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            request_body = json.loads(self.rfile.read(length) or b"{}")
+
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self._send_json(404, {"error": {"message": "not found"}})
+                return
+
+            api_key = self.headers.get("Authorization", "").replace("Bearer ", "")
+            with config.lock:
+                config.total_requests += 1
+                retry_after = config.take_key_token(api_key)
+                if retry_after:
+                    config.total_rate_limited += 1
+                saturated = config.max_concurrency and config.in_flight >= config.max_concurrency
+                if not saturated and not retry_after:
+                    config.in_flight += 1
+
+            if retry_after:
+                self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}},
+                                {"Retry-After": f"{retry_after:.3f}"})
+                return
+
+            if saturated or random.random() < config.error_rate:
+                if not saturated:
+                    with config.lock:
+                        config.in_flight -= 1
+                self._send_json(429, {"error": {"message": "rate limited", "type": "rate_limit_error"}})
+                return
+
+            try:
+                json_mode = (request_body.get("response_format") or {}).get("type") == "json_object"
+                reply = build_reply(request_body.get("messages", []), json_mode)
+                reply, finish_reason = apply_limits(reply, request_body.get("stop"), request_body.get("max_tokens"))
+                completion_tokens = len(reply)
+                prompt_tokens = sum(len(m.get("content", "")) for m in request_body.get("messages", []))
+                usage = {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": completion_tokens,
+                    "total_tokens": prompt_tokens + completion_tokens
+                }
+                if request_body.get("stream"):
+                    include_usage = (request_body.get("stream_options") or {}).get("include_usage")
+                    self._send_stream(reply, request_body.get("model", "deepseek-chat"), finish_reason,
+                                      usage if include_usage else None)
+                    return
+                time.sleep(config.latency + completion_tokens * config.per_token_latency)
+                self._send_json(200, {
+                    "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request_body.get("model", "deepseek-chat"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": reply},
+                        "finish_reason": finish_reason
+                    }],
+                    "usage": usage
+                })
+            finally:
+                with config.lock:
+                    config.in_flight -= 1
+
+    return FakeLLMHandler
+
+
+def create_server(port: int, config: FakeLLMConfig, certfile: str = None, keyfile: str = None) -> ThreadingHTTPServer:
+    """
+    创建模拟服务，提供证书时以HTTPS方式监听
+
+    Args:
+        port: 监听端口
+        config: 模拟服务配置
+        certfile: TLS证书文件
+        keyfile: TLS私钥文件
+
+    Returns:
+        服务器实例
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.daemon_threads = True
+    if certfile:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile, keyfile)
+        # 握手延迟到处理线程中进行，与真实服务一样每条新连接都要完成一次TLS握手
+        server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    return server
+
+
+def start_server(port: int, config: FakeLLMConfig, certfile: str = None, keyfile: str = None) -> ThreadingHTTPServer:
+    """
+    在后台线程中启动模拟服务
+
+    Args:
+        port: 监听端口
+        config: 模拟服务配置
+        certfile: TLS证书文件
+        keyfile: TLS私钥文件
+
+    Returns:
+        服务器实例
+    """
+    server = create_server(port, config, certfile, keyfile)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="本地模拟LLM服务（OpenAI兼容）")
+    parser.add_argument("--port", type=int, default=8950, help="监听端口")
+    parser.add_argument("--latency", type=float, default=0.2, help="每次请求的固定延迟（秒）")
+    parser.add_argument("--per-token-latency", type=float, default=0.0, help="每个生成token的额外延迟（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="随机返回429的概率")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="最大并发数，超出返回429（0为不限）")
+    parser.add_argument("--connect-delay", type=float, default=0.0, help="每条新连接的建连延迟（秒）")
+    parser.add_argument("--rate-limit-rps", type=float, default=0.0, help="每个API密钥每秒允许的请求数（0为不限）")
+    parser.add_argument("--rate-limit-burst", type=float, default=1.0, help="每个API密钥的突发请求数")
+    parser.add_argument("--certfile", help="TLS证书文件，提供后以HTTPS方式监听")
+    parser.add_argument("--keyfile", help="TLS私钥文件")
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(args.latency, args.per_token_latency, args.error_rate, args.max_concurrency,
+                           args.connect_delay, args.rate_limit_rps, args.rate_limit_burst)
+    server = create_server(args.port, config, args.certfile, args.keyfile)
+    scheme = "https" if args.certfile else "http"
+    print(f"🤖 模拟LLM服务运行在 {scheme}://127.0.0.1:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("\n👋 模拟LLM服务已停止")
+
+
+if __name__ == "__main__":
+    main()
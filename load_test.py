@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Bridge压测脚本 - 模拟多个并发会话运行完整剧本流程
+
+每个会话先创建剧本，然后循环执行 用户发言 → 获取下一个说话角色 → AI角色发言。
+默认同时启动本地模拟LLM服务和Electron Bridge，不消耗真实API额度。
+
+用法：
+    python load_test.py --sessions 1,2,4,8 --turns 5 --think-time 0.5
+    python load_test.py --bridge http://127.0.0.1:8900 --sessions 4   # 压测已运行的Bridge
+    python load_test.py --compare loadtest_results/a.json loadtest_results/b.json
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from fake_llm_server import FakeLLMConfig, start_server
+
+RESULTS_DIR = "loadtest_results"
+SCENES = [
+    "现代都市背景，朋友们在咖啡厅讨论创业计划",
+    "古代武侠世界，我在客栈遇到了神秘的江湖人士",
+    "科幻未来，我作为宇宙飞船的船员面临危机",
+    "校园青春，我和同学在图书馆准备重要考试",
+]
+USER_LINES = [
+    "大家好，我们先说说现在的情况吧",
+    "我有个想法，不知道大家怎么看",
+    "等一下，这里好像有点不对劲",
+    "那我们就这么决定了？",
+]
+
+
+class RouteStats:
+    def __init__(self):
+        """
+        初始化单个路由的统计信息
+        """
+        self.latencies = []
+        self.errors = 0
+        self.lock = threading.Lock()
+
+    def record(self, latency: float, ok: bool):
+        with self.lock:
+            self.latencies.append(latency)
+            if not ok:
+                self.errors += 1
+
+
+def percentile(values: list, p: float) -> float:
+    """
+    计算百分位数
+
+    Args:
+        values: 数值列表
+        p: 百分位（0-100）
+
+    Returns:
+        百分位数值
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(p / 100 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class SessionRunner:
+    def __init__(self, bridge_url: str, stats: dict, turns: int, think_time: float, timeout: float):
+        """
+        初始化会话模拟器
+
+        Args:
+            bridge_url: Bridge地址
+            stats: 路由 -> RouteStats 的统计字典
+            turns: 每个会话的对话轮数
+            think_time: 用户每次操作之间的思考时间（秒）
+            timeout: 单次请求超时（秒）
+        """
+        self.bridge_url = bridge_url.rstrip("/")
+        self.stats = stats
+        self.turns = turns
+        self.think_time = think_time
+        self.timeout = timeout
+
+    def _call(self, session_id: str, route: str, data: dict) -> dict:
+        headers = {"X-Session-Id": session_id, "X-Trace-Id": uuid.uuid4().hex}
+        start = time.perf_counter()
+        ok = False
+        result = {}
+        try:
+            response = requests.post(f"{self.bridge_url}{route}", json=data, headers=headers, timeout=self.timeout)
+            result = response.json()
+            ok = response.status_code == 200 and result.get("success", False)
+        except (requests.RequestException, ValueError) as e:
+            result = {"success": False, "error": str(e)}
+        finally:
+            self.stats[route].record(time.perf_counter() - start, ok)
+        return result
+
+    def _think(self):
+        if self.think_time > 0:
+            # 思考时间在设定值附近随机波动，避免所有会话同步请求
+            time.sleep(random.uniform(0.5, 1.5) * self.think_time)
+
+    def run(self, session_id: str):
+        """
+        运行一个完整会话
+
+        Args:
+            session_id: 会话ID
+        """
+        result = self._call(session_id, "/api/create-script", {"sceneDescription": random.choice(SCENES)})
+        if not result.get("success"):
+            return
+
+        for round_num in range(1, self.turns + 1):
+            self._think()
+            self._call(session_id, "/api/user-speak",
+                       {"message": random.choice(USER_LINES), "round": round_num, "action": "speak"})
+            decision = self._call(session_id, "/api/next-speaker", {"round": round_num})
+            speaker = decision.get("next_speaker")
+            if not speaker or speaker == "我":
+                continue
+            self._call(session_id, "/api/ai-speak", {"speaker": speaker, "round": round_num})
+
+
+def run_stage(bridge_url: str, sessions: int, turns: int, think_time: float, timeout: float) -> dict:
+    """
+    以指定并发会话数运行一轮压测
+
+    Args:
+        bridge_url: Bridge地址
+        sessions: 并发会话数
+        turns: 每个会话的对话轮数
+        think_time: 思考时间（秒）
+        timeout: 单次请求超时（秒）
+
+    Returns:
+        本轮压测结果
+    """
+    routes = ["/api/create-script", "/api/user-speak", "/api/next-speaker", "/api/ai-speak"]
+    stats = {route: RouteStats() for route in routes}
+    runner = SessionRunner(bridge_url, stats, turns, think_time, timeout)
+    stage_id = uuid.uuid4().hex[:6]
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=sessions) as executor:
+        list(executor.map(runner.run, [f"load-{stage_id}-{i}" for i in range(sessions)]))
+    elapsed = time.perf_counter() - start
+
+    total_requests = sum(len(s.latencies) for s in stats.values())
+    total_errors = sum(s.errors for s in stats.values())
+    return {
+        "sessions": sessions,
+        "elapsed": round(elapsed, 3),
+        "requests": total_requests,
+        "throughput": round(total_requests / elapsed, 2) if elapsed > 0 else 0.0,
+        "error_rate": round(total_errors / total_requests, 4) if total_requests else 0.0,
+        "routes": {
+            route: {
+                "count": len(s.latencies),
+                "errors": s.errors,
+                "p50": round(percentile(s.latencies, 50), 4),
+                "p95": round(percentile(s.latencies, 95), 4),
+                "p99": round(percentile(s.latencies, 99), 4),
+            }
+            for route, s in stats.items()
+        }
+    }
+
+
+def find_saturation(stages: list) -> dict:
+    """
+    找出饱和点：吞吐量增幅低于10%、错误率超过1%或p95翻倍的第一个并发级别
+
+    Args:
+        stages: 各并发级别的压测结果
+
+    Returns:
+        饱和点信息，未饱和时sessions为None
+    """
+    for previous, current in zip(stages, stages[1:]):
+        previous_p95 = previous["routes"]["/api/ai-speak"]["p95"]
+        current_p95 = current["routes"]["/api/ai-speak"]["p95"]
+        if current["error_rate"] > 0.01:
+            return {"sessions": current["sessions"], "reason": "错误率超过1%"}
+        if current["throughput"] < previous["throughput"] * 1.1:
+            return {"sessions": current["sessions"], "reason": "吞吐量不再增长"}
+        if previous_p95 > 0 and current_p95 > previous_p95 * 2:
+            return {"sessions": current["sessions"], "reason": "p95延迟翻倍"}
+    return {"sessions": None, "reason": "未达到饱和"}
+
+
+def print_stage(stage: dict):
+    """打印单轮压测结果"""
+    print(f"\n📊 并发会话数: {stage['sessions']}  耗时: {stage['elapsed']}s  "
+          f"请求数: {stage['requests']}  吞吐量: {stage['throughput']} req/s  错误率: {stage['error_rate']:.2%}")
+    print(f"   {'路由':<22}{'次数':>6}{'错误':>6}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for route, s in stage["routes"].items():
+        print(f"   {route:<24}{s['count']:>6}{s['errors']:>6}{s['p50']:>9.3f}{s['p95']:>9.3f}{s['p99']:>9.3f}")
+
+
+def compare_results(path_a: str, path_b: str):
+    """
+    对比两次压测结果
+
+    Args:
+        path_a: 基准结果文件
+        path_b: 对比结果文件
+    """
+    with open(path_a, encoding="utf-8") as f:
+        result_a = json.load(f)
+    with open(path_b, encoding="utf-8") as f:
+        result_b = json.load(f)
+
+    stages_b = {stage["sessions"]: stage for stage in result_b["stages"]}
+    print(f"🔍 对比 {path_a} → {path_b}")
+    for stage_a in result_a["stages"]:
+        stage_b = stages_b.get(stage_a["sessions"])
+        if not stage_b:
+            continue
+        print(f"\n并发会话数 {stage_a['sessions']}: 吞吐量 {stage_a['throughput']} → {stage_b['throughput']} req/s")
+        for route, s_a in stage_a["routes"].items():
+            s_b = stage_b["routes"].get(route)
+            if s_b:
+                print(f"   {route:<24} p95 {s_a['p95']:.3f} → {s_b['p95']:.3f}s  p99 {s_a['p99']:.3f} → {s_b['p99']:.3f}s")
+
+
+def start_local_backend(bridge_port: int, llm_port: int, args) -> subprocess.Popen:
+    """
+    启动模拟LLM服务和Bridge子进程
+
+    Args:
+        bridge_port: Bridge端口
+        llm_port: 模拟LLM服务端口
+        args: 命令行参数
+
+    Returns:
+        Bridge子进程
+    """
+    start_server(llm_port, FakeLLMConfig(args.llm_latency, 0.0, args.llm_error_rate, args.llm_max_concurrency))
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backg")
+    env = dict(os.environ, FLASK_PORT=str(bridge_port), DEEPSEEK_BASE_URL=f"http://127.0.0.1:{llm_port}",
+               PYTHONIOENCODING="utf-8")
+    process = subprocess.Popen([sys.executable, "electron_bridge.py"], cwd=backend_dir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # 等待Bridge就绪
+    for _ in range(100):
+        try:
+            if requests.get(f"http://127.0.0.1:{bridge_port}/api/status", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("Bridge启动超时")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="Electron Bridge 压测工具")
+    parser.add_argument("--bridge", help="已运行的Bridge地址，不指定时自动启动模拟LLM服务和Bridge")
+    parser.add_argument("--sessions", default="1,2,4,8", help="并发会话数，逗号分隔的多个值会依次运行")
+    parser.add_argument("--turns", type=int, default=5, help="每个会话的对话轮数")
+    parser.add_argument("--think-time", type=float, default=0.5, help="用户思考时间（秒）")
+    parser.add_argument("--timeout", type=float, default=60.0, help="单次请求超时（秒）")
+    parser.add_argument("--bridge-port", type=int, default=8901, help="自动启动的Bridge端口")
+    parser.add_argument("--llm-port", type=int, default=8950, help="模拟LLM服务端口")
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="模拟LLM延迟（秒）")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="模拟LLM随机429概率")
+    parser.add_argument("--llm-max-concurrency", type=int, default=0, help="模拟LLM最大并发数")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NEW"), help="对比两次压测结果文件")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_results(*args.compare)
+        return
+
+    process = None
+    bridge_url = args.bridge
+    if not bridge_url:
+        print("🚀 启动模拟LLM服务和Bridge...")
+        process = start_local_backend(args.bridge_port, args.llm_port, args)
+        bridge_url = f"http://127.0.0.1:{args.bridge_port}"
+
+    try:
+        stages = []
+        for sessions in [int(value) for value in args.sessions.split(",") if value.strip()]:
+            stage = run_stage(bridge_url, sessions, args.turns, args.think_time, args.timeout)
+            print_stage(stage)
+            stages.append(stage)
+    finally:
+        if process:
+            process.terminate()
+
+    saturation = find_saturation(stages)
+    print(f"\n📈 饱和点: {saturation['sessions'] or '-'} ({saturation['reason']})")
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    result_path = os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    with open(result_path, "w", encoding="utf-8") as f:
+        json.dump({
+            "timestamp": time.time(),
+            "bridge": bridge_url,
+            "turns": args.turns,
+            "think_time": args.think_time,
+            "llm_latency": None if args.bridge else args.llm_latency,
+            "stages": stages,
+            "saturation": saturation
+        }, f, ensure_ascii=False, indent=2)
+    print(f"💾 结果已保存到 {result_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -119,11 +119,17 @@ class ElectronApp {
           url: pythonUrl,
           data: req.body,
           headers: {
-            'Content-Type': 'application/json'
+            'Content-Type': 'application/json',
+            // 透传trace ID，便于在trace文件中串联整轮对话
+            ...(req.get('X-Trace-Id') ? { 'X-Trace-Id': req.get('X-Trace-Id') } : {}),
+            ...(req.get('X-Session-Id') ? { 'X-Session-Id': req.get('X-Session-Id') } : {})
           },
           timeout: 30000
         });
 
+        if (response.headers['x-trace-id']) {
+          res.set('X-Trace-Id', response.headers['x-trace-id']);
+        }
         res.json(response.data);
       } catch (error) {
         console.error(`代理请求失败: ${error.message}`);
@@ -152,6 +158,10 @@ class ElectronApp {
       proxyToPython(req, res, '/api/create-script');
     });
 
+    this.expressApp.get('/api/script-progress', (req, res) => {
+      proxyToPython(req, res, '/api/script-progress');
+    });
+
     this.expressApp.post('/api/send-message', (req, res) => {
       proxyToPython(req, res, '/api/send-message');
     });
@@ -176,6 +186,32 @@ class ElectronApp {
       proxyToPython(req, res, '/api/status');
     });
 
+    this.expressApp.get('/api/usage', (req, res) => {
+      const query = req.query.scope ? `?scope=${encodeURIComponent(req.query.scope)}` : '';
+      proxyToPython(req, res, `/api/usage${query}`);
+    });
+
+    this.expressApp.get('/api/autoplay', (req, res) => {
+      const query = req.query.since ? `?since=${encodeURIComponent(req.query.since)}` : '';
+      proxyToPython(req, res, `/api/autoplay${query}`);
+    });
+
+    this.expressApp.post('/api/autoplay/cancel', (req, res) => {
+      proxyToPython(req, res, '/api/autoplay/cancel');
+    });
+
+    this.expressApp.post('/api/fork', (req, res) => {
+      proxyToPython(req, res, '/api/fork');
+    });
+
+    this.expressApp.post('/api/continuations', (req, res) => {
+      proxyToPython(req, res, '/api/continuations');
+    });
+
+    this.expressApp.post('/api/presence', (req, res) => {
+      proxyToPython(req, res, '/api/presence');
+    });
+
     // 添加根路径处理
     this.expressApp.get('/', (req, res) => {
       res.json({
@@ -229,6 +265,17 @@ class ElectronApp {
         const output = data.toString();
         console.log(`Python后端输出: ${output}`);
         
+        // Bridge绑定端口后立即输出就绪信号，此后的请求会在监听队列中等待处理
+        if (output.includes('BRIDGE_READY')) {
+          console.log('收到Python后端就绪信号');
+          this.pythonBackendReady = true;
+          if (this.readyCheckInterval) {
+            clearInterval(this.readyCheckInterval);
+            this.readyCheckInterval = null;
+          }
+          return;
+        }
+        
         // 检测Python后端是否启动成功
         if (output.includes('启动Electron Bridge服务器') || 
             output.includes('Running on') ||
@@ -258,7 +305,7 @@ class ElectronApp {
 
       console.log('Python后端启动中...');
       
-      // 启动定时检查，每5秒检查一次Python后端是否就绪
+      // 启动定时检查（未收到就绪信号时的兜底），每5秒检查一次Python后端是否就绪
       this.readyCheckInterval = setInterval(() => {
         if (!this.pythonBackendReady) {
           console.log('定时检查Python后端状态...');
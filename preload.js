@@ -26,6 +26,17 @@ contextBridge.exposeInMainWorld('electronAPI', {
       }
     },
 
+    // 获取剧本创建进度
+    getScriptProgress: async () => {
+      try {
+        const response = await fetch('http://localhost:8899/api/script-progress');
+        return await response.json();
+      } catch (error) {
+        console.error('获取剧本创建进度失败:', error);
+        return { success: false, error: error.message };
+      }
+    },
+
     // 发送消息
     sendMessage: async (message, round = 1) => {
       try {
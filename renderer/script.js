@@ -200,9 +200,14 @@ class ScriptEditorApp {
         }
 
         this.showLoading('正在创建剧本设定...');
+        let progressTimer = null;
 
         try {
             if (window.electronAPI && window.electronAPI.request) {
+                // 剧本设定流式生成，轮询进度以便先展示场景和角色
+                if (window.electronAPI.request.getScriptProgress) {
+                    progressTimer = setInterval(() => this.updateScriptProgress(), 500);
+                }
                 const response = await window.electronAPI.request.createScript(sceneDescription);
                 
                 if (response.success) {
@@ -226,10 +231,27 @@ class ScriptEditorApp {
             console.error('创建剧本失败:', error);
             this.showNotification(`创建剧本失败: ${error.message}`, 'error');
         } finally {
+            if (progressTimer) {
+                clearInterval(progressTimer);
+            }
             this.hideLoading();
         }
     }
 
+    async updateScriptProgress() {
+        const response = await window.electronAPI.request.getScriptProgress();
+        if (!response.success || !response.data) {
+            return;
+        }
+
+        const progress = response.data;
+        if (progress.stage === 'characters_ready') {
+            this.showLoading(`角色已就绪：${progress.characters.join(', ')}，正在完善剧情大纲...`);
+        } else if (progress.stage === 'setting' && progress.scene_setting) {
+            this.showLoading(`场景：${progress.scene_setting}，正在创建角色...`);
+        }
+    }
+
     async simulateScriptCreation(sceneDescription) {
         // 模拟网络延迟
         await new Promise(resolve => setTimeout(resolve, 2000));
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM录制回放工具 - 查看cassette内容，或用录制的响应离线重跑整个剧本流程
+
+录制：以 ZGCA_LLM_CASSETTE_MODE=record 启动 electron_bridge.py 或 main.py，正常使用即可。
+回放：本工具以录制的第一个剧本设定请求中的场景描述创建剧本，再按录制的台词数量运行AI轮次，
+     输出耗时、命中情况、各调用点提示词长度（录制时与当前代码对比）和剧本设定解析统计。
+
+用法：
+    python replay_cassette.py info backg/cassettes/session.jsonl.gz
+    python replay_cassette.py run backg/cassettes/session.jsonl.gz --speed fast
+"""
+
+import argparse
+import collections
+import contextlib
+import io
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backg")
+sys.path.insert(0, BACKEND_DIR)
+
+from llm_cassette import configure, get_player, load_cassette  # noqa: E402
+
+
+def prompt_chars(request: dict) -> int:
+    """
+    计算请求中所有消息的字符数
+    """
+    return sum(len(message.get("content") or "") for message in request.get("messages", []))
+
+
+def summarize(entries: list) -> dict:
+    """
+    按调用点汇总记录
+
+    Args:
+        entries: cassette记录
+
+    Returns:
+        调用点 -> 调用次数、提示词字符数、生成token数、录制耗时
+    """
+    summary = collections.defaultdict(lambda: {"calls": 0, "prompt_chars": 0, "completion_tokens": 0, "latency": 0.0})
+    for entry in entries:
+        stats = summary[entry["call_site"]]
+        stats["calls"] += 1
+        stats["prompt_chars"] += prompt_chars(entry["request"])
+        stats["latency"] += entry["latency"]
+        usage = (entry.get("response") or {}).get("usage")
+        if usage is None:
+            usage = next((chunk.get("usage") for _, chunk in reversed(entry.get("chunks", [])) if chunk.get("usage")), None)
+        if usage:
+            stats["completion_tokens"] += usage.get("completion_tokens") or 0
+    return summary
+
+
+def print_summary(title: str, summary: dict, prompts_only: bool = False):
+    print(title)
+    for call_site, stats in sorted(summary.items()):
+        line = f"   {call_site:<15} 调用 {stats['calls']:>4}  提示词 {stats['prompt_chars']:>8} 字符"
+        if not prompts_only:
+            line += f"  生成 {stats['completion_tokens']:>6} token  录制耗时 {stats['latency']:>7.2f}s"
+        print(line)
+
+
+def find_scene(entries: list) -> str:
+    """
+    从第一个剧本设定请求中取出用户输入的场景描述
+    """
+    for entry in entries:
+        if entry["call_site"] == "setting":
+            return entry["request"]["messages"][-1]["content"]
+    raise ValueError("cassette中没有剧本设定请求")
+
+
+def run_replay(path: str, speed: str, turns: int, verbose: bool):
+    """
+    用cassette离线重跑剧本流程
+
+    Args:
+        path: cassette文件路径
+        speed: 回放速度（realtime或fast）
+        turns: AI轮数（0表示按录制的台词数量）
+        verbose: 是否输出剧本系统的打印内容
+    """
+    entries = load_cassette(path)
+    configure("replay", path, speed)
+    player = get_player()
+
+    # 记录当前代码实际发出的提示词长度，与录制时对比
+    current = collections.defaultdict(lambda: {"calls": 0, "prompt_chars": 0})
+    original_play = player.play
+
+    def play(call_site, request):
+        current[call_site]["calls"] += 1
+        current[call_site]["prompt_chars"] += prompt_chars(request)
+        return original_play(call_site, request)
+
+    player.play = play
+
+    from script_system import ScriptSystem
+
+    turns = turns or sum(1 for entry in entries if entry["call_site"] == "character")
+    output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    with output:
+        system = ScriptSystem()
+        result = system.initialize_script(find_scene(entries))
+        if "error" in result:
+            raise RuntimeError(result["error"])
+        setup_seconds = time.perf_counter() - start
+        for round_num in range(1, turns + 1):
+            situation = f"这是第{round_num}轮对话"
+            speaker = system.scheduler.decide_next_ai_speaker(situation)
+            agent = system.scheduler.get_character_agent(speaker) if speaker else None
+            if agent is None:
+                continue
+            system.scheduler.add_to_history(agent.generate_response(situation), speaker)
+    elapsed = time.perf_counter() - start
+
+    print(f"▶️ 回放 {path}（{speed}）：剧本创建 {setup_seconds:.2f}s，{turns} 轮AI对话，总耗时 {elapsed:.2f}s")
+    print(f"   命中 {player.stats['hits']}  按顺序回放 {player.stats['sequence_fallbacks']}  未命中 {player.stats['misses']}")
+    print_summary("📏 录制时的提示词：", summarize(entries))
+    print_summary("📏 当前代码的提示词：", current, prompts_only=True)
+    print(f"🧩 剧本设定解析统计：{system.scheduler.get_parse_stats()}")
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="LLM录制回放工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    info_parser = subparsers.add_parser("info", help="查看cassette内容")
+    info_parser.add_argument("path", help="cassette文件路径")
+
+    run_parser = subparsers.add_parser("run", help="用cassette离线重跑剧本流程")
+    run_parser.add_argument("path", help="cassette文件路径")
+    run_parser.add_argument("--speed", choices=["fast", "realtime"], default="fast", help="回放速度")
+    run_parser.add_argument("--turns", type=int, default=0, help="AI轮数（默认按录制的台词数量）")
+    run_parser.add_argument("--verbose", action="store_true", help="输出剧本系统的打印内容")
+    args = parser.parse_args()
+
+    if args.command == "info":
+        entries = load_cassette(args.path)
+        print(f"📼 {args.path}：{len(entries)} 条记录")
+        print_summary("📏 各调用点：", summarize(entries))
+    else:
+        run_replay(args.path, args.speed, args.turns, args.verbose)
+
+
+if __name__ == "__main__":
+    main()
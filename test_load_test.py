@@ -0,0 +1,120 @@
+"""
+load_test.py和fake_llm_server.py的单元测试：统计、饱和点判断、会话流程和模拟LLM服务
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from fake_llm_server import FakeLLMConfig, build_reply, start_server
+from load_test import RouteStats, SessionRunner, compare_results, find_saturation, percentile, run_stage
+
+ROUTES = ["/api/create-script", "/api/user-speak", "/api/next-speaker", "/api/ai-speak"]
+
+
+def stage(sessions, throughput, p95, error_rate=0.0):
+    return {"sessions": sessions, "throughput": throughput, "error_rate": error_rate,
+            "routes": {"/api/ai-speak": {"p95": p95, "p99": p95}}}
+
+
+def start_stub_bridge(next_speaker):
+    """启动返回固定结果的Bridge替身，记录收到的请求"""
+    calls = []
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass
+
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            calls.append((self.path, self.headers["X-Session-Id"], body))
+            payload = {"success": True}
+            if self.path == "/api/next-speaker":
+                payload["next_speaker"] = next_speaker
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, calls
+
+
+def test_percentile():
+    assert percentile([], 95) == 0.0
+    assert percentile([3.0, 1.0, 2.0], 50) == 2.0
+    assert percentile([float(i) for i in range(101)], 95) == 95.0
+    assert percentile([1.0, 2.0], 100) == 2.0
+
+
+def test_route_stats_counts_errors():
+    stats = RouteStats()
+    stats.record(0.1, True)
+    stats.record(0.2, False)
+    assert (stats.latencies, stats.errors) == ([0.1, 0.2], 1)
+
+
+def test_find_saturation():
+    assert find_saturation([stage(1, 10, 0.2), stage(2, 19, 0.25)])["sessions"] is None
+    assert find_saturation([stage(1, 10, 0.2), stage(2, 10.5, 0.25)]) == {"sessions": 2, "reason": "吞吐量不再增长"}
+    assert find_saturation([stage(1, 10, 0.2), stage(2, 19, 0.5)]) == {"sessions": 2, "reason": "p95延迟翻倍"}
+    assert find_saturation([stage(1, 10, 0.2), stage(2, 19, 0.2, 0.05)])["reason"] == "错误率超过1%"
+
+
+def test_compare_results(tmp_path, capsys):
+    for name, throughput in (("a.json", 10), ("b.json", 12)):
+        with open(tmp_path / name, "w", encoding="utf-8") as f:
+            json.dump({"stages": [stage(4, throughput, 0.3)]}, f)
+    compare_results(str(tmp_path / "a.json"), str(tmp_path / "b.json"))
+    assert "吞吐量 10 → 12 req/s" in capsys.readouterr().out
+
+
+def test_session_runner_follows_the_bridge_flow():
+    server, calls = start_stub_bridge("小明")
+    try:
+        stats = {route: RouteStats() for route in ROUTES}
+        SessionRunner(f"http://127.0.0.1:{server.server_port}", stats, turns=2, think_time=0, timeout=5).run("s1")
+    finally:
+        server.shutdown()
+    assert [path for path, _, _ in calls] == ROUTES[:1] + ROUTES[1:] * 2
+    assert {session for _, session, _ in calls} == {"s1"}
+    assert calls[-1][2] == {"speaker": "小明", "round": 2}
+    assert all(len(stats[route].latencies) == (1 if route == ROUTES[0] else 2) for route in ROUTES)
+
+
+def test_run_stage_skips_ai_speak_for_the_user():
+    server, calls = start_stub_bridge("我")
+    try:
+        result = run_stage(f"http://127.0.0.1:{server.server_port}", sessions=2, turns=1, think_time=0, timeout=5)
+    finally:
+        server.shutdown()
+    assert (result["sessions"], result["requests"], result["error_rate"]) == (2, 6, 0.0)
+    assert result["routes"]["/api/ai-speak"]["count"] == 0
+    assert len({session for _, session, _ in calls}) == 2
+
+
+def test_fake_reply_for_character():
+    messages = [{"role": "system", "content": "你现在扮演角色：小红\n"}, {"role": "user", "content": "继续"}]
+    assert build_reply(messages).startswith("小红：")
+
+
+def test_fake_server_serves_completions_and_rate_limits():
+    config = FakeLLMConfig(latency=0.0)
+    server = start_server(0, config)
+    url = f"http://127.0.0.1:{server.server_port}/chat/completions"
+    body = {"messages": [{"role": "system", "content": "你现在扮演角色：小明"}, {"role": "user", "content": "继续"}]}
+    try:
+        reply = requests.post(url, json=body, timeout=5).json()
+        assert reply["choices"][0]["message"]["content"].startswith("小明：")
+        assert reply["usage"]["completion_tokens"] > 0
+
+        config.error_rate = 1.0
+        assert requests.post(url, json=body, timeout=5).status_code == 429
+        assert requests.get(f"http://127.0.0.1:{server.server_port}/models", timeout=5).status_code == 200
+    finally:
+        server.shutdown()
+    assert (config.total_requests, config.in_flight) == (2, 0)
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地调度模型训练 - 用记录的LLM调度决定训练下一位说话者分类器，并输出评估报告
+
+按时间顺序把调度决定日志分为训练集和测试集，训练条件logit模型（NumPy批量梯度下降，带L2正则），
+在测试集上报告：与LLM决定的一致率、各置信度阈值下本地模型能直接决定的比例（即节省的LLM调用）及其一致率，
+并与"选最久没说话的角色"等简单规则对比。
+
+用法：
+    ZGCA_LOG_DECISIONS=1 python backg/electron_bridge.py   # 先运行一段时间收集调度决定
+    python train_speaker_model.py   # 默认读取backg/logs/scheduler_decisions.jsonl，输出backg/models/speaker_model.json
+"""
+
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backg"))
+
+from config import SCHEDULER_DECISION_LOG_PATH, SPEAKER_MODEL_PATH  # noqa: E402
+from speaker_model import FEATURE_NAMES, FEATURE_SET, SpeakerModel  # noqa: E402
+
+THRESHOLDS = [0.5, 0.6, 0.7, 0.8, 0.85, 0.9, 0.95]
+
+
+def load_decisions(path: str) -> list:
+    """
+    读取调度决定日志中与当前特征集一致的记录（按时间顺序）
+    """
+    entries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if entry.get("feature_set") == FEATURE_SET and len(entry["candidates"]) > 1:
+                entries.append(entry)
+    entries.sort(key=lambda entry: entry["time"])
+    return entries
+
+
+def to_arrays(entries: list) -> tuple:
+    """
+    把记录补齐为定长数组
+
+    Returns:
+        (特征 [N, C, F], 有效候选掩码 [N, C], 选中的候选下标 [N])
+    """
+    max_candidates = max(len(entry["candidates"]) for entry in entries)
+    features = np.zeros((len(entries), max_candidates, len(FEATURE_NAMES)))
+    mask = np.zeros((len(entries), max_candidates), dtype=bool)
+    chosen = np.array([entry["chosen"] for entry in entries])
+    for i, entry in enumerate(entries):
+        count = len(entry["candidates"])
+        features[i, :count] = entry["features"]
+        mask[i, :count] = True
+    return features, mask, chosen
+
+
+def probabilities(weights: np.ndarray, features: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    scores = np.where(mask, features @ weights, -np.inf)
+    scores -= scores.max(axis=1, keepdims=True)
+    exp = np.exp(scores)
+    return exp / exp.sum(axis=1, keepdims=True)
+
+
+def train(features: np.ndarray, mask: np.ndarray, chosen: np.ndarray, epochs: int, learning_rate: float,
+          l2: float) -> np.ndarray:
+    """
+    训练条件logit模型（最小化负对数似然+L2正则）
+
+    Returns:
+        权重
+    """
+    weights = np.zeros(features.shape[2])
+    target = np.zeros(mask.shape)
+    target[np.arange(len(chosen)), chosen] = 1.0
+    for _ in range(epochs):
+        error = probabilities(weights, features, mask) - target  # [N, C]
+        gradient = np.einsum("nc,ncf->f", error, features) / len(chosen) + l2 * weights
+        weights -= learning_rate * gradient
+    return weights
+
+
+def evaluate(weights: np.ndarray, features: np.ndarray, mask: np.ndarray, chosen: np.ndarray) -> dict:
+    """
+    评估一致率和各置信度阈值下的覆盖率
+
+    Returns:
+        agreement、log_loss和thresholds（阈值 -> 覆盖率、覆盖部分的一致率）
+    """
+    probs = probabilities(weights, features, mask)
+    predicted = probs.argmax(axis=1)
+    confidence = probs.max(axis=1)
+    correct = predicted == chosen
+    report = {
+        "agreement": float(correct.mean()),
+        "log_loss": float(-np.log(probs[np.arange(len(chosen)), chosen] + 1e-12).mean()),
+        "thresholds": {}
+    }
+    for threshold in THRESHOLDS:
+        covered = confidence >= threshold
+        report["thresholds"][threshold] = {
+            "coverage": float(covered.mean()),
+            "agreement": float(correct[covered].mean()) if covered.any() else None
+        }
+    return report
+
+
+def baseline_agreement(features: np.ndarray, mask: np.ndarray, chosen: np.ndarray) -> dict:
+    """
+    简单规则与LLM决定的一致率：选最久没说话的角色、选被上一句点名的角色（没有则最久没说话）、随机
+    """
+    gap = FEATURE_NAMES.index("turn_gap")
+    mentioned = FEATURE_NAMES.index("mentioned_last")
+    longest_gap = np.where(mask, features[:, :, gap], -1).argmax(axis=1)
+    mention_score = np.where(mask, features[:, :, mentioned] * 10 + features[:, :, gap], -1)
+    return {
+        "longest_gap": float((longest_gap == chosen).mean()),
+        "mentioned_then_gap": float((mention_score.argmax(axis=1) == chosen).mean()),
+        "random": float((1 / mask.sum(axis=1)).mean())
+    }
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="本地调度模型训练")
+    parser.add_argument("--log", default=SCHEDULER_DECISION_LOG_PATH, help="调度决定日志")
+    parser.add_argument("--output", default=SPEAKER_MODEL_PATH, help="模型输出路径")
+    parser.add_argument("--test-ratio", type=float, default=0.2, help="测试集比例（按时间取最后一部分）")
+    parser.add_argument("--epochs", type=int, default=2000, help="梯度下降轮数")
+    parser.add_argument("--learning-rate", type=float, default=0.5, help="学习率")
+    parser.add_argument("--l2", type=float, default=1e-3, help="L2正则系数")
+    parser.add_argument("--dry-run", action="store_true", help="只输出评估报告，不保存模型")
+    args = parser.parse_args()
+
+    entries = load_decisions(args.log)
+    if len(entries) < 20:
+        print(f"❌ 可用的调度决定只有 {len(entries)} 条，至少需要20条")
+        return
+    split = int(len(entries) * (1 - args.test_ratio))
+    train_arrays = to_arrays(entries[:split])
+    test_arrays = to_arrays(entries[split:])
+
+    weights = train(*train_arrays, args.epochs, args.learning_rate, args.l2)
+    train_report = evaluate(weights, *train_arrays)
+    test_report = evaluate(weights, *test_arrays)
+
+    print(f"📚 调度决定 {len(entries)} 条：训练 {split} 条，测试 {len(entries) - split} 条")
+    print("⚖️ 特征权重：")
+    for name, weight in zip(FEATURE_NAMES, weights):
+        print(f"   {name:<24} {weight:>8.3f}")
+    print(f"🎯 与LLM决定的一致率：训练集 {train_report['agreement']:.1%}，测试集 {test_report['agreement']:.1%}"
+          f"（对数损失 {test_report['log_loss']:.3f}）")
+    baselines = baseline_agreement(*test_arrays)
+    print(f"   对比规则：最久没说话 {baselines['longest_gap']:.1%}，被点名优先 {baselines['mentioned_then_gap']:.1%}，"
+          f"随机 {baselines['random']:.1%}")
+    print("💰 测试集上各置信度阈值的效果（本地决定比例即节省的LLM调度调用）：")
+    for threshold, stats in test_report["thresholds"].items():
+        agreement = f"{stats['agreement']:.1%}" if stats["agreement"] is not None else "-"
+        print(f"   阈值 {threshold:<5} 本地决定 {stats['coverage']:>6.1%}  其中与LLM一致 {agreement:>6}")
+
+    if not args.dry_run:
+        SpeakerModel(weights).save(args.output, {
+            "trained_on": split,
+            "test_agreement": round(test_report["agreement"], 4),
+            "test_thresholds": {str(k): v for k, v in test_report["thresholds"].items()}
+        })
+        print(f"💾 模型已保存到 {args.output}（调度时置信度阈值见 ZGCA_SPEAKER_MODEL_CONFIDENCE）")
+
+
+if __name__ == "__main__":
+    main()